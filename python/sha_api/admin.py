@@ -0,0 +1,370 @@
+"""
+`sha_api.admin` provides the `sha_api-admin` tool that exports the stored messages to a file, imports them back in bulk
+and collects the garbage chunks of the storage engine.
+
+Constants:
+    BINARY_MAGIC: The header of the binary export format.
+    FORMATS: The names of the export formats.
+
+Methods:
+    export_messages: Writes the stored messages to a file in one of the export formats.
+    import_messages: Stores the messages of an export file, resuming from a checkpoint.
+    main: The entrypoint method for setuptools that exports, imports or collects garbage from the command line.
+    open_storage: Returns the application and the storage engine configured for `sha_apid`.
+"""
+
+from __future__ import print_function
+
+import argparse
+import binascii
+import collections
+import hashlib
+import io
+import itertools
+import json
+import multiprocessing
+import os
+import struct
+import sys
+
+from sha_api.mybottle.serializers import get_serializer, SERIALIZERS
+from sha_api.mybottle.sha_api_bottle import ShaApiBottle
+from sha_api.storage.changelog import ChangeLogStorage
+from sha_api.storage.sqlite_engine import SqliteStorage
+
+BINARY_MAGIC = b'SHAAPI\x00\x01'
+FORMATS = (u'ndjson', u'binary')
+
+_HEADER = struct.Struct(u'>32sI')
+_SERIALIZERS = {}
+
+def _loads(serializer):
+    """
+    Returns the `loads` function of the named serializer, created once per process.
+    """
+
+    if serializer not in _SERIALIZERS:
+        _SERIALIZERS[serializer] = get_serializer(serializer).loads
+
+    return _SERIALIZERS[serializer]
+
+def _read_binary(fin, offset):
+    """
+    Yields the `(raw digest, UTF-8 bytes)` records of a binary export read from the byte `offset` of the input, and the
+    offset after each of them. Raises `ValueError` if the input ends within a record.
+    """
+
+    while True:
+        header = fin.read(_HEADER.size)
+
+        if not header:
+            return
+
+        if len(header) < _HEADER.size:
+            raise ValueError(u'Binary export ends within the header of a record at byte %d' % offset)
+
+        raw_digest, length = _HEADER.unpack(header)
+        data = fin.read(length)
+
+        if len(data) < length:
+            raise ValueError(u'Binary export ends within the message of a record at byte %d' % offset)
+
+        offset += _HEADER.size + length
+
+        yield (raw_digest, data), offset
+
+def _read_ndjson(lines, offset):
+    """
+    Yields the non empty lines of an NDJSON export that start at the byte `offset` of the input, and the offset after
+    each of them.
+    """
+
+    for line in lines:
+        offset += len(line)
+
+        if line.strip():
+            yield line, offset
+
+def _save_checkpoint(path, checkpoint):
+    """
+    Replaces the checkpoint file with the checkpoint, writing a temporary file first so a crash never leaves a partial
+    checkpoint behind.
+    """
+
+    temp_path = path + u'.tmp'
+
+    with open(temp_path, u'w') as fout:
+        json.dump(checkpoint, fout, sort_keys=True)
+
+    os.rename(temp_path, path)
+
+def _verify_records(args):
+    """
+    Returns the `(digest, message)` rows of a list of records of the format whose digest matches their message, and
+    the number of rejected records. Run in the hashing pool, so it only takes and returns picklable values.
+    """
+
+    fmt, serializer, records = args
+    loads = None if fmt == u'binary' else _loads(serializer)
+    rows = []
+    rejected = 0
+
+    for record in records:
+        try:
+            if fmt == u'binary':
+                expected = binascii.hexlify(record[0]).decode(u'ascii').upper()
+                message = record[1].decode(u'utf-8')
+            else:
+                item = loads(record)
+                expected = item.get(u'digest')
+                message = item[u'message']
+
+            digest = hashlib.sha256(message.encode(u'utf-8')).hexdigest().upper()
+            verified = expected is None or expected.upper() == digest
+        except (AttributeError, KeyError, TypeError, ValueError):
+            verified = False
+
+        if verified:
+            rows.append((digest, message))
+        else:
+            rejected += 1
+
+    return rows, rejected
+
+def export_messages(storage, fout, fmt=u'ndjson', serializer=None, start=None):
+    """
+    Writes the stored messages in digest order to a binary file object and returns the number of messages written.
+
+    Args:
+        fmt: The export format, one of the `FORMATS`.
+        fout: A file object opened for writing bytes.
+        serializer: An optional `Serializer` instance that encodes the NDJSON lines, otherwise they are encoded by
+                    `json`.
+        start: An optional digest or digest prefix to start the export from, such as the last digest of an export that
+               was interrupted.
+        storage: A `StorageEngine` instance.
+    """
+
+    if fmt not in FORMATS:
+        raise ValueError(u'Unknown export format %s, expected one of %s' % (fmt, u', '.join(FORMATS)))
+
+    dumps = json.dumps if serializer is None else serializer.dumps
+    messages = 0
+
+    if fmt == u'binary':
+        fout.write(BINARY_MAGIC)
+
+    for digest, message in storage.iter(start):
+        if fmt == u'binary':
+            data = message.encode(u'utf-8')
+            fout.write(_HEADER.pack(binascii.unhexlify(digest), len(data)))
+            fout.write(data)
+        else:
+            line = dumps({u'digest': digest, u'message': message})
+            fout.write(line.encode(u'utf-8') if issubclass(line.__class__, type(u'')) else line)
+            fout.write(b'\n')
+
+        messages += 1
+
+    return messages
+
+def import_messages(storage, fin, batch_size=10000, jobs=1, checkpoint_path=None, serializer=u'json', log=None):
+    """
+    Stores the messages of an export read from a binary file object, `batch_size` at a time, and returns the counters
+    of the import. The format is detected from the start of the input. With a checkpoint file, an import resumes at the
+    offset of the input and with the counters it saved, and the file is removed once the input is fully imported.
+
+    Args:
+        batch_size: The number of records stored per `put_many`.
+        checkpoint_path: An optional path of the checkpoint file, the input must be seekable to use one.
+        fin: A file object opened for reading bytes.
+        jobs: The number of processes that decode and hash the records, 1 to do it in this process.
+        log: An optional callable that receives progress messages.
+        serializer: The name of the serializer that decodes the NDJSON lines, one of the `SERIALIZERS`.
+        storage: A `StorageEngine` instance.
+
+    Returns:
+        A dict of the `records` read, the messages newly `stored`, the `duplicates` that were already stored and the
+        `rejected` records that could not be decoded or whose digest did not match their message.
+    """
+
+    log = log or (lambda message: None)
+    head = fin.read(len(BINARY_MAGIC))
+    fmt = u'binary' if head == BINARY_MAGIC else u'ndjson'
+    checkpoint = {u'duplicates': 0, u'offset': len(head), u'rejected': 0, u'records': 0, u'stored': 0}
+
+    if checkpoint_path is not None and os.path.isfile(checkpoint_path):
+        with open(checkpoint_path) as checkpoint_file:
+            checkpoint = json.load(checkpoint_file)
+
+        log(u'Resuming at byte %d after %d records' % (checkpoint[u'offset'], checkpoint[u'records']))
+        fin.seek(checkpoint[u'offset'])
+        head = b''
+
+    if fmt == u'binary':
+        records = _read_binary(fin, checkpoint[u'offset'])
+    else:
+        start = checkpoint[u'offset'] - len(head)
+
+        # The start of the input was read to detect the format, so the rest of its line is read to put it back
+        if head and not head.endswith(b'\n'):
+            head += fin.readline()
+
+        records = _read_ndjson(itertools.chain(io.BytesIO(head).readlines(), iter(fin.readline, b'')), start)
+
+    pool = multiprocessing.Pool(jobs) if jobs > 1 else None
+    pending = collections.deque()
+
+    def store(result, offset):
+        """
+        Stores the verified rows of a batch, then saves the checkpoint at the end of the batch.
+        """
+
+        rows, rejected = result
+        new_rows = sum(1 for row_stored in storage.put_many(rows) if row_stored) if rows else 0
+
+        checkpoint[u'offset'] = offset
+        checkpoint[u'records'] += len(rows) + rejected
+        checkpoint[u'stored'] += new_rows
+        checkpoint[u'duplicates'] += len(rows) - new_rows
+        checkpoint[u'rejected'] += rejected
+
+        if checkpoint_path is not None:
+            _save_checkpoint(checkpoint_path, checkpoint)
+
+        log(u'Imported %(records)d records, %(stored)d stored, %(duplicates)d duplicates, %(rejected)d rejected'
+            % checkpoint)
+
+    try:
+        while True:
+            batch = list(itertools.islice(records, batch_size))
+
+            if not batch:
+                break
+
+            task = (fmt, serializer, [record for record, _ in batch])
+
+            if pool is None:
+                store(_verify_records(task), batch[-1][1])
+                continue
+
+            # Only a few batches are in flight at a time so the input is never read far ahead of the writes
+            pending.append((pool.apply_async(_verify_records, (task,)), batch[-1][1]))
+
+            if len(pending) > jobs:
+                result, offset = pending.popleft()
+                store(result.get(), offset)
+
+        while pending:
+            result, offset = pending.popleft()
+            store(result.get(), offset)
+    finally:
+        if pool is not None:
+            pool.terminate()
+
+    if checkpoint_path is not None and os.path.isfile(checkpoint_path):
+        os.remove(checkpoint_path)
+
+    checkpoint.pop(u'offset')
+
+    return checkpoint
+
+def open_storage():
+    """
+    Returns the `ShaApiBottle` application and the storage engine it configures from the `sha_apid` configuration file.
+    Imports write their own large transactions, so the sqlite engine is returned without the group commit writer, still
+    appending the imported messages to the change log of a replication primary.
+    """
+
+    app = ShaApiBottle()
+    storage = app.storage
+
+    if app.group_commit_writer is not None:
+        storage = SqliteStorage(app.sqlite_pool, compressor=app.compressor, chunker=app.chunker)
+
+        if app.changelog is not None:
+            storage = ChangeLogStorage(storage, app.changelog)
+
+    return app, storage
+
+def main(argv=None): # pragma: no cover
+    """
+    `setuptools` entrypoint for sha_api-admin or for running manually.
+    """
+
+    parser = argparse.ArgumentParser(description=u'Export, import or collect the garbage of the messages of the '
+                                                 u'configured storage engine.')
+    parser.add_argument(u'--config', help=u'The sha_apid configuration file, SHA_API_CONFIG or '
+                                          u'/etc/sha_api/sha_api.conf by default.')
+    commands = parser.add_subparsers(dest=u'command')
+
+    export_parser = commands.add_parser(u'export', help=u'Write the stored messages to a file in digest order.')
+    export_parser.add_argument(u'--format', choices=FORMATS, default=u'ndjson', dest=u'fmt',
+                               help=u'NDJSON objects or the compact binary format.')
+    export_parser.add_argument(u'--start', help=u'Export from this digest or digest prefix on.')
+    export_parser.add_argument(u'output', nargs=u'?', default=u'-', help=u'The export file, - for stdout.')
+
+    commands.add_parser(u'gc', help=u'Delete the chunks that no stored message refers to.')
+
+    import_parser = commands.add_parser(u'import', help=u'Store the messages of an export file.')
+    import_parser.add_argument(u'--batch-size', default=10000, type=int, help=u'Messages stored per transaction.')
+    import_parser.add_argument(u'--checkpoint',
+                               help=u'The checkpoint file, <input>.checkpoint by default, none to disable it.')
+    import_parser.add_argument(u'--jobs', default=1, type=int,
+                               help=u'Processes that decode and hash the messages, 1 to do it in this process.')
+    import_parser.add_argument(u'--serializer', choices=(u'auto',) + SERIALIZERS, default=u'auto',
+                               help=u'The JSON library that decodes NDJSON exports.')
+    import_parser.add_argument(u'input', nargs=u'?', default=u'-', help=u'The export file, - for stdin.')
+
+    args = parser.parse_args(argv)
+
+    if args.config is not None:
+        os.environ[u'SHA_API_CONFIG'] = args.config
+
+    app, storage = open_storage()
+
+    try:
+        if args.command == u'export':
+            if args.output == u'-':
+                messages = export_messages(storage, getattr(sys.stdout, u'buffer', sys.stdout), args.fmt,
+                                           app.serializer, args.start)
+            else:
+                with open(args.output, u'wb') as fout:
+                    messages = export_messages(storage, fout, args.fmt, app.serializer, args.start)
+
+            print(u'%d messages exported' % messages, file=sys.stderr)
+
+            return 0
+
+        if args.command == u'gc':
+            print(u'%(refs)d chunk refs and %(chunks)d chunks of %(chunk_bytes)d bytes deleted'
+                  % storage.collect_garbage(), file=sys.stderr)
+
+            return 0
+
+        checkpoint_path = args.checkpoint
+
+        if checkpoint_path is None and args.input != u'-':
+            checkpoint_path = args.input + u'.checkpoint'
+        elif checkpoint_path == u'none':
+            checkpoint_path = None
+
+        log = lambda message: print(message, file=sys.stderr)
+        serializer = get_serializer(args.serializer).name
+
+        if args.input == u'-':
+            counters = import_messages(storage, getattr(sys.stdin, u'buffer', sys.stdin), args.batch_size, args.jobs,
+                                       None, serializer, log)
+        else:
+            with open(args.input, u'rb') as fin:
+                counters = import_messages(storage, fin, args.batch_size, args.jobs, checkpoint_path, serializer, log)
+    finally:
+        storage.close()
+
+    print(u'%(records)d records imported, %(stored)d stored, %(duplicates)d duplicates, %(rejected)d rejected'
+          % counters, file=sys.stderr)
+
+    return 1 if counters[u'rejected'] else 0
+
+if __name__ == u'__main__': # pragma: no cover
+    sys.exit(main())
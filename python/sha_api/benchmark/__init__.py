@@ -0,0 +1,4 @@
+"""
+The `sha_api.benchmark` subpackage provides a load test and benchmark suite that drives a local `ShaApiBottle` instance
+in-process through WSGI or over a real socket, and compares the results with a saved baseline.
+"""
@@ -0,0 +1,240 @@
+"""
+`sha_api.benchmark.clients` provides the transports the benchmark uses to send requests to `sha_apid`.
+
+Classes:
+    HttpClient: Sends requests over HTTP keep-alive connections, one per benchmark thread.
+    LocalServer: Serves a WSGI application from a thread pool HTTP server on an ephemeral localhost port.
+    RoundRobinClient: Spreads reads over several clients and sends the other requests to the first one.
+    WsgiClient: Calls a WSGI application in-process without any socket.
+"""
+
+import itertools
+import threading
+
+from io import BytesIO
+from wsgiref.simple_server import make_server, WSGIRequestHandler, WSGIServer
+
+try:
+    from httplib import HTTPConnection
+    from Queue import Queue
+    from SocketServer import ThreadingMixIn
+except ImportError: # pragma: no cover
+    from http.client import HTTPConnection
+    from queue import Queue
+    from socketserver import ThreadingMixIn
+
+class HttpClient(object):
+    """
+    `HttpClient` sends requests to a `sha_apid` listening on `host` and `port`. Each benchmark thread keeps its own
+    connection open between requests.
+
+    Methods:
+        close: Closes the connection of the calling thread.
+        request: Sends a request and returns its status code and body.
+    """
+
+    def __init__(self, host, port, timeout=30):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+
+        self._local = threading.local()
+
+    def close(self):
+        """
+        Closes the connection of the calling thread.
+        """
+
+        connection = getattr(self._local, u'connection', None)
+
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+    def request(self, method, path, body=b'', content_type=u'application/json'):
+        """
+        Sends the request and returns a tuple of its status code and response body.
+        """
+
+        connection = getattr(self._local, u'connection', None)
+
+        if connection is None:
+            connection = HTTPConnection(self.host, self.port, timeout=self.timeout)
+            self._local.connection = connection
+
+        try:
+            connection.request(method, path, body, {u'Content-Type': content_type})
+            http_response = connection.getresponse()
+
+            return http_response.status, http_response.read()
+        except Exception:
+            self.close()
+            raise
+
+class _QuietRequestHandler(WSGIRequestHandler):
+    """
+    A `wsgiref` request handler that does not log every request to stderr.
+    """
+
+    def log_message(self, *args): # pylint: disable=arguments-differ
+        pass
+
+class _PooledWSGIServer(ThreadingMixIn, WSGIServer):
+    """
+    A `wsgiref` server that handles connections on a fixed pool of threads like a production server does, so the
+    application keeps its per thread sqlite connections instead of opening one for every connection.
+    """
+
+    def __init__(self, server_address, handler_class, threads=16):
+        WSGIServer.__init__(self, server_address, handler_class)
+
+        self._requests = Queue()
+
+        for _ in range(threads):
+            thread = threading.Thread(target=self._handle_requests)
+            thread.daemon = True
+            thread.start()
+
+    def process_request(self, request, client_address):
+        self._requests.put((request, client_address))
+
+    def _handle_requests(self):
+        """
+        Handles queued connections for the life of the process.
+        """
+
+        while True:
+            self.process_request_thread(*self._requests.get())
+
+class LocalServer(object):
+    """
+    `LocalServer` serves a WSGI application from a `wsgiref` server with `threads` handler threads on an ephemeral
+    localhost port.
+
+    Methods:
+        client: Returns an `HttpClient` for the server.
+        close: Stops the server.
+    """
+
+    def __init__(self, app, host=u'127.0.0.1', threads=16):
+        self.server = make_server(host, 0, app, server_class=lambda address, handler: _PooledWSGIServer(
+            address, handler, threads
+        ), handler_class=_QuietRequestHandler)
+        self.host, self.port = self.server.server_address[:2]
+
+        self._thread = threading.Thread(target=self.server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def client(self):
+        """
+        Returns an `HttpClient` that sends requests to the server.
+        """
+
+        return HttpClient(self.host, self.port)
+
+    def close(self):
+        """
+        Stops the server and waits for its thread to exit.
+        """
+
+        self.server.shutdown()
+        self.server.server_close()
+        self._thread.join()
+
+class RoundRobinClient(object):
+    """
+    `RoundRobinClient` sends each `GET` request to the next of its clients in turn and every other request to the first
+    one, like a load balancer in front of a replication primary and its followers.
+
+    Methods:
+        close: Closes the connections of the calling thread of every client.
+        request: Sends a request to the next client for reads or to the first one otherwise.
+    """
+
+    def __init__(self, clients):
+        self.clients = clients
+
+        self._turns = itertools.count()
+
+    def close(self):
+        """
+        Closes the connections of the calling thread of every client.
+        """
+
+        for client in self.clients:
+            client.close()
+
+    def request(self, method, path, body=b'', content_type=u'application/json'):
+        """
+        Sends a `GET` request to the next client in turn and any other request to the first client, and returns a
+        tuple of its status code and response body.
+        """
+
+        if method == u'GET':
+            client = self.clients[next(self._turns) % len(self.clients)]
+        else:
+            client = self.clients[0]
+
+        return client.request(method, path, body, content_type)
+
+class WsgiClient(object):
+    """
+    `WsgiClient` calls a WSGI application in-process, which measures the cost of the application alone.
+
+    Methods:
+        close: Does nothing, there is no connection to close.
+        request: Calls the application and returns its status code and body.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    def close(self):
+        """
+        Does nothing, there is no connection to close.
+        """
+
+        pass
+
+    def request(self, method, path, body=b'', content_type=u'application/json'):
+        """
+        Calls the application with the request and returns a tuple of its status code and response body.
+        """
+
+        path, _, query_string = path.partition(u'?')
+        environ = {
+            u'CONTENT_LENGTH': u'%d' % len(body),
+            u'CONTENT_TYPE': content_type,
+            u'PATH_INFO': path,
+            u'QUERY_STRING': query_string,
+            u'REQUEST_METHOD': method,
+            u'SERVER_NAME': u'localhost',
+            u'SERVER_PORT': u'80',
+            u'SERVER_PROTOCOL': u'HTTP/1.1',
+            u'wsgi.errors': BytesIO(),
+            u'wsgi.input': BytesIO(body),
+            u'wsgi.multiprocess': False,
+            u'wsgi.multithread': True,
+            u'wsgi.run_once': False,
+            u'wsgi.url_scheme': u'http',
+            u'wsgi.version': (1, 0)
+        }
+        status = []
+
+        def start_response(status_line, headers, exc_info=None): # pylint: disable=unused-argument
+            """
+            Records the status line of the response.
+            """
+
+            status.append(status_line)
+
+        app_iter = self.app(environ, start_response)
+
+        try:
+            response_body = b''.join(app_iter)
+        finally:
+            if hasattr(app_iter, u'close'):
+                app_iter.close()
+
+        return int(status[0].split(u' ', 1)[0]), response_body
@@ -0,0 +1,278 @@
+"""
+`sha_api.benchmark.replication` measures how the read throughput of `sha_apid` grows with read replicas, and how far the
+followers lag behind the primary.
+
+Classes:
+    Node: A `sha_apid` process serving on a localhost port.
+
+Methods:
+    main: The entrypoint method for setuptools that runs the replication benchmark from the command line.
+    measure_lag: Writes to a primary and returns the largest replication lag of its followers.
+    wait_for_catch_up: Waits until followers have applied every change of the change log of a primary.
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import sha_api
+
+from sha_api.benchmark.clients import HttpClient, RoundRobinClient
+from sha_api.benchmark.runner import run_scenario
+from sha_api.benchmark.scenarios import ReadHeavy, WriteHeavy
+
+def _free_port():
+    """
+    Returns a localhost TCP port that is free at the time of the call.
+    """
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+
+    try:
+        sock.bind((u'127.0.0.1', 0))
+
+        return sock.getsockname()[1]
+    finally:
+        sock.close()
+
+def _replication_stats(client):
+    """
+    Returns the `/stats/replication` response of a node.
+    """
+
+    status, body = client.request(u'GET', u'/stats/replication')
+
+    if status != 200:
+        raise RuntimeError(u'Failed to read the replication stats: %d %s' % (status, body))
+
+    return json.loads(body)
+
+def measure_lag(primary, followers, requests=1000, concurrency=8, seed=0):
+    """
+    Runs the `write_heavy` scenario against the primary while sampling the replication lag of the followers, and
+    returns the write stats with the largest lag seen, in changes and in seconds, and the number of seconds the
+    followers took to catch up once the writes were done.
+
+    Args:
+        concurrency: The number of threads that send writes at the same time.
+        followers: The clients of the follower nodes.
+        primary: The client of the primary node.
+        requests: The number of timed requests.
+        seed: The seed of the random request choices.
+    """
+
+    results = {}
+    lags = []
+    writer = threading.Thread(target=lambda: results.update(
+        writes=run_scenario(primary, WriteHeavy(), requests, concurrency, seed)
+    ))
+    writer.start()
+
+    while writer.is_alive():
+        for follower in followers:
+            stats = _replication_stats(follower)[u'follower']
+            lags.append((stats[u'lag_changes'], stats[u'lag_seconds'] or 0.0))
+
+        time.sleep(0.05)
+
+    writer.join()
+
+    results[u'catch_up_seconds'] = wait_for_catch_up(primary, followers)
+    results[u'max_lag_changes'] = max([lag_changes for lag_changes, _ in lags] or [0])
+    results[u'max_lag_seconds'] = max([lag_seconds for _, lag_seconds in lags] or [0.0])
+
+    return results
+
+def wait_for_catch_up(primary, followers, timeout=300.0):
+    """
+    Waits until every follower has applied the last change of the change log of the primary and returns the number of
+    seconds it took. Raises `RuntimeError` if they have not caught up within `timeout` seconds.
+
+    Args:
+        followers: The clients of the follower nodes.
+        primary: The client of the primary node.
+        timeout: The maximum number of seconds to wait.
+    """
+
+    started = time.time()
+    last_seq = _replication_stats(primary)[u'changelog'][u'last_seq']
+
+    while True:
+        applied = [_replication_stats(follower)[u'follower'][u'applied_seq'] for follower in followers]
+
+        if all(seq >= last_seq for seq in applied):
+            return time.time() - started
+
+        if time.time() - started > timeout:
+            raise RuntimeError(u'The followers applied %s of %d changes in %d seconds' % (applied, last_seq, timeout))
+
+        time.sleep(0.05)
+
+class Node(object):
+    """
+    `Node` runs `sha_apid` with gunicorn on a free localhost port, with `workers` processes of `threads` threads, its
+    files in `directory`, the extra `config` lines and `sha_apid` arguments `args`, and waits until it serves requests.
+
+    Methods:
+        client: Returns an `HttpClient` for the node.
+        stop: Stops the node.
+    """
+
+    def __init__(self, name, directory, config=u'', workers=1, threads=8, timeout=30.0, args=()):
+        self.name = name
+        self.port = _free_port()
+        self.url = u'http://127.0.0.1:%d' % self.port
+
+        config_path = os.path.join(directory, name + u'.conf')
+
+        with open(config_path, u'w') as fout:
+            fout.write(u'[sha_api]\nhost = 127.0.0.1\nport = %d\nserver = gunicorn\nworkers = %d\nthreads = %d\n'
+                       u'[sqlite]\ndbfile = %s\n%s' % (self.port, workers, threads,
+                                                      os.path.join(directory, name + u'.db'), config))
+
+        env = dict(os.environ)
+        env[u'SHA_API_CONFIG'] = config_path
+        env[u'PYTHONPATH'] = os.pathsep.join(
+            [os.path.dirname(os.path.dirname(os.path.abspath(sha_api.__file__)))] +
+            ([env[u'PYTHONPATH']] if env.get(u'PYTHONPATH') else [])
+        )
+
+        self.log_path = os.path.join(directory, name + u'.log')
+
+        with open(self.log_path, u'w') as log:
+            self.process = subprocess.Popen([sys.executable, u'-m', u'sha_api.sha_apid'] + list(args), env=env,
+                                            stdout=log, stderr=subprocess.STDOUT)
+
+        deadline = time.time() + timeout
+
+        while True:
+            try:
+                _replication_stats(self.client())
+                break
+            except (IOError, OSError, RuntimeError):
+                if self.process.poll() is not None or time.time() > deadline:
+                    self.stop()
+
+                    with open(self.log_path) as fin:
+                        raise RuntimeError(u'%s did not start:\n%s' % (name, fin.read()[-2000:]))
+
+                time.sleep(0.1)
+
+    def client(self):
+        """
+        Returns an `HttpClient` that sends requests to the node.
+        """
+
+        return HttpClient(u'127.0.0.1', self.port)
+
+    def stop(self):
+        """
+        Stops the gunicorn master, which stops its workers, and waits for it to exit.
+        """
+
+        if self.process.poll() is None:
+            self.process.terminate()
+            self.process.wait()
+
+def main(argv=None): # pragma: no cover
+    """
+    `setuptools` entrypoint for sha_api-benchmark-replication or for running manually.
+    """
+
+    parser = argparse.ArgumentParser(description=u'Measure the read throughput of sha_apid as read replicas are added.')
+    parser.add_argument(u'--cold-set', default=5000, type=int, help=u'Messages read 10%% of the time.')
+    parser.add_argument(u'--concurrency', default=16, type=int, help=u'Concurrent client threads.')
+    parser.add_argument(u'--dir', help=u'The directory to create the node files in, a temporary one by default.')
+    parser.add_argument(u'--followers', default=2, type=int, help=u'The maximum number of followers.')
+    parser.add_argument(u'--hot-set', default=100, type=int, help=u'Messages read 90%% of the time.')
+    parser.add_argument(u'--output', help=u'Write the JSON results to this file.')
+    parser.add_argument(u'--poll-interval-ms', default=50, type=int,
+                        help=u'How often caught up followers poll the primary.')
+    parser.add_argument(u'--requests', default=5000, type=int, help=u'Timed requests per number of followers.')
+    parser.add_argument(u'--seed', default=0, type=int, help=u'The seed of the random request choices.')
+    parser.add_argument(u'--threads', default=8, type=int, help=u'Threads per worker process.')
+    parser.add_argument(u'--workers', default=1, type=int, help=u'Worker processes per node.')
+
+    args = parser.parse_args(argv)
+
+    directory = tempfile.mkdtemp(prefix=u'sha_api-replication-', dir=args.dir)
+    nodes = []
+
+    try:
+        primary = Node(u'primary', directory, u'[replication]\nchangelog = true\nchangelog_path = %s\n' %
+                       os.path.join(directory, u'primary.changes.db'), args.workers, args.threads)
+        nodes.append(primary)
+
+        scenario = ReadHeavy(hot_set=args.hot_set, cold_set=args.cold_set)
+        scenario.setup(primary.client())
+
+        # The followers start once the messages are stored, so they copy all of them from the change log
+        started = time.time()
+
+        for index in range(args.followers):
+            nodes.append(Node(u'follower%d' % index, directory, u'[replication]\nprimary = %s\nstate_file = %s\n'
+                              u'poll_interval_ms = %d\n' % (primary.url,
+                                                            os.path.join(directory, u'follower%d.json' % index),
+                                                            args.poll_interval_ms),
+                              args.workers, args.threads))
+
+        wait_for_catch_up(primary.client(), [node.client() for node in nodes[1:]])
+
+        catch_up_seconds = time.time() - started
+        changes = args.hot_set + args.cold_set
+
+        results = {
+            u'catch_up': {u'changes': changes, u'seconds': catch_up_seconds},
+            u'concurrency': args.concurrency,
+            u'cpus': multiprocessing.cpu_count(),
+            u'followers': {},
+            u'requests': args.requests,
+            u'threads': args.threads,
+            u'workers': args.workers
+        }
+
+        print(u'%d followers started and copied %d changes in %.2f s' % (args.followers, changes, catch_up_seconds))
+
+        for followers in range(args.followers + 1):
+            client = RoundRobinClient([node.client() for node in nodes[:followers + 1]])
+            stats = run_scenario(client, scenario, args.requests, args.concurrency, args.seed, setup=False)
+            results[u'followers'][followers] = stats
+
+            print(u'%d followers %9.1f req/s  p50 %7.2f ms  p95 %7.2f ms  p99 %7.2f ms  errors %d' % (
+                followers, stats[u'req_per_sec'], stats[u'latency_ms'][u'p50'], stats[u'latency_ms'][u'p95'],
+                stats[u'latency_ms'][u'p99'], stats[u'errors']
+            ))
+
+        if args.followers:
+            lag = measure_lag(primary.client(), [node.client() for node in nodes[1:]], args.requests,
+                              args.concurrency, args.seed)
+            results[u'write_lag'] = lag
+
+            print(u'writes %9.1f req/s  max lag %d changes / %.3f s  caught up %.3f s after the writes' % (
+                lag[u'writes'][u'req_per_sec'], lag[u'max_lag_changes'], lag[u'max_lag_seconds'],
+                lag[u'catch_up_seconds']
+            ))
+    finally:
+        for node in nodes:
+            node.stop()
+
+        shutil.rmtree(directory)
+
+    if args.output is not None:
+        with open(args.output, u'w') as fout:
+            json.dump(results, fout, indent=2, sort_keys=True)
+
+    return 0
+
+if __name__ == u'__main__': # pragma: no cover
+    sys.exit(main())
@@ -0,0 +1,257 @@
+"""
+`sha_api.benchmark.runner` runs the benchmark scenarios against a `ShaApiBottle(ROUTES)` instance, reports the request
+rate and latency percentiles of each and compares them with a saved baseline.
+
+Methods:
+    compare: Returns the regressions of a benchmark run against a baseline run.
+    main: The entrypoint method for setuptools that runs the benchmark from the command line.
+    percentile: Returns a nearest rank percentile of a sorted list.
+    run_scenario: Runs one scenario with a number of concurrent clients and returns its statistics.
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import sys
+import tempfile
+import threading
+import time
+
+from sha_api.benchmark.clients import HttpClient, LocalServer, WsgiClient
+from sha_api.benchmark.scenarios import SCENARIOS
+
+def percentile(sorted_values, pct):
+    """
+    Returns the nearest rank `pct` percentile of the sorted list, or `0.0` if it is empty.
+    """
+
+    if not sorted_values:
+        return 0.0
+
+    rank = int(math.ceil(pct / 100.0 * len(sorted_values)))
+
+    return sorted_values[min(max(rank, 1), len(sorted_values)) - 1]
+
+def run_scenario(client, scenario, requests=1000, concurrency=8, seed=0, setup=True):
+    """
+    Runs the scenario setup and then sends `requests` of its requests from `concurrency` threads.
+
+    Args:
+        client: A `WsgiClient`, `HttpClient` or `RoundRobinClient` instance.
+        concurrency: The number of threads that send requests at the same time.
+        requests: The number of timed requests.
+        scenario: A `Scenario` instance.
+        seed: The seed of the random request choices, each thread uses `seed` plus its index.
+        setup: Whether to run the scenario setup first, `False` when it already ran against the same data.
+
+    Returns:
+        A dict with the number of `requests` and `errors`, the elapsed `seconds`, `req_per_sec` and the `latency_ms`
+        mean, p50, p95, p99 and max.
+    """
+
+    if setup:
+        scenario.setup(client)
+
+    latencies = []
+    errors = []
+    remaining = [requests]
+    lock = threading.Lock()
+
+    def worker(index):
+        """
+        Sends requests until the shared budget is used up.
+        """
+
+        rng = random.Random(seed + index)
+        worker_latencies = []
+        worker_errors = 0
+
+        try:
+            while True:
+                with lock:
+                    if remaining[0] <= 0:
+                        break
+
+                    remaining[0] -= 1
+
+                method, path, body, content_type, expected_statuses = scenario.next_request(rng)
+                started = time.time()
+
+                try:
+                    status = client.request(method, path, body, content_type)[0]
+                except Exception: # pylint: disable=broad-except
+                    status = None
+
+                worker_latencies.append(time.time() - started)
+
+                if status not in expected_statuses:
+                    worker_errors += 1
+        finally:
+            client.close()
+
+            with lock:
+                latencies.extend(worker_latencies)
+                errors.append(worker_errors)
+
+    threads = [threading.Thread(target=worker, args=(index,)) for index in range(concurrency)]
+    started = time.time()
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    seconds = time.time() - started
+    latencies.sort()
+
+    return {
+        u'errors': sum(errors),
+        u'latency_ms': {
+            u'max': latencies[-1] * 1000.0 if latencies else 0.0,
+            u'mean': sum(latencies) * 1000.0 / len(latencies) if latencies else 0.0,
+            u'p50': percentile(latencies, 50) * 1000.0,
+            u'p95': percentile(latencies, 95) * 1000.0,
+            u'p99': percentile(latencies, 99) * 1000.0
+        },
+        u'req_per_sec': len(latencies) / seconds if seconds else 0.0,
+        u'requests': len(latencies),
+        u'seconds': seconds
+    }
+
+def compare(results, baseline, tolerance=0.1):
+    """
+    Returns a list of regression messages for the scenarios of `results` that are also in `baseline`. A scenario
+    regresses when its request rate drops, or its p99 latency grows, by more than `tolerance` (a fraction), or when it
+    has errors the baseline did not have.
+
+    Args:
+        baseline: A benchmark result dict loaded from a previous run.
+        results: A benchmark result dict of the current run.
+        tolerance: The allowed relative change before a regression is reported.
+    """
+
+    regressions = []
+
+    for name, stats in sorted(results[u'scenarios'].items()):
+        base = baseline.get(u'scenarios', {}).get(name)
+
+        if base is None:
+            continue
+
+        if stats[u'req_per_sec'] < base[u'req_per_sec'] * (1.0 - tolerance):
+            regressions.append(u'%s: req/s dropped from %.1f to %.1f' % (name, base[u'req_per_sec'],
+                                                                         stats[u'req_per_sec']))
+
+        if stats[u'latency_ms'][u'p99'] > base[u'latency_ms'][u'p99'] * (1.0 + tolerance):
+            regressions.append(u'%s: p99 latency grew from %.2f ms to %.2f ms' % (name, base[u'latency_ms'][u'p99'],
+                                                                                 stats[u'latency_ms'][u'p99']))
+
+        if stats[u'errors'] > base[u'errors']:
+            regressions.append(u'%s: errors grew from %d to %d' % (name, base[u'errors'], stats[u'errors']))
+
+    return regressions
+
+def _local_app(config=None):
+    """
+    Returns a `ShaApiBottle(ROUTES)` instance loaded from the config file, or backed by a new temporary database.
+    """
+
+    if config is None:
+        dbfile = tempfile.NamedTemporaryFile(suffix=u'.db', delete=False)
+        config_file = tempfile.NamedTemporaryFile(mode=u'w', suffix=u'.conf', delete=False)
+
+        with config_file:
+            config_file.write(u'[sqlite]\ndbfile = %s\n' % dbfile.name)
+
+        config = config_file.name
+
+    os.environ[u'SHA_API_CONFIG'] = config
+
+    # Imported here so the benchmark clients and scenarios can be used without the server dependencies
+    from sha_api.mybottle.sha_api_bottle import ShaApiBottle
+    from sha_api.routes import ROUTES
+
+    return ShaApiBottle(ROUTES)
+
+def main(argv=None): # pragma: no cover
+    """
+    `setuptools` entrypoint for sha_api-benchmark or for running manually.
+    """
+
+    parser = argparse.ArgumentParser(description=u'Benchmark sha_apid and compare the results with a baseline.')
+    parser.add_argument(u'--baseline', help=u'A JSON result file of a previous run to compare with.')
+    parser.add_argument(u'--concurrency', default=8, type=int, help=u'Concurrent client threads.')
+    parser.add_argument(u'--config', help=u'The sha_api.conf of the local instance, a temporary database by default.')
+    parser.add_argument(u'--output', help=u'Write the JSON results to this file.')
+    parser.add_argument(u'--requests', default=2000, type=int, help=u'Timed requests per scenario.')
+    parser.add_argument(u'--scenario', action=u'append', choices=list(SCENARIOS), dest=u'scenarios',
+                        help=u'A scenario to run, may be repeated (all by default).')
+    parser.add_argument(u'--seed', default=0, type=int, help=u'The seed of the random request choices.')
+    parser.add_argument(u'--tolerance', default=0.1, type=float,
+                        help=u'The relative change allowed before a regression is reported.')
+    parser.add_argument(u'--transport', choices=(u'wsgi', u'http'), default=u'wsgi',
+                        help=u'Call the app in-process or over a localhost socket.')
+    parser.add_argument(u'--url', help=u'Benchmark a running sha_apid at host:port over HTTP instead.')
+
+    args = parser.parse_args(argv)
+
+    server = None
+
+    if args.url is not None:
+        host, _, port = args.url.rpartition(u':')
+        client = HttpClient(host or u'127.0.0.1', int(port))
+        transport = u'http'
+    elif args.transport == u'http':
+        server = LocalServer(_local_app(args.config))
+        client = server.client()
+        transport = u'http'
+    else:
+        client = WsgiClient(_local_app(args.config))
+        transport = u'wsgi'
+
+    results = {
+        u'concurrency': args.concurrency,
+        u'python': platform.python_version(),
+        u'requests': args.requests,
+        u'scenarios': {},
+        u'timestamp': time.strftime(u'%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        u'transport': transport
+    }
+
+    try:
+        for name in args.scenarios or list(SCENARIOS):
+            stats = run_scenario(client, SCENARIOS[name](), args.requests, args.concurrency, args.seed)
+            results[u'scenarios'][name] = stats
+
+            print(u'%-14s %9.1f req/s  p50 %7.2f ms  p95 %7.2f ms  p99 %7.2f ms  errors %d' % (
+                name, stats[u'req_per_sec'], stats[u'latency_ms'][u'p50'], stats[u'latency_ms'][u'p95'],
+                stats[u'latency_ms'][u'p99'], stats[u'errors']
+            ))
+    finally:
+        if server is not None:
+            server.close()
+
+    if args.output is not None:
+        with open(args.output, u'w') as fout:
+            json.dump(results, fout, indent=2, sort_keys=True)
+
+    if args.baseline is not None:
+        with open(args.baseline) as fin:
+            regressions = compare(results, json.load(fin), args.tolerance)
+
+        for regression in regressions:
+            print(u'REGRESSION %s' % regression)
+
+        if regressions:
+            return 1
+
+    return 0
+
+if __name__ == u'__main__': # pragma: no cover
+    sys.exit(main())
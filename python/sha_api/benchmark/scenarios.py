@@ -0,0 +1,208 @@
+"""
+`sha_api.benchmark.scenarios` provides the request mixes the benchmark replays against `sha_apid`, each returning
+`(method, path, body, content_type, expected_statuses)` tuples.
+
+Classes:
+    LargePayload: Streams large raw messages in and out.
+    Mixed: A mix of single and batch writes, hot reads, lookups and misses.
+    NotFoundStorm: Reads digests that were never stored.
+    ReadHeavy: Reads from a small hot set and a larger cold set of stored messages.
+    Scenario: The base class of the scenarios.
+    WriteHeavy: Mostly writes new messages with a few reads.
+
+Constants:
+    SCENARIOS: The scenario classes by name, in the order they run by default.
+"""
+
+import binascii
+import collections
+import hashlib
+import itertools
+import json
+import os
+
+class Scenario(object):
+    """
+    `Scenario` is the base class of the scenarios. Subclasses set `name` and implement `next_request`.
+
+    Methods:
+        next_request: Returns the next request to send.
+        setup: Stores the messages the scenario reads.
+    """
+
+    name = None
+
+    def __init__(self, message_size=64):
+        self.message_size = message_size
+
+        self._counter = itertools.count()
+        self._prefix = binascii.hexlify(os.urandom(8)).decode(u'ascii')
+
+    def new_message(self):
+        """
+        Returns a message that has not been sent before by any scenario.
+        """
+
+        message = u'%s-%d-' % (self._prefix, next(self._counter))
+
+        return message + u'x' * max(0, self.message_size - len(message))
+
+    def next_request(self, rng):
+        """
+        Returns the next `(method, path, body, content_type, expected_statuses)` request.
+        """
+
+        raise NotImplementedError()
+
+    def setup(self, client): # pylint: disable=unused-argument
+        """
+        Stores the messages the scenario reads before it is timed.
+        """
+
+        pass
+
+    def _store(self, client, count):
+        """
+        Stores `count` new messages in batches and returns their digests.
+        """
+
+        digests = []
+
+        while len(digests) < count:
+            messages = [{u'message': self.new_message()} for _ in range(min(500, count - len(digests)))]
+            status, body = client.request(u'POST', u'/messages/batch', json.dumps(messages).encode(u'utf-8'))
+
+            if status != 200:
+                raise RuntimeError(u'Failed to store the scenario messages: %d %s' % (status, body))
+
+            digests.extend(result[u'digest'] for result in json.loads(body)[u'results'])
+
+        return digests
+
+class LargePayload(Scenario):
+    """
+    Streams raw messages of `payload_size` bytes in with `PUT /messages` and back out of `/messages/<digest>/raw`.
+    """
+
+    name = u'large_payload'
+
+    def __init__(self, payload_size=1024 * 1024, **kwargs):
+        super(LargePayload, self).__init__(**kwargs)
+        self.payload_size = payload_size
+
+        self._digests = []
+
+    def next_request(self, rng):
+        if not self._digests or rng.random() < 0.5:
+            payload = self.new_message().encode(u'utf-8')
+            payload += b'x' * max(0, self.payload_size - len(payload))
+
+            # The digest is known up front, so later reads can fetch the payload even if this write is still running
+            self._digests.append(hashlib.sha256(payload).hexdigest())
+
+            return u'PUT', u'/messages', payload, u'application/octet-stream', (200,)
+
+        return u'GET', u'/messages/%s/raw' % rng.choice(self._digests), b'', u'application/json', (200, 404)
+
+class Mixed(Scenario):
+    """
+    Mixes hot reads (50%), single writes (20%), batch writes (10%), batch lookups (10%) and misses (10%).
+    """
+
+    name = u'mixed'
+
+    def __init__(self, hot_set=100, batch_size=50, lookup_size=20, **kwargs):
+        super(Mixed, self).__init__(**kwargs)
+        self.batch_size = batch_size
+        self.hot_set = hot_set
+        self.lookup_size = lookup_size
+
+        self._digests = []
+
+    def next_request(self, rng):
+        choice = rng.random()
+
+        if choice < 0.5:
+            return u'GET', u'/messages/%s' % rng.choice(self._digests), b'', u'application/json', (200,)
+        elif choice < 0.7:
+            body = json.dumps({u'message': self.new_message()}).encode(u'utf-8')
+
+            return u'POST', u'/messages', body, u'application/json', (200,)
+        elif choice < 0.8:
+            body = json.dumps([{u'message': self.new_message()} for _ in range(self.batch_size)]).encode(u'utf-8')
+
+            return u'POST', u'/messages/batch', body, u'application/json', (200,)
+        elif choice < 0.9:
+            body = json.dumps([rng.choice(self._digests) for _ in range(self.lookup_size)]).encode(u'utf-8')
+
+            return u'POST', u'/messages/lookup', body, u'application/json', (200,)
+
+        return u'GET', u'/messages/%064x' % rng.getrandbits(256), b'', u'application/json', (404,)
+
+    def setup(self, client):
+        self._digests = self._store(client, self.hot_set)
+
+class NotFoundStorm(Scenario):
+    """
+    Reads random digests that were never stored, which exercises the miss path and the negative cache.
+    """
+
+    name = u'not_found'
+
+    def __init__(self, distinct=1000, **kwargs):
+        super(NotFoundStorm, self).__init__(**kwargs)
+        self.distinct = distinct
+
+    def next_request(self, rng):
+        return u'GET', u'/messages/%064x' % rng.randrange(self.distinct), b'', u'application/json', (404,)
+
+class ReadHeavy(Scenario):
+    """
+    Reads stored messages, 90% from a hot set of `hot_set` messages and the rest from `cold_set` others.
+    """
+
+    name = u'read_heavy'
+
+    def __init__(self, hot_set=100, cold_set=5000, **kwargs):
+        super(ReadHeavy, self).__init__(**kwargs)
+        self.cold_set = cold_set
+        self.hot_set = hot_set
+
+        self._cold = []
+        self._hot = []
+
+    def next_request(self, rng):
+        digests = self._hot if rng.random() < 0.9 or not self._cold else self._cold
+
+        return u'GET', u'/messages/%s' % rng.choice(digests), b'', u'application/json', (200,)
+
+    def setup(self, client):
+        digests = self._store(client, self.hot_set + self.cold_set)
+
+        self._hot = digests[:self.hot_set]
+        self._cold = digests[self.hot_set:]
+
+class WriteHeavy(Scenario):
+    """
+    Writes new messages (90%) and reads back recently written ones (10%).
+    """
+
+    name = u'write_heavy'
+
+    def __init__(self, **kwargs):
+        super(WriteHeavy, self).__init__(**kwargs)
+
+        self._digests = collections.deque(maxlen=1000)
+
+    def next_request(self, rng):
+        if self._digests and rng.random() < 0.1:
+            return u'GET', u'/messages/%s' % rng.choice(self._digests), b'', u'application/json', (200, 404)
+
+        message = self.new_message()
+        self._digests.append(hashlib.sha256(message.encode(u'utf-8')).hexdigest())
+
+        return u'POST', u'/messages', json.dumps({u'message': message}).encode(u'utf-8'), u'application/json', (200,)
+
+SCENARIOS = collections.OrderedDict(
+    (scenario.name, scenario) for scenario in (WriteHeavy, ReadHeavy, NotFoundStorm, LargePayload, Mixed)
+)
@@ -0,0 +1,253 @@
+"""
+`sha_api.benchmark.storage` compares the storage engines directly, without the REST API in front of them.
+
+Constants:
+    PAYLOADS: The kinds of generated messages.
+    VERSIONS: The number of versions of each document of the `versioned` payload.
+
+Methods:
+    main: The entrypoint method for setuptools that runs the storage benchmark from the command line.
+    make_storage: Returns a storage engine over new files in a directory.
+    run_storage_benchmark: Stores messages with a storage engine and returns its throughput and disk usage.
+"""
+
+from __future__ import print_function
+
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from sha_api.mybottle.metrics import record_phases, stop_recording_phases
+from sha_api.mybottle.sqlite_pool import SqlitePool
+from sha_api.schema import create_schema
+from sha_api.storage.chunking import Chunker, DEFAULT_THRESHOLD
+from sha_api.storage.compression import CODECS, get_compressor
+from sha_api.storage.engine import ENGINES
+from sha_api.storage.sqlite_engine import SqliteStorage
+
+PAYLOADS = (u'random', u'log', u'versioned')
+VERSIONS = 10
+
+_LEVELS = (u'DEBUG', u'INFO', u'INFO', u'INFO', u'WARNING', u'ERROR')
+_PATHS = (u'/messages', u'/messages/batch', u'/messages/lookup', u'/stats/cache', u'/metrics')
+
+def _log_line(rng):
+    """
+    Returns a JSON log line of a web service with random fields.
+    """
+
+    return (u'{"ts": "2026-10-18T07:%02d:%02d.%06dZ", "level": "%s", "host": "web-%02d", "method": "GET", '
+            u'"path": "%s", "status": %d, "latency_ms": %.3f, "request_id": "%032x"}\n') % (
+                rng.randint(0, 59), rng.randint(0, 59), rng.randint(0, 999999), rng.choice(_LEVELS),
+                rng.randint(1, 16), rng.choice(_PATHS), rng.choice((200, 200, 200, 201, 404, 500)),
+                rng.random() * 100, rng.getrandbits(128)
+            )
+
+def _message(rng, payload, message_size, previous=None):
+    """
+    Returns a generated message of `message_size` characters: random hex digits, JSON log lines, or for the
+    `versioned` payload the `previous` version with a log line inserted and another one overwritten.
+    """
+
+    if payload == u'random':
+        return u'%0*x' % (message_size, rng.getrandbits(message_size * 4))
+
+    if payload == u'versioned' and previous is not None:
+        position = rng.randrange(len(previous) + 1)
+        message = previous[:position] + _log_line(rng) + previous[position:]
+
+        line = _log_line(rng)
+        position = rng.randrange(len(message) + 1)
+        message = message[:position] + line + message[position + len(line):]
+
+        return message[:message_size]
+
+    lines = []
+    size = 0
+
+    while size < message_size:
+        lines.append(_log_line(rng))
+        size += len(lines[-1])
+
+    return u''.join(lines)[:message_size]
+
+def make_storage(engine, directory, compression=u'none', chunk_size=0, chunk_threshold=DEFAULT_THRESHOLD):
+    """
+    Returns the storage engine named `engine` over new files in the directory, with the settings `sha_apid` uses by
+    default, the named `compression` codec and, for the sqlite engine, the chunking of the messages of at least
+    `chunk_threshold` characters into chunks of `chunk_size` bytes unless it is 0.
+    """
+
+    compressor = get_compressor(compression)
+
+    if chunk_size and engine != u'sqlite':
+        raise ValueError(u'Chunking is only supported by the sqlite storage engine')
+
+    if engine == u'lmdb':
+        # Imported here so the sqlite engine can be benchmarked without the lmdb package
+        from sha_api.storage.lmdb_engine import LmdbStorage
+
+        return LmdbStorage(os.path.join(directory, u'sha_api.lmdb'), compressor=compressor)
+
+    if engine != u'sqlite':
+        raise ValueError(u'Unknown storage engine %s, expected one of %s' % (engine, u', '.join(ENGINES)))
+
+    pool = SqlitePool(os.path.join(directory, u'sha_api.db'))
+    create_schema(pool.connection())
+
+    return SqliteStorage(pool, compressor=compressor,
+                         chunker=Chunker(chunk_size, chunk_threshold) if chunk_size else None)
+
+def run_storage_benchmark(storage, messages=100000, message_size=256, reads=100000, lookup_size=100, seed=0,
+                          payload=u'random'):
+    """
+    Stores `messages` generated messages of `message_size` characters in batches of 1000, then times `reads` single
+    reads of random stored digests, `reads` digests looked up `lookup_size` at a time and an iteration over every
+    message. The messages were just written, so the reads are served from a warm page cache. The phases are recorded
+    like those of a request, so the time spent decompressing the single reads is reported too.
+
+    Args:
+        lookup_size: The number of digests of each `get_many`.
+        message_size: The number of characters of each message.
+        messages: The number of messages to store.
+        payload: The kind of generated messages, one of the `PAYLOADS`.
+        reads: The number of digests read by the single reads and by the lookups.
+        seed: The seed of the random messages and reads.
+        storage: A `StorageEngine` instance over empty files.
+
+    Returns:
+        A dict with the `messages` stored, the `writes_per_sec`, `reads_per_sec`, `lookups_per_sec` (digests) and
+        `iter_per_sec` rates, the `read_decompress_us` microseconds spent decompressing per single read, the UTF-8
+        `message_bytes` of the messages, and the `disk_bytes` of the engine files and their `bytes_per_message`.
+    """
+
+    rng = random.Random(seed)
+    rows = []
+    message_bytes = 0
+    message = None
+
+    for index in range(messages):
+        message = _message(rng, payload, message_size, None if index % VERSIONS == 0 else message)
+        message_bytes += len(message.encode(u'utf-8'))
+        rows.append((hashlib.sha256(message.encode(u'utf-8')).hexdigest().upper(), message))
+
+    digests = [digest for digest, _ in rows]
+    environ = {}
+    phases = record_phases(environ)
+
+    try:
+        started = time.time()
+
+        for index in range(0, len(rows), 1000):
+            storage.put_many(rows[index:index + 1000])
+
+        write_seconds = time.time() - started
+        read_digests = [rng.choice(digests) for _ in range(reads)]
+
+        phases.clear()
+        started = time.time()
+
+        for digest in read_digests:
+            storage.get(digest)
+
+        read_seconds = time.time() - started
+        read_decompress_seconds = phases.get(u'compress', 0.0)
+
+        started = time.time()
+
+        for index in range(0, len(read_digests), lookup_size):
+            storage.get_many(read_digests[index:index + lookup_size])
+
+        lookup_seconds = time.time() - started
+
+        started = time.time()
+        iterated = sum(1 for _ in storage.iter())
+        iter_seconds = time.time() - started
+    finally:
+        stop_recording_phases(environ)
+
+    disk_bytes = storage.disk_usage()
+
+    return {
+        u'bytes_per_message': float(disk_bytes) / messages if messages else 0.0,
+        u'disk_bytes': disk_bytes,
+        u'iter_per_sec': iterated / iter_seconds if iter_seconds else 0.0,
+        u'lookups_per_sec': reads / lookup_seconds if lookup_seconds else 0.0,
+        u'message_bytes': message_bytes,
+        u'messages': iterated,
+        u'read_decompress_us': read_decompress_seconds * 1000000.0 / reads if reads else 0.0,
+        u'reads_per_sec': reads / read_seconds if read_seconds else 0.0,
+        u'writes_per_sec': messages / write_seconds if write_seconds else 0.0
+    }
+
+def main(argv=None): # pragma: no cover
+    """
+    `setuptools` entrypoint for sha_api-benchmark-storage or for running manually.
+    """
+
+    parser = argparse.ArgumentParser(description=u'Compare the read throughput and disk usage of the storage engines.')
+    parser.add_argument(u'--chunk-size', action=u'append', type=int, dest=u'chunk_sizes',
+                        help=u'A chunk size in bytes to benchmark the sqlite engine with, 0 to store messages whole, '
+                             u'may be repeated (0 by default).')
+    parser.add_argument(u'--chunk-threshold', default=DEFAULT_THRESHOLD, type=int,
+                        help=u'Characters from which messages are chunked.')
+    parser.add_argument(u'--compression', action=u'append', choices=(u'none', u'auto') + CODECS,
+                        dest=u'compressions',
+                        help=u'A compression codec to benchmark, may be repeated (none by default).')
+    parser.add_argument(u'--dir', help=u'The directory to create the engine files in, a temporary one by default.')
+    parser.add_argument(u'--engine', action=u'append', choices=ENGINES, dest=u'engines',
+                        help=u'A storage engine to benchmark, may be repeated (all by default).')
+    parser.add_argument(u'--lookup-size', default=100, type=int, help=u'Digests per batch lookup.')
+    parser.add_argument(u'--message-size', default=256, type=int, help=u'Characters per message.')
+    parser.add_argument(u'--messages', default=100000, type=int, help=u'Messages stored per engine.')
+    parser.add_argument(u'--payload', choices=PAYLOADS, default=u'random',
+                        help=u'Random hex messages, compressible JSON log lines or versions of JSON log documents.')
+    parser.add_argument(u'--output', help=u'Write the JSON results to this file.')
+    parser.add_argument(u'--reads', default=100000, type=int, help=u'Digests read by the reads and by the lookups.')
+    parser.add_argument(u'--seed', default=0, type=int, help=u'The seed of the random messages and reads.')
+
+    args = parser.parse_args(argv)
+
+    results = {}
+
+    for engine in args.engines or list(ENGINES):
+        for compression, chunk_size in itertools.product(args.compressions or [u'none'], args.chunk_sizes or [0]):
+            if chunk_size and engine != u'sqlite':
+                continue
+
+            name = engine if compression == u'none' else u'%s+%s' % (engine, compression)
+            name = name if not chunk_size else u'%s+chunk%d' % (name, chunk_size)
+            directory = tempfile.mkdtemp(prefix=u'sha_api-%s-' % engine, dir=args.dir)
+            storage = make_storage(engine, directory, compression, chunk_size, args.chunk_threshold)
+
+            try:
+                stats = run_storage_benchmark(storage, args.messages, args.message_size, args.reads,
+                                              args.lookup_size, args.seed, args.payload)
+            finally:
+                storage.close()
+                shutil.rmtree(directory)
+
+            results[name] = stats
+
+            print(u'%-24s writes %8.1f/s  reads %8.1f/s (decompress %.1f us)  lookups %8.1f/s  iter %8.1f/s  '
+                  u'disk %6.1f MB (%.1f B/message, ratio %.2f)' % (
+                      name, stats[u'writes_per_sec'], stats[u'reads_per_sec'], stats[u'read_decompress_us'],
+                      stats[u'lookups_per_sec'], stats[u'iter_per_sec'], stats[u'disk_bytes'] / 1048576.0,
+                      stats[u'bytes_per_message'], float(stats[u'message_bytes']) / (stats[u'disk_bytes'] or 1)
+                  ))
+
+    if args.output is not None:
+        with open(args.output, u'w') as fout:
+            json.dump(results, fout, indent=2, sort_keys=True)
+
+    return 0
+
+if __name__ == u'__main__': # pragma: no cover
+    sys.exit(main())
@@ -0,0 +1,375 @@
+"""
+`sha_api.mybottle.admission` provides the admission control of the `sha_api` REST API: limits on the read and write
+requests served at once, per-client rate limits, and a `bottle` plugin that sheds the requests over them.
+
+Classes:
+    AdmissionController: Admits or sheds requests by traffic class and client, and counts its decisions.
+    AdmissionPlugin: A `bottle` plugin that only calls route callbacks for the requests the controller admits.
+    ClientRateLimiter: Per-client token buckets, keeping the most recently seen clients.
+    ConcurrencyLimit: Admits a maximum number of callers at a time, with a bounded queue and wait.
+
+Constants:
+    COUNTERS: The admission decisions counted for each traffic class.
+    TRAFFIC_CLASSES: The traffic classes that are limited separately.
+
+Methods:
+    client_address: Returns the address of the client of a request, taking `X-Real-IP` only from trusted proxies.
+    route_traffic_class: Returns the traffic class of a route.
+"""
+
+import collections
+import math
+import os
+import threading
+import time
+
+from bottle import request, response # pylint: disable=no-name-in-module
+from sha_api.mybottle.counters import Counters
+from sha_api.mybottle.serializers import error_response
+
+COUNTERS = (u'admitted', u'queued', u'rate_limited', u'shed_queue_full', u'shed_timeout')
+TRAFFIC_CLASSES = (u'read', u'write')
+
+class _ReleasingIterator(object):
+    """
+    Iterates a streamed response body and releases its admission slot once the body is exhausted, fails or is closed.
+    """
+
+    def __init__(self, iterator, release):
+        self._close = getattr(iterator, u'close', None)
+        self._iterator = iterator
+        self._release = release
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self._iterator)
+        except BaseException:
+            self.close()
+            raise
+
+    next = __next__
+
+    def close(self):
+        """
+        Closes the body and releases the slot, only once.
+        """
+
+        release, self._release = self._release, None
+
+        try:
+            if self._close is not None:
+                self._close()
+        finally:
+            if release is not None:
+                release()
+
+def client_address(environ, trusted_proxies=()):
+    """
+    Returns the address of the client of a request: the `X-Real-IP` header when the peer of the connection is one of
+    the `trusted_proxies`, since any other client could set it to anything, otherwise the peer itself.
+    """
+
+    peer = environ.get(u'REMOTE_ADDR')
+
+    if peer in trusted_proxies and environ.get(u'HTTP_X_REAL_IP'):
+        return environ[u'HTTP_X_REAL_IP']
+
+    return peer
+
+def route_traffic_class(route):
+    """
+    Returns the `traffic_class` set in the config of the `bottle` route, otherwise `write` for `POST` and `PUT` routes
+    and `read` for the others.
+    """
+
+    traffic_class = route.config.get(u'traffic_class')
+
+    if traffic_class is None:
+        traffic_class = u'write' if route.method in (u'POST', u'PUT') else u'read'
+
+    return traffic_class
+
+class ConcurrencyLimit(object):
+    """
+    `ConcurrencyLimit` admits at most `max_active` callers at a time. Callers over the limit wait for a slot for at
+    most `max_wait` seconds, with at most `max_queue` of them waiting at once. The condition the callers wait on is
+    created on first use in each process since it cannot survive a fork.
+
+    Methods:
+        acquire: Takes a slot, waiting for one if needed, and returns whether it waited or why it could not.
+        release: Gives back a slot and wakes up a waiting caller.
+        stats: Returns the number of active and waiting callers and the limits.
+    """
+
+    def __init__(self, max_active, max_queue=0, max_wait=0.1):
+        self.max_active = max_active
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+
+        self.active = 0
+        self.waiting = 0
+
+        self._condition = None
+        self._pid = None
+
+    def _get_condition(self):
+        """
+        Returns the condition of the calling process, creating it after a fork.
+        """
+
+        if self._pid != os.getpid():
+            self._condition = threading.Condition()
+            self._pid = os.getpid()
+            self.active = self.waiting = 0
+
+        return self._condition
+
+    def acquire(self):
+        """
+        Takes a slot and returns `admitted`, or `queued` when it had to wait for a slot to be released. Returns
+        `queue_full` without waiting when all the slots are taken and `max_queue` callers are already waiting, and
+        `timeout` when no slot was released within `max_wait` seconds.
+        """
+
+        condition = self._get_condition()
+
+        with condition:
+            if self.active < self.max_active:
+                self.active += 1
+                return u'admitted'
+
+            if self.waiting >= self.max_queue:
+                return u'queue_full'
+
+            deadline = time.time() + self.max_wait
+            self.waiting += 1
+
+            try:
+                while self.active >= self.max_active:
+                    remaining = deadline - time.time()
+
+                    if remaining <= 0:
+                        return u'timeout'
+
+                    condition.wait(remaining)
+            finally:
+                self.waiting -= 1
+
+            self.active += 1
+
+        return u'queued'
+
+    def release(self):
+        """
+        Gives back the slot taken by `acquire` and wakes up one of the waiting callers.
+        """
+
+        condition = self._get_condition()
+
+        with condition:
+            self.active -= 1
+            condition.notify()
+
+    def stats(self):
+        """
+        Returns a dict of the number of active and waiting callers and the limits.
+        """
+
+        return {
+            u'in_flight': self.active,
+            u'max_in_flight': self.max_active,
+            u'max_queue': self.max_queue,
+            u'max_wait': self.max_wait,
+            u'waiting': self.waiting
+        }
+
+class ClientRateLimiter(object):
+    """
+    `ClientRateLimiter` keeps a token bucket per client that fills up with `rate` tokens per second up to `burst`
+    tokens, each request taking one. Only the `max_clients` most recently seen clients are kept, a client that was
+    dropped starts over with a full bucket.
+
+    Methods:
+        acquire: Takes a token from the bucket of a client or returns the seconds until it has one.
+        stats: Returns the number of clients with a bucket.
+    """
+
+    def __init__(self, rate, burst, max_clients=10000):
+        self.burst = float(max(burst, 1))
+        self.max_clients = max_clients
+        self.rate = float(rate)
+
+        self._buckets = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def acquire(self, client):
+        """
+        Takes a token from the bucket of the client and returns 0, or returns the number of seconds until the bucket
+        has a token again when it is empty.
+        """
+
+        now = time.time()
+
+        with self._lock:
+            # Popping and setting again moves the client to the end, so the first one is the least recently seen
+            tokens, updated = self._buckets.pop(client, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0
+            else:
+                wait = (1 - tokens) / self.rate
+
+            self._buckets[client] = (tokens, now)
+
+            if len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+
+        return wait
+
+    def stats(self):
+        """
+        Returns a dict of the rate, the burst and the number of clients with a bucket.
+        """
+
+        return {u'burst': self.burst, u'clients': len(self._buckets), u'rate': self.rate}
+
+class AdmissionController(object):
+    """
+    `AdmissionController` admits the requests of each of the `TRAFFIC_CLASSES` up to the `ConcurrencyLimit` of the
+    class, if it has one, and the requests of each client up to the `ClientRateLimiter`, if there is one. Shed requests
+    are asked to retry after `retry_after` seconds, or after their bucket has a token again when rate limited.
+
+    Methods:
+        admit: Admits a request or returns the status code and retry delay it is shed with.
+        release: Ends an admitted request.
+        stats: Returns the limits, the requests in flight and the admission counters.
+    """
+
+    def __init__(self, limits, rate_limiter=None, retry_after=1):
+        self.limits = limits
+        self.rate_limiter = rate_limiter
+        self.retry_after = retry_after
+
+        self._counters = Counters(*[
+            u'%s_%s' % (traffic_class, name) for traffic_class in TRAFFIC_CLASSES for name in COUNTERS
+        ])
+
+    def admit(self, traffic_class, client=None):
+        """
+        Returns `None` when a request of the traffic class from the client is admitted, in which case `release` must
+        be called once it is served. Otherwise returns the status code and the `Retry-After` seconds it is shed with:
+        `429` when the client is over its rate limit and `503` when the traffic class is over its limit.
+        """
+
+        if self.rate_limiter is not None and client is not None:
+            wait = self.rate_limiter.acquire(client)
+
+            if wait:
+                self._counters.increment(u'%s_rate_limited' % traffic_class)
+                return 429, int(math.ceil(wait))
+
+        limit = self.limits.get(traffic_class)
+
+        if limit is not None:
+            outcome = limit.acquire()
+
+            if outcome == u'queued':
+                self._counters.increment(u'%s_queued' % traffic_class)
+            elif outcome != u'admitted':
+                self._counters.increment(u'%s_shed_%s' % (traffic_class, outcome))
+                return 503, self.retry_after
+
+        self._counters.increment(u'%s_admitted' % traffic_class)
+
+        return None
+
+    def release(self, traffic_class):
+        """
+        Ends a request of the traffic class that `admit` admitted.
+        """
+
+        limit = self.limits.get(traffic_class)
+
+        if limit is not None:
+            limit.release()
+
+    def stats(self):
+        """
+        Returns a dict of the admission counters of each traffic class, with the `ConcurrencyLimit` stats of the
+        limited classes and the `ClientRateLimiter` stats when clients are rate limited.
+        """
+
+        stats = self._counters.snapshot()
+        stats[u'retry_after'] = self.retry_after
+
+        for traffic_class, limit in self.limits.items():
+            stats[traffic_class] = limit.stats()
+
+        if self.rate_limiter is not None:
+            stats[u'rate_limit'] = self.rate_limiter.stats()
+
+        return stats
+
+class AdmissionPlugin(object): # pylint: disable=too-few-public-methods
+    """
+    `AdmissionPlugin` only calls the route callbacks for the requests that an `AdmissionController` admits, and returns
+    a JSON error with a `Retry-After` header for the others. It must be installed after the `bottle` JSON plugin and
+    before the plugins that take a database connection.
+    """
+
+    name = u'admission'
+    api = 2
+
+    def __init__(self, controller, trusted_proxies=()):
+        self.controller = controller
+        self.trusted_proxies = frozenset(trusted_proxies)
+
+    def apply(self, callback, route):
+        """
+        Wraps the route callback to admit or shed its requests.
+        """
+
+        traffic_class = route_traffic_class(route)
+
+        if traffic_class not in TRAFFIC_CLASSES:
+            return callback
+
+        def wrapper(*args, **kwargs):
+            """
+            Calls the route callback if the request is admitted, otherwise returns the error it is shed with.
+            """
+
+            shed = self.controller.admit(traffic_class, client_address(request.environ, self.trusted_proxies))
+
+            if shed is not None:
+                status, retry_after = shed
+
+                response.status = status
+                response.set_header(u'Retry-After', str(retry_after))
+
+                if status == 429:
+                    return error_response(u'Too many requests, retry later')
+
+                return error_response(u'Server busy, retry later')
+
+            streamed = False
+
+            try:
+                result = callback(*args, **kwargs)
+
+                # A streamed body does its reads while the server iterates it, so it keeps the slot until then
+                if hasattr(result, u'next') or hasattr(result, u'__next__'):
+                    streamed = True
+                    return _ReleasingIterator(result, lambda: self.controller.release(traffic_class))
+
+                return result
+            finally:
+                if not streamed:
+                    self.controller.release(traffic_class)
+
+        return wrapper
@@ -0,0 +1,266 @@
+"""
+`sha_api.mybottle.content_encoding` provides the HTTP compression of response bodies negotiated with the
+`Accept-Encoding` request header, and a `bottle` plugin that passes the configured encoder to route callbacks.
+
+Classes:
+    ContentEncoder: Negotiates a content coding and compresses response bodies, caching them by key.
+    ContentEncoderPlugin: A `bottle` plugin that passes a `ContentEncoder` instance to route callbacks that accept an
+                          `encoder` keyword argument.
+
+Constants:
+    DEFAULT_MIN_SIZE: The default number of message characters below which responses are sent uncompressed.
+    ENCODINGS: The names of the supported content codings, in the order they are preferred when a client accepts
+               several of them equally.
+
+Methods:
+    accepted_encodings: Returns the quality of each content coding listed in an `Accept-Encoding` header.
+    get_content_encoder: Returns the content encoder of the configured content codings.
+"""
+
+import threading
+import zlib
+
+from sha_api.mybottle.counters import Counters
+from sha_api.mybottle.keyword_plugin import KeywordPlugin
+from sha_api.mybottle.metrics import timed
+
+DEFAULT_MIN_SIZE = 1024
+ENCODINGS = (u'zstd', u'br', u'gzip', u'deflate')
+
+_LOCAL = threading.local()
+
+def _brotli_encoder():
+    """
+    Returns the compress function of `brotli`, raises `ImportError` if it is not installed.
+    """
+
+    import brotli # pylint: disable=import-error
+
+    # The default quality of 11 is meant for static files, 5 compresses better than gzip at a similar speed
+    return lambda body: brotli.compress(body, quality=5)
+
+def _deflate_encoder():
+    """
+    Returns the compress function of the `zlib` format.
+    """
+
+    return lambda body: zlib.compress(body, 6)
+
+def _gzip_encoder():
+    """
+    Returns the compress function of the `gzip` format.
+    """
+
+    def compress(body):
+        """
+        Compresses the body into a single `gzip` member.
+        """
+
+        # A window of 16 + 15 bits writes the gzip header and trailer instead of the zlib ones
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+
+        return compressor.compress(body) + compressor.flush()
+
+    return compress
+
+def _zstd_encoder():
+    """
+    Returns the compress function of `zstandard`, raises `ImportError` if it is not installed.
+    """
+
+    import zstandard # pylint: disable=import-error
+
+    def compress(body):
+        """
+        Compresses the body with the `ZstdCompressor` of the calling thread, they must not be shared between threads.
+        """
+
+        compressor = getattr(_LOCAL, u'zstd_compressor', None)
+
+        if compressor is None:
+            compressor = _LOCAL.zstd_compressor = zstandard.ZstdCompressor(level=3)
+
+        return compressor.compress(body)
+
+    return compress
+
+_ENCODERS = {
+    u'br': _brotli_encoder,
+    u'deflate': _deflate_encoder,
+    u'gzip': _gzip_encoder,
+    u'zstd': _zstd_encoder
+}
+
+def accepted_encodings(accept_encoding):
+    """
+    Returns a dict of the quality of each content coding listed in the `Accept-Encoding` header, with `*` for the ones
+    it does not list. Codings with a quality of 0 are listed as refused.
+    """
+
+    qualities = {}
+
+    for item in (accept_encoding or u'').split(u','):
+        params = item.split(u';')
+        coding = params[0].strip().lower()
+
+        if not coding:
+            continue
+
+        quality = 1.0
+
+        for param in params[1:]:
+            name, _, value = param.partition(u'=')
+
+            if name.strip().lower() == u'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+
+        # x-gzip is an alias of gzip that older clients still send
+        qualities[u'gzip' if coding == u'x-gzip' else coding] = quality
+
+    return qualities
+
+def get_content_encoder(names=u'auto', min_size=DEFAULT_MIN_SIZE, cache=None):
+    """
+    Returns a `ContentEncoder` of the comma separated `ENCODINGS` in `names`, or of `auto` for all the installed ones,
+    or `None` for `none`. Raises `ValueError` for an unknown content coding and `ImportError` if a named one is not
+    installed.
+
+    Args:
+        cache: An optional `MessageCache` instance the compressed bodies are cached in.
+        min_size: The number of message characters below which responses are sent uncompressed.
+        names: The names of the content codings.
+    """
+
+    if names == u'none':
+        return None
+
+    encoders = []
+
+    if names == u'auto':
+        for name in ENCODINGS:
+            try:
+                encoders.append((name, _ENCODERS[name]()))
+            except ImportError:
+                continue
+    else:
+        for name in [name.strip().lower() for name in names.split(u',') if name.strip()]:
+            if name not in _ENCODERS:
+                raise ValueError(u'Unknown content encoding %s, expected auto, none or one of %s' % (
+                    name, u', '.join(ENCODINGS)
+                ))
+
+            encoders.append((name, _ENCODERS[name]()))
+
+        # Equally accepted codings are chosen in the order of preference, not the configured order
+        encoders.sort(key=lambda encoder: ENCODINGS.index(encoder[0]))
+
+    return ContentEncoder(encoders, min_size, cache)
+
+class ContentEncoder(object):
+    """
+    `ContentEncoder` compresses response bodies with the content coding that a request accepts best out of its
+    `encodings`, for messages of at least `min_size` characters. Compressed bodies are cached by key and content coding
+    in the optional `cache`.
+
+    Methods:
+        encode: Returns the body compressed with a content coding, from the cache when possible.
+        negotiate: Returns the content coding that an `Accept-Encoding` header accepts best.
+        stats: Returns the responses and bytes compressed by content coding and the cache counters.
+    """
+
+    def __init__(self, encoders, min_size=DEFAULT_MIN_SIZE, cache=None):
+        self.cache = cache
+        self.encodings = tuple(name for name, _ in encoders)
+        self.min_size = min_size
+
+        self._counters = Counters()
+        self._encoders = dict(encoders)
+
+    def encode(self, key, body, encoding):
+        """
+        Returns the body compressed with the content coding, or `None` if compressing does not make it smaller. The
+        result is cached by key and content coding unless the key is `None`, so the body of a key must never change.
+        """
+
+        cache_key = None if key is None or self.cache is None else (key, encoding)
+
+        if cache_key is not None:
+            encoded = self.cache.get(cache_key)
+
+            if encoded is not None:
+                self._counters.increment(u'%s_cached' % encoding)
+                return encoded or None
+
+        with timed(u'compress'):
+            encoded = self._encoders[encoding](body)
+
+        self._counters.increment(u'%s_responses' % encoding)
+        self._counters.increment(u'%s_bytes_in' % encoding, len(body))
+        self._counters.increment(u'%s_bytes_out' % encoding, len(encoded))
+
+        # An empty body remembers that the body does not compress, so it is not compressed again
+        if len(encoded) >= len(body):
+            encoded = b''
+
+        if cache_key is not None:
+            self.cache.put(cache_key, encoded)
+
+        return encoded or None
+
+    def negotiate(self, accept_encoding, available=None):
+        """
+        Returns the content coding out of `available` (by default the `encodings` of the encoder) that the
+        `Accept-Encoding` header accepts with the highest quality, preferring the earlier ones in `ENCODINGS` when
+        several are accepted equally, or `None` when the body has to be sent as it is.
+        """
+
+        if not accept_encoding:
+            return None
+
+        qualities = accepted_encodings(accept_encoding)
+        best_encoding = None
+        best_quality = 0.0
+
+        for encoding in (self.encodings if available is None else available):
+            quality = qualities.get(encoding, qualities.get(u'*', 0.0))
+
+            if quality > best_quality:
+                best_encoding = encoding
+                best_quality = quality
+
+        return best_encoding
+
+    def stats(self):
+        """
+        Returns a dict of the responses compressed, served from the cache, and the bytes before and after compression
+        of each content coding, along with the counters of the cache.
+        """
+
+        stats = dict(
+            (u'%s_%s' % (encoding, name), 0)
+            for encoding in self.encodings for name in (u'bytes_in', u'bytes_out', u'cached', u'responses')
+        )
+        stats.update(self._counters.snapshot())
+        stats[u'encodings'] = list(self.encodings)
+        stats[u'min_size'] = self.min_size
+
+        if self.cache is not None:
+            stats[u'cache'] = self.cache.stats()
+
+        return stats
+
+class ContentEncoderPlugin(KeywordPlugin): # pylint: disable=too-few-public-methods
+    """
+    `ContentEncoderPlugin` passes a `ContentEncoder` instance, or `None` when responses are not compressed, to route
+    callbacks that accept an `encoder` keyword argument (configurable). Routes that do not accept the keyword are left
+    untouched.
+    """
+
+    name = u'content_encoder'
+
+    def __init__(self, encoder, keyword=u'encoder'):
+        super(ContentEncoderPlugin, self).__init__(encoder, keyword)
+        self.encoder = encoder
@@ -0,0 +1,37 @@
+"""
+`sha_api.mybottle.counters` provides thread safe named counters that route handlers update and stats endpoints report.
+
+Classes:
+    Counters: A thread safe set of named integer counters.
+"""
+
+import threading
+
+class Counters(object):
+    """
+    `Counters` is a thread safe set of named integer counters that start at zero.
+
+    Methods:
+        increment: Adds an amount to a counter.
+        snapshot: Returns a copy of all the counters.
+    """
+
+    def __init__(self, *names):
+        self._counters = dict((name, 0) for name in names)
+        self._lock = threading.Lock()
+
+    def increment(self, name, amount=1):
+        """
+        Adds the amount to the named counter, creating it if needed.
+        """
+
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def snapshot(self):
+        """
+        Returns a dict copy of all the counters.
+        """
+
+        with self._lock:
+            return dict(self._counters)
@@ -0,0 +1,257 @@
+"""
+`sha_api.mybottle.group_commit` provides a single writer thread that coalesces the inserts of concurrent requests into
+group commits, and a `bottle` plugin that passes it to route callbacks.
+
+Classes:
+    GroupCommitPlugin: A `bottle` plugin that passes a `GroupCommitWriter` to route callbacks that accept a `writer`
+                       keyword argument.
+    GroupCommitWriter: A single writer thread that commits the rows of concurrent requests in groups.
+"""
+
+import collections
+import os
+import time
+
+try:
+    import thread as _thread
+except ImportError: # pragma: no cover
+    import _thread
+
+try:
+    from gevent.monkey import get_original
+except ImportError: # pragma: no cover
+    get_original = None
+
+from sha_api.mybottle.keyword_plugin import KeywordPlugin
+
+# The unpatched primitives when `sha_apid --async` monkey patched the process, so the writer always runs on an OS thread
+# that the OS threads of the async mode database executor can hand rows to
+if get_original is None: # pragma: no cover
+    _ALLOCATE_LOCK = _thread.allocate_lock
+    _START_NEW_THREAD = _thread.start_new_thread
+else:
+    _ALLOCATE_LOCK, _START_NEW_THREAD = get_original(_thread.__name__, [u'allocate_lock', u'start_new_thread'])
+
+BATCH_ROWS_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)
+
+class _WriteRequest(object): # pylint: disable=too-few-public-methods
+    """
+    The rows of one request and the lock its handler waits on until they are committed.
+    """
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.error = None
+        self.result = None
+        self.done = _ALLOCATE_LOCK()
+        self.done.acquire()
+
+class GroupCommitWriter(object):
+    """
+    `GroupCommitWriter` owns the only thread of the process that writes messages, committing the rows submitted by
+    concurrent requests in groups. The thread is started on the first submit in each process since it cannot survive
+    a fork, and again on the next submit after it failed.
+
+    Methods:
+        queue: Queues rows for the next group commit and returns the request to wait on.
+        stats: Returns the group commit counters.
+        submit: Queues rows for the next group commit and returns whether each one was newly stored.
+        wait: Waits until a queued request is committed and returns whether each of its rows was newly stored.
+    """
+
+    def __init__(self, pool, max_batch_size=256):
+        self.max_batch_size = max_batch_size
+        self.pool = pool
+
+        self._mutex = _ALLOCATE_LOCK()
+        self._pending = collections.deque()
+        self._pending_rows = 0
+        self._pid = None
+        self._running = False
+        self._wakeup = _ALLOCATE_LOCK()
+        self._writer_idle = True
+
+        self._stats = {
+            u'batch_rows_histogram': dict((bucket, 0) for bucket in BATCH_ROWS_BUCKETS + (u'inf',)),
+            u'commit_seconds_total': 0.0,
+            u'commits': 0,
+            u'errors': 0,
+            u'max_batch_rows': 0,
+            u'max_commit_seconds': 0.0,
+            u'requests': 0,
+            u'rows': 0
+        }
+
+    def queue(self, rows):
+        """
+        Queues the `(digest, message)` rows for the next group commit without waiting for it, starting the writer
+        thread if needed, and returns the request to pass to `wait`.
+        """
+
+        write_request = _WriteRequest(rows)
+
+        with self._mutex:
+            if self._pid != os.getpid() or not self._running:
+                self._pid = os.getpid()
+                self._pending = collections.deque()
+                self._pending_rows = 0
+                self._running = True
+                self._wakeup = _ALLOCATE_LOCK()
+                self._wakeup.acquire()
+                self._writer_idle = True
+                _START_NEW_THREAD(self._run, ())
+
+            self._pending.append(write_request)
+            self._pending_rows += len(rows)
+
+            if self._writer_idle:
+                self._writer_idle = False
+                self._wakeup.release()
+
+        return write_request
+
+    def stats(self):
+        """
+        Returns a dict of the group commit counters, including the average rows per commit and commit latency.
+        """
+
+        with self._mutex:
+            stats = dict(self._stats)
+            stats[u'batch_rows_histogram'] = dict(
+                (u'%s' % bucket, count) for bucket, count in self._stats[u'batch_rows_histogram'].items()
+            )
+            stats[u'pending_rows'] = self._pending_rows
+
+        commits = stats[u'commits']
+        stats[u'avg_batch_rows'] = float(stats[u'rows']) / commits if commits else 0.0
+        stats[u'avg_commit_seconds'] = stats[u'commit_seconds_total'] / commits if commits else 0.0
+
+        return stats
+
+    def submit(self, rows):
+        """
+        Queues the `(digest, message)` rows for the next group commit and blocks until it is committed.
+
+        Returns:
+            A list with a boolean for each row that is `True` if it was newly stored and `False` if it was already
+            stored.
+
+        Raises:
+            The exception that failed the group commit that contained the rows, or the writer thread.
+        """
+
+        return self.wait(self.queue(rows))
+
+    def wait(self, write_request):
+        """
+        Blocks until the rows of a request returned by `queue` are committed and returns the same result as `submit`.
+
+        Raises:
+            The exception that failed the group commit that contained the rows, or the writer thread.
+        """
+
+        write_request.done.acquire()
+
+        if write_request.error is not None:
+            raise write_request.error # pylint: disable=raising-bad-type
+
+        return write_request.result
+
+    def _commit(self, db_con, group):
+        """
+        Inserts the rows of every request in the group in one transaction and hands each request its results.
+        """
+
+        started = time.time()
+        rows = sum(len(write_request.rows) for write_request in group)
+
+        try:
+            with db_con:
+                for write_request in group:
+                    write_request.result = [
+                        db_con.execute(
+                            u'INSERT OR IGNORE INTO sha_api (digest, message) VALUES (?, ?)',
+                            row
+                        ).rowcount == 1 for row in write_request.rows
+                    ]
+        except Exception as err: # pylint: disable=broad-except
+            for write_request in group:
+                write_request.error = err
+                write_request.result = None
+
+        elapsed = time.time() - started
+
+        with self._mutex:
+            self._stats[u'commits'] += 1
+            self._stats[u'requests'] += len(group)
+            self._stats[u'rows'] += rows
+            self._stats[u'commit_seconds_total'] += elapsed
+            self._stats[u'max_batch_rows'] = max(self._stats[u'max_batch_rows'], rows)
+            self._stats[u'max_commit_seconds'] = max(self._stats[u'max_commit_seconds'], elapsed)
+            self._stats[u'batch_rows_histogram'][
+                next((bucket for bucket in BATCH_ROWS_BUCKETS if rows <= bucket), u'inf')
+            ] += 1
+
+            if group[0].error is not None:
+                self._stats[u'errors'] += 1
+
+        for write_request in group:
+            write_request.done.release()
+
+    def _run(self):
+        """
+        The writer thread loop that waits for submitted rows and commits them in groups. If the thread fails, e.g. when
+        its connection cannot be opened, the queued requests get the error and the next submit starts a new thread.
+        """
+
+        group = []
+
+        try:
+            db_con = self.pool.connection()
+
+            while True:
+                self._wakeup.acquire()
+
+                while True:
+                    with self._mutex:
+                        group = []
+                        group_rows = 0
+
+                        while self._pending and (not group or
+                                                 group_rows + len(self._pending[0].rows) <= self.max_batch_size):
+                            write_request = self._pending.popleft()
+                            group.append(write_request)
+                            group_rows += len(write_request.rows)
+
+                        self._pending_rows -= group_rows
+
+                        if not group:
+                            self._writer_idle = True
+                            break
+
+                    self._commit(db_con, group)
+                    group = []
+        except Exception as err: # pylint: disable=broad-except
+            with self._mutex:
+                group.extend(self._pending)
+                self._pending = collections.deque()
+                self._pending_rows = 0
+                self._running = False
+                self._stats[u'errors'] += 1
+
+            for write_request in group:
+                write_request.error = err
+                write_request.result = None
+                write_request.done.release()
+
+class GroupCommitPlugin(KeywordPlugin): # pylint: disable=too-few-public-methods
+    """
+    `GroupCommitPlugin` passes a `GroupCommitWriter` instance to route callbacks that accept a `writer` keyword argument
+    (configurable). Routes that do not accept the keyword are left untouched.
+    """
+
+    name = u'group_commit'
+
+    def __init__(self, writer, keyword=u'writer'):
+        super(GroupCommitPlugin, self).__init__(writer, keyword)
+        self.writer = writer
@@ -0,0 +1,39 @@
+"""
+`sha_api.mybottle.keyword_plugin` provides a `bottle` plugin base class that passes a shared object to the route
+callbacks that accept it as a keyword argument, in the same way `bottle-sqlite` passes its `db` handle.
+
+Classes:
+    KeywordPlugin: A `bottle` plugin that passes a value to route callbacks that accept its keyword argument.
+"""
+
+class KeywordPlugin(object): # pylint: disable=too-few-public-methods
+    """
+    `KeywordPlugin` passes `value` to route callbacks that accept a `keyword` argument. Routes that do not accept the
+    keyword are left untouched.
+    """
+
+    name = u'keyword'
+    api = 2
+
+    def __init__(self, value, keyword):
+        self.value = value
+        self.keyword = keyword
+
+    def apply(self, callback, route):
+        """
+        Wraps the route callback to pass the value as a keyword argument if the callback accepts it.
+        """
+
+        if self.keyword not in route.get_callback_args():
+            return callback
+
+        def wrapper(*args, **kwargs):
+            """
+            Adds the value as a keyword argument to the route callback.
+            """
+
+            kwargs[self.keyword] = self.value
+
+            return callback(*args, **kwargs)
+
+        return wrapper
@@ -0,0 +1,171 @@
+"""
+`sha_api.mybottle.message_cache` provides a bounded in-process read cache for messages keyed by their SHA256 digest and
+a `bottle` plugin that passes it to route callbacks.
+
+Classes:
+    MessageCache: A thread safe LRU cache of digest to message mappings with a short lived negative cache.
+    MessageCachePlugin: A `bottle` plugin that passes a `MessageCache` instance to route callbacks that accept a
+                        `cache` keyword argument.
+"""
+
+import collections
+import threading
+import time
+
+from sha_api.mybottle.keyword_plugin import KeywordPlugin
+
+class MessageCache(object):
+    """
+    `MessageCache` is a thread safe LRU cache of digest to message mappings bounded by both entry count and total
+    message size, along with a bounded cache of recently missed digests that expire after `negative_ttl` seconds.
+
+    Methods:
+        contains: Returns whether a digest is cached without updating the counters or its LRU position.
+        forget_missing: Clears the negative entry for a digest.
+        get: Returns the cached message for a digest or `None`.
+        is_missing: Returns whether the digest was recently looked up and not found.
+        put: Adds a message to the cache and clears any negative entry for its digest.
+        put_missing: Remembers that a digest was not found.
+        stats: Returns the cache counters and current size.
+    """
+
+    def __init__(self, max_entries=10000, max_bytes=64 * 1024 * 1024, negative_ttl=5.0):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.negative_ttl = negative_ttl
+
+        self._entries = collections.OrderedDict()
+        self._missing = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._size = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.negative_hits = 0
+        self.evictions = 0
+
+    def contains(self, digest):
+        """
+        Returns whether the digest is cached without counting a hit or miss or updating its LRU position, for callers
+        that only need to know the message is stored.
+        """
+
+        with self._lock:
+            return digest in self._entries
+
+    def forget_missing(self, digest):
+        """
+        Clears the negative entry for the digest, if any, after its message has been written.
+        """
+
+        with self._lock:
+            self._missing.pop(digest, None)
+
+    def get(self, digest):
+        """
+        Returns the cached message for the digest, marking it as most recently used, or `None` if it is not cached.
+        """
+
+        with self._lock:
+            message = self._entries.pop(digest, None)
+
+            if message is None:
+                self.misses += 1
+                return None
+
+            self._entries[digest] = message
+            self.hits += 1
+
+            return message
+
+    def is_missing(self, digest):
+        """
+        Returns `True` if the digest was looked up and not found within the last `negative_ttl` seconds.
+        """
+
+        with self._lock:
+            expires = self._missing.get(digest)
+
+            if expires is None:
+                return False
+
+            if expires < time.time():
+                del self._missing[digest]
+                return False
+
+            self.negative_hits += 1
+
+            return True
+
+    def put(self, digest, message):
+        """
+        Adds the message to the cache, evicting the least recently used entries until it fits within the limits.
+        Messages larger than `max_bytes` are not cached.
+        """
+
+        size = len(message)
+
+        if self.max_entries <= 0 or size > self.max_bytes:
+            return
+
+        with self._lock:
+            self._missing.pop(digest, None)
+
+            previous = self._entries.pop(digest, None)
+
+            if previous is not None:
+                self._size -= len(previous)
+
+            while self._entries and (len(self._entries) >= self.max_entries or self._size + size > self.max_bytes):
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+                self.evictions += 1
+
+            self._entries[digest] = message
+            self._size += size
+
+    def put_missing(self, digest):
+        """
+        Remembers that the digest was not found for the next `negative_ttl` seconds.
+        """
+
+        if self.max_entries <= 0 or self.negative_ttl <= 0:
+            return
+
+        with self._lock:
+            self._missing.pop(digest, None)
+
+            while len(self._missing) >= self.max_entries:
+                self._missing.popitem(last=False)
+
+            self._missing[digest] = time.time() + self.negative_ttl
+
+    def stats(self):
+        """
+        Returns a dict of the cache counters and its current size.
+        """
+
+        with self._lock:
+            return {
+                u'bytes': self._size,
+                u'entries': len(self._entries),
+                u'evictions': self.evictions,
+                u'hits': self.hits,
+                u'max_bytes': self.max_bytes,
+                u'max_entries': self.max_entries,
+                u'misses': self.misses,
+                u'negative_entries': len(self._missing),
+                u'negative_hits': self.negative_hits
+            }
+
+class MessageCachePlugin(KeywordPlugin): # pylint: disable=too-few-public-methods
+    """
+    `MessageCachePlugin` passes a `MessageCache` instance to route callbacks that accept a `cache` keyword argument
+    (configurable). Routes that do not accept the keyword are left untouched.
+    """
+
+    name = u'message_cache'
+
+    def __init__(self, cache, keyword=u'cache'):
+        super(MessageCachePlugin, self).__init__(cache, keyword)
+        self.cache = cache
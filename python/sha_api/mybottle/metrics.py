@@ -0,0 +1,517 @@
+"""
+`sha_api.mybottle.metrics` provides a small Prometheus style metrics registry and a `bottle` plugin that records the
+count, status, latency, payload sizes and `PHASES` timings of each request.
+
+Classes:
+    Counter: A monotonically increasing metric with labels.
+    Histogram: A metric that counts observations into buckets with labels.
+    MetricsPlugin: A `bottle` plugin that records the metrics of every route.
+    MetricsRegistry: A collection of metrics rendered in the Prometheus text exposition format.
+
+Constants:
+    LATENCY_BUCKETS: The histogram buckets for durations, in seconds.
+    PHASES: The names of the phases that request time is attributed to.
+    SIZE_BUCKETS: The histogram buckets for payload sizes, in bytes.
+
+Methods:
+    record_error: Records a database error of the current request by its type.
+    record_phases: Starts recording the phases of a request that no `MetricsPlugin` records.
+    request_phases: Returns the seconds spent in each phase of the current request so far.
+    stop_recording_phases: Stops recording the phases of the request started with `record_phases`.
+    timed: Returns a context manager that adds the time spent in its block to a phase of the current request.
+    timed_dumps: Returns a wrapper of a JSON encoder that attributes its time to the `serialize` phase of the current
+                 request.
+    timed_json_dumps: `json.dumps` that attributes its time to the `serialize` phase of the current request.
+"""
+
+import bisect
+import json
+import threading
+import time
+
+import bottle
+
+from bottle import request, response # pylint: disable=no-name-in-module
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PHASES = (u'acquire', u'compress', u'execute', u'hash', u'parse', u'serialize')
+SIZE_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+ENVIRON_KEY = u'sha_api.metrics'
+STRING_TYPES = (bytes, type(u''))
+
+_LOCAL = threading.local()
+
+class _CounterChild(object): # pylint: disable=too-few-public-methods
+    """
+    The value of one combination of label values of a `Counter`.
+    """
+
+    __slots__ = (u'lock', u'value')
+
+    def __init__(self, lock):
+        self.lock = lock
+        self.value = 0
+
+    def inc(self, amount=1):
+        """
+        Increments the value by `amount`.
+        """
+
+        with self.lock:
+            self.value += amount
+
+class Counter(object):
+    """
+    `Counter` is a monotonically increasing metric with a value per combination of label values.
+
+    Methods:
+        child: Returns the counter of a combination of label values, which increments without a label lookup.
+        inc: Increments the value of a combination of label values.
+        render: Returns the metric in the Prometheus text exposition format.
+    """
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.name = name
+
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def child(self, labelvalues=(), lock=None):
+        """
+        Returns the `_CounterChild` of the label values tuple, creating it on first use. Children created with a
+        `lock` are guarded by it, so related metrics can be updated together under one lock.
+        """
+
+        child = self._children.get(labelvalues)
+
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(labelvalues, _CounterChild(lock or threading.Lock()))
+
+        return child
+
+    def inc(self, labelvalues=(), amount=1):
+        """
+        Increments the value of the label values tuple by `amount`.
+        """
+
+        self.child(labelvalues).inc(amount)
+
+    def render(self):
+        """
+        Returns the lines of the metric in the Prometheus text exposition format.
+        """
+
+        with self._lock:
+            children = sorted(self._children.items())
+
+        lines = [u'# HELP %s %s' % (self.name, self.documentation), u'# TYPE %s counter' % self.name]
+
+        for labelvalues, child in children:
+            with child.lock:
+                value = child.value
+
+            lines.append(u'%s%s %s' % (self.name, _labels(self.labelnames, labelvalues), _number(value)))
+
+        return lines
+
+class _HistogramChild(object):
+    """
+    The buckets, sum and count of one combination of label values of a `Histogram`.
+    """
+
+    __slots__ = (u'buckets', u'counts', u'lock', u'sum')
+
+    def __init__(self, buckets, lock):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.lock = lock
+        self.sum = 0.0
+
+    def observe(self, value):
+        """
+        Counts the value into its bucket.
+        """
+
+        with self.lock:
+            self.observe_locked(value)
+
+    def observe_locked(self, value):
+        """
+        Counts the value into its bucket while the caller holds the lock of the child.
+        """
+
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+class Histogram(object):
+    """
+    `Histogram` counts observations into `buckets` per combination of label values and keeps their sum.
+
+    Methods:
+        child: Returns the histogram of a combination of label values, which observes without a label lookup.
+        observe: Counts a value for a combination of label values.
+        render: Returns the metric in the Prometheus text exposition format.
+    """
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.name = name
+
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def child(self, labelvalues=(), lock=None):
+        """
+        Returns the `_HistogramChild` of the label values tuple, creating it on first use. Children created with a
+        `lock` are guarded by it, so related metrics can be updated together under one lock.
+        """
+
+        child = self._children.get(labelvalues)
+
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(labelvalues, _HistogramChild(self.buckets, lock or threading.Lock()))
+
+        return child
+
+    def observe(self, value, labelvalues=()):
+        """
+        Counts the value for the label values tuple.
+        """
+
+        self.child(labelvalues).observe(value)
+
+    def render(self):
+        """
+        Returns the lines of the metric in the Prometheus text exposition format.
+        """
+
+        with self._lock:
+            children = sorted(self._children.items())
+
+        lines = [u'# HELP %s %s' % (self.name, self.documentation), u'# TYPE %s histogram' % self.name]
+
+        for labelvalues, child in children:
+            with child.lock:
+                counts = list(child.counts)
+                total = child.sum
+
+            cumulative = 0
+
+            for bound, count in zip(self.buckets + (u'+Inf',), counts):
+                cumulative += count
+                lines.append(u'%s_bucket%s %d' % (
+                    self.name,
+                    _labels(self.labelnames + (u'le',), labelvalues + (_number(bound),)),
+                    cumulative
+                ))
+
+            lines.append(u'%s_sum%s %s' % (self.name, _labels(self.labelnames, labelvalues), _number(total)))
+            lines.append(u'%s_count%s %d' % (self.name, _labels(self.labelnames, labelvalues), cumulative))
+
+        return lines
+
+class MetricsRegistry(object):
+    """
+    `MetricsRegistry` keeps the metrics of the process and renders them for scraping.
+
+    Methods:
+        counter: Creates and registers a `Counter`.
+        histogram: Creates and registers a `Histogram`.
+        render: Returns all metrics in the Prometheus text exposition format.
+    """
+
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, documentation, labelnames=()):
+        """
+        Creates, registers and returns a `Counter`.
+        """
+
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+
+        return metric
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        """
+        Creates, registers and returns a `Histogram`.
+        """
+
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+
+        return metric
+
+    def render(self, extra_lines=()):
+        """
+        Returns the registered metrics followed by `extra_lines` in the Prometheus text exposition format.
+        """
+
+        lines = []
+
+        for metric in self._metrics:
+            lines.extend(metric.render())
+
+        lines.extend(extra_lines)
+
+        return u'\n'.join(lines) + u'\n'
+
+class _RequestMetrics(dict):
+    """
+    The seconds spent in each phase of the request being handled, by phase, and its database errors.
+    """
+
+    errors = ()
+
+class _Timed(object): # pylint: disable=too-few-public-methods
+    """
+    A context manager that adds the time spent in its block to a phase of the current request.
+    """
+
+    __slots__ = (u'phase', u'request_metrics', u'started')
+
+    def __init__(self, phase):
+        self.phase = phase
+        self.request_metrics = _current()
+        self.started = 0.0
+
+    def __enter__(self):
+        self.started = time.time()
+
+    def __exit__(self, *exc_info):
+        if self.request_metrics is not None:
+            self.request_metrics[self.phase] = self.request_metrics.get(self.phase, 0.0) + time.time() - self.started
+
+def _current():
+    """
+    Returns the `_RequestMetrics` of the current request or `None` outside of an instrumented request.
+    """
+
+    # The thread that runs the plugin wrapper finds them without the slower lookup of the bound request, an executor
+    # thread that runs the handler falls back to the request environ
+    request_metrics = getattr(_LOCAL, u'current', None)
+
+    if request_metrics is not None:
+        return request_metrics
+
+    try:
+        request_metrics = request.environ.get(ENVIRON_KEY)
+    except (AttributeError, RuntimeError):
+        return None
+
+    return request_metrics if request_metrics.__class__ is _RequestMetrics else None
+
+def _labels(labelnames, labelvalues):
+    """
+    Returns the rendered label set of the label names and values.
+    """
+
+    if not labelnames:
+        return u''
+
+    return u'{%s}' % u','.join(
+        u'%s="%s"' % (labelname, (u'%s' % labelvalue).replace(u'\\', u'\\\\').replace(u'"', u'\\"')
+                                 .replace(u'\n', u'\\n'))
+        for labelname, labelvalue in zip(labelnames, labelvalues)
+    )
+
+def _number(value):
+    """
+    Returns the rendered sample value.
+    """
+
+    if value.__class__ is float:
+        return repr(value)
+
+    return u'%s' % value
+
+def record_error(err):
+    """
+    Records the database error of the current request by its type, so errors that a handler turns into a 500 response
+    remain visible.
+    """
+
+    request_metrics = _current()
+
+    if request_metrics is not None:
+        request_metrics.errors += (err.__class__.__name__,)
+
+def record_phases(environ):
+    """
+    Starts recording the phases and database errors of the request of `environ` on the calling thread and returns the
+    dict of the seconds spent in each phase, for requests that no `MetricsPlugin` records.
+    """
+
+    request_metrics = _RequestMetrics()
+    environ[ENVIRON_KEY] = request_metrics
+    _LOCAL.current = request_metrics
+
+    return request_metrics
+
+def request_phases():
+    """
+    Returns the dict of the seconds spent in each phase of the current request so far, or `None` when its phases are
+    not recorded.
+    """
+
+    return _current()
+
+def stop_recording_phases(environ):
+    """
+    Stops recording the phases of the request of `environ` started with `record_phases` on the calling thread.
+    """
+
+    _LOCAL.current = None
+    environ.pop(ENVIRON_KEY, None)
+
+def timed(phase):
+    """
+    Returns a context manager that adds the time spent in its block to the `phase` of the current request.
+    """
+
+    return _Timed(phase)
+
+def timed_dumps(dumps):
+    """
+    Returns a wrapper of the `dumps` JSON encoder that attributes its time to the `serialize` phase of the current
+    request.
+    """
+
+    def timed_dumps_wrapper(obj):
+        """
+        Returns the JSON encoding of the object, attributing the time to the `serialize` phase of the current request.
+        """
+
+        # Called by the JSON plugin inside of the metrics plugin wrapper for every response, so it skips the context
+        # manager
+        request_metrics = getattr(_LOCAL, u'current', None)
+        started = time.time()
+        body = dumps(obj)
+
+        if request_metrics is not None:
+            request_metrics[u'serialize'] = request_metrics.get(u'serialize', 0.0) + time.time() - started
+
+        return body
+
+    return timed_dumps_wrapper
+
+timed_json_dumps = timed_dumps(json.dumps) # pylint: disable=invalid-name
+
+class MetricsPlugin(object): # pylint: disable=too-few-public-methods
+    """
+    `MetricsPlugin` records the request count by status code, the latency, the request and response sizes, the time
+    spent in each of the `PHASES` and the database errors of every route, labelled with the route rule. It must be
+    installed before the `bottle` JSON plugin so the JSON encoding is included in the measured time.
+    """
+
+    name = u'metrics'
+    api = 2
+
+    def __init__(self, registry):
+        self.registry = registry
+
+        self.db_errors = registry.counter(u'sha_api_db_errors_total', u'Database errors by route and error type.',
+                                          (u'route', u'error'))
+        self.duration = registry.histogram(u'sha_api_request_duration_seconds', u'Request latency by route.',
+                                           (u'route', u'method'))
+        self.phase_duration = registry.histogram(u'sha_api_request_phase_duration_seconds',
+                                                 u'Time per request spent in each request phase.',
+                                                 (u'route', u'phase'))
+        self.request_size = registry.histogram(u'sha_api_request_size_bytes', u'Request body sizes by route.',
+                                               (u'route',), SIZE_BUCKETS)
+        self.requests = registry.counter(u'sha_api_requests_total', u'Requests by route, method and status code.',
+                                         (u'route', u'method', u'status'))
+        self.response_size = registry.histogram(u'sha_api_response_size_bytes', u'Response body sizes by route.',
+                                                (u'route',), SIZE_BUCKETS)
+
+    def apply(self, callback, route):
+        """
+        Wraps the route callback to record its metrics.
+        """
+
+        # Resolve the metrics of the route once and guard them with one lock, so recording a request only takes a
+        # single lock and does no label lookups
+        lock = threading.Lock()
+        duration = self.duration.child((route.rule, route.method), lock)
+        phase_durations = dict((phase, self.phase_duration.child((route.rule, phase), lock)) for phase in PHASES)
+        request_size = self.request_size.child((route.rule,), lock)
+        requests = {}
+        response_size = self.response_size.child((route.rule,), lock)
+
+        def wrapper(*args, **kwargs):
+            """
+            Calls the route callback and records its metrics.
+            """
+
+            environ = request.environ
+            request_metrics = _RequestMetrics()
+            environ[ENVIRON_KEY] = request_metrics
+            _LOCAL.current = request_metrics
+            started = time.time()
+            status = 500
+            body = None
+
+            try:
+                body = result = callback(*args, **kwargs)
+
+                # The JSON plugin returns the HTTP errors its callback raises instead of raising them again
+                if isinstance(result, bottle.HTTPResponse):
+                    status = result.status_code
+                    body = result.body
+                else:
+                    status = response.status_code
+
+                return result
+            except bottle.HTTPResponse as err:
+                status = err.status_code
+                body = err.body
+                raise
+            finally:
+                elapsed = time.time() - started
+                # The request stays bound to the thread after it is handled, so its metrics are removed from it
+                _LOCAL.current = None
+                environ.pop(ENVIRON_KEY, None)
+
+                if body.__class__ in STRING_TYPES:
+                    body_size = len(body)
+                else:
+                    body_size = response.content_length
+
+                # A malformed Content-Length must not turn the result of the route into an error
+                try:
+                    request_bytes = int(environ.get(u'CONTENT_LENGTH') or 0)
+                except ValueError:
+                    request_bytes = 0
+
+                status_requests = requests.get(status)
+
+                if status_requests is None:
+                    status_requests = requests.setdefault(status, self.requests.child(
+                        (route.rule, route.method, status), lock
+                    ))
+
+                with lock:
+                    duration.observe_locked(elapsed)
+                    status_requests.value += 1
+
+                    if request_bytes > 0:
+                        request_size.observe_locked(request_bytes)
+
+                    if body_size >= 0:
+                        response_size.observe_locked(body_size)
+
+                    for phase, seconds in request_metrics.items():
+                        phase_durations[phase].observe_locked(seconds)
+
+                for error in request_metrics.errors:
+                    self.db_errors.inc((route.rule, error))
+
+        return wrapper
@@ -0,0 +1,326 @@
+"""
+`sha_api.mybottle.profiler` provides an opt-in request profiler that writes folded call stacks for flame graphs, and a
+`bottle` plugin that profiles sampled requests and adds `Server-Timing` headers.
+
+Classes:
+    ProfilerPlugin: A `bottle` plugin that profiles sampled requests and adds `Server-Timing` headers on request.
+    RequestProfiler: Samples requests, traces them and aggregates their call stacks and phase timings.
+
+Constants:
+    SERVER_TIMING_ENVIRON_KEY: The WSGI environ key of the request header that asks for a `Server-Timing` header.
+"""
+
+import json
+import os
+import random
+import signal
+import sys
+import threading
+import time
+import types
+
+import bottle
+
+from bottle import request, response # pylint: disable=no-name-in-module
+from sha_api.mybottle.metrics import PHASES, record_phases, request_phases, stop_recording_phases
+
+SERVER_TIMING_ENVIRON_KEY = u'HTTP_X_SERVER_TIMING'
+
+class _Tracer(object): # pylint: disable=too-few-public-methods
+    """
+    A `sys.setprofile` function that adds the time spent in each call, excluding its callees, to its folded call stack.
+    """
+
+    __slots__ = (u'stack', u'stacks')
+
+    def __init__(self, root):
+        # Each entry is the frame name, its start time and the time spent in its callees
+        self.stack = [[root, time.time(), 0.0]]
+        self.stacks = {}
+
+    def finish(self):
+        """
+        Ends the calls that are still on the stack and returns the seconds spent in each folded call stack.
+        """
+
+        while self.stack:
+            self._end(time.time())
+
+        return self.stacks
+
+    def trace(self, frame, event, arg):
+        """
+        Records the start and end of Python and C calls.
+        """
+
+        now = time.time()
+
+        if event == u'call':
+            code = frame.f_code
+            self.stack.append([u'%s:%s' % (frame.f_globals.get(u'__name__', code.co_filename), code.co_name), now, 0.0])
+        elif event == u'c_call':
+            owner = getattr(arg, u'__self__', None)
+
+            if owner is None or owner.__class__ is types.ModuleType:
+                name = u'%s:%s' % (getattr(arg, u'__module__', None) or u'builtins', arg.__name__)
+            else:
+                # Methods of C types such as sqlite3.Connection.execute
+                name = u'%s:%s.%s' % (owner.__class__.__module__, owner.__class__.__name__, arg.__name__)
+
+            self.stack.append([name, now, 0.0])
+        elif len(self.stack) > 1:
+            # return, c_return and c_exception end the innermost call, the root is only ended by `finish`
+            self._end(now)
+
+    def _end(self, now):
+        """
+        Ends the innermost call on the stack.
+        """
+
+        name, started, callees = self.stack.pop()
+        elapsed = now - started
+        folded = u';'.join([entry[0] for entry in self.stack] + [name])
+
+        self.stacks[folded] = self.stacks.get(folded, 0.0) + elapsed - callees
+
+        if self.stack:
+            self.stack[-1][2] += elapsed
+
+class RequestProfiler(object):
+    """
+    `RequestProfiler` profiles a `sample_rate` fraction of the requests while it is `enabled` and aggregates their call
+    stacks and phase timings per worker process. They are written to `output_dir` at most every `dump_interval` seconds
+    and whenever profiling is turned off.
+
+    Methods:
+        dump: Writes the aggregated call stacks and phase timings to `output_dir`.
+        install_signal: Toggles profiling when the process receives a signal.
+        paths: Returns the paths of the call stack and phase timing files of the current process.
+        profile: Calls a route callback under the tracer.
+        record: Adds the phase timings of a profiled request.
+        sample: Returns whether the next request should be profiled.
+        toggle: Turns profiling on or off.
+    """
+
+    def __init__(self, output_dir, sample_rate=0.01, enabled=False, dump_interval=60.0):
+        self.dump_interval = dump_interval
+        self.enabled = enabled
+        self.output_dir = output_dir
+        self.sample_rate = sample_rate
+
+        self._last_dump = time.time()
+        self._lock = threading.Lock()
+        self._phases = {}
+        self._pid = os.getpid()
+        self._stacks = {}
+
+    def dump(self):
+        """
+        Writes the aggregated call stacks, in microseconds, and the mean phase timings of each route, in milliseconds,
+        to the files returned by `paths`. Each file is replaced atomically, so it can be read at any time.
+        """
+
+        with self._lock:
+            stacks = sorted(self._stacks.items())
+            phases = dict((name, dict(totals)) for name, totals in self._phases.items())
+            self._last_dump = time.time()
+
+        summary = {}
+
+        for name, totals in phases.items():
+            requests = totals.pop(u'requests')
+            summary[name] = {
+                u'mean_ms': dict((phase, seconds * 1000.0 / requests) for phase, seconds in totals.items()),
+                u'requests': requests
+            }
+
+        stacks_path, phases_path = self.paths()
+
+        if not os.path.isdir(self.output_dir):
+            os.makedirs(self.output_dir)
+
+        _write_atomic(stacks_path, u''.join(u'%s %d\n' % (folded, round(seconds * 1000000))
+                                            for folded, seconds in stacks))
+        _write_atomic(phases_path, json.dumps(summary, indent=2, sort_keys=True) + u'\n')
+
+    def install_signal(self, signum):
+        """
+        Toggles profiling when the process receives the `signum` signal. It must be called from the main thread.
+        """
+
+        signal.signal(signum, lambda signum, frame: self.toggle())
+
+    def paths(self):
+        """
+        Returns a tuple of the paths of the call stack and phase timing files of the current process.
+        """
+
+        prefix = os.path.join(self.output_dir, u'sha_apid-%d' % os.getpid())
+
+        return prefix + u'.folded', prefix + u'.phases.json'
+
+    def profile(self, name, callback, args, kwargs):
+        """
+        Calls the route callback with the `args` tuple and `kwargs` dict under the tracer and adds its call stacks,
+        rooted at a frame of the route `name`. The arguments are passed as is since they can include a `name` keyword.
+        """
+
+        tracer = _Tracer(name)
+        sys.setprofile(tracer.trace)
+
+        try:
+            return callback(*args, **kwargs)
+        finally:
+            sys.setprofile(None)
+            stacks = tracer.finish()
+
+            with self._lock:
+                self._reset_after_fork()
+
+                for folded, seconds in stacks.items():
+                    self._stacks[folded] = self._stacks.get(folded, 0.0) + seconds
+
+    def record(self, name, elapsed, phases):
+        """
+        Adds the total and phase timings of a profiled request of the route `name`, and writes the aggregates if they
+        were last written more than `dump_interval` seconds ago.
+        """
+
+        with self._lock:
+            self._reset_after_fork()
+
+            totals = self._phases.setdefault(name, dict.fromkeys(PHASES + (u'requests', u'total'), 0))
+            totals[u'requests'] += 1
+            totals[u'total'] += elapsed
+
+            for phase, seconds in phases.items():
+                totals[phase] += seconds
+
+            due = time.time() - self._last_dump >= self.dump_interval
+
+        if due:
+            try:
+                self.dump()
+            except (IOError, OSError) as err:
+                sys.stderr.write(u'Failed to write the request profile to %s: %s\n' % (self.output_dir, err))
+
+    def sample(self):
+        """
+        Returns whether the next request should be profiled.
+        """
+
+        return self.enabled and random.random() < self.sample_rate
+
+    def toggle(self):
+        """
+        Turns profiling on or off, writing the aggregates when it is turned off.
+        """
+
+        self.enabled = not self.enabled
+
+        if not self.enabled:
+            try:
+                self.dump()
+            except (IOError, OSError) as err:
+                sys.stderr.write(u'Failed to write the request profile to %s: %s\n' % (self.output_dir, err))
+
+    def _reset_after_fork(self):
+        """
+        Drops the aggregates inherited from the parent process, each worker process writes its own.
+        """
+
+        if self._pid != os.getpid():
+            self._phases = {}
+            self._pid = os.getpid()
+            self._stacks = {}
+
+def _write_atomic(path, content):
+    """
+    Writes the content to a temporary file next to `path` and renames it over `path`.
+    """
+
+    temp_path = u'%s.tmp' % path
+
+    with open(temp_path, u'wb') as fout:
+        fout.write(content.encode(u'utf-8'))
+
+    os.rename(temp_path, path)
+
+def _server_timing(elapsed, phases):
+    """
+    Returns the `Server-Timing` header value of the request total and phase timings, in milliseconds.
+    """
+
+    return u', '.join([u'%s;dur=%.3f' % (phase, phases[phase] * 1000.0) for phase in PHASES if phase in phases] +
+                      [u'total;dur=%.3f' % (elapsed * 1000.0)])
+
+class ProfilerPlugin(object): # pylint: disable=too-few-public-methods
+    """
+    `ProfilerPlugin` profiles the requests sampled by a `RequestProfiler` and, when `server_timing` is set, adds a
+    `Server-Timing` header to the responses of requests that send an `X-Server-Timing` header. It must be installed
+    before the `bottle` JSON plugin.
+    """
+
+    name = u'profiler'
+    api = 2
+
+    def __init__(self, profiler, server_timing=False):
+        self.profiler = profiler
+        self.server_timing = server_timing
+
+    def apply(self, callback, route):
+        """
+        Wraps the route callback to profile sampled requests and add the requested `Server-Timing` headers.
+        """
+
+        name = u'%s %s' % (route.method, route.rule)
+
+        def wrapper(*args, **kwargs):
+            """
+            Calls the route callback, under the tracer if the request is sampled, and records its phase timings.
+            """
+
+            timing = self.server_timing and SERVER_TIMING_ENVIRON_KEY in request.environ
+            sampled = self.profiler.sample()
+
+            if not (timing or sampled):
+                return callback(*args, **kwargs)
+
+            # The metrics plugin records the phases of every request when it is installed, otherwise they are only
+            # recorded for this one
+            phases = request_phases()
+            recording = phases is None
+
+            environ = request.environ
+
+            if recording:
+                phases = record_phases(environ)
+
+            started = time.time()
+            result = None
+
+            try:
+                if sampled:
+                    result = self.profiler.profile(name, callback, args, kwargs)
+                else:
+                    result = callback(*args, **kwargs)
+
+                return result
+            except bottle.HTTPResponse as err:
+                result = err
+                raise
+            finally:
+                elapsed = time.time() - started
+
+                if recording:
+                    stop_recording_phases(environ)
+
+                if sampled:
+                    self.profiler.record(name, elapsed, phases)
+
+                if timing:
+                    # The headers of an HTTP error replace those of the response when it is sent
+                    target = result if isinstance(result, bottle.HTTPResponse) else response
+                    target.set_header(u'Server-Timing', _server_timing(elapsed, phases))
+
+        return wrapper
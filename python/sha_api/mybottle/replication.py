@@ -0,0 +1,416 @@
+"""
+`sha_api.mybottle.replication` provides the follower side of the read replicas of the `sha_api` REST API, tailing the
+change log of a primary `sha_apid` and sending it the writes the follower receives.
+
+Classes:
+    Follower: Tails the change log of a primary and stores its messages with the local storage engine.
+    ReplicaPlugin: A `bottle` plugin that redirects or forwards the write requests of a follower to its primary.
+
+Constants:
+    FORWARDED_HEADERS: The request headers that are sent along with a forwarded write.
+    MAX_SKIPPED_CHANGES: The number of most recently skipped changes kept in the state file.
+    RETRY_INTERVAL: The minimum number of seconds between attempts after an error or while another worker tails.
+    WRITE_MODES: The ways a follower can send writes to its primary.
+"""
+
+import fcntl
+import hashlib
+import json
+import os
+import socket
+import threading
+import time
+
+from bottle import request, response # pylint: disable=no-name-in-module
+from sha_api.mybottle.admission import client_address, route_traffic_class
+from sha_api.mybottle.metrics import record_error
+from sha_api.mybottle.serializers import error_response
+
+try:
+    from httplib import HTTPConnection, HTTPException, HTTPSConnection
+    from urllib import urlencode
+    from urlparse import urlparse
+except ImportError: # pragma: no cover
+    from http.client import HTTPConnection, HTTPException, HTTPSConnection
+    from urllib.parse import urlencode, urlparse
+
+FORWARDED_HEADERS = (u'Accept', u'Content-Type')
+MAX_SKIPPED_CHANGES = 100
+RETRY_INTERVAL = 1.0
+WRITE_MODES = (u'redirect', u'forward')
+
+def _connect(url, timeout):
+    """
+    Returns a new HTTP or HTTPS connection to the host and port of the URL.
+    """
+
+    parsed = urlparse(url)
+
+    if parsed.scheme not in (u'http', u'https') or not parsed.hostname:
+        raise ValueError(u'Invalid primary URL %s, expected http://<host>:<port>' % url)
+
+    return (HTTPSConnection if parsed.scheme == u'https' else HTTPConnection)(parsed.hostname, parsed.port,
+                                                                              timeout=timeout)
+
+class Follower(object):
+    """
+    `Follower` tails the change log of the `sha_apid` primary at the `primary` URL and stores the messages of the
+    changes with the storage engine, once they match their digest.
+
+    Methods:
+        apply: Fetches and applies the next batch of changes and returns the number of changes left to apply.
+        run: Tails the change log until `stop` is called, while the process holds the lock of the state file.
+        start: Starts tailing the change log on a daemon thread of the calling process.
+        stats: Returns the replication state and lag.
+        stop: Stops tailing the change log.
+    """
+
+    def __init__(self, primary, storage, state_path, batch_size=1000, poll_interval=0.2, timeout=10.0, loads=None,
+                 cache=None, max_attempts=10):
+        # Fail on an invalid URL when the app is configured rather than in the tailing thread
+        _connect(primary, timeout)
+
+        self.batch_size = batch_size
+        self.cache = cache
+        self.loads = json.loads if loads is None else loads
+        self.max_attempts = max(1, max_attempts)
+        self.poll_interval = poll_interval
+        self.primary = primary.rstrip(u'/')
+        self.state_path = state_path
+        self.storage = storage
+        self.timeout = timeout
+
+        self._connection = None
+        self._path = urlparse(primary).path.rstrip(u'/')
+        self._pid = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _fetch(self, after):
+        """
+        Returns the decoded response of the primary to a request for the changes after the sequence number.
+        """
+
+        if self._connection is None:
+            self._connection = _connect(self.primary, self.timeout)
+
+        try:
+            self._connection.request(
+                u'GET',
+                u'%s/replication/changes?%s' % (self._path, urlencode({u'after': after, u'limit': self.batch_size})),
+                headers={u'Accept': u'application/json'}
+            )
+            http_response = self._connection.getresponse()
+            body = http_response.read()
+        except Exception:
+            self._connection.close()
+            self._connection = None
+            raise
+
+        if http_response.status != 200:
+            raise IOError(u'The primary answered %d: %s' % (http_response.status, body[:200].decode(u'utf-8',
+                                                                                                    u'replace')))
+
+        return self.loads(body.decode(u'utf-8'))
+
+    def _load_state(self):
+        """
+        Returns the replication state saved in the state file, or the initial state if there is none yet.
+        """
+
+        state = {
+            u'applied_seq': 0,
+            u'batches': 0,
+            u'caught_up_at': None,
+            u'changes': 0,
+            u'errors': 0,
+            u'last_error': None,
+            u'log_id': None,
+            u'polled_at': None,
+            u'primary_seq': 0,
+            u'rejected': 0,
+            u'retry_attempts': 0,
+            u'retry_seq': None,
+            u'skipped': 0,
+            u'skipped_changes': [],
+            u'stored': 0
+        }
+
+        # State files written by older releases lack the newer keys
+        try:
+            with open(self.state_path) as fin:
+                state.update(json.load(fin))
+        except (IOError, OSError, ValueError):
+            pass
+
+        return state
+
+    def _save_state(self, state):
+        """
+        Replaces the state file with the replication state, so the other processes never read a partial file.
+        """
+
+        temp_path = self.state_path + u'.tmp'
+
+        with open(temp_path, u'w') as fout:
+            json.dump(state, fout)
+
+        os.rename(temp_path, self.state_path)
+
+    def apply(self):
+        """
+        Fetches and stores the next batch of changes from the primary and returns the number of changes left to apply.
+        A message that does not match its digest stops the batch and raises a `ValueError` once the changes before it
+        are saved, so it is fetched again on the next poll, until it is skipped on its `max_attempts`th attempt.
+        """
+
+        state = self._load_state()
+        polled_at = time.time()
+        after = state[u'applied_seq']
+        feed = self._fetch(after)
+
+        if feed[u'log_id'] != state[u'log_id']:
+            if after:
+                after = 0
+                feed = self._fetch(after)
+
+            state[u'log_id'] = feed[u'log_id']
+
+        applied = []
+        rejected = None
+        rows = []
+
+        for change in feed[u'changes']:
+            message = change[u'message']
+
+            if message is None or hashlib.sha256(message.encode(u'utf-8')).hexdigest().upper() != change[u'digest']:
+                state[u'rejected'] += 1
+                attempts = state[u'retry_attempts'] + 1 if state[u'retry_seq'] == change[u'seq'] else 1
+
+                # The changes after a rejected one wait for it, so it is fetched again on the next poll
+                if attempts < self.max_attempts:
+                    state[u'retry_attempts'] = attempts
+                    state[u'retry_seq'] = change[u'seq']
+                    rejected = change
+                    break
+
+                # A change that stays bad, e.g. its message is gone from the primary, is recorded and skipped
+                state[u'skipped'] += 1
+                state[u'skipped_changes'] = (state[u'skipped_changes'] + [
+                    {u'digest': change[u'digest'], u'seq': change[u'seq']}
+                ])[-MAX_SKIPPED_CHANGES:]
+            else:
+                rows.append((change[u'digest'], message))
+
+            applied.append(change)
+            state[u'retry_attempts'] = 0
+            state[u'retry_seq'] = None
+
+        if rows:
+            state[u'stored'] += sum(1 for stored in self.storage.put_many(rows) if stored)
+
+            if self.cache is not None:
+                for digest, _ in rows:
+                    self.cache.forget_missing(digest)
+
+        if applied:
+            state[u'applied_seq'] = applied[-1][u'seq']
+            state[u'batches'] += 1
+            state[u'changes'] += len(applied)
+        else:
+            state[u'applied_seq'] = after
+
+        state[u'polled_at'] = polled_at
+        state[u'primary_seq'] = feed[u'last_seq']
+
+        # Every change stored on the primary before the poll has a sequence number up to the last one it returned
+        if state[u'applied_seq'] >= state[u'primary_seq']:
+            state[u'caught_up_at'] = polled_at
+
+        self._save_state(state)
+
+        if rejected is not None:
+            raise ValueError(u'Rejected change %d, its message does not match its digest %s (attempt %d of %d)' % (
+                rejected[u'seq'], rejected[u'digest'], state[u'retry_attempts'], self.max_attempts
+            ))
+
+        return max(0, state[u'primary_seq'] - state[u'applied_seq'])
+
+    def run(self):
+        """
+        Waits for the lock of the state file, then applies batches of changes until `stop` is called, right away while
+        changes are left and every `poll_interval` seconds once it has applied every change. Errors are counted in the
+        state file and retried after at least `RETRY_INTERVAL` seconds.
+        """
+
+        with open(self.state_path + u'.lock', u'a') as lock:
+            while not self._stop.is_set():
+                try:
+                    fcntl.flock(lock.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except (IOError, OSError):
+                    self._stop.wait(RETRY_INTERVAL)
+
+            while not self._stop.is_set():
+                try:
+                    pending = self.apply()
+                except Exception as err: # pylint: disable=broad-except
+                    state = self._load_state()
+                    state[u'errors'] += 1
+                    state[u'last_error'] = u'%s: %s' % (err.__class__.__name__, err)
+
+                    try:
+                        self._save_state(state)
+                    except (IOError, OSError):
+                        pass
+
+                    self._stop.wait(max(self.poll_interval, RETRY_INTERVAL))
+                    continue
+
+                if not pending:
+                    self._stop.wait(self.poll_interval)
+
+    def start(self):
+        """
+        Starts tailing the change log on a daemon thread, once per process. It must be called in each worker process
+        after the fork, only the first process to take the lock of the state file tails the log.
+        """
+
+        if self._pid == os.getpid():
+            return
+
+        self._connection = None
+        self._pid = os.getpid()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self.run, name=u'sha_api-follower')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stats(self):
+        """
+        Returns a dict of the replication state saved in the state file with the primary URL and the lag: the number
+        of changes of the primary left to apply as of the last poll, and the number of seconds since the follower last
+        had every change of the primary, or `None` until it has.
+        """
+
+        stats = self._load_state()
+        stats[u'lag_changes'] = max(0, stats[u'primary_seq'] - stats[u'applied_seq'])
+        stats[u'lag_seconds'] = None if stats[u'caught_up_at'] is None else max(0.0, time.time() -
+                                                                                stats[u'caught_up_at'])
+        stats[u'primary'] = self.primary
+
+        return stats
+
+    def stop(self):
+        """
+        Stops tailing the change log and waits for the current batch to be applied.
+        """
+
+        self._stop.set()
+
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+        self._pid = None
+
+class ReplicaPlugin(object): # pylint: disable=too-few-public-methods
+    """
+    `ReplicaPlugin` redirects or forwards the requests of the write routes of a follower to the `sha_apid` primary at
+    the `primary` URL. It must be installed after the `bottle` JSON plugin and before the admission control.
+    """
+
+    name = u'replica'
+    api = 2
+
+    def __init__(self, primary, mode=u'redirect', timeout=10.0, trusted_proxies=()):
+        if mode not in WRITE_MODES:
+            raise ValueError(u'Unknown write mode %s, expected one of %s' % (mode, u', '.join(WRITE_MODES)))
+
+        _connect(primary, timeout)
+
+        self.mode = mode
+        self.primary = primary.rstrip(u'/')
+        self.timeout = timeout
+        self.trusted_proxies = frozenset(trusted_proxies)
+
+        self._local = threading.local()
+        self._path = urlparse(primary).path.rstrip(u'/')
+
+    def _forward(self):
+        """
+        Sends the current request to the primary and returns its response body, setting its status and content type.
+        """
+
+        body = request.body
+        length = request.content_length
+
+        if length < 0:
+            body.seek(0, os.SEEK_END)
+            length = body.tell()
+
+        headers = {u'Content-Length': str(length)}
+
+        for name in FORWARDED_HEADERS:
+            if request.headers.get(name):
+                headers[name] = request.headers.get(name)
+
+        # The primary rate limits the client of the request rather than the follower, when it trusts the follower
+        client = client_address(request.environ, self.trusted_proxies)
+
+        if client:
+            headers[u'X-Real-IP'] = client
+
+        for attempt in range(2):
+            connection = getattr(self._local, u'connection', None)
+
+            if connection is None:
+                connection = self._local.connection = _connect(self.primary, self.timeout)
+
+            try:
+                body.seek(0)
+                connection.request(request.method, self._path + request.fullpath +
+                                   (u'?' + request.query_string if request.query_string else u''), body, headers)
+                forwarded = connection.getresponse()
+                data = forwarded.read()
+                break
+            except (HTTPException, socket.error) as err:
+                connection.close()
+                self._local.connection = None
+
+                if attempt:
+                    record_error(err)
+                    response.status = 502
+                    return error_response(u'Failed to forward the write to the primary')
+
+        response.status = forwarded.status
+
+        for name in (u'Content-Type', u'Retry-After'):
+            if forwarded.getheader(name):
+                response.set_header(name, forwarded.getheader(name))
+
+        return data
+
+    def apply(self, callback, route):
+        """
+        Wraps the callbacks of the write routes to send their requests to the primary.
+        """
+
+        if route_traffic_class(route) != u'write':
+            return callback
+
+        def wrapper(*args, **kwargs): # pylint: disable=unused-argument
+            """
+            Redirects or forwards the write request to the primary instead of calling the route callback.
+            """
+
+            if self.mode == u'forward':
+                return self._forward()
+
+            response.status = 307
+            response.set_header(u'Location', self.primary + request.fullpath +
+                                (u'?' + request.query_string if request.query_string else u''))
+
+            return error_response(u'Writes are served by the primary %s' % self.primary)
+
+        return wrapper
@@ -0,0 +1,153 @@
+"""
+`sha_api.mybottle.serializers` provides the pluggable JSON serializers that decode the request bodies and encode the
+responses, and a `bottle` plugin that passes the configured one to route callbacks.
+
+Classes:
+    Serializer: A pair of JSON encode and decode functions that reuses the encoding of constant responses.
+    SerializerPlugin: A `bottle` plugin that passes a `Serializer` instance to route callbacks that accept a
+                      `serializer` keyword argument.
+
+Constants:
+    SERIALIZERS: The names of the supported serializers, in the order `auto` prefers them.
+
+Methods:
+    constant: Marks a response object as constant so serializers encode it only once.
+    error_response: Returns the constant error response object of a fixed error message.
+    get_serializer: Returns the serializer with the configured name.
+"""
+
+import functools
+import json
+import threading
+
+from sha_api.mybottle.keyword_plugin import KeywordPlugin
+
+SERIALIZERS = (u'orjson', u'ujson', u'json')
+
+# Constant objects by id, they are never freed so their ids are never reused by another object
+_CONSTANTS = {}
+_ERRORS = {}
+_ERRORS_LOCK = threading.Lock()
+
+def _json_codec():
+    """
+    Returns the encode and decode functions of the standard library `json` module.
+    """
+
+    return json.dumps, json.loads
+
+def _orjson_codec():
+    """
+    Returns the encode and decode functions of `orjson`, raises `ImportError` if it is not installed.
+    """
+
+    import orjson # pylint: disable=import-error
+
+    return orjson.dumps, orjson.loads
+
+def _ujson_codec():
+    """
+    Returns the encode and decode functions of `ujson`, raises `ImportError` if it is not installed.
+    """
+
+    import ujson # pylint: disable=import-error
+
+    # Forward slashes are escaped by default, which the other encoders do not do
+    return functools.partial(ujson.dumps, escape_forward_slashes=False), ujson.loads
+
+_CODECS = {
+    u'json': _json_codec,
+    u'orjson': _orjson_codec,
+    u'ujson': _ujson_codec
+}
+
+def constant(obj):
+    """
+    Marks the response object as constant and returns it. Serializers encode it on first use and return the same
+    encoding afterwards, so it must never be modified.
+    """
+
+    _CONSTANTS[id(obj)] = obj
+
+    return obj
+
+def error_response(err_msg):
+    """
+    Returns the constant `{"err_msg": err_msg}` response object of the error message. The same object is returned for
+    the same message, so it must only be used for fixed messages or ones built from configuration settings.
+    """
+
+    err_response = _ERRORS.get(err_msg)
+
+    if err_response is None:
+        with _ERRORS_LOCK:
+            err_response = _ERRORS.get(err_msg)
+
+            if err_response is None:
+                err_response = _ERRORS[err_msg] = constant({u'err_msg': err_msg})
+
+    return err_response
+
+def get_serializer(name=u'auto'):
+    """
+    Returns the `Serializer` named by one of the `SERIALIZERS` or `auto` for the first of them that is installed.
+    Raises `ValueError` for an unknown name and `ImportError` if the named serializer is not installed.
+    """
+
+    if name == u'auto':
+        for candidate in SERIALIZERS:
+            try:
+                return get_serializer(candidate)
+            except ImportError:
+                continue
+
+    if name not in _CODECS:
+        raise ValueError(u'Unknown serializer %s, expected auto or one of %s' % (name, u', '.join(SERIALIZERS)))
+
+    dumps, loads = _CODECS[name]()
+
+    return Serializer(name, dumps, loads)
+
+class Serializer(object):
+    """
+    `Serializer` encodes and decodes JSON with the `dumps` and `loads` functions of a JSON library and reuses the
+    encoding of the response objects marked with `constant`.
+
+    Methods:
+        dumps: Returns the JSON encoding of an object.
+        loads: Returns the object decoded from a JSON string.
+    """
+
+    def __init__(self, name, dumps, loads):
+        self.loads = loads
+        self.name = name
+
+        self._bodies = {}
+        self._dumps = dumps
+
+    def dumps(self, obj):
+        """
+        Returns the JSON encoding of the object, which is only computed once for constant objects.
+        """
+
+        body = self._bodies.get(id(obj))
+
+        if body is None:
+            body = self._dumps(obj)
+
+            if _CONSTANTS.get(id(obj)) is obj:
+                self._bodies[id(obj)] = body
+
+        return body
+
+class SerializerPlugin(KeywordPlugin): # pylint: disable=too-few-public-methods
+    """
+    `SerializerPlugin` passes a `Serializer` instance to route callbacks that accept a `serializer` keyword argument
+    (configurable). Routes that do not accept the keyword are left untouched.
+    """
+
+    name = u'serializer'
+
+    def __init__(self, serializer, keyword=u'serializer'):
+        super(SerializerPlugin, self).__init__(serializer, keyword)
+        self.serializer = serializer
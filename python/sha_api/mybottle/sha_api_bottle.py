@@ -8,17 +8,34 @@ Classes:
 Methods:
     global_config: A wrapper around `bottle.ConfigDict` to retrieve a configuration setting either from the global app
                    config or its default value in both old format and the new namespace format.
+    global_config_bool: A wrapper around `global_config` that converts the configuration setting to a boolean.
 """
 
-import json
 import os
+import signal
 import sqlite3
 import tempfile
 
 import bottle
 
 from bottle import response # pylint: disable=no-name-in-module
-from bottle.ext import sqlite # pylint: disable=import-error,no-name-in-module
+from sha_api.mybottle.admission import AdmissionController, AdmissionPlugin, ClientRateLimiter, ConcurrencyLimit
+from sha_api.mybottle.content_encoding import ContentEncoderPlugin, DEFAULT_MIN_SIZE, get_content_encoder
+from sha_api.mybottle.counters import Counters
+from sha_api.mybottle.group_commit import GroupCommitPlugin, GroupCommitWriter
+from sha_api.mybottle.message_cache import MessageCache, MessageCachePlugin
+from sha_api.mybottle.metrics import MetricsPlugin, MetricsRegistry, timed_dumps
+from sha_api.mybottle.profiler import ProfilerPlugin, RequestProfiler
+from sha_api.mybottle.replication import Follower, ReplicaPlugin
+from sha_api.mybottle.serializers import get_serializer, SerializerPlugin
+from sha_api.mybottle.shards import ShardedGroupCommitWriter, ShardedSqlitePool
+from sha_api.mybottle.sqlite_pool import DEFAULT_PRAGMAS, GeventDbExecutor, SqlitePool, SqlitePoolPlugin
+from sha_api.schema import create_schema
+from sha_api.storage.changelog import ChangeLog, ChangeLogStorage
+from sha_api.storage.chunking import DEFAULT_CHUNK_SIZE, DEFAULT_THRESHOLD as DEFAULT_CHUNK_THRESHOLD, Chunker
+from sha_api.storage.compression import DEFAULT_THRESHOLD, get_compressor
+from sha_api.storage.engine import ENGINES, ExecutorStorage, StoragePlugin
+from sha_api.storage.sqlite_engine import SqliteStorage
 
 def global_config(config, config_namespace, config_namespace_prop, default):
     """
@@ -32,16 +49,32 @@ def global_config(config, config_namespace, config_namespace_prop, default):
     else:
         return config.get(config_namespace + u'.' + config_namespace_prop, default)
 
+def global_config_bool(config, config_namespace, config_namespace_prop, default):
+    """
+    Returns the boolean configuration setting from the application `ConfigDict` instance or the default. Values
+    loaded from a config file are strings, so `true`, `yes`, `on` and `1` (in any case) are treated as `True`.
+    """
+
+    value = global_config(config, config_namespace, config_namespace_prop, default)
+
+    if issubclass(value.__class__, bool):
+        return value
+
+    return (u'%s' % value).strip().lower() in (u'1', u'on', u'true', u'yes')
+
 class ShaApiBottle(bottle.Bottle): # pylint: disable=no-member,too-few-public-methods
     """
-    `ShaApiBottle` provides a new `bottle.Bottle` class that by default always returns JSON responses on error
-    and automatically installs sqlite support after loading configuration from an expected location if provided.
+    `ShaApiBottle` provides a new `bottle.Bottle` class that by default always returns JSON responses on error and
+    automatically installs the configured plugins and storage engine after loading configuration from an expected
+    location if provided.
 
     Methods:
         default_error_handler: Overrides the error handler to always return JSON errors instead of HTML.
+        install_profiler_signal: Toggles the request profiler on the configured signal.
+        start_replication: Starts tailing the change log of the primary in a follower.
     """
 
-    def __init__(self, routes=None):
+    def __init__(self, routes=None, async_mode=False):
         super(ShaApiBottle, self).__init__()
 
         if routes is not None:
@@ -71,35 +104,258 @@ class ShaApiBottle(bottle.Bottle): # pylint: disable=no-member,too-few-public-me
             temp_file = tempfile.NamedTemporaryFile(delete=False)
             sqlite_db_file = temp_file.name
 
-        self.install(
-            sqlite.Plugin(
-                dbfile=sqlite_db_file
+        self.serializer = get_serializer(global_config(self.config, u'sha_api', u'serializer', u'auto'))
+
+        # The default JSON plugin is replaced by one that encodes with the serializer. The metrics and profiler plugins
+        # have to wrap it to see the encoded responses, so it is installed after them and times the encoding
+        self.metrics_registry = MetricsRegistry()
+        self.profiler = RequestProfiler(
+            global_config(self.config, u'profiler', u'output_dir', u'/data/profiles'),
+            sample_rate=float(global_config(self.config, u'profiler', u'sample_rate', 0.01)),
+            enabled=global_config_bool(self.config, u'profiler', u'enabled', False),
+            dump_interval=float(global_config(self.config, u'profiler', u'dump_interval', 60))
+        )
+        self.profiler_signal = global_config(self.config, u'profiler', u'signal', None)
+        metrics_enabled = global_config_bool(self.config, u'metrics', u'enabled', True)
+        server_timing = global_config_bool(self.config, u'profiler', u'server_timing', False)
+        # Requests pass through the profiler plugin only when profiling can be turned on
+        profiler_installed = self.profiler.enabled or self.profiler_signal is not None or server_timing
+
+        self.uninstall(bottle.JSONPlugin)
+
+        if metrics_enabled:
+            self.install(MetricsPlugin(self.metrics_registry))
+
+        if profiler_installed:
+            self.install(ProfilerPlugin(self.profiler, server_timing=server_timing))
+
+        if metrics_enabled or profiler_installed:
+            self.install(bottle.JSONPlugin(json_dumps=timed_dumps(self.serializer.dumps)))
+        else:
+            self.install(bottle.JSONPlugin(json_dumps=self.serializer.dumps))
+
+        self.install(SerializerPlugin(self.serializer))
+
+        # Only the proxies in front of the server, and the followers of a primary, may set X-Real-IP
+        trusted_proxies = [address.strip() for address in
+                           global_config(self.config, u'admission', u'trusted_proxies', u'').split(u',')
+                           if address.strip()]
+
+        # A follower sends its writes to the primary before they are admitted or take a db connection
+        primary = global_config(self.config, u'replication', u'primary', None)
+        replication_timeout = float(global_config(self.config, u'replication', u'timeout', 10))
+
+        if primary:
+            self.install(ReplicaPlugin(
+                primary,
+                mode=global_config(self.config, u'replication', u'write_mode', u'redirect'),
+                timeout=replication_timeout,
+                trusted_proxies=trusted_proxies
+            ))
+
+        # Requests are admitted before they take a db connection, and shed ones still go through the metrics
+        max_queue = int(global_config(self.config, u'admission', u'max_queue', 64))
+        max_wait = float(global_config(self.config, u'admission', u'max_wait_ms', 100)) / 1000.0
+        limits = {}
+
+        for traffic_class, setting in ((u'read', u'max_reads'), (u'write', u'max_writes')):
+            max_active = int(global_config(self.config, u'admission', setting, 0))
+
+            if max_active > 0:
+                limits[traffic_class] = ConcurrencyLimit(max_active, max_queue=max_queue, max_wait=max_wait)
+
+        client_rate = float(global_config(self.config, u'admission', u'client_rate', 0))
+
+        if client_rate > 0:
+            rate_limiter = ClientRateLimiter(
+                client_rate,
+                float(global_config(self.config, u'admission', u'client_burst', 20)),
+                max_clients=int(global_config(self.config, u'admission', u'max_clients', 10000))
+            )
+        else:
+            rate_limiter = None
+
+        if limits or rate_limiter is not None:
+            self.admission = AdmissionController(
+                limits,
+                rate_limiter=rate_limiter,
+                retry_after=int(global_config(self.config, u'admission', u'retry_after', 1))
+            )
+
+            self.install(AdmissionPlugin(self.admission, trusted_proxies=trusted_proxies))
+        else:
+            self.admission = None
+
+        pragmas = tuple(
+            (pragma, global_config(self.config, u'sqlite', pragma, default)) for pragma, default in DEFAULT_PRAGMAS
+        )
+        cached_statements = int(global_config(self.config, u'sqlite', u'cached_statements', 100))
+        without_rowid = global_config_bool(self.config, u'sqlite', u'without_rowid', True)
+        shards = int(global_config(self.config, u'sqlite', u'shards', 1))
+
+        # In sharded mode the messages are spread over the shard files instead of the dbfile, which is not used
+        if shards > 1:
+            self.sqlite_pool = ShardedSqlitePool(
+                global_config(self.config, u'sqlite', u'shard_dir', u'/data/shards'),
+                shards,
+                pragmas=pragmas,
+                cached_statements=cached_statements,
+                without_rowid=without_rowid
+            )
+        else:
+            self.sqlite_pool = SqlitePool(sqlite_db_file, pragmas=pragmas, cached_statements=cached_statements)
+
+        # In async mode the event loop must never block on sqlite, so database routes run on a bounded thread pool
+        if async_mode:
+            self.db_executor = GeventDbExecutor(int(global_config(self.config, u'sha_api', u'db_threads', 16)))
+        else:
+            self.db_executor = None
+
+        self.install(SqlitePoolPlugin(self.sqlite_pool, executor=self.db_executor))
+
+        self.message_cache = MessageCache(
+            max_entries=int(global_config(self.config, u'cache', u'max_entries', 10000)),
+            max_bytes=int(global_config(self.config, u'cache', u'max_bytes', 64 * 1024 * 1024)),
+            negative_ttl=float(global_config(self.config, u'cache', u'negative_ttl', 5.0))
+        )
+
+        self.install(MessageCachePlugin(self.message_cache))
+
+        # The compressed bodies have their own cache so they do not evict the hot messages, and never expire
+        self.content_encoder = get_content_encoder(
+            global_config(self.config, u'response_compression', u'encodings', u'auto'),
+            min_size=int(global_config(self.config, u'response_compression', u'min_size', DEFAULT_MIN_SIZE)),
+            cache=MessageCache(
+                max_entries=int(global_config(self.config, u'response_compression', u'cache_max_entries', 10000)),
+                max_bytes=int(global_config(self.config, u'response_compression', u'cache_max_bytes',
+                                            32 * 1024 * 1024)),
+                negative_ttl=0
             )
         )
 
+        self.install(ContentEncoderPlugin(self.content_encoder))
+
+        storage_engine = global_config(self.config, u'storage', u'engine', u'sqlite')
+
+        if storage_engine not in ENGINES:
+            raise ValueError(u'Unknown storage engine %s, expected one of %s' % (storage_engine, u', '.join(ENGINES)))
+
+        # With group commit the inserts of concurrent requests share one transaction on a single writer thread
+        if storage_engine == u'sqlite' and global_config_bool(self.config, u'sqlite', u'group_commit', False):
+            self.group_commit_writer = (ShardedGroupCommitWriter if shards > 1 else GroupCommitWriter)(
+                self.sqlite_pool,
+                max_batch_size=int(global_config(self.config, u'sqlite', u'group_commit_max_batch', 256))
+            )
+        else:
+            self.group_commit_writer = None
+
+        self.install(GroupCommitPlugin(self.group_commit_writer))
+
+        compression_level = global_config(self.config, u'storage', u'compression_level', None)
+
+        self.compressor = get_compressor(
+            global_config(self.config, u'storage', u'compression', u'none'),
+            level=None if compression_level is None else int(compression_level),
+            threshold=int(global_config(self.config, u'storage', u'compression_threshold', DEFAULT_THRESHOLD))
+        )
+
+        if global_config_bool(self.config, u'storage', u'chunking', False):
+            if storage_engine != u'sqlite':
+                raise ValueError(u'Chunking is only supported by the sqlite storage engine')
+
+            self.chunker = Chunker(
+                chunk_size=int(global_config(self.config, u'storage', u'chunk_size', DEFAULT_CHUNK_SIZE)),
+                threshold=int(global_config(self.config, u'storage', u'chunk_threshold', DEFAULT_CHUNK_THRESHOLD))
+            )
+        else:
+            self.chunker = None
+
+        if storage_engine == u'lmdb':
+            # Imported here so the lmdb package is only required when the engine is used
+            from sha_api.storage.lmdb_engine import DEFAULT_MAP_SIZE, LmdbStorage
+
+            storage = LmdbStorage(
+                global_config(self.config, u'storage', u'path', u'/data/sha_api.lmdb'),
+                map_size=int(global_config(self.config, u'storage', u'map_size', DEFAULT_MAP_SIZE)),
+                sync=global_config_bool(self.config, u'storage', u'sync', True),
+                max_readers=int(global_config(self.config, u'storage', u'max_readers', 126)),
+                compressor=self.compressor
+            )
+        else:
+            storage = SqliteStorage(self.sqlite_pool, writer=self.group_commit_writer, compressor=self.compressor,
+                                    chunker=self.chunker)
+
+        # The messages are appended to the change log after the engine stored them, whatever the engine
+        if global_config_bool(self.config, u'replication', u'changelog', False):
+            self.changelog = ChangeLog(
+                global_config(self.config, u'replication', u'changelog_path', u'/data/sha_api_changes.db'),
+                pragmas=pragmas
+            )
+            storage = ChangeLogStorage(storage, self.changelog)
+        else:
+            self.changelog = None
+
+        # The message routes do not take a db connection, so in async mode the engine itself runs on the executor
+        if self.db_executor is not None:
+            storage = ExecutorStorage(storage, self.db_executor)
+
+        self.storage = storage
+
+        self.install(StoragePlugin(self.storage))
+
+        if primary:
+            self.follower = Follower(
+                primary,
+                self.storage,
+                global_config(self.config, u'replication', u'state_file', u'/data/sha_api_replica.json'),
+                batch_size=int(global_config(self.config, u'replication', u'batch_size', 1000)),
+                poll_interval=float(global_config(self.config, u'replication', u'poll_interval_ms', 200)) / 1000.0,
+                timeout=replication_timeout,
+                loads=self.serializer.loads,
+                cache=self.message_cache,
+                max_attempts=int(global_config(self.config, u'replication', u'max_attempts', 10))
+            )
+        else:
+            self.follower = None
+
+        self.write_counters = Counters(u'duplicates', u'duplicates_cached', u'stored')
+
         # bind all the routes
         if routes is not None:
             for route in routes:
                 self.route(**route)
 
-        # Initialize the sqlite db
-        db_con = sqlite3.connect(sqlite_db_file)
+        # Initialize the sqlite db, the shards are initialized when they are first opened
+        if shards <= 1:
+            db_con = sqlite3.connect(sqlite_db_file)
 
-        db_con.execute("""
-        CREATE TABLE IF NOT EXISTS sha_api (
-            digest  TEXT,
-            message TEXT,
-            PRIMARY KEY (digest, message)
-        );
-        """)
+            create_schema(db_con, without_rowid=without_rowid)
 
-        db_con.close()
+            db_con.close()
 
-    def default_error_handler(self, res): # pylint: disable=no-self-use
+    def default_error_handler(self, res):
         """
         Override the default error handler to always return JSON instead of HTML (dont know why it does this, it makes
         no sense that they set the default content type to JSON then return HTML).
         """
 
         response.content_type = u'application/json'
-        return json.dumps({u'err_msg': res.body})
+        return self.serializer.dumps({u'err_msg': res.body})
+
+    def install_profiler_signal(self):
+        """
+        Toggles the request profiler when the process receives the signal named by `signal` in the `[profiler]`
+        section, if any. It must be called from the main thread of each process that serves requests.
+        """
+
+        if self.profiler_signal is not None:
+            self.profiler.install_signal(getattr(signal, self.profiler_signal))
+
+    def start_replication(self):
+        """
+        Starts tailing the change log of the primary when the app is a follower. It must be called in each process that
+        serves requests, after the fork, only one of them tails the log at a time.
+        """
+
+        if self.follower is not None:
+            self.follower.start()
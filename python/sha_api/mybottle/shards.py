@@ -0,0 +1,440 @@
+"""
+`sha_api.mybottle.shards` provides a sharded storage mode that spreads the messages over several sqlite files by digest,
+the resharding tool and a group commit writer per shard.
+
+Classes:
+    ShardedConnection: The per request view of a `ShardedSqlitePool` that hands out the connections of the shards.
+    ShardedGroupCommitWriter: Group commits the rows of each shard on a writer thread of its own.
+    ShardedSqlitePool: A pool of per thread sqlite3 connections for each shard file, opening the shards on first use.
+
+Constants:
+    MAX_SHARDS: The largest supported shard count, one shard per value of the first four hex characters.
+
+Methods:
+    main: The entrypoint method for setuptools that reshards a database.
+    reshard: Copies the rows of the source database files into a new set of shard files.
+    shard_index: Returns the index of the shard that stores a digest or blob id.
+    shard_paths: Returns the file paths of the shards in a directory.
+"""
+
+from __future__ import print_function
+
+import argparse
+import collections
+import os
+import sqlite3
+import sys
+import threading
+
+from sha_api.mybottle.group_commit import BATCH_ROWS_BUCKETS, GroupCommitWriter
+from sha_api.mybottle.metrics import timed
+from sha_api.mybottle.sqlite_pool import DEFAULT_PRAGMAS, SqlitePool, TEXT_FACTORY
+from sha_api.schema import create_schema
+
+MAX_SHARDS = 65536
+
+# The tables copied by `reshard` with their columns and the query of the key their rows are routed by and the columns.
+# A chunk is copied to the shards of all the messages that refer to it
+RESHARD_TABLES = (
+    (u'sha_api', (u'digest', u'message'), u'SELECT digest, digest, message FROM sha_api'),
+    (u'sha_api_blobs', (u'digest', u'blob_id', u'size'), u'SELECT digest, digest, blob_id, size FROM sha_api_blobs'),
+    (u'sha_api_segments', (u'blob_id', u'seq', u'data'), u'SELECT blob_id, blob_id, seq, data FROM sha_api_segments'),
+    (u'sha_api_chunk_refs', (u'digest', u'seq', u'chunk'),
+     u'SELECT digest, digest, seq, chunk FROM sha_api_chunk_refs'),
+    (u'sha_api_chunks', (u'chunk', u'data'),
+     u'SELECT DISTINCT sha_api_chunk_refs.digest, sha_api_chunks.chunk, sha_api_chunks.data FROM sha_api_chunk_refs '
+     u'JOIN sha_api_chunks ON sha_api_chunks.chunk = sha_api_chunk_refs.chunk')
+)
+
+def shard_index(key, shards):
+    """
+    Returns the index of the shard that stores the digest or blob id `key` out of `shards` shards. Keys that are not
+    hex strings can not be stored and are routed to the first shard.
+    """
+
+    prefix = key[:4]
+
+    try:
+        # Shorter keys are padded with zeros, so a digest prefix is routed like the smallest digest starting with it
+        return (int(prefix, 16) << 4 * (4 - len(prefix))) * shards >> 16
+    except ValueError:
+        return 0
+
+def shard_paths(directory, shards):
+    """
+    Returns the list of the file paths of the `shards` shards in `directory`.
+    """
+
+    return [os.path.join(directory, u'sha_api-%04d-of-%04d.db' % (index, shards)) for index in range(shards)]
+
+class ShardedSqlitePool(object):
+    """
+    `ShardedSqlitePool` keeps a `SqlitePool` for each of the `shards` shard files in `directory`. A shard is opened, and
+    its file and schema created, the first time it is used. `connection` returns a `ShardedConnection` in place of a
+    single connection, so the `SqlitePoolPlugin` passes it to the route callbacks as their `db`.
+
+    Methods:
+        close_all: Closes every connection of the opened shards.
+        connection: Returns a new `ShardedConnection` of the pool.
+        pool: Returns the `SqlitePool` of a shard, opening the shard if needed.
+        shard_index: Returns the index of the shard that stores a digest or blob id.
+        shard_pool: Returns the `SqlitePool` of the shard that stores a digest or blob id.
+    """
+
+    def __init__(self, directory, shards, pragmas=DEFAULT_PRAGMAS, cached_statements=100, without_rowid=True):
+        assert 1 <= shards <= MAX_SHARDS, u'shards must be between 1 and %d' % MAX_SHARDS
+
+        self.cached_statements = cached_statements
+        self.directory = directory
+        self.paths = shard_paths(directory, shards)
+        self.pragmas = pragmas
+        self.shards = shards
+        self.without_rowid = without_rowid
+
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._pools = [None] * shards
+
+    def close_all(self):
+        """
+        Closes every connection of the opened shards. Threads open a new connection on their next use.
+        """
+
+        for pool in self._pools:
+            if pool is not None:
+                pool.close_all()
+
+    def connection(self):
+        """
+        Returns a new `ShardedConnection` that hands out the connections of the calling thread to the shards.
+        """
+
+        return ShardedConnection(self)
+
+    def pool(self, index):
+        """
+        Returns the `SqlitePool` of the shard `index`, creating its file with the current schema on first use.
+        """
+
+        pool = self._pools[index]
+
+        if pool is None:
+            if self._pid != os.getpid():
+                self._lock = threading.Lock()
+                self._pid = os.getpid()
+
+            with self._lock:
+                pool = self._pools[index]
+
+                if pool is None:
+                    if not os.path.isdir(self.directory):
+                        os.makedirs(self.directory)
+
+                    db_con = sqlite3.connect(self.paths[index])
+
+                    try:
+                        create_schema(db_con, without_rowid=self.without_rowid)
+                    finally:
+                        db_con.close()
+
+                    pool = self._pools[index] = SqlitePool(self.paths[index], pragmas=self.pragmas,
+                                                           cached_statements=self.cached_statements)
+
+        return pool
+
+    def shard_index(self, key):
+        """
+        Returns the index of the shard that stores the digest or blob id `key`.
+        """
+
+        return shard_index(key, self.shards)
+
+    def shard_pool(self, key):
+        """
+        Returns the `SqlitePool` of the shard that stores the digest or blob id `key`.
+        """
+
+        return self.pool(shard_index(key, self.shards))
+
+class ShardedConnection(object):
+    """
+    `ShardedConnection` is the `db` of a request in sharded mode. It hands out the pooled connections of the calling
+    thread to the shards of the digests and blob ids the request works on, and commits or rolls back all of them when
+    the request ends. Each shard commits on its own, there are no transactions across shards.
+
+    Methods:
+        commit: Commits the pending changes of every shard used by the request.
+        rollback: Rolls back the pending changes of every shard used by the request.
+        shard: Returns the connection of the shard that stores a digest or blob id.
+        shard_index: Returns the index of the shard that stores a digest or blob id.
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+
+        self._connections = []
+
+    def commit(self):
+        """
+        Commits the pending changes of every shard used by the request.
+        """
+
+        for db_con in self._connections:
+            db_con.commit()
+
+    def rollback(self):
+        """
+        Rolls back the pending changes of every shard used by the request.
+        """
+
+        for db_con in self._connections:
+            db_con.rollback()
+
+    def shard(self, key):
+        """
+        Returns the connection of the calling thread to the shard that stores the digest or blob id `key`.
+        """
+
+        with timed(u'acquire'):
+            db_con = self.pool.shard_pool(key).connection()
+
+        if db_con not in self._connections:
+            self._connections.append(db_con)
+
+        return db_con
+
+    def shard_index(self, key):
+        """
+        Returns the index of the shard that stores the digest or blob id `key`.
+        """
+
+        return self.pool.shard_index(key)
+
+class ShardedGroupCommitWriter(object):
+    """
+    `ShardedGroupCommitWriter` has the same interface as `GroupCommitWriter` for a `ShardedSqlitePool`, queuing the rows
+    of a request on the writer of each of its shards before waiting for any of them.
+
+    Methods:
+        stats: Returns the group commit counters summed over the shards.
+        submit: Queues rows for the next group commit of their shards and returns whether each one was newly stored.
+    """
+
+    def __init__(self, pool, max_batch_size=256):
+        self.max_batch_size = max_batch_size
+        self.pool = pool
+
+        self._lock = threading.Lock()
+        self._writers = [None] * pool.shards
+
+    def stats(self):
+        """
+        Returns a dict of the group commit counters of all shards, where `requests` counts the submits to each shard.
+        """
+
+        stats = {
+            u'batch_rows_histogram': dict((u'%s' % bucket, 0) for bucket in BATCH_ROWS_BUCKETS + (u'inf',)),
+            u'commit_seconds_total': 0.0,
+            u'commits': 0,
+            u'errors': 0,
+            u'max_batch_rows': 0,
+            u'max_commit_seconds': 0.0,
+            u'pending_rows': 0,
+            u'requests': 0,
+            u'rows': 0
+        }
+
+        for writer in self._writers:
+            if writer is None:
+                continue
+
+            shard_stats = writer.stats()
+
+            for name in (u'commit_seconds_total', u'commits', u'errors', u'pending_rows', u'requests', u'rows'):
+                stats[name] += shard_stats[name]
+
+            for name in (u'max_batch_rows', u'max_commit_seconds'):
+                stats[name] = max(stats[name], shard_stats[name])
+
+            for bucket, count in shard_stats[u'batch_rows_histogram'].items():
+                stats[u'batch_rows_histogram'][bucket] += count
+
+        commits = stats[u'commits']
+        stats[u'avg_batch_rows'] = float(stats[u'rows']) / commits if commits else 0.0
+        stats[u'avg_commit_seconds'] = stats[u'commit_seconds_total'] / commits if commits else 0.0
+
+        return stats
+
+    def submit(self, rows):
+        """
+        Queues the `(digest, message)` rows for the next group commit of their shards and blocks until they are all
+        committed.
+
+        Returns:
+            A list with a boolean for each row that is `True` if it was newly stored and `False` if it was already
+            stored.
+
+        Raises:
+            The exception that failed the group commit of a shard. The rows of the other shards may be stored.
+        """
+
+        positions = collections.OrderedDict()
+
+        for position, row in enumerate(rows):
+            positions.setdefault(self.pool.shard_index(row[0]), []).append(position)
+
+        queued = []
+
+        for index, shard_positions in positions.items():
+            writer = self._writer(index)
+            queued.append((writer, shard_positions, writer.queue([rows[position] for position in shard_positions])))
+
+        # Every shard is waited on before an error is raised, so no request is left behind in a writer
+        error = None
+        results = [None] * len(rows)
+
+        for writer, shard_positions, write_request in queued:
+            try:
+                shard_results = writer.wait(write_request)
+            except Exception as err: # pylint: disable=broad-except
+                error = error or err
+                continue
+
+            for position, stored in zip(shard_positions, shard_results):
+                results[position] = stored
+
+        if error is not None:
+            raise error # pylint: disable=raising-bad-type
+
+        return results
+
+    def _writer(self, index):
+        """
+        Returns the `GroupCommitWriter` of the shard `index`, creating it on first use.
+        """
+
+        writer = self._writers[index]
+
+        if writer is None:
+            with self._lock:
+                writer = self._writers[index]
+
+                if writer is None:
+                    writer = self._writers[index] = GroupCommitWriter(
+                        self.pool.pool(index),
+                        max_batch_size=self.max_batch_size
+                    )
+
+        return writer
+
+def reshard(sources, directory, shards, batch_size=10000, without_rowid=True, log=None):
+    """
+    Copies the messages, raw message blobs and their segments, and the chunks of chunked messages of the source database
+    files into a new set of `shards` shard files in `directory`. The sources are either a single database file or the
+    shard files of another shard count, and are left untouched. `sha_apid` must not write to the sources while they are
+    copied. Rows that are already in the new shards are skipped, so an interrupted run can be started again.
+
+    Args:
+        batch_size: The number of rows read from a source per transaction.
+        directory: The directory of the new shard files.
+        log: An optional callable that receives progress messages.
+        shards: The number of new shard files.
+        sources: The list of source database file paths.
+        without_rowid: Whether the `sha_api` tables of the new shards are `WITHOUT ROWID` tables.
+
+    Returns:
+        The number of messages and raw messages copied.
+    """
+
+    log = log or (lambda message: None)
+    targets = ShardedSqlitePool(directory, shards, pragmas=((u'journal_mode', u'WAL'), (u'synchronous', u'OFF')),
+                                without_rowid=without_rowid)
+
+    assert not set(os.path.abspath(path) for path in sources) & set(os.path.abspath(path) for path in targets.paths), \
+        u'The new shard files must not be sources'
+
+    messages = 0
+
+    try:
+        for source in sources:
+            src_con = sqlite3.connect(source)
+            src_con.text_factory = TEXT_FACTORY
+
+            try:
+                tables = set(row[0] for row in src_con.execute(u"SELECT name FROM sqlite_master WHERE type = 'table'"))
+
+                for table, columns, select_sql in RESHARD_TABLES:
+                    if table not in tables:
+                        continue
+
+                    cursor = src_con.execute(select_sql)
+                    copied = 0
+
+                    while True:
+                        rows = cursor.fetchmany(batch_size)
+
+                        if not rows:
+                            break
+
+                        groups = {}
+
+                        for row in rows:
+                            groups.setdefault(targets.shard_index(row[0]), []).append(row[1:])
+
+                        for index, group in groups.items():
+                            db_con = targets.pool(index).connection()
+
+                            with db_con:
+                                db_con.executemany(
+                                    u'INSERT OR IGNORE INTO %s (%s) VALUES (%s)' % (
+                                        table, u', '.join(columns), u', '.join([u'?'] * len(columns))
+                                    ),
+                                    group
+                                )
+
+                        copied += len(rows)
+
+                    if table in (u'sha_api', u'sha_api_blobs'):
+                        messages += copied
+
+                    log(u'Copied %d %s rows from %s' % (copied, table, source))
+            finally:
+                src_con.close()
+    finally:
+        targets.close_all()
+
+    return messages
+
+def main(argv=None): # pragma: no cover
+    """
+    `setuptools` entrypoint for sha_api-reshard or for running manually.
+    """
+
+    parser = argparse.ArgumentParser(description=u'Copy a sha_api database into a new set of shard files while '
+                                                 u'sha_apid is stopped.')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument(u'--from-dbfile', help=u'Reshard the single, unsharded, database file.')
+    source.add_argument(u'--from-shards', type=int, help=u'Reshard the shard files of this shard count.')
+    parser.add_argument(u'--batch-size', default=10000, type=int, help=u'Rows copied per transaction.')
+    parser.add_argument(u'--rowid', action=u'store_true',
+                        help=u'Create rowid tables instead of WITHOUT ROWID tables, for databases of large messages.')
+    parser.add_argument(u'--shard-dir', default=u'/data/shards', help=u'The directory of the shard files.')
+    parser.add_argument(u'shards', type=int, help=u'The new shard count.')
+
+    args = parser.parse_args(argv)
+
+    if args.from_dbfile is not None:
+        sources = [args.from_dbfile]
+    else:
+        sources = [path for path in shard_paths(args.shard_dir, args.from_shards) if os.path.isfile(path)]
+
+    messages = reshard(sources, args.shard_dir, args.shards, batch_size=args.batch_size,
+                       without_rowid=not args.rowid, log=print)
+    print(u'%d messages copied into %d shards in %s, set shards = %d in the [sqlite] section to use them' % (
+        messages, args.shards, args.shard_dir, args.shards
+    ))
+
+    return 0
+
+if __name__ == u'__main__': # pragma: no cover
+    sys.exit(main())
@@ -0,0 +1,201 @@
+"""
+`sha_api.mybottle.sqlite_pool` provides a pool of long lived sqlite3 connections, one per thread, and a `bottle` plugin
+that passes them to route callbacks in place of `bottle-sqlite`.
+
+Classes:
+    GeventDbExecutor: Runs database work on a bounded pool of OS threads so it never blocks a gevent event loop.
+    SqlitePool: A pool of per thread sqlite3 connections opened with tuned PRAGMAs.
+    SqlitePoolPlugin: A `bottle` plugin that passes a pooled connection to route callbacks that accept a `db` keyword
+                      argument.
+
+Constants:
+    DEFAULT_PRAGMAS: The PRAGMAs applied to each connection when they are not configured in the `[sqlite]` section.
+"""
+
+import os
+import sqlite3
+import threading
+
+import bottle
+
+from bottle import request, response # pylint: disable=no-name-in-module
+from sha_api.mybottle.metrics import timed
+
+DEFAULT_PRAGMAS = (
+    (u'journal_mode', u'WAL'),
+    (u'synchronous', u'NORMAL'),
+    (u'mmap_size', 268435456),
+    (u'cache_size', -65536),
+    (u'busy_timeout', 5000)
+)
+
+try:
+    TEXT_FACTORY = unicode
+except NameError: # pragma: no cover
+    TEXT_FACTORY = str
+
+class GeventDbExecutor(object): # pylint: disable=too-few-public-methods
+    """
+    `GeventDbExecutor` runs functions on a gevent pool of at most `max_threads` OS threads and cooperatively waits for
+    their result, so only the calling greenlet waits on sqlite while the event loop keeps serving other connections.
+    The pool is created on first use in each process since it cannot survive a fork.
+
+    Methods:
+        run: Runs a function on the thread pool and returns its result or raises its exception.
+    """
+
+    def __init__(self, max_threads=16):
+        self.max_threads = max_threads
+
+        self._pid = None
+        self._threadpool = None
+
+    def run(self, func):
+        """
+        Runs the function on the thread pool and returns its result or raises its exception.
+        """
+
+        if self._pid != os.getpid():
+            from gevent.threadpool import ThreadPool # pylint: disable=import-error
+
+            self._threadpool = ThreadPool(self.max_threads)
+            self._pid = os.getpid()
+
+        return self._threadpool.apply(func)
+
+class SqlitePool(object):
+    """
+    `SqlitePool` hands out one long lived sqlite3 connection per thread, opening it on first use with the configured
+    PRAGMAs.
+
+    Methods:
+        close_all: Closes every connection opened by the pool.
+        connection: Returns the connection of the calling thread, opening it if needed.
+    """
+
+    def __init__(self, dbfile, pragmas=DEFAULT_PRAGMAS, cached_statements=100):
+        self.dbfile = dbfile
+        self.pragmas = pragmas
+        self.cached_statements = cached_statements
+
+        self._connections = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def close_all(self):
+        """
+        Closes every connection opened by the pool. Threads open a new connection on their next use.
+        """
+
+        with self._lock:
+            connections, self._connections = self._connections, []
+
+        for db_con in connections:
+            db_con.close()
+
+        self._local = threading.local()
+
+    def connection(self):
+        """
+        Returns the sqlite3 connection of the calling thread, opening it with the pool PRAGMAs on first use.
+        """
+
+        if self._pid != os.getpid():
+            # sqlite connections must not be used across a fork, the parent keeps using (and closes) its own so the
+            # inherited ones are only dropped here
+            self._connections = []
+            self._local = threading.local()
+            self._lock = threading.Lock()
+            self._pid = os.getpid()
+
+        db_con = getattr(self._local, u'connection', None)
+
+        if db_con is None:
+            # Connections are only used by the thread that opened them, the check is disabled so `close_all` can close
+            # them from any thread
+            db_con = sqlite3.connect(self.dbfile, cached_statements=self.cached_statements, check_same_thread=False)
+            db_con.text_factory = TEXT_FACTORY
+            db_con.row_factory = sqlite3.Row
+
+            for pragma, value in self.pragmas:
+                db_con.execute(u'PRAGMA %s = %s' % (pragma, value)).fetchall()
+
+            with self._lock:
+                self._connections.append(db_con)
+
+            self._local.connection = db_con
+
+        return db_con
+
+class SqlitePoolPlugin(object): # pylint: disable=too-few-public-methods
+    """
+    `SqlitePoolPlugin` passes the pooled connection of the current thread to route callbacks that accept a `db` keyword
+    argument, committing after the callback returns and rolling back if it raises. With an `executor`, the callback runs
+    on one of its threads.
+    """
+
+    name = u'sqlite_pool'
+    api = 2
+
+    def __init__(self, pool, keyword=u'db', executor=None):
+        self.executor = executor
+        self.pool = pool
+        self.keyword = keyword
+
+    def apply(self, callback, route):
+        """
+        Wraps the route callback to pass the pooled connection as a keyword argument if the callback accepts it.
+        """
+
+        if self.keyword not in route.get_callback_args():
+            return callback
+
+        def call_with_connection(*args, **kwargs):
+            """
+            Adds the pooled connection as a keyword argument to the route callback.
+            """
+
+            with timed(u'acquire'):
+                db_con = self.pool.connection()
+
+            kwargs[self.keyword] = db_con
+
+            try:
+                return_value = callback(*args, **kwargs)
+                db_con.commit()
+            except bottle.HTTPResponse:
+                db_con.commit()
+                raise
+            except Exception:
+                db_con.rollback()
+                raise
+
+            return return_value
+
+        def wrapper(*args, **kwargs):
+            """
+            Calls the route callback with the pooled connection, on the executor if one is set.
+            """
+
+            if self.executor is None:
+                return call_with_connection(*args, **kwargs)
+
+            environ = request.environ
+
+            def run_callback():
+                """
+                Binds the request on the executor thread and returns the callback result and the response it built.
+                """
+
+                request.bind(environ)
+                response.bind()
+
+                return call_with_connection(*args, **kwargs), response.copy(cls=bottle.HTTPResponse)
+
+            return_value, callback_response = self.executor.run(run_callback)
+            callback_response.apply(response)
+
+            return return_value
+
+        return wrapper
@@ -3,64 +3,677 @@
 
 Methods:
     add_message: REST endpoint for POST to /messages. Adds the provided message to the database.
-    retrieve_message: REST endpoint for GET to /messages/<digest>. Retrieves the message with the requested digest from
-                      the database.
+    add_messages: REST endpoint for POST to /messages/batch. Adds a batch of messages to the database in a single
+                  write.
+    add_raw_message: REST endpoint for PUT to /messages. Streams a raw message body of any size into the database.
+    retrieve_message: REST endpoint for GET to /messages/<digest>. Retrieves the message with the requested digest or
+                      digest prefix from the database, or answers a conditional request with 304 Not Modified.
+    retrieve_messages: REST endpoint for POST to /messages/lookup and GET to /messages. Retrieves the messages for a
+                       list of digests from the database.
+    retrieve_raw_message: REST endpoint for GET to /messages/<digest>/raw. Streams the raw body of the message with the
+                          requested digest from the database.
 """
 
 import hashlib
+import json
+import sqlite3
+import uuid
 
-from bottle import request, response # pylint: disable=no-name-in-module
+from bottle import HTTPError, request, response # pylint: disable=no-name-in-module
 
-def add_message(db): # pylint: disable=invalid-name
+from sha_api.mybottle.content_encoding import ENCODINGS
+from sha_api.mybottle.metrics import record_error, timed
+from sha_api.mybottle.serializers import error_response
+from sha_api.mybottle.shards import ShardedConnection
+from sha_api.mybottle.sha_api_bottle import global_config
+from sha_api.storage.compression import decompress_data
+
+DEFAULT_CACHE_MAX_AGE = 31536000
+DEFAULT_MIN_PREFIX_LENGTH = 8
+DIGEST_LENGTH = 64
+HEX_DIGITS = frozenset(u'0123456789ABCDEF')
+JSON_CONTENT_TYPES = (u'application/json', u'application/json-rpc')
+NDJSON_CONTENT_TYPES = (u'application/x-ndjson', u'application/ndjson')
+PREFIX_CANDIDATES = 10
+RAW_CONTENT_TYPE = u'application/octet-stream'
+STREAM_CHUNK_SIZE = 65536
+
+# The storage compression codecs whose data is also a HTTP content coding
+STORED_ENCODINGS = {
+    u'zlib': u'deflate',
+    u'zstd': u'zstd'
+}
+
+def _hash_message(message):
+    """
+    Returns the decoded message and its upper cased SHA256 hex digest.
+    """
+
+    with timed(u'hash'):
+        message = message.decode(u'utf-8')
+
+        return message, hashlib.sha256(message).hexdigest().upper()
+
+def _discard_segments(db, blob_id): # pylint: disable=invalid-name
+    """
+    Deletes the segments of an upload that was not stored, ignoring errors since the upload already failed or was a
+    duplicate.
+    """
+
+    try:
+        with db:
+            db.execute(u'DELETE FROM sha_api_segments WHERE blob_id = ?', (blob_id,))
+    except Exception: # pylint: disable=broad-except
+        pass
+
+def _iter_segments(pool, executor, blob_id):
+    """
+    Yields the segments of a stored raw message one query at a time, so only one segment is held in memory. The
+    segments are read from the pooled connection of the thread that iterates the response, on the executor if one is
+    set.
+    """
+
+    seq = 0
+
+    while True:
+        def fetch_segment(seq=seq):
+            """
+            Returns the segment row with the sequence number or `None` after the last one.
+            """
+
+            return pool.connection().execute(
+                u'SELECT data FROM sha_api_segments WHERE blob_id = ? AND seq = ?',
+                (blob_id, seq)
+            ).fetchone()
+
+        row = fetch_segment() if executor is None else executor.run(fetch_segment)
+
+        if row is None:
+            return
+
+        yield bytes(row[0])
+        seq += 1
+
+def _normalize_digest(digest):
+    """
+    Returns the digest in the upper cased form it is stored in the database.
+    """
+
+    return digest.decode(u'utf-8').upper()
+
+def _not_modified(digest):
+    """
+    Returns the entity tag of the digest, `"<digest>"` or `"<digest>-<encoding>"` of a compressed response, that the
+    `If-None-Match` header of the request lists, compared weakly as RFC 7232 requires for `If-None-Match`, or `None`.
+    """
+
+    if_none_match = request.headers.get(u'If-None-Match')
+
+    if not if_none_match:
+        return None
+
+    etags = [u'"%s"' % digest] + [u'"%s-%s"' % (digest, encoding) for encoding in ENCODINGS]
+
+    for candidate in if_none_match.split(u','):
+        candidate = candidate.strip()
+
+        if candidate.startswith(u'W/'):
+            candidate = candidate[2:]
+
+        if candidate in etags:
+            return candidate
+
+    return None
+
+def _read_chunks(stream, length, chunk_size):
+    """
+    Yields chunks of at most `chunk_size` bytes from the WSGI input, up to `length` bytes or until its end if the
+    length is negative. Raises `IOError` if the input ends before `length` bytes were read.
+    """
+
+    while length != 0:
+        chunk = stream.read(chunk_size if length < 0 else min(chunk_size, length))
+
+        if not chunk:
+            if length > 0:
+                raise IOError(u'Request body ended before its Content-Length')
+
+            return
+
+        if length > 0:
+            length -= len(chunk)
+
+        yield chunk
+
+def _parse_batch(body, content_type, loads):
+    """
+    Returns the list of batch items decoded with `loads` from a JSON array or NDJSON request body. NDJSON lines that
+    cannot be parsed are returned as `None` so they can be reported individually.
+    """
+
+    if content_type in NDJSON_CONTENT_TYPES:
+        items = []
+
+        for line in body.splitlines():
+            if not line.strip():
+                continue
+
+            try:
+                items.append(loads(line))
+            except ValueError:
+                items.append(None)
+
+        return items
+
+    items = loads(body)
+
+    if not issubclass(items.__class__, list):
+        raise ValueError(u'Batch request body must be a JSON array')
+
+    return items
+
+def _request_json(serializer):
+    """
+    Returns the JSON request body decoded like `request.json`, with the serializer if one is set, or `None` if the
+    request is not JSON. Raises an `HTTPError` for invalid JSON or a body larger than `request.MEMFILE_MAX`.
+    """
+
+    if serializer is None:
+        return request.json
+
+    if (request.content_type or u'').split(u';')[0].strip().lower() not in JSON_CONTENT_TYPES:
+        return None
+
+    body = request.body.read(request.MEMFILE_MAX + 1)
+
+    if len(body) > request.MEMFILE_MAX:
+        raise HTTPError(413, u'Request entity too large')
+
+    if not body:
+        return None
+
+    try:
+        return serializer.loads(body)
+    except (TypeError, ValueError):
+        raise HTTPError(400, u'Invalid JSON')
+
+def _resolve_prefix(prefix, storage):
+    """
+    Returns the digest of the only stored message whose digest starts with the prefix and `None`, or `None` and the
+    error response when the prefix is invalid, matches no digest or matches several of them.
+    """
+
+    min_length = int(global_config(request.app.config, u'sha_api', u'min_prefix_length', DEFAULT_MIN_PREFIX_LENGTH))
+
+    if len(prefix) < min_length or not HEX_DIGITS.issuperset(prefix):
+        response.status = 400
+        return None, error_response(u'Invalid digest prefix, expected at least %d hex characters' % min_length)
+
+    try:
+        with timed(u'execute'):
+            digests = storage.find_digests(prefix, PREFIX_CANDIDATES)
+    except Exception as err: # pylint: disable=broad-except
+        record_error(err)
+        response.status = 500
+        return None, error_response(u'Failed to retrieve message for the provided SHA256 digest from database')
+
+    if not digests:
+        response.set_header(u'Cache-Control', u'no-cache')
+        response.status = 404
+        return None, error_response(u'Message not found')
+
+    if len(digests) > 1:
+        response.status = 409
+        return None, {u'digests': digests, u'err_msg': u'Ambiguous digest prefix'}
+
+    return digests[0], None
+
+def _set_cache_headers(etag, immutable=True):
+    """
+    Sets the `ETag` and the immutable `Cache-Control` of a message response, cached for `cache_max_age` seconds, or a
+    `Cache-Control` that has caches revalidate a response that is not immutable.
     """
-    Adds a message and its SHA256 digest to the database.
+
+    response.set_header(u'ETag', etag)
+
+    if immutable:
+        max_age = int(global_config(request.app.config, u'sha_api', u'cache_max_age', DEFAULT_CACHE_MAX_AGE))
+        response.set_header(u'Cache-Control', u'public, max-age=%d, immutable' % max_age)
+    else:
+        response.set_header(u'Cache-Control', u'no-cache')
+
+def _shard(db, key):
+    """
+    Returns the connection of the shard that stores the digest or blob id `key` when `db` is a `ShardedConnection`,
+    otherwise `db` itself.
+    """
+
+    if issubclass(db.__class__, ShardedConnection):
+        return db.shard(key)
+
+    return db
+
+def add_message(storage, cache=None, serializer=None):
+    """
+    Adds a message and its SHA256 digest to the database. Since the digest is derived from the message, a digest that is
+    already cached or stored is not written again and the response reports whether the message was newly stored.
 
     Args:
-        db: A Sqlite3 db connection handle.
+        cache: An optional `MessageCache` instance that is filled with the added message.
+        serializer: An optional `Serializer` instance that decodes the request, otherwise it is decoded by `bottle`.
+        storage: A `StorageEngine` instance.
     """
 
-    if request.json is None:
+    with timed(u'parse'):
+        payload = _request_json(serializer)
+
+    if payload is None:
         response.status = 400
-        return {u'err_msg': u'Invalid content type, expected JSON'}
+        return error_response(u'Invalid content type, expected JSON')
 
-    if request.json.get(u'message') is None:
+    if payload.get(u'message') is None:
         response.status = 400
-        return {u'err_msg': u'Invalid JSON request, no message key found'}
+        return error_response(u'Invalid JSON request, no message key found')
 
-    message = request.json.get(u'message').decode(u'utf-8')
-    sha256_digest = hashlib.sha256(message).hexdigest().upper()
+    message, sha256_digest = _hash_message(payload.get(u'message'))
+
+    if cache is not None and cache.contains(sha256_digest):
+        request.app.write_counters.increment(u'duplicates')
+        request.app.write_counters.increment(u'duplicates_cached')
+        return {u'digest': sha256_digest, u'stored': False}
 
     try:
-        with db:
-            db.execute(u'INSERT OR REPLACE INTO sha_api (digest, message) VALUES (?, ?)', (sha256_digest, message))
-    except Exception: # pylint: disable=broad-except
+        with timed(u'execute'):
+            stored = storage.put(sha256_digest, message)
+    except Exception as err: # pylint: disable=broad-except
+        record_error(err)
         response.status = 500
-        return {u'err_msg': u'Failed to add message and its SHA256 digest to database'}
+        return error_response(u'Failed to add message and its SHA256 digest to database')
+
+    request.app.write_counters.increment(u'stored' if stored else u'duplicates')
 
-    return {u'digest': sha256_digest}
+    if cache is not None:
+        cache.put(sha256_digest, message)
 
-def retrieve_message(digest, db): # pylint: disable=invalid-name
+    return {u'digest': sha256_digest, u'stored': stored}
+
+def add_messages(storage, cache=None, serializer=None):
     """
-    Returns the message associated with the SHA256 digest from the database or an error message if not found.
+    Adds a batch of messages and their SHA256 digests to the database with a single `put_many` of the storage engine.
+    The request body is either a JSON array or NDJSON (`application/x-ndjson`) of message objects. Results are returned
+    in input order with either the digest or the error for each item, so invalid items do not fail the whole batch.
+    Messages whose digest is already stored, or repeated within the batch, are not written again.
 
     Args:
-        db: A Sqlite3 db connection handle.
-        digest: The SHA256 digest of the message to retrieve.
+        cache: An optional `MessageCache` instance whose negative entries for the added digests are cleared.
+        serializer: An optional `Serializer` instance that decodes the request, otherwise it is decoded by `json`.
+        storage: A `StorageEngine` instance.
     """
 
+    content_type = (request.content_type or u'').split(u';')[0].strip().lower()
+
+    if content_type != u'application/json' and content_type not in NDJSON_CONTENT_TYPES:
+        response.status = 400
+        return error_response(u'Invalid content type, expected JSON or NDJSON')
+
     try:
-        row = db.execute(u'SELECT message FROM sha_api WHERE digest = ?', (digest.decode(u'utf-8').upper(),)).fetchone()
+        with timed(u'parse'):
+            items = _parse_batch(request.body.read(), content_type,
+                                 json.loads if serializer is None else serializer.loads)
+    except ValueError:
+        response.status = 400
+        return error_response(u'Invalid JSON request, expected an array of messages')
+
+    max_batch_size = int(global_config(request.app.config, u'sha_api', u'max_batch_size', 1000))
+
+    if len(items) > max_batch_size:
+        response.status = 413
+        return error_response(u'Too many messages in batch, the maximum is %d' % max_batch_size)
+
+    results = []
+    row_results = []
+    rows = []
 
-        if row is not None:
-            message = row[0]
+    for item in items:
+        if not issubclass(item.__class__, dict):
+            results.append({u'err_msg': u'Invalid JSON item, expected a message object'})
+        elif item.get(u'message') is None:
+            results.append({u'err_msg': u'Invalid JSON request, no message key found'})
         else:
-            message = None
-    except Exception: # pylint: disable=broad-except
+            try:
+                message, sha256_digest = _hash_message(item.get(u'message'))
+            except (AttributeError, UnicodeError):
+                results.append({u'err_msg': u'Invalid message, expected a UTF-8 string'})
+                continue
+
+            rows.append((sha256_digest, message))
+            row_results.append({u'digest': sha256_digest, u'stored': False})
+            results.append(row_results[-1])
+
+    stored = []
+
+    if rows:
+        try:
+            with timed(u'execute'):
+                stored = storage.put_many(rows)
+        except Exception as err: # pylint: disable=broad-except
+            record_error(err)
+            response.status = 500
+            return error_response(u'Failed to add messages and their SHA256 digests to database')
+
+    new_rows = [row for row, row_stored in zip(rows, stored) if row_stored]
+
+    for result, row_stored in zip(row_results, stored):
+        result[u'stored'] = row_stored
+
+    request.app.write_counters.increment(u'stored', len(new_rows))
+    request.app.write_counters.increment(u'duplicates', len(rows) - len(new_rows))
+
+    # Only clear the negative entries so a large batch does not flush the hot read set out of the cache
+    if cache is not None:
+        for sha256_digest, _ in new_rows:
+            cache.forget_missing(sha256_digest)
+
+    return {u'results': results}
+
+def add_raw_message(db, storage): # pylint: disable=invalid-name
+    """
+    Adds a raw message body of any size to the database without holding it in memory. The WSGI input is read in
+    chunks of `stream_chunk_size` bytes that are hashed incrementally and written as segments of a new blob in short
+    transactions. Once the body is complete the blob is indexed by its SHA256 digest, or discarded if a message with
+    the digest is already stored.
+
+    Args:
+        db: A Sqlite3 db connection handle or a `ShardedConnection`.
+        storage: A `StorageEngine` instance that is checked for a message added as JSON with the same digest.
+    """
+
+    content_type = (request.content_type or u'').split(u';')[0].strip().lower()
+
+    if content_type != RAW_CONTENT_TYPE:
+        response.status = 400
+        return error_response(u'Invalid content type, expected %s' % RAW_CONTENT_TYPE)
+
+    length = request.content_length
+
+    # Without a length the input can only be read to its end if the server terminates it (e.g. chunked uploads)
+    if length < 0 and not request.environ.get(u'wsgi.input_terminated'):
+        response.status = 411
+        return error_response(u'Content-Length required')
+
+    chunk_size = int(global_config(request.app.config, u'sha_api', u'stream_chunk_size', STREAM_CHUNK_SIZE))
+    blob_id = uuid.uuid4().hex
+    sha256 = hashlib.sha256()
+    size = 0
+
+    # The digest is only known once the body is complete, so the segments are stored in the shard of the blob id
+    segments_db = _shard(db, blob_id)
+
+    try:
+        for seq, chunk in enumerate(_read_chunks(request.environ[u'wsgi.input'], length, chunk_size)):
+            with timed(u'hash'):
+                sha256.update(chunk)
+
+            size += len(chunk)
+
+            with timed(u'execute'), segments_db:
+                segments_db.execute(
+                    u'INSERT INTO sha_api_segments (blob_id, seq, data) VALUES (?, ?, ?)',
+                    (blob_id, seq, sqlite3.Binary(chunk))
+                )
+
+        sha256_digest = sha256.hexdigest().upper()
+        shard_db = _shard(db, sha256_digest)
+
+        with timed(u'execute'):
+            stored = not storage.exists(sha256_digest)
+
+            if stored:
+                with shard_db:
+                    stored = shard_db.execute(
+                        u'INSERT OR IGNORE INTO sha_api_blobs (digest, blob_id, size) VALUES (?, ?, ?)',
+                        (sha256_digest, blob_id, size)
+                    ).rowcount == 1
+    except IOError:
+        _discard_segments(segments_db, blob_id)
+        response.status = 400
+        return error_response(u'Request body ended before its Content-Length')
+    except Exception as err: # pylint: disable=broad-except
+        record_error(err)
+        _discard_segments(segments_db, blob_id)
         response.status = 500
-        return {u'err_msg': u'Failed to retrieve message for the provided SHA256 digest from database'}
+        return error_response(u'Failed to add message and its SHA256 digest to database')
+
+    if not stored:
+        _discard_segments(segments_db, blob_id)
+
+    request.app.write_counters.increment(u'stored' if stored else u'duplicates')
+
+    return {u'digest': sha256_digest, u'stored': stored, u'size': size}
+
+def retrieve_message(digest, storage, cache=None, serializer=None, encoder=None):
+    """
+    Returns the message associated with the SHA256 digest, or the only digest that starts with a digest prefix, from the
+    cache or the database or an error message if not found. Conditional requests that already have its `ETag` get an
+    empty 304 response.
+
+    Args:
+        cache: An optional `MessageCache` instance consulted before the database and filled with the result.
+        digest: The SHA256 digest, or digest prefix, of the message to retrieve.
+        encoder: An optional `ContentEncoder` instance that compresses the response.
+        serializer: An optional `Serializer` instance that encodes compressed responses, otherwise they are encoded by
+                    `json`.
+        storage: A `StorageEngine` instance.
+    """
+
+    digest = _normalize_digest(digest)
+    encoding = None
 
-    if message is not None:
+    if encoder is not None:
+        # Every response of the route depends on the Accept-Encoding of the request, not just the compressed ones
+        response.set_header(u'Vary', u'Accept-Encoding')
+        encoding = encoder.negotiate(request.headers.get(u'Accept-Encoding'))
+
+    immutable = len(digest) >= DIGEST_LENGTH
+
+    if not immutable:
+        digest, err_response = _resolve_prefix(digest, storage)
+
+        if err_response is not None:
+            return err_response
+
+        response.set_header(u'Content-Location', u'/messages/%s' % digest)
+
+    etag = _not_modified(digest)
+
+    if etag is not None:
+        _set_cache_headers(etag, immutable)
+        response.status = 304
+        return u''
+
+    message = None if cache is None else cache.get(digest)
+
+    if message is None:
+        if cache is not None and cache.is_missing(digest):
+            # The message may still be stored later, so caches have to revalidate a miss
+            response.set_header(u'Cache-Control', u'no-cache')
+            response.status = 404
+            return error_response(u'Message not found')
+
+        try:
+            with timed(u'execute'):
+                message = storage.get(digest)
+        except Exception as err: # pylint: disable=broad-except
+            record_error(err)
+            response.status = 500
+            return error_response(u'Failed to retrieve message for the provided SHA256 digest from database')
+
+        if cache is not None:
+            if message is not None:
+                cache.put(digest, message)
+            else:
+                cache.put_missing(digest)
+
+        if message is None:
+            response.set_header(u'Cache-Control', u'no-cache')
+            response.status = 404
+            return error_response(u'Message not found')
+
+    if encoding is None or len(message) < encoder.min_size:
+        _set_cache_headers(u'"%s"' % digest, immutable)
         return {u'message': message}
+
+    # The body is encoded here instead of by the JSON plugin since it has to be compressed
+    with timed(u'serialize'):
+        body = (json.dumps if serializer is None else serializer.dumps)({u'message': message})
+
+    if issubclass(body.__class__, type(u'')):
+        body = body.encode(u'utf-8')
+
+    encoded = encoder.encode(digest, body, encoding)
+    response.content_type = u'application/json'
+
+    if encoded is None:
+        _set_cache_headers(u'"%s"' % digest, immutable)
+        return body
+
+    response.set_header(u'Content-Encoding', encoding)
+    _set_cache_headers(u'"%s-%s"' % (digest, encoding), immutable)
+
+    return encoded
+
+def retrieve_messages(storage, serializer=None):
+    """
+    Returns the messages associated with a list of SHA256 digests from the database. The digests are provided either
+    as a JSON array in the body of a POST or as repeated `digest` query parameters of a GET. The digests are resolved
+    with a single `get_many` of the storage engine and the response maps each found digest to its message and lists the
+    missing digests.
+
+    Args:
+        serializer: An optional `Serializer` instance that decodes the request, otherwise it is decoded by `json`.
+        storage: A `StorageEngine` instance.
+    """
+
+    if request.method == u'GET':
+        digests = request.query.getall(u'digest')
     else:
+        try:
+            with timed(u'parse'):
+                digests = (json.loads if serializer is None else serializer.loads)(request.body.read())
+        except ValueError:
+            digests = None
+
+    if not issubclass(digests.__class__, list):
+        response.status = 400
+        return error_response(u'Invalid JSON request, expected an array of digests')
+
+    max_lookup_size = int(global_config(request.app.config, u'sha_api', u'max_lookup_size', 1000))
+
+    if len(digests) > max_lookup_size:
+        response.status = 413
+        return error_response(u'Too many digests in lookup, the maximum is %d' % max_lookup_size)
+
+    try:
+        digests = [_normalize_digest(digest) for digest in digests]
+    except (AttributeError, UnicodeError):
+        response.status = 400
+        return error_response(u'Invalid digest, expected a hex string')
+
+    # Drop duplicates but keep the requested order so the missing list is stable
+    unique_digests = []
+    seen_digests = set()
+
+    for digest in digests:
+        if digest not in seen_digests:
+            seen_digests.add(digest)
+            unique_digests.append(digest)
+
+    try:
+        with timed(u'execute'):
+            messages = storage.get_many(unique_digests)
+    except Exception as err: # pylint: disable=broad-except
+        record_error(err)
+        response.status = 500
+        return error_response(u'Failed to retrieve messages for the provided SHA256 digests from database')
+
+    return {
+        u'messages': messages,
+        u'missing': [digest for digest in unique_digests if digest not in messages]
+    }
+
+def retrieve_raw_message(digest, db, storage, encoder=None): # pylint: disable=invalid-name
+    """
+    Streams the raw body of the message associated with the SHA256 digest as `application/octet-stream`, or returns an
+    error message if not found. Messages added as JSON are returned as their UTF-8 encoding.
+
+    Args:
+        db: A Sqlite3 db connection handle or a `ShardedConnection`.
+        digest: The SHA256 digest of the message to retrieve.
+        encoder: An optional `ContentEncoder` instance that compresses the response of messages added as JSON.
+        storage: A `StorageEngine` instance that messages added as JSON are retrieved from.
+    """
+
+    digest = _normalize_digest(digest)
+
+    try:
+        with timed(u'execute'):
+            blob = _shard(db, digest).execute(
+                u'SELECT blob_id, size FROM sha_api_blobs WHERE digest = ?',
+                (digest,)
+            ).fetchone()
+            accept_encoding = request.headers.get(u'Accept-Encoding')
+            message = None
+
+            if blob is None:
+                if encoder is None or accept_encoding is None:
+                    message = storage.get_stream(digest)
+                else:
+                    message = storage.get_compressed(digest)
+    except Exception as err: # pylint: disable=broad-except
+        record_error(err)
+        response.status = 500
+        return error_response(u'Failed to retrieve message for the provided SHA256 digest from database')
+
+    if blob is None and message is None:
         response.status = 404
-        return {u'err_msg': u'Message not found'}
+        return error_response(u'Message not found')
+
+    response.content_type = RAW_CONTENT_TYPE
+
+    if blob is None and encoder is not None:
+        response.set_header(u'Vary', u'Accept-Encoding')
+
+    if blob is None and (encoder is None or accept_encoding is None):
+        response.content_length, pieces = message
+        return pieces
+
+    if blob is None:
+        codec, data = message
+
+        if codec is not None and encoder.negotiate(accept_encoding, (STORED_ENCODINGS[codec],)) is not None:
+            response.set_header(u'Content-Encoding', STORED_ENCODINGS[codec])
+            return data
+
+        data = decompress_data(codec, data)
+        encoding = encoder.negotiate(accept_encoding)
+
+        if encoding is None or len(data) < encoder.min_size:
+            return data
+
+        encoded = encoder.encode(u'%s/raw' % digest, data, encoding)
+
+        if encoded is None:
+            return data
+
+        response.set_header(u'Content-Encoding', encoding)
+
+        return encoded
+
+    response.content_length = blob[1]
+
+    pool = request.app.sqlite_pool
+
+    if issubclass(db.__class__, ShardedConnection):
+        pool = pool.shard_pool(blob[0])
+
+    return _iter_segments(pool, request.app.db_executor, blob[0])
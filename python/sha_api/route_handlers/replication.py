@@ -0,0 +1,93 @@
+"""
+`sha_api.route_handlers.replication` provides route handler methods for the /replication/* REST API endpoints that
+follower nodes tail to copy the messages of a primary.
+
+Methods:
+    retrieve_changes: REST endpoint for GET to /replication/changes. Returns the changes of the change log after a
+                      sequence number along with their messages.
+
+Constants:
+    DEFAULT_MAX_BATCH_BYTES: The default maximum number of message characters returned by a single request.
+    MAX_CHANGES: The maximum number of changes returned by a single request.
+    PAGE_SIZE: The number of messages read from the storage engine at a time.
+"""
+
+from bottle import request, response # pylint: disable=no-name-in-module
+
+from sha_api.mybottle.metrics import record_error, timed
+from sha_api.mybottle.serializers import error_response
+from sha_api.mybottle.sha_api_bottle import global_config
+
+DEFAULT_MAX_BATCH_BYTES = 8 * 1024 * 1024
+MAX_CHANGES = 10000
+PAGE_SIZE = 100
+
+def retrieve_changes(storage):
+    """
+    Returns the changes of the change log after the `after` query parameter, at most `limit` of them, with the sequence
+    number of the last change and the id of the log, or a 404 when the change log is disabled.
+
+    Args:
+        storage: A `StorageEngine` instance.
+    """
+
+    changelog = request.app.changelog
+
+    if changelog is None:
+        response.status = 404
+        return error_response(u'The change log is disabled')
+
+    try:
+        after = int(request.query.get(u'after', 0))
+        limit = int(request.query.get(u'limit', 1000))
+    except ValueError:
+        response.status = 400
+        return error_response(u'Invalid after or limit, expected integers')
+
+    if after < 0 or not 0 < limit <= MAX_CHANGES:
+        response.status = 400
+        return error_response(u'Invalid after or limit, expected after >= 0 and 0 < limit <= %d' % MAX_CHANGES)
+
+    max_batch_bytes = int(global_config(request.app.config, u'replication', u'max_batch_bytes',
+                                        DEFAULT_MAX_BATCH_BYTES))
+
+    def read_changes():
+        """
+        Returns the last sequence number and the requested changes of the change log.
+        """
+
+        return changelog.head(), changelog.read(after, limit)
+
+    try:
+        with timed(u'execute'):
+            # Like the storage engine, the change log must not block the event loop in async mode
+            if request.app.db_executor is None:
+                last_seq, changes = read_changes()
+            else:
+                last_seq, changes = request.app.db_executor.run(read_changes)
+
+            results = []
+            size = 0
+
+            # The messages are read a page at a time so a batch of large messages stops before it is all in memory
+            for start in range(0, len(changes), PAGE_SIZE):
+                if size >= max_batch_bytes:
+                    break
+
+                page = changes[start:start + PAGE_SIZE]
+                messages = storage.get_many([digest for _, digest in page])
+
+                for seq, digest in page:
+                    if results and size >= max_batch_bytes:
+                        break
+
+                    message = messages.get(digest)
+                    size += 0 if message is None else len(message)
+
+                    results.append({u'digest': digest, u'message': message, u'seq': seq})
+    except Exception as err: # pylint: disable=broad-except
+        record_error(err)
+        response.status = 500
+        return error_response(u'Failed to read the change log')
+
+    return {u'changes': results, u'last_seq': last_seq, u'log_id': changelog.log_id}
@@ -0,0 +1,192 @@
+"""
+`sha_api.route_handlers.stats` provides route handler methods for the /stats/* REST API endpoints.
+
+Methods:
+    admission_stats: REST endpoint for GET to /stats/admission. Returns the admission control limits and counters.
+    cache_stats: REST endpoint for GET to /stats/cache. Returns the message read cache counters.
+    encoding_stats: REST endpoint for GET to /stats/encoding. Returns the response compression counters.
+    prometheus_metrics: REST endpoint for GET to /metrics. Returns the request metrics and all stats counters in the
+                        Prometheus text exposition format.
+    replication_stats: REST endpoint for GET to /stats/replication. Returns the change log head and the replication
+                       lag of a follower.
+    write_stats: REST endpoint for GET to /stats/writes. Returns the message write and deduplication counters.
+    writer_stats: REST endpoint for GET to /stats/writer. Returns the group commit writer counters.
+
+Constants:
+    ADMISSION_GAUGES: The admission control stats of each limited traffic class exported as Prometheus gauges.
+    CACHE_COUNTERS: The message read cache stats exported as Prometheus counters.
+    CACHE_GAUGES: The message read cache stats exported as Prometheus gauges.
+    PROMETHEUS_CONTENT_TYPE: The content type of the Prometheus text exposition format.
+    REPLICATION_COUNTERS: The follower stats exported as Prometheus counters.
+    REPLICATION_GAUGES: The follower stats exported as Prometheus gauges.
+    WRITER_COUNTERS: The group commit writer stats exported as Prometheus counters.
+"""
+
+from bottle import request, response # pylint: disable=no-name-in-module
+from sha_api.mybottle.admission import COUNTERS as ADMISSION_COUNTERS, TRAFFIC_CLASSES
+
+ADMISSION_GAUGES = (u'in_flight', u'waiting')
+CACHE_COUNTERS = (u'evictions', u'hits', u'misses', u'negative_hits')
+CACHE_GAUGES = (u'bytes', u'entries', u'negative_entries')
+PROMETHEUS_CONTENT_TYPE = u'text/plain; version=0.0.4; charset=utf-8'
+REPLICATION_COUNTERS = (u'batches', u'changes', u'errors', u'rejected', u'skipped', u'stored')
+REPLICATION_GAUGES = (u'applied_seq', u'lag_changes', u'lag_seconds', u'primary_seq')
+WRITER_COUNTERS = (u'commits', u'errors', u'requests', u'rows')
+
+def _samples(name, metric_type, value):
+    """
+    Returns the Prometheus text exposition lines of a metric with a single unlabelled sample.
+    """
+
+    return [u'# TYPE %s %s' % (name, metric_type), u'%s %s' % (name, value)]
+
+def admission_stats():
+    """
+    Returns the admitted, queued and shed request counters of each traffic class along with the current requests in
+    flight and the limits, or only `enabled: false` when admission control is disabled.
+    """
+
+    if request.app.admission is None:
+        return {u'enabled': False}
+
+    stats = request.app.admission.stats()
+    stats[u'enabled'] = True
+
+    return stats
+
+def cache_stats(cache):
+    """
+    Returns the hit, miss and eviction counters and the current size of the message read cache.
+
+    Args:
+        cache: A `MessageCache` instance.
+    """
+
+    return cache.stats()
+
+def encoding_stats(encoder):
+    """
+    Returns the responses and bytes compressed by content coding and the counters of the compressed body cache, or only
+    `enabled: false` when responses are not compressed.
+
+    Args:
+        encoder: A `ContentEncoder` instance or `None`.
+    """
+
+    if encoder is None:
+        return {u'enabled': False}
+
+    stats = encoder.stats()
+    stats[u'enabled'] = True
+
+    return stats
+
+def prometheus_metrics(cache, writer):
+    """
+    Returns the request metrics followed by the message read cache, write, group commit, admission and replication
+    counters in the Prometheus text exposition format. Like the other stats, the metrics are kept per worker process,
+    except for the replication stats of a follower which all its workers read from its state file.
+
+    Args:
+        cache: A `MessageCache` instance.
+        writer: A `GroupCommitWriter` instance or `None`.
+    """
+
+    lines = []
+    stats = cache.stats()
+
+    for name in CACHE_COUNTERS:
+        lines.extend(_samples(u'sha_api_cache_%s_total' % name, u'counter', stats[name]))
+
+    for name in CACHE_GAUGES:
+        lines.extend(_samples(u'sha_api_cache_%s' % name, u'gauge', stats[name]))
+
+    for name, value in sorted(request.app.write_counters.snapshot().items()):
+        lines.extend(_samples(u'sha_api_messages_%s_total' % name, u'counter', value))
+
+    if writer is not None:
+        stats = writer.stats()
+
+        for name in WRITER_COUNTERS:
+            lines.extend(_samples(u'sha_api_group_commit_%s_total' % name, u'counter', stats[name]))
+
+    if request.app.admission is not None:
+        stats = request.app.admission.stats()
+
+        for traffic_class in TRAFFIC_CLASSES:
+            for name in ADMISSION_COUNTERS:
+                name = u'%s_%s' % (traffic_class, name)
+                lines.extend(_samples(u'sha_api_admission_%s_total' % name, u'counter', stats[name]))
+
+        for traffic_class in sorted(request.app.admission.limits):
+            for name in ADMISSION_GAUGES:
+                lines.extend(_samples(u'sha_api_admission_%s_%s' % (traffic_class, name), u'gauge',
+                                      stats[traffic_class][name]))
+
+    if request.app.changelog is not None:
+        lines.extend(_samples(u'sha_api_replication_log_seq', u'gauge', request.app.changelog.head()))
+
+    if request.app.follower is not None:
+        stats = request.app.follower.stats()
+
+        for name in REPLICATION_COUNTERS:
+            lines.extend(_samples(u'sha_api_replication_%s_total' % name, u'counter', stats[name]))
+
+        for name in REPLICATION_GAUGES:
+            # The lag in seconds is unknown until the follower first caught up
+            if stats[name] is not None:
+                lines.extend(_samples(u'sha_api_replication_%s' % name, u'gauge', stats[name]))
+
+    response.content_type = PROMETHEUS_CONTENT_TYPE
+
+    return request.app.metrics_registry.render(lines)
+
+def replication_stats():
+    """
+    Returns the id and last sequence number of the change log of a primary under `changelog`, and the replication state
+    and lag of a follower under `follower`, or only `enabled: false` when the app is neither.
+    """
+
+    changelog = request.app.changelog
+    follower = request.app.follower
+
+    if changelog is None and follower is None:
+        return {u'enabled': False}
+
+    stats = {u'enabled': True}
+
+    if changelog is not None:
+        stats[u'changelog'] = {u'last_seq': changelog.head(), u'log_id': changelog.log_id}
+
+    if follower is not None:
+        stats[u'follower'] = follower.stats()
+
+    return stats
+
+def write_stats():
+    """
+    Returns the counters of newly stored and duplicate messages and the resulting deduplication hit rate.
+    """
+
+    stats = request.app.write_counters.snapshot()
+    writes = stats[u'stored'] + stats[u'duplicates']
+    stats[u'dedup_hit_rate'] = float(stats[u'duplicates']) / writes if writes else 0.0
+
+    return stats
+
+def writer_stats(writer):
+    """
+    Returns the commit, batch size and commit latency counters of the group commit writer, or only `enabled: false`
+    when group commit is disabled.
+
+    Args:
+        writer: A `GroupCommitWriter` instance or `None`.
+    """
+
+    if writer is None:
+        return {u'enabled': False}
+
+    stats = writer.stats()
+    stats[u'enabled'] = True
+
+    return stats
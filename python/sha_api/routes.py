@@ -0,0 +1,99 @@
+"""
+`sha_api.routes` defines the routes of the `sha_apid` REST API and their handlers.
+
+Constants:
+    ROUTES: Defines the routes for our sha_apid daemon REST API and their handlers. The monitoring routes have a
+            `traffic_class` of `none` so they keep answering while admission control sheds load.
+"""
+
+from sha_api.route_handlers.messages import add_message, add_messages, add_raw_message, retrieve_message, \
+                                           retrieve_messages, retrieve_raw_message
+from sha_api.route_handlers.replication import retrieve_changes
+from sha_api.route_handlers.stats import admission_stats, cache_stats, encoding_stats, prometheus_metrics, \
+                                        replication_stats, write_stats, writer_stats
+
+ROUTES = [
+    {
+        u'callback': add_message,
+        u'path': u'/messages',
+        u'method': u'POST'
+    },
+    {
+        u'callback': add_raw_message,
+        u'path': u'/messages',
+        u'method': u'PUT'
+    },
+    {
+        u'callback': add_messages,
+        u'path': u'/messages/batch',
+        u'method': u'POST'
+    },
+    {
+        u'callback': retrieve_messages,
+        u'path': u'/messages',
+        u'method': u'GET'
+    },
+    {
+        u'callback': retrieve_messages,
+        u'path': u'/messages/lookup',
+        u'method': u'POST',
+        u'traffic_class': u'read'
+    },
+    {
+        u'callback': retrieve_message,
+        u'path': u'/messages/<digest>',
+        u'method': u'GET'
+    },
+    {
+        u'callback': retrieve_raw_message,
+        u'path': u'/messages/<digest>/raw',
+        u'method': u'GET'
+    },
+    {
+        u'callback': prometheus_metrics,
+        u'path': u'/metrics',
+        u'method': u'GET',
+        u'traffic_class': u'none'
+    },
+    {
+        u'callback': retrieve_changes,
+        u'path': u'/replication/changes',
+        u'method': u'GET'
+    },
+    {
+        u'callback': admission_stats,
+        u'path': u'/stats/admission',
+        u'method': u'GET',
+        u'traffic_class': u'none'
+    },
+    {
+        u'callback': cache_stats,
+        u'path': u'/stats/cache',
+        u'method': u'GET',
+        u'traffic_class': u'none'
+    },
+    {
+        u'callback': encoding_stats,
+        u'path': u'/stats/encoding',
+        u'method': u'GET',
+        u'traffic_class': u'none'
+    },
+    {
+        u'callback': replication_stats,
+        u'path': u'/stats/replication',
+        u'method': u'GET',
+        u'traffic_class': u'none'
+    },
+    {
+        u'callback': write_stats,
+        u'path': u'/stats/writes',
+        u'method': u'GET',
+        u'traffic_class': u'none'
+    },
+    {
+        u'callback': writer_stats,
+        u'path': u'/stats/writer',
+        u'method': u'GET',
+        u'traffic_class': u'none'
+    }
+]
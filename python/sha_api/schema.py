@@ -0,0 +1,219 @@
+"""
+`sha_api.schema` provides the versioned sqlite schema of the `sha_api` tables and the online migration that upgrades an
+existing database in place. The schema version is kept in `PRAGMA user_version`.
+
+Constants:
+    SCHEMA_VERSION: The current schema version created for new databases.
+
+Methods:
+    create_schema: Creates the `sha_api` table at the current schema version and the raw stream and chunk tables if
+                   they do not exist.
+    main: The entrypoint method for setuptools that runs the migration on a database file.
+    migrate: Upgrades an existing database to the current schema version while it stays online.
+    schema_version: Returns the schema version of a database.
+"""
+
+from __future__ import print_function
+
+import argparse
+import sqlite3
+import sys
+
+SCHEMA_VERSION = 1
+
+CREATE_TABLE_SQL = u"""
+CREATE TABLE IF NOT EXISTS %s (
+    digest  TEXT PRIMARY KEY,
+    message TEXT
+)%s;
+"""
+
+CREATE_BLOB_TABLES_SQL = (
+    u"""
+    CREATE TABLE IF NOT EXISTS sha_api_blobs (
+        digest  TEXT PRIMARY KEY,
+        blob_id TEXT NOT NULL,
+        size    INTEGER NOT NULL
+    )
+    """,
+    u"""
+    CREATE TABLE IF NOT EXISTS sha_api_segments (
+        blob_id TEXT NOT NULL,
+        seq     INTEGER NOT NULL,
+        data    BLOB NOT NULL,
+        PRIMARY KEY (blob_id, seq)
+    )
+    """
+)
+
+CREATE_CHUNK_TABLES_SQL = (
+    u"""
+    CREATE TABLE IF NOT EXISTS sha_api_chunks (
+        chunk BLOB PRIMARY KEY,
+        data  BLOB NOT NULL
+    )
+    """,
+    u"""
+    CREATE TABLE IF NOT EXISTS sha_api_chunk_refs (
+        digest TEXT NOT NULL,
+        seq    INTEGER NOT NULL,
+        chunk  BLOB NOT NULL,
+        PRIMARY KEY (digest, seq)
+    ) WITHOUT ROWID
+    """,
+    u"""
+    CREATE INDEX IF NOT EXISTS sha_api_chunk_refs_chunk ON sha_api_chunk_refs (chunk)
+    """
+)
+
+def create_schema(db_con, without_rowid=True):
+    """
+    Creates the `sha_api` table at the current schema version if the database does not have one yet. Databases with an
+    older table are left untouched until they are migrated. The raw stream and chunk tables are created if they are
+    missing.
+
+    Args:
+        db_con: A Sqlite3 db connection handle.
+        without_rowid: Whether to create a `WITHOUT ROWID` table.
+    """
+
+    for create_table_sql in CREATE_BLOB_TABLES_SQL + CREATE_CHUNK_TABLES_SQL:
+        db_con.execute(create_table_sql)
+
+    if not _table_exists(db_con, u'sha_api'):
+        db_con.execute(_create_table_sql(u'sha_api', without_rowid))
+        db_con.execute(u'PRAGMA user_version = %d' % SCHEMA_VERSION)
+
+    db_con.commit()
+
+def schema_version(db_con):
+    """
+    Returns the schema version of the database or `None` if it does not have a `sha_api` table.
+
+    Args:
+        db_con: A Sqlite3 db connection handle.
+    """
+
+    if not _table_exists(db_con, u'sha_api'):
+        return None
+
+    return db_con.execute(u'PRAGMA user_version').fetchone()[0]
+
+def migrate(dbfile, batch_size=10000, vacuum=False, without_rowid=True, log=None):
+    """
+    Upgrades the database to the current schema version in place while `sha_apid` keeps serving from it, copying the
+    rows in short transactions before swapping the tables atomically.
+
+    Args:
+        batch_size: The number of rows copied per transaction.
+        dbfile: The path of the sqlite database file.
+        log: An optional callable that receives progress messages.
+        vacuum: Whether to `VACUUM` the database afterwards to return the freed pages to the file system.
+        without_rowid: Whether the upgraded table is a `WITHOUT ROWID` table.
+
+    Returns:
+        The number of rows in the migrated table.
+    """
+
+    log = log or (lambda message: None)
+
+    # Autocommit mode so the explicit transactions below are not interrupted by the implicit commits of the module
+    db_con = sqlite3.connect(dbfile, isolation_level=None)
+
+    try:
+        db_con.execute(u'PRAGMA busy_timeout = 30000')
+
+        version = schema_version(db_con)
+
+        if version is None:
+            create_schema(db_con, without_rowid)
+            log(u'Created sha_api table at schema version %d' % SCHEMA_VERSION)
+            return 0
+
+        if version >= SCHEMA_VERSION:
+            log(u'Database is already at schema version %d' % version)
+            return db_con.execute(u'SELECT COUNT(*) FROM sha_api').fetchone()[0]
+
+        db_con.execute(_create_table_sql(u'sha_api_migrate', without_rowid))
+
+        last_rowid = 0
+        max_rowid = db_con.execute(u'SELECT MAX(rowid) FROM sha_api').fetchone()[0] or 0
+
+        while last_rowid < max_rowid:
+            db_con.execute(u'BEGIN IMMEDIATE')
+            batch_rowid = db_con.execute(
+                u'SELECT MAX(rowid) FROM (SELECT rowid FROM sha_api WHERE rowid > ? ORDER BY rowid LIMIT ?)',
+                (last_rowid, batch_size)
+            ).fetchone()[0] or max_rowid
+            db_con.execute(
+                u'INSERT OR REPLACE INTO sha_api_migrate (digest, message) '
+                u'SELECT digest, message FROM sha_api WHERE rowid > ? AND rowid <= ?',
+                (last_rowid, batch_rowid)
+            )
+            db_con.execute(u'COMMIT')
+
+            last_rowid = batch_rowid
+            log(u'Copied rows up to rowid %d of %d' % (last_rowid, max_rowid))
+
+        db_con.execute(u'BEGIN IMMEDIATE')
+
+        try:
+            db_con.execute(
+                u'INSERT OR REPLACE INTO sha_api_migrate (digest, message) '
+                u'SELECT digest, message FROM sha_api WHERE rowid > ?',
+                (last_rowid,)
+            )
+            db_con.execute(u'DROP TABLE sha_api')
+            db_con.execute(u'ALTER TABLE sha_api_migrate RENAME TO sha_api')
+            db_con.execute(u'PRAGMA user_version = %d' % SCHEMA_VERSION)
+            db_con.execute(u'COMMIT')
+        except Exception:
+            db_con.execute(u'ROLLBACK')
+            raise
+
+        log(u'Upgraded sha_api table from schema version %d to %d' % (version, SCHEMA_VERSION))
+
+        if vacuum:
+            db_con.execute(u'VACUUM')
+            log(u'Vacuumed database')
+
+        return db_con.execute(u'SELECT COUNT(*) FROM sha_api').fetchone()[0]
+    finally:
+        db_con.close()
+
+def _create_table_sql(table, without_rowid):
+    """
+    Returns the `CREATE TABLE` statement of the current schema version for the table.
+    """
+
+    return CREATE_TABLE_SQL % (table, u' WITHOUT ROWID' if without_rowid else u'')
+
+def _table_exists(db_con, table):
+    """
+    Returns whether the table exists in the database.
+    """
+
+    return db_con.execute(u"SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone() \
+           is not None
+
+def main(argv=None): # pragma: no cover
+    """
+    `setuptools` entrypoint for sha_api-migrate or for running manually.
+    """
+
+    parser = argparse.ArgumentParser(description=u'Upgrade a sha_api database to the current schema version in place.')
+    parser.add_argument(u'--batch-size', default=10000, type=int, help=u'Rows copied per transaction.')
+    parser.add_argument(u'--rowid', action=u'store_true',
+                        help=u'Create a rowid table instead of a WITHOUT ROWID table, for databases of large messages.')
+    parser.add_argument(u'--vacuum', action=u'store_true', help=u'VACUUM the database after the upgrade.')
+    parser.add_argument(u'dbfile', nargs=u'?', default=u'/data/sha_api.db', help=u'The sqlite database file.')
+
+    args = parser.parse_args(argv)
+
+    rows = migrate(args.dbfile, batch_size=args.batch_size, vacuum=args.vacuum, without_rowid=not args.rowid, log=print)
+    print(u'%d rows at schema version %d' % (rows, SCHEMA_VERSION))
+
+    return 0
+
+if __name__ == u'__main__': # pragma: no cover
+    sys.exit(main())
@@ -1,47 +1,108 @@
 """
-`sha_api.sha_apid` is the entrypoint of the sha_apid daemon for our REST API.
-
-Constants:
-    ROUTES: Defines the routes for our sha_apid daemon REST API and their handlers.
+`sha_api.sha_apid` is the entrypoint of the sha_apid daemon for our REST API. It only imports `bottle` and the
+application once `main` has parsed its arguments, so `--async` can monkey patch the process with gevent first.
 
 Methods:
     main: The entrypoint method for setuptools that instantiates our REST API, configures the routes, and starts the
           REST API.
+    server_options: Returns the extra `bottle.run` options for the configured server.
 """
 
 # pragma: no cover
 
-import bottle
-
-from sha_api.mybottle.sha_api_bottle import global_config, ShaApiBottle
-from sha_api.route_handlers.messages import add_message, retrieve_message
-
-ROUTES = [
-    {
-        u'callback': add_message,
-        u'path': u'/messages',
-        u'method': u'POST'
-    },
-    {
-        u'callback': retrieve_message,
-        u'path': u'/messages/<digest>',
-        u'method': u'GET'
+import argparse
+import multiprocessing
+
+def server_options(config, async_mode=False):
+    """
+    Returns the extra `bottle.run` options for the server configured in the `[sha_api]` section, or for the gevent
+    workers in async mode.
+
+    Args:
+        async_mode: Whether to run the gevent event loop workers regardless of the configured server.
+        config: The application `ConfigDict` instance.
+    """
+
+    from sha_api.mybottle.sha_api_bottle import global_config
+
+    if async_mode:
+        return {
+            u'graceful_timeout': int(global_config(config, u'sha_api', u'graceful_timeout', 30)),
+            u'keepalive': int(global_config(config, u'sha_api', u'keepalive', 5)),
+            u'timeout': int(global_config(config, u'sha_api', u'timeout', 30)),
+            u'worker_class': u'gevent',
+            u'worker_connections': int(global_config(config, u'sha_api', u'worker_connections', 10000)),
+            u'workers': int(global_config(config, u'sha_api', u'workers', multiprocessing.cpu_count()))
+        }
+
+    if global_config(config, u'sha_api', u'server', u'wsgiref') != u'gunicorn':
+        return {}
+
+    threads = int(global_config(config, u'sha_api', u'threads', 1))
+
+    return {
+        u'graceful_timeout': int(global_config(config, u'sha_api', u'graceful_timeout', 30)),
+        u'keepalive': int(global_config(config, u'sha_api', u'keepalive', 5)),
+        u'threads': threads,
+        u'timeout': int(global_config(config, u'sha_api', u'timeout', 30)),
+        u'worker_class': u'gthread' if threads > 1 else u'sync',
+        u'workers': int(global_config(config, u'sha_api', u'workers', multiprocessing.cpu_count()))
     }
-]
 
 def main(): # pragma: no cover
     """
     `setuptools` entrypoint for sha_apid or for running manually.
     """
 
-    app = ShaApiBottle(ROUTES)
+    parser = argparse.ArgumentParser(description=u'The sha_api REST API daemon.')
+    parser.add_argument(u'--async', action=u'store_true', dest=u'async_mode',
+                        help=u'Serve from gevent event loop workers with sqlite work on a bounded thread pool.')
+
+    args = parser.parse_args()
+
+    # bottle binds the request and response to thread locals when it is imported, they must be greenlet locals in async
+    # mode or a greenlet that yields can send its response to the client of another one
+    if args.async_mode:
+        from gevent import monkey # pylint: disable=import-error
+
+        monkey.patch_all()
+
+    import bottle
+
+    from sha_api.mybottle.sha_api_bottle import global_config, ShaApiBottle
+    from sha_api.routes import ROUTES
+
+    app = ShaApiBottle(ROUTES, async_mode=args.async_mode)
+
+    if args.async_mode:
+        server = u'gunicorn'
+    else:
+        server = global_config(app.config, u'sha_api', u'server', u'wsgiref')
+
+    options = server_options(app.config, args.async_mode)
+
+    if server == u'gunicorn':
+        def post_worker_init(worker): # pylint: disable=unused-argument
+            """
+            Installs the profiler signal and starts the replication in each worker after the fork, since gunicorn
+            workers reset their signal handlers and threads do not survive a fork.
+            """
+
+            app.install_profiler_signal()
+            app.start_replication()
+
+        options[u'post_worker_init'] = post_worker_init
+    else:
+        app.install_profiler_signal()
+        app.start_replication()
 
     bottle.run( # pylint: disable=no-member
         app,
         debug=global_config(app.config, u'sha_api', u'debug', True),
         host=global_config(app.config, u'sha_api', u'host', u'0.0.0.0'),
         port=global_config(app.config, u'sha_api', u'port', 8080),
-        server=global_config(app.config, u'sha_api', u'server', u'wsgiref')
+        server=server,
+        **options
     )
 
 if __name__ == u'__main__': # pragma: no cover
@@ -0,0 +1,4 @@
+"""
+The `sha_api.storage` subpackage provides the storage engines that the route handlers store and retrieve messages with,
+selected by the `engine` setting of the `[storage]` section.
+"""
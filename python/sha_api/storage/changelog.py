@@ -0,0 +1,202 @@
+"""
+`sha_api.storage.changelog` provides the change log of a replication primary, an ordered log of the digests of newly
+stored messages that followers tail, and a storage engine wrapper that appends to it.
+
+Classes:
+    ChangeLog: The ordered log of the digests of the newly stored messages.
+    ChangeLogStorage: Wraps a storage engine to append the messages it newly stores to a change log.
+
+Constants:
+    CREATE_CHANGELOG_TABLES_SQL: The statements that create the change log tables.
+"""
+
+import sqlite3
+import time
+import uuid
+
+from sha_api.mybottle.sqlite_pool import DEFAULT_PRAGMAS, SqlitePool
+from sha_api.storage.engine import StorageEngine
+
+CREATE_CHANGELOG_TABLES_SQL = (
+    u"""
+    CREATE TABLE IF NOT EXISTS sha_api_changes (
+        seq     INTEGER PRIMARY KEY AUTOINCREMENT,
+        digest  TEXT NOT NULL,
+        created REAL NOT NULL
+    )
+    """,
+    u"""
+    CREATE TABLE IF NOT EXISTS sha_api_changelog (
+        log_id TEXT NOT NULL
+    )
+    """
+)
+
+class ChangeLog(object):
+    """
+    `ChangeLog` keeps the digests of the newly stored messages in the order they were stored, numbered from 1, in the
+    sqlite file at `path`. Each log gets a random `log_id` when its file is created, so followers can tell a log that
+    was recreated, and numbered from 1 again, from the one they were tailing.
+
+    Methods:
+        append: Appends the changes of a list of digests.
+        close: Closes the connections to the log file.
+        head: Returns the sequence number of the last change.
+        read: Returns the changes after a sequence number.
+    """
+
+    def __init__(self, path, pragmas=DEFAULT_PRAGMAS):
+        self.path = path
+        self.pool = SqlitePool(path, pragmas=pragmas)
+
+        db_con = sqlite3.connect(path)
+
+        with db_con:
+            for statement in CREATE_CHANGELOG_TABLES_SQL:
+                db_con.execute(statement)
+
+            # The first process to open the file names the log, the others read the name it stored
+            db_con.execute(u'INSERT INTO sha_api_changelog (log_id) SELECT ? WHERE NOT EXISTS '
+                           u'(SELECT 1 FROM sha_api_changelog)', (uuid.uuid4().hex,))
+
+        self.log_id = db_con.execute(u'SELECT log_id FROM sha_api_changelog').fetchone()[0]
+
+        db_con.close()
+
+    def append(self, digests):
+        """
+        Appends a change for each digest of the list, in order, in a single transaction.
+        """
+
+        if not digests:
+            return
+
+        created = time.time()
+        db_con = self.pool.connection()
+
+        with db_con:
+            db_con.executemany(u'INSERT INTO sha_api_changes (digest, created) VALUES (?, ?)',
+                               [(digest, created) for digest in digests])
+
+    def close(self):
+        """
+        Closes the connections to the log file opened in this process.
+        """
+
+        self.pool.close_all()
+
+    def head(self):
+        """
+        Returns the sequence number of the last change, or 0 if the log is empty.
+        """
+
+        return self.pool.connection().execute(u'SELECT COALESCE(MAX(seq), 0) FROM sha_api_changes').fetchone()[0]
+
+    def read(self, after, limit):
+        """
+        Returns a list of at most `limit` `(seq, digest)` changes with a sequence number greater than `after`, in order.
+        """
+
+        return [tuple(row) for row in self.pool.connection().execute(
+            u'SELECT seq, digest FROM sha_api_changes WHERE seq > ? ORDER BY seq LIMIT ?', (after, limit)
+        )]
+
+class ChangeLogStorage(StorageEngine):
+    """
+    `ChangeLogStorage` wraps a storage engine to append the digests of the messages that `put` and `put_many` newly
+    store to a `ChangeLog` once the engine has stored them. Messages that were already stored are not appended again.
+    """
+
+    def __init__(self, engine, changelog):
+        self.changelog = changelog
+        self.engine = engine
+        self.name = engine.name
+
+    def close(self):
+        """
+        Closes the engine and the change log.
+        """
+
+        self.engine.close()
+        self.changelog.close()
+
+    def collect_garbage(self):
+        """
+        Returns `collect_garbage` of the engine.
+        """
+
+        return self.engine.collect_garbage()
+
+    def disk_usage(self):
+        """
+        Returns the disk usage of the engine.
+        """
+
+        return self.engine.disk_usage()
+
+    def exists(self, digest):
+        """
+        Returns `exists` of the engine.
+        """
+
+        return self.engine.exists(digest)
+
+    def find_digests(self, prefix, limit):
+        """
+        Returns `find_digests` of the engine.
+        """
+
+        return self.engine.find_digests(prefix, limit)
+
+    def get(self, digest):
+        """
+        Returns `get` of the engine.
+        """
+
+        return self.engine.get(digest)
+
+    def get_compressed(self, digest):
+        """
+        Returns `get_compressed` of the engine.
+        """
+
+        return self.engine.get_compressed(digest)
+
+    def get_many(self, digests):
+        """
+        Returns `get_many` of the engine.
+        """
+
+        return self.engine.get_many(digests)
+
+    def get_stream(self, digest):
+        """
+        Returns `get_stream` of the engine.
+        """
+
+        return self.engine.get_stream(digest)
+
+    def iter(self, start=None):
+        """
+        Returns `iter` of the engine.
+        """
+
+        return self.engine.iter(start)
+
+    def paths(self):
+        """
+        Returns the paths of the engine files.
+        """
+
+        return self.engine.paths()
+
+    def put_many(self, rows):
+        """
+        Stores the rows with the engine, then appends the digests of the newly stored ones to the change log.
+        """
+
+        stored = self.engine.put_many(rows)
+
+        self.changelog.append([digest for (digest, _), new in zip(rows, stored) if new])
+
+        return stored
@@ -0,0 +1,119 @@
+"""
+`sha_api.storage.chunking` provides the content defined chunking of large messages, which lets the storage engine keep
+the parts that similar messages share only once.
+
+Classes:
+    Chunker: Splits the UTF-8 bytes of messages into content defined chunks.
+
+Constants:
+    DEFAULT_CHUNK_SIZE: The default target average size of the chunks in bytes.
+    DEFAULT_THRESHOLD: The default number of characters below which messages are stored whole.
+    MANIFEST_MARKER: The first byte of the stored value of a chunked message.
+
+Methods:
+    is_manifest: Returns whether a stored value is the manifest of a chunked message.
+    manifest: Returns the stored value of a chunked message of a size.
+    manifest_size: Returns the size of the message of a manifest.
+"""
+
+import hashlib
+import math
+import re
+import struct
+
+DEFAULT_CHUNK_SIZE = 8192
+DEFAULT_THRESHOLD = 65536
+
+# Like the codec markers of `sha_api.storage.compression`, a byte that is never part of UTF-8
+MANIFEST_MARKER = b'\xfa'
+
+_SIZE = struct.Struct('>Q')
+
+def _boundary_pattern(bits):
+    """
+    Returns the compiled regular expression that matches the windows of `2 * bits - 1` bytes that end at a chunk
+    boundary. Every other byte of the window is matched by a character class that takes the odd or the even value of
+    each pair of byte values by the bit of the pair in the SHA256 of the position in the window, so the classes are the
+    same on every platform and Python version.
+    """
+
+    classes = []
+
+    for position in range(bits):
+        selected = bytearray(hashlib.sha256((u'sha_api chunk boundary %d' % position).encode(u'ascii')).digest())
+
+        classes.append(u'[%s]' % u''.join(
+            u'\\x%02x' % (pair * 2 + (selected[pair // 8] >> (pair % 8) & 1)) for pair in range(128)
+        ))
+
+    return re.compile(u'.'.join(classes).encode(u'ascii'), re.DOTALL)
+
+def is_manifest(value):
+    """
+    Returns whether the stored value (bytes or buffer) is the manifest of a chunked message.
+    """
+
+    return bytes(value[:1]) == MANIFEST_MARKER
+
+def manifest(size):
+    """
+    Returns the stored value of a chunked message whose UTF-8 encoding has `size` bytes.
+    """
+
+    return MANIFEST_MARKER + _SIZE.pack(size)
+
+def manifest_size(value):
+    """
+    Returns the size in bytes of the UTF-8 encoding of the chunked message of the manifest.
+    """
+
+    return _SIZE.unpack(bytes(value[1:1 + _SIZE.size]))[0]
+
+class Chunker(object): # pylint: disable=too-few-public-methods
+    """
+    `Chunker` splits the UTF-8 bytes of the messages of at least `threshold` characters into content defined chunks of
+    about `chunk_size` bytes, between a quarter and 8 times `chunk_size` long.
+
+    Methods:
+        split: Returns the chunks of the bytes of a message.
+    """
+
+    def __init__(self, chunk_size=DEFAULT_CHUNK_SIZE, threshold=DEFAULT_THRESHOLD):
+        if chunk_size < 256:
+            raise ValueError(u'Invalid chunk size %d, expected at least 256 bytes' % chunk_size)
+
+        self.chunk_size = chunk_size
+        self.max_size = chunk_size * 8
+        self.min_size = chunk_size // 4
+        self.threshold = threshold
+
+        # Past the minimum size a boundary comes after 2 ** bits bytes on average
+        self.bits = int(round(math.log(chunk_size - self.min_size, 2)))
+        self.window = 2 * self.bits - 1
+
+        self._pattern = _boundary_pattern(self.bits)
+
+    def split(self, data):
+        """
+        Returns the list of the consecutive chunks of the bytes, each one ending at the first boundary after the
+        minimum size, or at the maximum size when there is none.
+        """
+
+        chunks = []
+        search = self._pattern.search
+        size = len(data)
+        start = 0
+
+        while start < size:
+            end = min(size, start + self.max_size)
+            match = None
+
+            # A window that ends at the minimum size starts `window` bytes before it
+            if end - start > self.min_size:
+                match = search(data, start + self.min_size - self.window, end)
+
+            cut = end if match is None else match.end()
+            chunks.append(data[start:cut])
+            start = cut
+
+        return chunks
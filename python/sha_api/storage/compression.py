@@ -0,0 +1,209 @@
+"""
+`sha_api.storage.compression` provides the optional compression of the stored messages by the storage engines, marking
+each compressed value with a byte that never occurs in UTF-8.
+
+Classes:
+    Compressor: Compresses messages with a codec and marks them with the codec marker.
+
+Constants:
+    CODECS: The names of the supported codecs, in the order `auto` prefers them.
+    DEFAULT_THRESHOLD: The default number of characters below which messages are stored uncompressed.
+
+Methods:
+    decompress: Returns the message of a stored value, decompressing it if it has a codec marker.
+    decompress_data: Returns the UTF-8 bytes of a message compressed with a codec.
+    get_compressor: Returns the compressor of the configured codec.
+    unpack: Returns the codec and the data of a stored value without decompressing it.
+"""
+
+import codecs
+import threading
+import zlib
+
+from sha_api.mybottle.metrics import timed
+
+CODECS = (u'zstd', u'zlib')
+DEFAULT_THRESHOLD = 256
+
+# Bytes 0xF8 to 0xFF are never part of UTF-8
+_MARKERS = {
+    u'zlib': b'\xf8',
+    u'zstd': b'\xf9'
+}
+
+_LOCAL = threading.local()
+
+def _zlib_codec(level):
+    """
+    Returns the compress and decompress functions of `zlib`.
+    """
+
+    level = 6 if level is None else level
+
+    return lambda data: zlib.compress(data, level), zlib.decompress
+
+def _zstd_codec(level):
+    """
+    Returns the compress and decompress functions of `zstandard`, raises `ImportError` if it is not installed.
+    """
+
+    import zstandard # pylint: disable=import-error
+
+    level = 3 if level is None else level
+
+    # Compressor and decompressor objects must not be shared between threads
+    def compress(data):
+        """
+        Compresses the data with the `ZstdCompressor` of the calling thread.
+        """
+
+        compressor = getattr(_LOCAL, u'zstd_compressor_%d' % level, None)
+
+        if compressor is None:
+            compressor = zstandard.ZstdCompressor(level=level)
+            setattr(_LOCAL, u'zstd_compressor_%d' % level, compressor)
+
+        return compressor.compress(data)
+
+    return compress, _zstd_decompress
+
+def _zstd_decompress(data):
+    """
+    Decompresses the data with the `ZstdDecompressor` of the calling thread, raises `ImportError` if `zstandard` is not
+    installed.
+    """
+
+    decompressor = getattr(_LOCAL, u'zstd_decompressor', None)
+
+    if decompressor is None:
+        import zstandard # pylint: disable=import-error
+
+        decompressor = _LOCAL.zstd_decompressor = zstandard.ZstdDecompressor()
+
+    return decompressor.decompress(data)
+
+_CODECS = {
+    u'zlib': _zlib_codec,
+    u'zstd': _zstd_codec
+}
+
+_CODECS_BY_MARKER = dict((marker, name) for name, marker in _MARKERS.items())
+
+_DECOMPRESSORS = {
+    _MARKERS[u'zlib']: zlib.decompress,
+    _MARKERS[u'zstd']: _zstd_decompress
+}
+
+def decompress(value):
+    """
+    Returns the unicode message of a value stored by an engine: the bytes (or buffer) of a compressed message with its
+    codec marker or of a plain UTF-8 message. Raises `ImportError` for a message compressed with `zstd` when
+    `zstandard` is not installed.
+    """
+
+    decompress_func = _DECOMPRESSORS.get(bytes(value[:1]))
+
+    if decompress_func is None:
+        return codecs.utf_8_decode(value)[0]
+
+    with timed(u'compress'):
+        return decompress_func(value[1:]).decode(u'utf-8')
+
+def decompress_data(codec, data):
+    """
+    Returns the UTF-8 bytes of the message that `unpack` returned as compressed with the codec, or the data itself when
+    the codec is `None`.
+    """
+
+    if codec is None:
+        return data
+
+    with timed(u'compress'):
+        return _DECOMPRESSORS[_MARKERS[codec]](data)
+
+def get_compressor(name=u'auto', level=None, threshold=DEFAULT_THRESHOLD):
+    """
+    Returns the `Compressor` of one of the `CODECS`, or of `auto` for the first of them that is installed, or `None`
+    for `none`. Raises `ValueError` for an unknown name and `ImportError` if the named codec is not installed.
+
+    Args:
+        level: The compression level of the codec, or `None` for its default.
+        name: The name of the codec.
+        threshold: The number of characters below which messages are stored uncompressed.
+    """
+
+    if name == u'none':
+        return None
+
+    if name == u'auto':
+        for candidate in CODECS:
+            try:
+                return get_compressor(candidate, level, threshold)
+            except ImportError:
+                continue
+
+    if name not in _CODECS:
+        raise ValueError(u'Unknown compression %s, expected auto, none or one of %s' % (name, u', '.join(CODECS)))
+
+    compress_func, _ = _CODECS[name](level)
+
+    return Compressor(name, compress_func, threshold)
+
+def unpack(value):
+    """
+    Returns the name of the codec a stored value is compressed with and its compressed bytes, or `None` and the UTF-8
+    bytes of a message that is stored uncompressed, without decompressing it.
+    """
+
+    codec = _CODECS_BY_MARKER.get(bytes(value[:1]))
+
+    if codec is None:
+        return None, bytes(value)
+
+    return codec, bytes(value[1:])
+
+class Compressor(object): # pylint: disable=too-few-public-methods
+    """
+    `Compressor` compresses the messages of at least `threshold` characters with the `compress_func` of a codec and
+    prefixes them with the codec marker.
+
+    Methods:
+        compress: Returns the value to store for a message, or `None` to store it uncompressed.
+        compress_data: Returns the value to store for UTF-8 bytes, or `None` to store them uncompressed.
+    """
+
+    def __init__(self, name, compress_func, threshold=DEFAULT_THRESHOLD):
+        self.name = name
+        self.threshold = threshold
+
+        self._compress_func = compress_func
+        self._marker = _MARKERS[name]
+
+    def compress(self, message):
+        """
+        Returns the marked compressed bytes of the message, or `None` when it is shorter than the threshold or does
+        not get smaller, in which case it is stored uncompressed.
+        """
+
+        if len(message) < self.threshold:
+            return None
+
+        with timed(u'compress'):
+            data = message.encode(u'utf-8')
+            value = self._marker + self._compress_func(data)
+
+        return value if len(value) < len(data) else None
+
+    def compress_data(self, data):
+        """
+        Returns the marked compressed bytes of part of the UTF-8 encoding of a message, such as a chunk, or `None` when
+        it is shorter than the threshold in bytes or does not get smaller.
+        """
+
+        if len(data) < self.threshold:
+            return None
+
+        with timed(u'compress'):
+            value = self._marker + self._compress_func(data)
+
+        return value if len(value) < len(data) else None
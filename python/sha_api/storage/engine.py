@@ -0,0 +1,307 @@
+"""
+`sha_api.storage.engine` provides the interface of the storage engines that map the SHA256 digests of the messages to
+the messages, an executor wrapper and a `bottle` plugin that passes the engine to route callbacks.
+
+Classes:
+    ExecutorStorage: Runs the operations of a storage engine on an executor, such as the `GeventDbExecutor` of the
+                     async mode.
+    StorageEngine: The base class of the storage engines.
+    StoragePlugin: A `bottle` plugin that passes a `StorageEngine` instance to route callbacks that accept a `storage`
+                   keyword argument.
+
+Constants:
+    ENGINES: The names of the supported storage engines.
+    ITER_PAGE_SIZE: The number of messages `iter` reads at a time.
+"""
+
+import itertools
+import os
+
+from sha_api.mybottle.keyword_plugin import KeywordPlugin
+from sha_api.storage.compression import decompress_data
+
+ENGINES = (u'sqlite', u'lmdb')
+ITER_PAGE_SIZE = 1000
+
+class StorageEngine(object):
+    """
+    `StorageEngine` is the base class of the storage engines. Engines implement `get`, `get_many`, `iter`, `paths` and
+    `put_many`, and may override the other methods with faster versions.
+
+    Methods:
+        close: Releases the files and connections held by the engine in this process.
+        collect_garbage: Deletes the stored chunks that no message refers to.
+        disk_usage: Returns the number of bytes the engine files use on disk.
+        exists: Returns whether a message with a digest is stored.
+        find_digests: Returns the stored digests that start with a digest prefix.
+        get: Returns the message with a digest or `None`.
+        get_compressed: Returns the codec and the stored bytes of the message with a digest or `None`.
+        get_many: Returns a dict of the stored messages of a list of digests.
+        get_stream: Returns the size of the message with a digest and an iterator over its UTF-8 bytes, or `None`.
+        iter: Yields the stored digests and messages in digest order.
+        paths: Returns the paths of the engine files.
+        put: Stores a message and returns whether it was newly stored.
+        put_many: Stores a list of messages and returns whether each of them was newly stored.
+    """
+
+    name = None
+
+    def close(self):
+        """
+        Releases the files and connections held by the engine in this process, they are opened again on next use.
+        """
+
+        pass
+
+    def collect_garbage(self):
+        """
+        Deletes the chunks of chunked messages that no stored message refers to anymore and returns a dict of the
+        number of `refs` of deleted messages, of `chunks` and of `chunk_bytes` removed. Engines that do not chunk
+        messages have nothing to collect.
+        """
+
+        return {u'chunk_bytes': 0, u'chunks': 0, u'refs': 0}
+
+    def disk_usage(self):
+        """
+        Returns the number of bytes of the blocks allocated to the engine files, which excludes the holes of sparse
+        files.
+        """
+
+        return sum(os.stat(path).st_blocks * 512 for path in self.paths() if os.path.exists(path))
+
+    def exists(self, digest):
+        """
+        Returns whether a message with the digest is stored.
+        """
+
+        return self.get(digest) is not None
+
+    def get(self, digest):
+        """
+        Returns the message with the digest or `None` if it is not stored.
+        """
+
+        raise NotImplementedError(u'%s does not implement get' % self.__class__.__name__)
+
+    def find_digests(self, prefix, limit):
+        """
+        Returns a list of at most `limit` stored digests that start with the upper cased hex digest prefix, in digest
+        order. Engines read them with a range scan of their ordered keys, so the cost grows with the log of the number
+        of stored messages rather than with the number itself.
+        """
+
+        rows = itertools.takewhile(lambda row: row[0].startswith(prefix), self.iter(prefix))
+
+        return [digest for digest, _ in itertools.islice(rows, limit)]
+
+    def get_compressed(self, digest):
+        """
+        Returns a `(codec, data)` pair of the message with the digest as it is stored, the name of the compression
+        codec and the compressed bytes or `None` and the UTF-8 bytes of an uncompressed message, or `None` if it is
+        not stored. Engines that do not compress messages return their UTF-8 bytes.
+        """
+
+        message = self.get(digest)
+
+        return None if message is None else (None, message.encode(u'utf-8'))
+
+    def get_many(self, digests):
+        """
+        Returns a dict of the stored messages by digest for the list of digests, digests that are not stored are left
+        out.
+        """
+
+        raise NotImplementedError(u'%s does not implement get_many' % self.__class__.__name__)
+
+    def get_stream(self, digest):
+        """
+        Returns a `(size, pieces)` pair of the size in bytes of the UTF-8 encoding of the message with the digest and an
+        iterator over the consecutive pieces of it, or `None` if it is not stored. Engines that chunk messages read the
+        chunks of a large message a few at a time while it is iterated, others return it in one piece.
+        """
+
+        message = self.get_compressed(digest)
+
+        if message is None:
+            return None
+
+        data = decompress_data(*message)
+
+        return len(data), iter([data])
+
+    def iter(self, start=None):
+        """
+        Yields the `(digest, message)` pairs of the stored messages in digest order, from the first digest that is not
+        less than the digest or digest prefix `start` if one is set. Messages are read `ITER_PAGE_SIZE` at a time
+        without holding a transaction between pages, so messages stored while iterating may or may not be included.
+        """
+
+        raise NotImplementedError(u'%s does not implement iter' % self.__class__.__name__)
+
+    def paths(self):
+        """
+        Returns the list of paths of the files the engine stores the messages in.
+        """
+
+        raise NotImplementedError(u'%s does not implement paths' % self.__class__.__name__)
+
+    def put(self, digest, message):
+        """
+        Stores the message under its digest and returns whether it was newly stored.
+        """
+
+        return self.put_many([(digest, message)])[0]
+
+    def put_many(self, rows):
+        """
+        Stores a list of `(digest, message)` rows and returns a list with whether each row was newly stored, in the
+        order of the rows. A digest repeated within the rows is only reported as stored once.
+        """
+
+        raise NotImplementedError(u'%s does not implement put_many' % self.__class__.__name__)
+
+class ExecutorStorage(StorageEngine):
+    """
+    `ExecutorStorage` runs every operation of a storage engine on an executor with a `run(func)` method and waits for
+    its result, so a blocking engine never stalls a gevent event loop. Operations called from a thread of the executor
+    itself run on that thread right away.
+    """
+
+    def __init__(self, engine, executor):
+        self.engine = engine
+        self.executor = executor
+        self.name = engine.name
+
+    def close(self):
+        """
+        Closes the engine.
+        """
+
+        self.engine.close()
+
+    def collect_garbage(self):
+        """
+        Runs `collect_garbage` of the engine on the executor.
+        """
+
+        return self.executor.run(self.engine.collect_garbage)
+
+    def disk_usage(self):
+        """
+        Returns the disk usage of the engine.
+        """
+
+        return self.engine.disk_usage()
+
+    def exists(self, digest):
+        """
+        Runs `exists` of the engine on the executor.
+        """
+
+        return self.executor.run(lambda: self.engine.exists(digest))
+
+    def get(self, digest):
+        """
+        Runs `get` of the engine on the executor.
+        """
+
+        return self.executor.run(lambda: self.engine.get(digest))
+
+    def find_digests(self, prefix, limit):
+        """
+        Runs `find_digests` of the engine on the executor.
+        """
+
+        return self.executor.run(lambda: self.engine.find_digests(prefix, limit))
+
+    def get_compressed(self, digest):
+        """
+        Runs `get_compressed` of the engine on the executor.
+        """
+
+        return self.executor.run(lambda: self.engine.get_compressed(digest))
+
+    def get_many(self, digests):
+        """
+        Runs `get_many` of the engine on the executor.
+        """
+
+        return self.executor.run(lambda: self.engine.get_many(digests))
+
+    def get_stream(self, digest):
+        """
+        Runs `get_stream` of the engine on the executor, and reads each piece of the message on the executor.
+        """
+
+        stream = self.executor.run(lambda: self.engine.get_stream(digest))
+
+        if stream is None:
+            return None
+
+        size, pieces = stream
+
+        def read_pieces():
+            """
+            Yields the pieces of the message, reading each one on the executor.
+            """
+
+            while True:
+                piece = self.executor.run(lambda: next(pieces, None))
+
+                if piece is None:
+                    return
+
+                yield piece
+
+        return size, read_pieces()
+
+    def iter(self, start=None):
+        """
+        Yields the messages of the engine, reading each page on the executor.
+        """
+
+        # Engines hold nothing between their pages, so each page can be read on whichever thread the executor picks
+        pages = self.engine.iter(start)
+
+        while True:
+            page = self.executor.run(lambda: list(itertools.islice(pages, ITER_PAGE_SIZE)))
+
+            if not page:
+                return
+
+            for row in page:
+                yield row
+
+    def paths(self):
+        """
+        Returns the paths of the engine files.
+        """
+
+        return self.engine.paths()
+
+    def put(self, digest, message):
+        """
+        Runs `put` of the engine on the executor.
+        """
+
+        return self.executor.run(lambda: self.engine.put(digest, message))
+
+    def put_many(self, rows):
+        """
+        Runs `put_many` of the engine on the executor.
+        """
+
+        return self.executor.run(lambda: self.engine.put_many(rows))
+
+class StoragePlugin(KeywordPlugin): # pylint: disable=too-few-public-methods
+    """
+    `StoragePlugin` passes a `StorageEngine` instance to route callbacks that accept a `storage` keyword argument
+    (configurable). Routes that do not accept the keyword are left untouched.
+    """
+
+    name = u'storage'
+
+    def __init__(self, storage, keyword=u'storage'):
+        super(StoragePlugin, self).__init__(storage, keyword)
+        self.storage = storage
@@ -0,0 +1,234 @@
+"""
+`sha_api.storage.lmdb_engine` provides a storage engine that keeps the messages in an LMDB memory-mapped key-value store
+(requires the `lmdb` package).
+
+Classes:
+    LmdbStorage: A storage engine over an LMDB environment directory.
+
+Constants:
+    DEFAULT_MAP_SIZE: The default maximum size of the LMDB map, it is allocated on disk as the data grows.
+    DIGEST_SIZE: The number of bytes of a SHA256 digest.
+"""
+
+import binascii
+import os
+import threading
+
+import lmdb # pylint: disable=import-error
+
+from sha_api.storage.compression import decompress, unpack
+from sha_api.storage.engine import ITER_PAGE_SIZE, StorageEngine
+
+DEFAULT_MAP_SIZE = 10 * 1024 * 1024 * 1024
+DIGEST_SIZE = 32
+
+def _digest(key):
+    """
+    Returns the upper cased hex digest of a raw digest key.
+    """
+
+    return binascii.hexlify(key).decode(u'ascii').upper()
+
+def _key(digest):
+    """
+    Returns the raw digest key of a hex digest, or `None` if it is not a hex SHA256 digest and can not be stored.
+    """
+
+    try:
+        key = binascii.unhexlify(digest)
+    except (TypeError, UnicodeError, ValueError):
+        return None
+
+    return key if len(key) == DIGEST_SIZE else None
+
+class LmdbStorage(StorageEngine):
+    """
+    `LmdbStorage` stores the messages in the LMDB environment directory `path`, keyed by the raw bytes of their digest.
+    The environment is opened on first use in each process, since it must not be used across a fork.
+    """
+
+    name = u'lmdb'
+
+    def __init__(self, path, map_size=DEFAULT_MAP_SIZE, sync=True, max_readers=126, compressor=None):
+        self.compressor = compressor
+        self.map_size = map_size
+        self.max_readers = max_readers
+        self.path = path
+        self.sync = sync
+
+        self._env = None
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def _environment(self):
+        """
+        Returns the LMDB environment of the process, opening it on first use.
+        """
+
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    # The environment inherited from the parent process is left alone, the parent still uses it
+                    self._env = lmdb.open(self.path, map_size=self.map_size, max_readers=self.max_readers,
+                                          metasync=self.sync, sync=self.sync)
+                    self._pid = os.getpid()
+
+        return self._env
+
+    def close(self):
+        """
+        Closes the LMDB environment of the process, it is opened again on next use.
+        """
+
+        with self._lock:
+            if self._pid == os.getpid():
+                self._env.close()
+
+            self._env = None
+            self._pid = None
+
+    def exists(self, digest):
+        """
+        Returns whether a message with the digest is stored, without reading the message.
+        """
+
+        key = _key(digest)
+
+        if key is None:
+            return False
+
+        with self._environment().begin(buffers=True) as txn:
+            return txn.cursor().set_key(key)
+
+    def find_digests(self, prefix, limit):
+        """
+        Returns at most `limit` stored digests that start with the prefix, read from the keys after the smallest key
+        that can start with it.
+        """
+
+        digests = []
+
+        with self._environment().begin(buffers=True) as txn:
+            cursor = txn.cursor()
+
+            if cursor.set_range(binascii.unhexlify(prefix + u'0' * (len(prefix) % 2))):
+                for key in cursor.iternext(keys=True, values=False):
+                    digest = _digest(key)
+
+                    if len(digests) == limit or not digest.startswith(prefix):
+                        break
+
+                    digests.append(digest)
+
+        return digests
+
+    def get(self, digest):
+        """
+        Returns the message with the digest, decoded from the mapped page, or `None` if it is not stored.
+        """
+
+        key = _key(digest)
+
+        if key is None:
+            return None
+
+        with self._environment().begin(buffers=True) as txn:
+            value = txn.get(key)
+
+            # The buffer points into the map and is only valid until the transaction ends
+            return None if value is None else decompress(value)
+
+    def get_compressed(self, digest):
+        """
+        Returns the codec and the bytes of the stored value of the digest, copied out of the map, or `None` if it is
+        not stored.
+        """
+
+        key = _key(digest)
+
+        if key is None:
+            return None
+
+        with self._environment().begin(buffers=True) as txn:
+            value = txn.get(key)
+
+            return None if value is None else unpack(value)
+
+    def get_many(self, digests):
+        """
+        Returns a dict of the stored messages by digest, read in a single transaction.
+        """
+
+        messages = {}
+
+        with self._environment().begin(buffers=True) as txn:
+            for digest in digests:
+                key = _key(digest)
+                value = None if key is None else txn.get(key)
+
+                if value is not None:
+                    messages[digest] = decompress(value)
+
+        return messages
+
+    def iter(self, start=None):
+        """
+        Yields the `(digest, message)` pairs in digest order, one `ITER_PAGE_SIZE` read transaction at a time so a long
+        iteration does not keep the pages freed by writers from being reused.
+        """
+
+        start = (start or u'').upper()
+        lower = binascii.unhexlify(start + u'0' * (len(start) % 2))
+
+        while True:
+            page = []
+
+            with self._environment().begin(buffers=True) as txn:
+                cursor = txn.cursor()
+
+                if cursor.set_range(lower):
+                    for key, value in cursor:
+                        page.append((_digest(key), decompress(value)))
+
+                        if len(page) == ITER_PAGE_SIZE:
+                            break
+
+            for row in page:
+                yield row
+
+            if len(page) < ITER_PAGE_SIZE:
+                return
+
+            # The smallest key after the last one
+            lower = _key(page[-1][0]) + b'\x00'
+
+    def paths(self):
+        """
+        Returns the paths of the LMDB data and lock files.
+        """
+
+        return [os.path.join(self.path, u'data.mdb'), os.path.join(self.path, u'lock.mdb')]
+
+    def put_many(self, rows):
+        """
+        Stores the rows in a single write transaction and returns whether each row was newly stored. Raises
+        `ValueError` for a digest that is not a hex SHA256 digest.
+        """
+
+        results = []
+
+        with self._environment().begin(write=True) as txn:
+            for digest, message in rows:
+                key = _key(digest)
+
+                if key is None:
+                    raise ValueError(u'Invalid SHA256 digest %s' % digest)
+
+                value = None if self.compressor is None else self.compressor.compress(message)
+
+                if value is None:
+                    value = message.encode(u'utf-8')
+
+                results.append(txn.put(key, value, overwrite=False))
+
+        return results
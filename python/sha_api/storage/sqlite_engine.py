@@ -0,0 +1,477 @@
+"""
+`sha_api.storage.sqlite_engine` provides the default storage engine, which stores the messages in the `sha_api` table
+of the pooled sqlite connections, in a single database file or spread over the shards of a `ShardedSqlitePool`.
+
+Classes:
+    SqliteStorage: A storage engine over a `SqlitePool` or `ShardedSqlitePool`, with an optional group commit writer.
+
+Constants:
+    CHUNK_PAGE_SIZE: The number of chunks of a chunked message that `get_stream` reads at a time.
+    LOOKUP_CHUNK_SIZE: The number of digests looked up by a single `IN` query, within the bound parameter limit.
+"""
+
+import collections
+import hashlib
+import os
+import sqlite3
+
+from sha_api.mybottle.metrics import timed
+from sha_api.mybottle.shards import ShardedSqlitePool
+from sha_api.storage.chunking import is_manifest, manifest, manifest_size
+from sha_api.storage.compression import decompress, decompress_data, unpack
+from sha_api.storage.engine import ITER_PAGE_SIZE, StorageEngine
+
+CHUNK_PAGE_SIZE = 16
+LOOKUP_CHUNK_SIZE = 500
+
+def _chunks(items):
+    """
+    Yields consecutive slices of the list that fit within the bound parameter limit of a single `IN` query.
+    """
+
+    for index in range(0, len(items), LOOKUP_CHUNK_SIZE):
+        yield items[index:index + LOOKUP_CHUNK_SIZE]
+
+def _existing_chunks(db_con, keys):
+    """
+    Returns the set of chunk keys from the list that are already stored in the database.
+    """
+
+    existing = set()
+
+    for chunk in _chunks(keys):
+        rows = db_con.execute(
+            u'SELECT chunk FROM sha_api_chunks WHERE chunk IN (%s)' % u', '.join([u'?'] * len(chunk)),
+            [sqlite3.Binary(key) for key in chunk]
+        ).fetchall()
+        existing.update(bytes(row[0]) for row in rows)
+
+    return existing
+
+def _read_chunks(db_con, digest, seq=0, limit=-1):
+    """
+    Returns the list of the decompressed chunks of the chunked message from the sequence number on, at most `limit` of
+    them unless it is negative.
+    """
+
+    rows = db_con.execute(
+        u'SELECT sha_api_chunks.data FROM sha_api_chunk_refs '
+        u'JOIN sha_api_chunks ON sha_api_chunks.chunk = sha_api_chunk_refs.chunk '
+        u'WHERE sha_api_chunk_refs.digest = ? AND sha_api_chunk_refs.seq >= ? ORDER BY sha_api_chunk_refs.seq LIMIT ?',
+        (digest, seq, limit)
+    ).fetchall()
+
+    return [decompress_data(*unpack(row[0])) for row in rows]
+
+def _decode(db_con, digest, value):
+    """
+    Returns the message of a `message` column value, decompressing the `BLOB` values and reassembling chunked messages
+    from their chunks.
+    """
+
+    if isinstance(value, type(u'')):
+        return value
+
+    if is_manifest(value):
+        return b''.join(_read_chunks(db_con, digest)).decode(u'utf-8')
+
+    return decompress(value)
+
+class SqliteStorage(StorageEngine):
+    """
+    `SqliteStorage` stores the messages in the `sha_api` table through the pooled connection of the calling thread,
+    optionally sharded, group committed, compressed and chunked.
+    """
+
+    name = u'sqlite'
+
+    def __init__(self, pool, writer=None, compressor=None, chunker=None):
+        self.chunker = chunker
+        self.compressor = compressor
+        self.pool = pool
+        self.writer = writer
+
+        self._sharded = issubclass(pool.__class__, ShardedSqlitePool)
+
+    def _connection(self, digest):
+        """
+        Returns the pooled connection of the calling thread to the database or shard that stores the digest.
+        """
+
+        with timed(u'acquire'):
+            if self._sharded:
+                return self.pool.shard_pool(digest).connection()
+
+            return self.pool.connection()
+
+    def _chunk_value(self, chunk):
+        """
+        Returns the value of the `data` column of a chunk, its compressed bytes or the chunk itself.
+        """
+
+        value = None if self.compressor is None else self.compressor.compress_data(chunk)
+
+        return sqlite3.Binary(chunk if value is None else value)
+
+    def _chunked(self, message):
+        """
+        Returns whether the message is stored as chunks.
+        """
+
+        return self.chunker is not None and len(message) >= self.chunker.threshold
+
+    def _encode(self, message):
+        """
+        Returns the value of the `message` column of the message, its compressed bytes or the message itself.
+        """
+
+        value = None if self.compressor is None else self.compressor.compress(message)
+
+        return message if value is None else sqlite3.Binary(value)
+
+    def _group_by_shard(self, items, key=lambda item: item):
+        """
+        Returns a list of `(connection, items)` pairs of the items grouped by the shard that stores their `key`, or a
+        single pair of the database connection and all the items when the pool is not sharded. The items keep their
+        order.
+        """
+
+        if not items:
+            return []
+
+        if not self._sharded:
+            return [(self._connection(key(items[0])), items)]
+
+        groups = collections.OrderedDict()
+
+        for item in items:
+            groups.setdefault(self.pool.shard_index(key(item)), []).append(item)
+
+        return [(self._connection(key(group[0])), group) for group in groups.values()]
+
+    def _put_chunked(self, digest, message):
+        """
+        Stores the message as the manifest of its chunks in a transaction of its own, writing only the chunks that are
+        not stored yet, and returns whether it was newly stored.
+        """
+
+        db_con = self._connection(digest)
+
+        if db_con.execute(u'SELECT 1 FROM sha_api WHERE digest = ?', (digest,)).fetchone() is not None:
+            return False
+
+        with timed(u'hash'):
+            data = message.encode(u'utf-8')
+            chunks = collections.OrderedDict()
+            keys = []
+
+            for chunk in self.chunker.split(data):
+                keys.append(hashlib.sha256(chunk).digest())
+                chunks[keys[-1]] = chunk
+
+        # The new chunks are compressed before the write transaction so the write lock is held as short as possible
+        existing = _existing_chunks(db_con, list(chunks))
+        values = dict((key, self._chunk_value(chunks[key])) for key in chunks if key not in existing)
+
+        with db_con:
+            if db_con.execute(
+                    u'INSERT OR IGNORE INTO sha_api (digest, message) VALUES (?, ?)',
+                    (digest, sqlite3.Binary(manifest(len(data))))
+            ).rowcount != 1:
+                return False
+
+            # Chunks may have been collected since they were looked up, the write transaction keeps the rest
+            existing = _existing_chunks(db_con, list(chunks))
+
+            db_con.executemany(u'INSERT INTO sha_api_chunks (chunk, data) VALUES (?, ?)', [
+                (sqlite3.Binary(key), values[key] if key in values else self._chunk_value(chunks[key]))
+                for key in chunks if key not in existing
+            ])
+
+            # The refs of a message that was deleted before its chunks were collected are replaced
+            db_con.execute(u'DELETE FROM sha_api_chunk_refs WHERE digest = ?', (digest,))
+            db_con.executemany(u'INSERT INTO sha_api_chunk_refs (digest, seq, chunk) VALUES (?, ?, ?)', [
+                (digest, seq, sqlite3.Binary(key)) for seq, key in enumerate(keys)
+            ])
+
+        return True
+
+    def close(self):
+        """
+        Closes the pooled connections, threads open new ones on their next use.
+        """
+
+        self.pool.close_all()
+
+    def collect_garbage(self):
+        """
+        Deletes the chunk refs of the messages that are no longer stored and the chunks that no message refers to, in
+        one write transaction per database or shard, so chunks are never collected while a message that refers to them
+        is being stored.
+        """
+
+        collected = {u'chunk_bytes': 0, u'chunks': 0, u'refs': 0}
+
+        if self._sharded:
+            # Shards that were never opened have nothing to collect and are not created
+            pools = [self.pool.pool(index) for index, path in enumerate(self.pool.paths) if os.path.exists(path)]
+        else:
+            pools = [self.pool]
+
+        for pool in pools:
+            with timed(u'acquire'):
+                db_con = pool.connection()
+
+            with db_con:
+                collected[u'refs'] += db_con.execute(
+                    u'DELETE FROM sha_api_chunk_refs WHERE NOT EXISTS '
+                    u'(SELECT 1 FROM sha_api WHERE sha_api.digest = sha_api_chunk_refs.digest)'
+                ).rowcount
+
+                unreferenced = u'NOT EXISTS (SELECT 1 FROM sha_api_chunk_refs ' \
+                               u'WHERE sha_api_chunk_refs.chunk = sha_api_chunks.chunk)'
+                chunks, chunk_bytes = db_con.execute(
+                    u'SELECT COUNT(*), TOTAL(LENGTH(data)) FROM sha_api_chunks WHERE ' + unreferenced
+                ).fetchone()
+
+                db_con.execute(u'DELETE FROM sha_api_chunks WHERE ' + unreferenced)
+
+            collected[u'chunk_bytes'] += int(chunk_bytes)
+            collected[u'chunks'] += chunks
+
+        return collected
+
+    def exists(self, digest):
+        """
+        Returns whether a message with the digest is stored.
+        """
+
+        return self._connection(digest).execute(u'SELECT 1 FROM sha_api WHERE digest = ?', (digest,)).fetchone() \
+               is not None
+
+    def find_digests(self, prefix, limit):
+        """
+        Returns at most `limit` stored digests that start with the prefix, with a range scan of the `digest` primary key
+        in each shard whose digests can start with it.
+        """
+
+        # Every digest that starts with the prefix sorts before the prefix followed by the character after F
+        upper = prefix + u'G'
+        digests = []
+
+        if self._sharded:
+            shards = range(self.pool.shard_index(prefix), self.pool.shard_index((prefix + u'FFFF')[:4]) + 1)
+        else:
+            shards = [None]
+
+        for index in shards:
+            with timed(u'acquire'):
+                db_con = self.pool.connection() if index is None else self.pool.pool(index).connection()
+
+            digests.extend(row[0] for row in db_con.execute(
+                u'SELECT digest FROM sha_api WHERE digest >= ? AND digest < ? ORDER BY digest LIMIT ?',
+                (prefix, upper, limit - len(digests))
+            ))
+
+            if len(digests) >= limit:
+                break
+
+        return digests
+
+    def get(self, digest):
+        """
+        Returns the message with the digest or `None` if it is not stored.
+        """
+
+        db_con = self._connection(digest)
+        row = db_con.execute(u'SELECT message FROM sha_api WHERE digest = ?', (digest,)).fetchone()
+
+        return None if row is None else _decode(db_con, digest, row[0])
+
+    def get_compressed(self, digest):
+        """
+        Returns the codec and the bytes of the `message` column of the digest, the UTF-8 bytes of a `TEXT` value or of
+        a chunked message, or `None` if it is not stored.
+        """
+
+        db_con = self._connection(digest)
+        row = db_con.execute(u'SELECT message FROM sha_api WHERE digest = ?', (digest,)).fetchone()
+
+        if row is None:
+            return None
+
+        if isinstance(row[0], type(u'')):
+            return None, row[0].encode(u'utf-8')
+
+        if is_manifest(row[0]):
+            return None, b''.join(_read_chunks(db_con, digest))
+
+        return unpack(row[0])
+
+    def get_many(self, digests):
+        """
+        Returns a dict of the stored messages by digest, looked up with chunked `IN` queries on each shard.
+        """
+
+        messages = {}
+
+        for db_con, shard_digests in self._group_by_shard(digests):
+            for chunk in _chunks(shard_digests):
+                rows = db_con.execute(
+                    u'SELECT digest, message FROM sha_api WHERE digest IN (%s)' % u', '.join([u'?'] * len(chunk)),
+                    chunk
+                ).fetchall()
+
+                for row in rows:
+                    messages[row[0]] = _decode(db_con, row[0], row[1])
+
+        return messages
+
+    def get_stream(self, digest):
+        """
+        Returns the size and the pieces of the UTF-8 encoding of the message, reading the chunks of a chunked message
+        `CHUNK_PAGE_SIZE` at a time as they are iterated, or `None` if it is not stored.
+        """
+
+        row = self._connection(digest).execute(u'SELECT message FROM sha_api WHERE digest = ?', (digest,)).fetchone()
+
+        if row is None:
+            return None
+
+        if isinstance(row[0], type(u'')) or not is_manifest(row[0]):
+            data = row[0].encode(u'utf-8') if isinstance(row[0], type(u'')) else decompress_data(*unpack(row[0]))
+
+            return len(data), iter([data])
+
+        def read_chunks():
+            """
+            Yields the chunks of the message one page at a time, each page from the connection of the calling thread.
+            """
+
+            seq = 0
+
+            while True:
+                chunks = _read_chunks(self._connection(digest), digest, seq, CHUNK_PAGE_SIZE)
+
+                for chunk in chunks:
+                    yield chunk
+
+                if len(chunks) < CHUNK_PAGE_SIZE:
+                    return
+
+                seq += CHUNK_PAGE_SIZE
+
+        return manifest_size(row[0]), read_chunks()
+
+    def iter(self, start=None):
+        """
+        Yields the `(digest, message)` pairs in digest order, one `ITER_PAGE_SIZE` query at a time. The shards hold
+        consecutive ranges of digests, so they are read one after the other.
+        """
+
+        start = (start or u'').upper()
+
+        if self._sharded:
+            shards = range(self.pool.shard_index(start), self.pool.shards)
+        else:
+            shards = [None]
+
+        for index in shards:
+            query = u'SELECT digest, message FROM sha_api WHERE digest >= ? ORDER BY digest LIMIT ?'
+            after = start
+
+            while True:
+                with timed(u'acquire'):
+                    db_con = self.pool.connection() if index is None else self.pool.pool(index).connection()
+
+                rows = db_con.execute(query, (after, ITER_PAGE_SIZE)).fetchall()
+
+                for row in rows:
+                    yield row[0], _decode(db_con, row[0], row[1])
+
+                if len(rows) < ITER_PAGE_SIZE:
+                    break
+
+                query = u'SELECT digest, message FROM sha_api WHERE digest > ? ORDER BY digest LIMIT ?'
+                after = rows[-1][0]
+
+    def paths(self):
+        """
+        Returns the paths of the database or shard files and their write-ahead logs.
+        """
+
+        dbfiles = self.pool.paths if self._sharded else [self.pool.dbfile]
+
+        return [path + suffix for path in dbfiles for suffix in (u'', u'-wal')]
+
+    def put(self, digest, message):
+        """
+        Stores the message with a single `INSERT OR IGNORE`, or as chunks if it is large enough, and returns whether it
+        was newly stored.
+        """
+
+        if self._chunked(message):
+            return self._put_chunked(digest, message)
+
+        message = self._encode(message)
+
+        if self.writer is not None:
+            return self.writer.submit([(digest, message)])[0]
+
+        db_con = self._connection(digest)
+
+        with db_con:
+            return db_con.execute(
+                u'INSERT OR IGNORE INTO sha_api (digest, message) VALUES (?, ?)',
+                (digest, message)
+            ).rowcount == 1
+
+    def put_many(self, rows):
+        """
+        Stores the rows in one transaction per shard, inserting only the digests that are not stored yet, and returns
+        whether each row was newly stored. Messages that are stored as chunks get a transaction each.
+        """
+
+        # Repeats within the rows are dropped first, so the writer and the inserts only see each digest once
+        chunked_rows = []
+        unique_rows = []
+        seen_digests = set()
+
+        for digest, message in rows:
+            if digest not in seen_digests:
+                seen_digests.add(digest)
+
+                if self._chunked(message):
+                    chunked_rows.append((digest, message))
+                else:
+                    unique_rows.append((digest, self._encode(message)))
+
+        new_digests = set()
+
+        if self.writer is not None:
+            # A batch of only chunked messages leaves nothing for the writer to commit
+            if unique_rows:
+                stored_flags = self.writer.submit(unique_rows)
+                new_digests.update(row[0] for row, stored in zip(unique_rows, stored_flags) if stored)
+        else:
+            # The rowcount of each insert tells whether this transaction stored the digest, which a probe before the
+            # write lock is taken cannot tell when another process inserts it concurrently
+            for db_con, shard_rows in self._group_by_shard(unique_rows, key=lambda row: row[0]):
+                with db_con:
+                    shard_new_digests = [
+                        digest for digest, message in shard_rows
+                        if db_con.execute(u'INSERT OR IGNORE INTO sha_api (digest, message) VALUES (?, ?)',
+                                          (digest, message)).rowcount == 1
+                    ]
+
+                new_digests.update(shard_new_digests)
+
+        new_digests.update(digest for digest, message in chunked_rows if self._put_chunked(digest, message))
+
+        results = []
+
+        for digest, _ in rows:
+            results.append(digest in new_digests)
+            new_digests.discard(digest)
+
+        return results
@@ -0,0 +1,229 @@
+"""
+The `test.unit.sha_api.admin_test` module provides unit tests for the export and import methods in `sha_api.admin`.
+
+Classes:
+    TestAdmin: A unit test class for the `export_messages`, `import_messages` and `open_storage` methods.
+"""
+
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from mock import patch
+from sha_api.admin import BINARY_MAGIC, export_messages, import_messages, open_storage
+from sha_api.mybottle.serializers import get_serializer
+from sha_api.mybottle.sqlite_pool import SqlitePool
+from sha_api.schema import create_schema
+from sha_api.storage.sqlite_engine import SqliteStorage
+from test.unit.sha_api.storage.conformance import digest
+
+class TestAdmin(unittest.TestCase):
+    """
+    A unit test class for the `export_messages`, `import_messages` and `open_storage` methods.
+
+    Methods:
+        setUp: Unit test initialization.
+        tearDown: Closes the engines and removes their files.
+        make_storage: Returns a `SqliteStorage` over a new database file.
+        test_export_import: Tests that every message survives an export and an import in both formats.
+        test_import_checkpoint: Tests that an interrupted import resumes after the last batch it stored.
+        test_import_verify: Tests that records that cannot be decoded or whose digest does not match are rejected.
+        test_open_storage: Tests that imports bypass the group commit writer of the configured engine.
+    """
+
+    def setUp(self):
+        """
+        Initializes the unit test global configs
+        """
+
+        self.maxDiff = None # pylint: disable=invalid-name
+        self.storage_dir = tempfile.mkdtemp()
+        self.storages = []
+        self.messages = dict((digest(message), message) for message in
+                             [u'message %d' % index for index in range(250)] + [u'f\xf6\xf6 \u2603\n"x"', u''])
+
+    def tearDown(self):
+        """
+        Closes the engines and removes their files.
+        """
+
+        for storage in self.storages:
+            storage.close()
+
+        shutil.rmtree(self.storage_dir)
+
+    def make_storage(self):
+        """
+        Returns a `SqliteStorage` over a new database file.
+        """
+
+        pool = SqlitePool(os.path.join(tempfile.mkdtemp(dir=self.storage_dir), u'sha_api.db'))
+        create_schema(pool.connection())
+        self.storages.append(SqliteStorage(pool))
+
+        return self.storages[-1]
+
+    def test_export_import(self):
+        """
+        Tests that every message survives an export and an import in both formats.
+        """
+
+        source = self.make_storage()
+        source.put_many(sorted(self.messages.items()))
+
+        for fmt in (u'ndjson', u'binary'):
+            # Branch 1: Test that every message is exported in digest order
+
+            fout = io.BytesIO()
+
+            self.assertEqual(export_messages(source, fout, fmt, get_serializer(u'json')), len(self.messages))
+
+            if fmt == u'binary':
+                self.assertEqual(fout.getvalue()[:len(BINARY_MAGIC)], BINARY_MAGIC)
+            else:
+                lines = fout.getvalue().splitlines()
+
+                self.assertEqual(len(lines), len(self.messages))
+                self.assertEqual([json.loads(line)[u'digest'] for line in lines], sorted(self.messages))
+
+            # Branch 2: Test that the import stores every message in batches, with and without the hashing pool
+
+            for jobs in (1, 2):
+                target = self.make_storage()
+
+                self.assertDictEqual(import_messages(target, io.BytesIO(fout.getvalue()), batch_size=100, jobs=jobs),
+                                     {u'duplicates': 0, u'records': 252, u'rejected': 0, u'stored': 252})
+                self.assertDictEqual(dict(target.iter()), self.messages)
+
+            # Branch 3: Test that importing again stores nothing new
+
+            self.assertDictEqual(import_messages(target, io.BytesIO(fout.getvalue())),
+                                 {u'duplicates': 252, u'records': 252, u'rejected': 0, u'stored': 0})
+
+        # Branch 4: Test that the export starts from a digest prefix and that unknown formats are rejected
+
+        fout = io.BytesIO()
+
+        self.assertEqual(export_messages(source, fout, start=u'8'),
+                         sum(1 for message_digest in self.messages if message_digest >= u'8'))
+
+        with self.assertRaises(ValueError):
+            export_messages(source, fout, u'csv')
+
+    def test_import_checkpoint(self):
+        """
+        Tests that an interrupted import resumes after the last batch it stored.
+        """
+
+        export_path = os.path.join(self.storage_dir, u'export.ndjson')
+        checkpoint_path = export_path + u'.checkpoint'
+        lines = [json.dumps({u'message': message}) for _, message in sorted(self.messages.items())]
+
+        # Lines without a digest, blank lines and a first line shorter than the binary header are imported too
+        with open(export_path, u'wb') as fout:
+            fout.write(b'{"message": "a"}\n\n' + b'\n'.join(line.encode(u'utf-8') for line in lines) + b'\n')
+
+        storage = self.make_storage()
+        put_many = storage.put_many
+        calls = []
+
+        def failing_put_many(rows):
+            """
+            Stores the first two batches and fails on the third one.
+            """
+
+            calls.append(len(rows))
+
+            if len(calls) == 3:
+                raise IOError(u'disk went foobar')
+
+            return put_many(rows)
+
+        # Branch 1: Test that the checkpoint is left at the end of the last stored batch when an import fails
+
+        with patch.object(storage, u'put_many', failing_put_many):
+            with open(export_path, u'rb') as fin:
+                with self.assertRaises(IOError):
+                    import_messages(storage, fin, batch_size=100, checkpoint_path=checkpoint_path)
+
+        with open(checkpoint_path) as fin:
+            checkpoint = json.load(fin)
+
+        self.assertEqual(checkpoint[u'records'], 200)
+        self.assertEqual(checkpoint[u'stored'], 200)
+
+        # Branch 2: Test that the import resumes from the checkpoint, adds up the counters and removes the checkpoint
+
+        logs = []
+
+        with open(export_path, u'rb') as fin:
+            counters = import_messages(storage, fin, batch_size=100, checkpoint_path=checkpoint_path, log=logs.append)
+
+        self.assertDictEqual(counters, {u'duplicates': 0, u'records': 253, u'rejected': 0, u'stored': 253})
+        self.assertEqual(logs[0], u'Resuming at byte %d after 200 records' % checkpoint[u'offset'])
+        self.assertFalse(os.path.exists(checkpoint_path))
+        self.assertEqual(sum(1 for _ in storage.iter()), 253)
+
+    def test_import_verify(self):
+        """
+        Tests that records that cannot be decoded or whose digest does not match are rejected.
+        """
+
+        storage = self.make_storage()
+
+        # Branch 1: Test that NDJSON lines with a wrong digest, no message or invalid JSON are rejected
+
+        body = b'\n'.join([
+            json.dumps({u'digest': digest(u'foo'), u'message': u'foo'}).encode(u'utf-8'),
+            json.dumps({u'digest': digest(u'foo').lower(), u'message': u'foo'}).encode(u'utf-8'),
+            json.dumps({u'digest': digest(u'foo'), u'message': u'bar'}).encode(u'utf-8'),
+            json.dumps({u'digest': 1, u'message': u'bar'}).encode(u'utf-8'),
+            json.dumps({u'msg': u'bar'}).encode(u'utf-8'),
+            json.dumps([u'bar']).encode(u'utf-8'),
+            b'{"message": '
+        ])
+
+        self.assertDictEqual(import_messages(storage, io.BytesIO(body), serializer=u'json'),
+                             {u'duplicates': 1, u'records': 7, u'rejected': 5, u'stored': 1})
+
+        # Branch 2: Test that binary records with a wrong digest or invalid UTF-8 are rejected
+
+        source = self.make_storage()
+        source.put_many([(digest(u'bar'), u'bar'), (digest(u'baz'), u'baz')])
+        fout = io.BytesIO()
+
+        export_messages(source, fout, u'binary')
+
+        body = fout.getvalue().replace(b'bar', b'BAR').replace(b'baz', b'\xff\xfe\xfd')
+
+        self.assertDictEqual(import_messages(storage, io.BytesIO(body)),
+                             {u'duplicates': 0, u'records': 2, u'rejected': 2, u'stored': 0})
+
+        # Branch 3: Test that a truncated binary export fails
+
+        with self.assertRaises(ValueError):
+            import_messages(storage, io.BytesIO(fout.getvalue()[:-1]))
+
+    def test_open_storage(self):
+        """
+        Tests that imports bypass the group commit writer of the configured engine.
+        """
+
+        config_path = os.path.join(self.storage_dir, u'sha_api.conf')
+
+        with open(config_path, u'w') as fout:
+            fout.write(u'[sqlite]\ndbfile = %s\ngroup_commit = true\n[storage]\ncompression = zlib\n' %
+                       os.path.join(self.storage_dir, u'sha_api.db'))
+
+        with patch.dict(u'sha_api.mybottle.sha_api_bottle.os.environ', values={u'SHA_API_CONFIG': config_path}):
+            app, storage = open_storage()
+
+        self.storages.append(storage)
+
+        self.assertIsNotNone(app.group_commit_writer)
+        self.assertIsNone(storage.writer)
+        self.assertIs(storage.pool, app.sqlite_pool)
+        self.assertEqual(storage.compressor.name, u'zlib')
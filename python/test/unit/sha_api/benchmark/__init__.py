@@ -0,0 +1,3 @@
+"""
+The `test.unit.sha_api.benchmark` module provides nose unit tests for `sha_api.benchmark`.
+"""
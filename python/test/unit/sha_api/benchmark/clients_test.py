@@ -0,0 +1,114 @@
+"""
+The `test.unit.sha_api.benchmark.clients_test` module provides unit tests for the benchmark transports in
+`sha_api.benchmark.clients`.
+
+Classes:
+    TestClients: A unit test class for the `HttpClient`, `LocalServer`, `RoundRobinClient` and `WsgiClient` classes.
+"""
+
+import json
+import unittest
+
+import bottle
+
+from sha_api.benchmark.clients import LocalServer, RoundRobinClient, WsgiClient
+
+class TestClients(unittest.TestCase):
+    """
+    A unit test class for the `HttpClient`, `LocalServer`, `RoundRobinClient` and `WsgiClient` classes.
+
+    Methods:
+        setUp: Unit test initialization.
+        test_local_server: Tests that requests are served over a localhost socket.
+        test_round_robin_client: Tests that reads take turns over the clients and other requests go to the first one.
+        test_wsgi_client: Tests that requests are passed to the application in-process.
+    """
+
+    def setUp(self):
+        """
+        Initializes the unit test global configs
+        """
+
+        self.maxDiff = None # pylint: disable=invalid-name
+        self.app = bottle.Bottle()
+
+        @self.app.route(u'/echo', method=[u'GET', u'POST'])
+        def echo(): # pylint: disable=unused-variable
+            """
+            Returns the method, query string, content type and body of the request.
+            """
+
+            return {
+                u'body': bottle.request.body.read().decode(u'utf-8'),
+                u'content_type': bottle.request.content_type,
+                u'method': bottle.request.method,
+                u'query': bottle.request.query_string
+            }
+
+    def test_local_server(self):
+        """
+        Tests that requests are served over a localhost socket.
+        """
+
+        server = LocalServer(self.app, threads=2)
+
+        try:
+            client = server.client()
+
+            # Branch 1: Test that the status and body are returned
+
+            status, body = client.request(u'POST', u'/echo?a=1', b'foo', u'text/plain')
+
+            self.assertEqual(status, 200)
+            self.assertEqual(json.loads(body)[u'body'], u'foo')
+
+            # Branch 2: Test that a new connection is opened after the server closed the previous one
+
+            self.assertEqual(client.request(u'GET', u'/missing')[0], 404)
+
+            client.close()
+        finally:
+            server.close()
+
+    def test_round_robin_client(self):
+        """
+        Tests that reads take turns over the clients and other requests go to the first one.
+        """
+
+        clients = [WsgiClient(self.app), WsgiClient(self.app)]
+        calls = []
+
+        for index, client in enumerate(clients):
+            client.request = lambda method, path, body=b'', content_type=u'', index=index: calls.append((index, method))
+
+        client = RoundRobinClient(clients)
+
+        for method in (u'GET', u'GET', u'POST', u'GET', u'PUT'):
+            client.request(method, u'/echo')
+
+        client.close()
+
+        self.assertListEqual(calls, [(0, u'GET'), (1, u'GET'), (0, u'POST'), (0, u'GET'), (0, u'PUT')])
+
+    def test_wsgi_client(self):
+        """
+        Tests that requests are passed to the application in-process.
+        """
+
+        client = WsgiClient(self.app)
+
+        # Branch 1: Test that the method, path, query string, content type and body are passed to the application
+
+        status, body = client.request(u'POST', u'/echo?a=1', b'foo', u'text/plain')
+
+        self.assertEqual(status, 200)
+        self.assertDictEqual(json.loads(body), {
+            u'body': u'foo',
+            u'content_type': u'text/plain',
+            u'method': u'POST',
+            u'query': u'a=1'
+        })
+
+        # Branch 2: Test that the status code of an error response is returned
+
+        self.assertEqual(client.request(u'GET', u'/missing')[0], 404)
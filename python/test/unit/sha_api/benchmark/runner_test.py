@@ -0,0 +1,108 @@
+"""
+The `test.unit.sha_api.benchmark.runner_test` module provides unit tests for the benchmark scenarios and runner in
+`sha_api.benchmark.scenarios` and `sha_api.benchmark.runner`.
+
+Classes:
+    TestRunner: A unit test class for the `compare`, `percentile` and `run_scenario` methods.
+"""
+
+import tempfile
+import unittest
+
+from mock import patch
+from sha_api.benchmark.clients import WsgiClient
+from sha_api.benchmark.runner import compare, percentile, run_scenario
+from sha_api.benchmark.scenarios import LargePayload, Mixed, NotFoundStorm, ReadHeavy, WriteHeavy
+from sha_api.mybottle.sha_api_bottle import ShaApiBottle
+from sha_api.routes import ROUTES
+
+class TestRunner(unittest.TestCase):
+    """
+    A unit test class for the `compare`, `percentile` and `run_scenario` methods.
+
+    Methods:
+        setUp: Unit test initialization.
+        test_compare: Tests that drops in throughput, growth in p99 latency and new errors are reported.
+        test_percentile: Tests that nearest rank percentiles are returned.
+        test_run_scenario: Tests that every scenario runs against a local instance without errors.
+    """
+
+    def setUp(self):
+        """
+        Initializes the unit test global configs
+        """
+
+        self.maxDiff = None # pylint: disable=invalid-name
+        self.config_sample = tempfile.NamedTemporaryFile(delete=False)
+        self.dbfile = tempfile.NamedTemporaryFile(delete=False)
+
+        with open(self.config_sample.name, 'w') as fout:
+            fout.write(u"[sqlite]\ndbfile = %s\nsynchronous = OFF" % self.dbfile.name)
+
+    def test_compare(self):
+        """
+        Tests that drops in throughput, growth in p99 latency and new errors are reported.
+        """
+
+        baseline = {u'scenarios': {u'a': {u'errors': 0, u'latency_ms': {u'p99': 10.0}, u'req_per_sec': 1000.0}}}
+
+        # Branch 1: Test that changes within the tolerance and scenarios missing from the baseline are not reported
+
+        results = {u'scenarios': {u'a': {u'errors': 0, u'latency_ms': {u'p99': 10.5}, u'req_per_sec': 950.0},
+                                  u'b': {u'errors': 9, u'latency_ms': {u'p99': 99.0}, u'req_per_sec': 1.0}}}
+
+        self.assertEqual(compare(results, baseline), [])
+
+        # Branch 2: Test that each kind of regression is reported
+
+        results = {u'scenarios': {u'a': {u'errors': 2, u'latency_ms': {u'p99': 12.0}, u'req_per_sec': 800.0}}}
+
+        self.assertEqual(compare(results, baseline),
+                         [u'a: req/s dropped from 1000.0 to 800.0',
+                          u'a: p99 latency grew from 10.00 ms to 12.00 ms',
+                          u'a: errors grew from 0 to 2'])
+        self.assertEqual(len(compare(results, baseline, tolerance=0.5)), 1)
+
+    def test_percentile(self):
+        """
+        Tests that nearest rank percentiles are returned.
+        """
+
+        values = [float(value) for value in range(1, 101)]
+
+        self.assertEqual(percentile([], 50), 0.0)
+        self.assertEqual(percentile(values, 50), 50.0)
+        self.assertEqual(percentile(values, 99), 99.0)
+        self.assertEqual(percentile(values, 100), 100.0)
+        self.assertEqual(percentile([5.0], 95), 5.0)
+
+    def test_run_scenario(self):
+        """
+        Tests that every scenario runs against a local instance without errors.
+        """
+
+        with patch.dict(u'sha_api.mybottle.sha_api_bottle.os.environ',
+                        values={u'SHA_API_CONFIG': self.config_sample.name}):
+            client = WsgiClient(ShaApiBottle(ROUTES))
+
+        scenarios = [
+            WriteHeavy(),
+            ReadHeavy(hot_set=5, cold_set=5),
+            NotFoundStorm(distinct=5),
+            LargePayload(payload_size=200000),
+            Mixed(hot_set=5, batch_size=3, lookup_size=3)
+        ]
+
+        for scenario in scenarios:
+            stats = run_scenario(client, scenario, requests=40, concurrency=4)
+
+            self.assertEqual(stats[u'errors'], 0, scenario.name)
+            self.assertEqual(stats[u'requests'], 40)
+            self.assertGreater(stats[u'req_per_sec'], 0.0)
+            self.assertLessEqual(stats[u'latency_ms'][u'p50'], stats[u'latency_ms'][u'p99'])
+
+        # Branch 2: Test that a scenario runs again without its setup against the data it already stored
+
+        stats = run_scenario(client, scenarios[1], requests=10, concurrency=2, setup=False)
+
+        self.assertEqual((stats[u'errors'], stats[u'requests']), (0, 10))
@@ -0,0 +1,92 @@
+"""
+The `test.unit.sha_api.benchmark.storage_test` module provides unit tests for the storage engine benchmark in
+`sha_api.benchmark.storage`.
+
+Classes:
+    TestStorageBenchmark: A unit test class for the `make_storage` and `run_storage_benchmark` methods.
+"""
+
+import shutil
+import tempfile
+import unittest
+
+from sha_api.benchmark.storage import make_storage, run_storage_benchmark
+
+class TestStorageBenchmark(unittest.TestCase):
+    """
+    A unit test class for the `make_storage` and `run_storage_benchmark` methods.
+
+    Methods:
+        setUp: Unit test initialization.
+        tearDown: Removes the engine files.
+        test_make_storage: Tests that unknown engines are rejected.
+        test_run_storage_benchmark: Tests that every engine stores and reads back every message, with and without
+                                    compression.
+    """
+
+    def setUp(self):
+        """
+        Initializes the unit test global configs
+        """
+
+        self.maxDiff = None # pylint: disable=invalid-name
+        self.storage_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """
+        Removes the engine files.
+        """
+
+        shutil.rmtree(self.storage_dir)
+
+    def test_make_storage(self):
+        """
+        Tests that unknown engines are rejected.
+        """
+
+        with self.assertRaises(ValueError):
+            make_storage(u'rocksdb', self.storage_dir)
+
+    def test_run_storage_benchmark(self):
+        """
+        Tests that every engine stores and reads back every message, with and without compression.
+        """
+
+        engines = [u'sqlite']
+
+        try:
+            import lmdb # pylint: disable=unused-variable
+
+            engines.append(u'lmdb')
+        except ImportError: # pragma: no cover
+            pass
+
+        for engine in engines:
+            # Branch 1: Test that the random messages are stored and read back without compression
+
+            storage = make_storage(engine, tempfile.mkdtemp(dir=self.storage_dir))
+
+            try:
+                stats = run_storage_benchmark(storage, messages=1500, message_size=64, reads=200, lookup_size=50)
+            finally:
+                storage.close()
+
+            self.assertEqual(stats[u'messages'], 1500)
+            self.assertGreater(stats[u'disk_bytes'], 1500 * 64)
+            self.assertEqual(stats[u'bytes_per_message'], stats[u'disk_bytes'] / 1500.0)
+
+            for rate in (u'iter_per_sec', u'lookups_per_sec', u'reads_per_sec', u'writes_per_sec'):
+                self.assertGreater(stats[rate], 0)
+
+            # Branch 2: Test that the compressed log lines are read back and their decompression is timed
+
+            storage = make_storage(engine, tempfile.mkdtemp(dir=self.storage_dir), u'zlib')
+
+            try:
+                stats = run_storage_benchmark(storage, messages=200, message_size=2048, reads=50, payload=u'log')
+            finally:
+                storage.close()
+
+            self.assertEqual(stats[u'messages'], 200)
+            self.assertEqual(stats[u'message_bytes'], 200 * 2048)
+            self.assertGreater(stats[u'read_decompress_us'], 0)
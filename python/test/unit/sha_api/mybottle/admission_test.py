@@ -0,0 +1,267 @@
+"""
+The `test.unit.sha_api.mybottle.admission_test` module provides unit tests for the admission control in
+`sha_api.mybottle.admission`.
+
+Classes:
+    TestAdmission: A unit test class for the `AdmissionController`, `AdmissionPlugin`, `ClientRateLimiter` and
+                   `ConcurrencyLimit` classes.
+"""
+
+import json
+import threading
+import unittest
+
+from io import BytesIO
+
+import bottle
+
+from mock import patch
+from sha_api.mybottle.admission import AdmissionController, AdmissionPlugin, ClientRateLimiter, ConcurrencyLimit
+
+class TestAdmission(unittest.TestCase):
+    """
+    A unit test class for the `AdmissionController`, `AdmissionPlugin`, `ClientRateLimiter` and `ConcurrencyLimit`
+    classes.
+
+    Methods:
+        call: Calls a WSGI app and returns its status code, headers and body.
+        test_admission_controller: Tests that requests are limited by traffic class and client and counted.
+        test_admission_plugin: Tests that shed requests get a JSON error with a `Retry-After` header.
+        test_client_rate_limiter: Tests that each client gets its own token bucket.
+        test_concurrency_limit: Tests that callers over the limit wait in a bounded queue for a bounded time.
+    """
+
+    def call(self, app, method, path, headers=None):
+        """
+        Calls a WSGI app and returns its status code, headers and body.
+        """
+
+        status = []
+        environ = {u'PATH_INFO': path, u'REQUEST_METHOD': method, u'wsgi.errors': BytesIO(), u'wsgi.input': BytesIO()}
+        environ.update(headers or {})
+
+        body = b''.join(app(environ, lambda status_line, headers, exc_info=None: status.append((status_line, headers))))
+
+        return int(status[0][0].split(u' ', 1)[0]), dict(status[0][1]), body
+
+    def test_admission_controller(self):
+        """
+        Tests that requests are limited by traffic class and client and counted.
+        """
+
+        controller = AdmissionController({u'write': ConcurrencyLimit(1)}, ClientRateLimiter(1, 2), retry_after=3)
+
+        # Branch 1: Test that reads are not limited without a limit and writes are shed with 503 over their limit
+
+        self.assertIsNone(controller.admit(u'read', u'10.0.0.1'))
+        self.assertIsNone(controller.admit(u'write', u'10.0.0.2'))
+        self.assertEqual(controller.admit(u'write', u'10.0.0.3'), (503, 3))
+
+        controller.release(u'read')
+        controller.release(u'write')
+
+        self.assertIsNone(controller.admit(u'write', u'10.0.0.3'))
+
+        controller.release(u'write')
+
+        # Branch 2: Test that a client over its rate limit is shed with 429 until its bucket has a token again
+
+        with patch(u'sha_api.mybottle.admission.time.time', return_value=1000.0):
+            controller = AdmissionController({}, ClientRateLimiter(0.5, 1))
+
+            self.assertIsNone(controller.admit(u'read', u'10.0.0.1'))
+            self.assertEqual(controller.admit(u'read', u'10.0.0.1'), (429, 2))
+            self.assertIsNone(controller.admit(u'read', None))
+
+        # Branch 3: Test that every decision is counted by traffic class
+
+        self.assertDictContainsSubset({u'read_admitted': 2, u'read_rate_limited': 1, u'retry_after': 1},
+                                      controller.stats())
+        self.assertDictContainsSubset({u'clients': 1}, controller.stats()[u'rate_limit'])
+
+    def test_admission_plugin(self):
+        """
+        Tests that shed requests get a JSON error with a `Retry-After` header.
+        """
+
+        app = bottle.Bottle()
+        controller = AdmissionController({u'read': ConcurrencyLimit(1), u'write': ConcurrencyLimit(1)},
+                                         ClientRateLimiter(1, 1))
+        calls = []
+
+        app.install(AdmissionPlugin(controller, trusted_proxies=[u'127.0.0.1']))
+
+        @app.get(u'/items')
+        def get_items(): # pylint: disable=unused-variable
+            """
+            Returns whether a write was in flight during the read.
+            """
+
+            calls.append(u'read')
+
+            return {u'writes': controller.limits[u'write'].active}
+
+        @app.post(u'/items/lookup', traffic_class=u'read')
+        def lookup_items(): # pylint: disable=unused-variable
+            """
+            Returns the number of reads in flight.
+            """
+
+            return {u'reads': controller.limits[u'read'].active}
+
+        @app.get(u'/stats', traffic_class=u'none')
+        def get_stats(): # pylint: disable=unused-variable
+            """
+            Returns the number of reads in flight.
+            """
+
+            return {u'reads': controller.limits[u'read'].active}
+
+        # Branch 1: Test that an admitted request is served and releases its slot, POST routes can be reads
+
+        self.assertEqual(json.loads(self.call(app, u'GET', u'/items', {u'HTTP_X_REAL_IP': u'10.0.0.1',
+                                                                       u'REMOTE_ADDR': u'127.0.0.1'})[2]),
+                         {u'writes': 0})
+        self.assertEqual(json.loads(self.call(app, u'POST', u'/items/lookup', {u'REMOTE_ADDR': u'10.0.0.2'})[2]),
+                         {u'reads': 1})
+        self.assertEqual(controller.limits[u'read'].active, 0)
+
+        # Branch 2: Test that a request over the limit of its class gets a 503 and is not served, unless exempt
+
+        controller.limits[u'read'].active = 1
+
+        status, headers, body = self.call(app, u'GET', u'/items', {u'HTTP_X_REAL_IP': u'10.0.0.3'})
+
+        self.assertEqual((status, headers[u'Retry-After']), (503, u'1'))
+        self.assertEqual(json.loads(body), {u'err_msg': u'Server busy, retry later'})
+        self.assertEqual(calls, [u'read'])
+        self.assertEqual(json.loads(self.call(app, u'GET', u'/stats', {u'HTTP_X_REAL_IP': u'10.0.0.3'})[2]),
+                         {u'reads': 1})
+
+        controller.limits[u'read'].active = 0
+
+        # Branch 3: Test that a client over its rate limit gets a 429, keyed on X-Real-IP from a trusted proxy only
+
+        status, headers, body = self.call(app, u'GET', u'/items', {u'HTTP_X_REAL_IP': u'10.0.0.1',
+                                                                   u'REMOTE_ADDR': u'127.0.0.1'})
+
+        self.assertEqual((status, headers[u'Retry-After']), (429, u'1'))
+        self.assertEqual(json.loads(body), {u'err_msg': u'Too many requests, retry later'})
+
+        status, _, body = self.call(app, u'GET', u'/items', {u'HTTP_X_REAL_IP': u'10.0.0.4',
+                                                             u'REMOTE_ADDR': u'10.0.0.2'})
+
+        self.assertEqual((status, json.loads(body)[u'err_msg']), (429, u'Too many requests, retry later'))
+        self.assertEqual(self.call(app, u'GET', u'/items', {u'HTTP_X_REAL_IP': u'10.0.0.2',
+                                                            u'REMOTE_ADDR': u'10.0.0.7'})[0], 200)
+
+        # Branch 4: Test that the slot is released when the route callback raises an error
+
+        @app.post(u'/items')
+        def add_item(): # pylint: disable=unused-variable
+            """
+            Fails to add an item.
+            """
+
+            raise bottle.HTTPError(409, u'Conflict')
+
+        self.assertEqual(self.call(app, u'POST', u'/items', {u'REMOTE_ADDR': u'10.0.0.4'})[0], 409)
+        self.assertEqual(controller.limits[u'write'].active, 0)
+        self.assertDictContainsSubset({u'read_admitted': 3, u'read_rate_limited': 2, u'read_shed_queue_full': 1,
+                                       u'write_admitted': 1}, controller.stats())
+
+        # Branch 5: Test that a streamed body keeps its slot until it is exhausted or closed
+
+        reads_in_flight = []
+
+        @app.get(u'/items/raw')
+        def get_raw_items(): # pylint: disable=unused-variable
+            """
+            Streams the number of reads in flight while each piece is read.
+            """
+
+            for _ in range(2):
+                reads_in_flight.append(controller.limits[u'read'].active)
+                yield b'x'
+
+        self.assertEqual(self.call(app, u'GET', u'/items/raw', {u'REMOTE_ADDR': u'10.0.0.5'})[2], b'xx')
+        self.assertListEqual(reads_in_flight, [1, 1])
+        self.assertEqual(controller.limits[u'read'].active, 0)
+
+        body = app({u'PATH_INFO': u'/items/raw', u'REMOTE_ADDR': u'10.0.0.6', u'REQUEST_METHOD': u'GET',
+                    u'wsgi.errors': BytesIO(), u'wsgi.input': BytesIO()}, lambda *args: None)
+
+        self.assertEqual(controller.limits[u'read'].active, 1)
+
+        body.close()
+
+        self.assertEqual(controller.limits[u'read'].active, 0)
+
+    def test_client_rate_limiter(self):
+        """
+        Tests that each client gets its own token bucket.
+        """
+
+        limiter = ClientRateLimiter(2, 2, max_clients=2)
+
+        with patch(u'sha_api.mybottle.admission.time.time') as now:
+            # Branch 1: Test that a client can burst and then has to wait for its bucket to fill up
+
+            now.return_value = 1000.0
+
+            self.assertEqual([limiter.acquire(u'A') for _ in range(3)], [0, 0, 0.5])
+            self.assertEqual(limiter.acquire(u'B'), 0)
+
+            now.return_value = 1000.25
+
+            self.assertEqual(limiter.acquire(u'A'), 0.25)
+
+            now.return_value = 1000.75
+
+            self.assertEqual(limiter.acquire(u'A'), 0)
+
+            # Branch 2: Test that only the most recently seen clients are kept
+
+            self.assertEqual(limiter.acquire(u'C'), 0)
+            self.assertEqual(limiter.stats(), {u'burst': 2.0, u'clients': 2, u'rate': 2.0})
+            self.assertEqual(list(limiter._buckets), [u'A', u'C']) # pylint: disable=protected-access
+
+    def test_concurrency_limit(self):
+        """
+        Tests that callers over the limit wait in a bounded queue for a bounded time.
+        """
+
+        limit = ConcurrencyLimit(1, max_queue=1, max_wait=5)
+
+        # Branch 1: Test that a caller waits for a released slot and callers over the queue are shed right away
+
+        self.assertEqual(limit.acquire(), u'admitted')
+
+        waited = []
+        waiter = threading.Thread(target=lambda: waited.append(limit.acquire()))
+        waiter.start()
+
+        while not limit.waiting:
+            waiter.join(0.001)
+
+        self.assertEqual(limit.acquire(), u'queue_full')
+        self.assertDictEqual(limit.stats(), {u'in_flight': 1, u'max_in_flight': 1, u'max_queue': 1, u'max_wait': 5,
+                                             u'waiting': 1})
+
+        limit.release()
+        waiter.join()
+
+        self.assertEqual(waited, [u'queued'])
+        self.assertEqual((limit.active, limit.waiting), (1, 0))
+
+        # Branch 2: Test that a caller gives up when no slot is released in time
+
+        limit.max_wait = 0.01
+
+        self.assertEqual(limit.acquire(), u'timeout')
+        self.assertEqual((limit.active, limit.waiting), (1, 0))
+
+        # Branch 3: Test that the state starts over in a forked process
+
+        with patch(u'sha_api.mybottle.admission.os.getpid', return_value=-1):
+            self.assertEqual(limit.acquire(), u'admitted')
@@ -0,0 +1,140 @@
+"""
+The `test.unit.sha_api.mybottle.content_encoding_test` module provides unit tests for the response compression in
+`sha_api.mybottle.content_encoding`.
+
+Classes:
+    TestContentEncoding: A unit test class for the `ContentEncoder` class and the `accepted_encodings` and
+                         `get_content_encoder` methods.
+"""
+
+import unittest
+import zlib
+
+from mock import patch
+from sha_api.mybottle.content_encoding import accepted_encodings, ContentEncoder, get_content_encoder
+from sha_api.mybottle.message_cache import MessageCache
+
+class TestContentEncoding(unittest.TestCase):
+    """
+    A unit test class for the `ContentEncoder` class and the `accepted_encodings` and `get_content_encoder` methods.
+
+    Methods:
+        setUp: Unit test initialization.
+        test_accepted_encodings: Tests that the quality of each listed content coding is parsed.
+        test_encode: Tests that bodies are compressed with each content coding and cached by key.
+        test_get_content_encoder: Tests that the configured content codings are returned and unknown ones are rejected.
+        test_negotiate: Tests that the content coding accepted with the highest quality is chosen.
+    """
+
+    def setUp(self):
+        """
+        Initializes the unit test global configs
+        """
+
+        self.maxDiff = None # pylint: disable=invalid-name
+
+    def test_accepted_encodings(self):
+        """
+        Tests that the quality of each listed content coding is parsed.
+        """
+
+        # Branch 1: Test that missing and empty headers accept nothing
+
+        self.assertDictEqual(accepted_encodings(None), {})
+        self.assertDictEqual(accepted_encodings(u' , '), {})
+
+        # Branch 2: Test that qualities default to 1, x-gzip is gzip and an invalid quality refuses the coding
+
+        self.assertDictEqual(accepted_encodings(u'GZIP, br;q=0.8 , x-gzip;Q=0.5, zstd;q=foo, *;q=0'),
+                             {u'*': 0.0, u'br': 0.8, u'gzip': 0.5, u'zstd': 0.0})
+
+    def test_encode(self):
+        """
+        Tests that bodies are compressed with each content coding and cached by key.
+        """
+
+        body = b'{"message": "' + b'{\\"level\\": \\"INFO\\", \\"msg\\": \\"foobar\\"} ' * 100 + b'"}'
+        encoder = get_content_encoder(u'gzip, deflate', cache=MessageCache(negative_ttl=0))
+
+        # Branch 1: Test that the gzip and deflate bodies decompress to the body
+
+        self.assertEqual(zlib.decompress(encoder.encode(u'A', body, u'gzip'), 31), body)
+        self.assertEqual(zlib.decompress(encoder.encode(u'A', body, u'deflate')), body)
+
+        # Branch 2: Test that a key is compressed once per content coding and served from the cache afterwards
+
+        with patch.dict(encoder._encoders, {u'gzip': None}): # pylint: disable=protected-access
+            self.assertEqual(zlib.decompress(encoder.encode(u'A', body, u'gzip'), 31), body)
+
+        self.assertDictContainsSubset({u'gzip_bytes_in': len(body), u'gzip_cached': 1, u'gzip_responses': 1,
+                                       u'deflate_cached': 0, u'deflate_responses': 1}, encoder.stats())
+        self.assertLess(encoder.stats()[u'gzip_bytes_out'], len(body))
+
+        # Branch 3: Test that a body that does not get smaller is not compressed, and remembered as such
+
+        self.assertIsNone(encoder.encode(u'B', b'0123456789abcdef', u'gzip'))
+        self.assertIsNone(encoder.encode(u'B', b'0123456789abcdef', u'gzip'))
+        self.assertEqual(encoder.stats()[u'gzip_cached'], 2)
+
+        # Branch 4: Test that bodies without a key or without a cache are compressed every time
+
+        encoder.encode(None, body, u'gzip')
+        ContentEncoder([(u'deflate', zlib.compress)]).encode(u'A', body, u'deflate')
+
+        self.assertEqual(encoder.stats()[u'gzip_responses'], 3)
+
+    def test_get_content_encoder(self):
+        """
+        Tests that the configured content codings are returned and unknown ones are rejected.
+        """
+
+        # Branch 1: Test that none disables compression and named codings are ordered by preference
+
+        self.assertIsNone(get_content_encoder(u'none'))
+
+        encoder = get_content_encoder(u'deflate, GZIP', min_size=10)
+
+        self.assertEqual(encoder.encodings, (u'gzip', u'deflate'))
+        self.assertEqual(encoder.min_size, 10)
+        self.assertIsNone(encoder.cache)
+
+        # Branch 2: Test that auto skips the content codings whose packages are not installed
+
+        with patch.dict(u'sys.modules', {u'brotli': None, u'zstandard': None}):
+            self.assertEqual(get_content_encoder(u'auto').encodings, (u'gzip', u'deflate'))
+
+            with self.assertRaises(ImportError):
+                get_content_encoder(u'gzip, br')
+
+        # Branch 3: Test that an unknown content coding is rejected
+
+        with self.assertRaises(ValueError) as err:
+            get_content_encoder(u'gzip, lzma')
+
+        self.assertEqual(str(err.exception),
+                         u'Unknown content encoding lzma, expected auto, none or one of zstd, br, gzip, deflate')
+
+    def test_negotiate(self):
+        """
+        Tests that the content coding accepted with the highest quality is chosen.
+        """
+
+        encoder = ContentEncoder([(u'br', None), (u'gzip', None), (u'deflate', None)])
+
+        # Branch 1: Test that nothing is chosen without an accepted coding
+
+        self.assertIsNone(encoder.negotiate(None))
+        self.assertIsNone(encoder.negotiate(u'identity'))
+        self.assertIsNone(encoder.negotiate(u'gzip;q=0, zstd'))
+
+        # Branch 2: Test that the highest quality wins and ties go to the preferred coding
+
+        self.assertEqual(encoder.negotiate(u'gzip, deflate, br'), u'br')
+        self.assertEqual(encoder.negotiate(u'gzip, br;q=0.5'), u'gzip')
+        self.assertEqual(encoder.negotiate(u'*;q=0.1, deflate'), u'deflate')
+        self.assertEqual(encoder.negotiate(u'*, br;q=0'), u'gzip')
+
+        # Branch 3: Test that only the available codings are considered
+
+        self.assertEqual(encoder.negotiate(u'gzip, deflate;q=0.5', available=(u'deflate',)), u'deflate')
+        self.assertIsNone(encoder.negotiate(u'gzip', available=(u'zstd',)))
@@ -0,0 +1,48 @@
+"""
+The `test.unit.sha_api.mybottle.counters_test` module provides unit tests for the `Counters` class in
+`sha_api.mybottle.counters`.
+
+Classes:
+    TestCounters: A unit test class for the `Counters` class.
+"""
+
+import threading
+import unittest
+
+from sha_api.mybottle.counters import Counters
+
+class TestCounters(unittest.TestCase):
+    """
+    A unit test class for the `Counters` class.
+
+    Methods:
+        test_increment: Tests that counters start at zero and are incremented safely from many threads.
+    """
+
+    def test_increment(self):
+        """
+        Tests that counters start at zero and are incremented safely from many threads.
+        """
+
+        counters = Counters(u'stored')
+
+        self.assertDictEqual(counters.snapshot(), {u'stored': 0})
+
+        def increment():
+            """
+            Increments the counters many times.
+            """
+
+            for _ in range(1000):
+                counters.increment(u'stored')
+                counters.increment(u'bytes', 2)
+
+        threads = [threading.Thread(target=increment) for _ in range(4)]
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        self.assertDictEqual(counters.snapshot(), {u'bytes': 8000, u'stored': 4000})
@@ -0,0 +1,167 @@
+"""
+The `test.unit.sha_api.mybottle.group_commit_test` module provides unit tests for the `GroupCommitWriter` and
+`GroupCommitPlugin` classes in `sha_api.mybottle.group_commit`.
+
+Classes:
+    TestGroupCommit: A unit test class for the `GroupCommitWriter` and `GroupCommitPlugin` classes.
+"""
+
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+
+from mock import MagicMock
+from sha_api.mybottle.group_commit import GroupCommitPlugin, GroupCommitWriter
+from sha_api.mybottle.sqlite_pool import SqlitePool
+from sha_api.schema import create_schema
+
+class TestGroupCommit(unittest.TestCase):
+    """
+    A unit test class for the `GroupCommitWriter` and `GroupCommitPlugin` classes.
+
+    Methods:
+        setUp: Unit test initialization.
+        test_concurrent_submit: Tests that rows submitted while a group is committed are committed together in the next
+                                group.
+        test_plugin: Tests that the plugin only wraps callbacks that accept the writer keyword.
+        test_submit: Tests that submitted rows are committed and reported as stored or already stored.
+    """
+
+    def setUp(self):
+        """
+        Initializes the unit test global configs
+        """
+
+        self.maxDiff = None # pylint: disable=invalid-name
+        self.dbfile = tempfile.NamedTemporaryFile(delete=False)
+
+        db_con = sqlite3.connect(self.dbfile.name)
+        create_schema(db_con)
+        db_con.close()
+
+    def test_concurrent_submit(self):
+        """
+        Tests that rows submitted while a group is committed are committed together in the next group.
+        """
+
+        db_con = sqlite3.connect(self.dbfile.name, check_same_thread=False)
+        gate = threading.Event()
+        pool = MagicMock(spec=SqlitePool)
+        pool.connection.return_value = MagicMock(wraps=db_con)
+        pool.connection.return_value.__enter__ = lambda _: db_con.__enter__()
+        pool.connection.return_value.__exit__ = lambda _, *exc_info: db_con.__exit__(*exc_info)
+        writer = GroupCommitWriter(pool, max_batch_size=64)
+        results = []
+
+        def execute(*args):
+            """
+            Runs the statement once the gate is open.
+            """
+
+            gate.wait()
+
+            return db_con.execute(*args)
+
+        pool.connection.return_value.execute.side_effect = execute
+
+        def submit(index):
+            """
+            Submits one row from a client thread.
+            """
+
+            results.append(writer.submit([(u'D%d' % index, u'm%d' % index)]))
+
+        # The first row is committed right away and its commit is held until the other rows are queued
+        threads = [threading.Thread(target=submit, args=(index,)) for index in range(32)]
+        threads[0].start()
+
+        while not pool.connection.return_value.execute.called:
+            time.sleep(0.001)
+
+        for thread in threads[1:]:
+            thread.start()
+
+        while writer.stats()[u'pending_rows'] < 31:
+            time.sleep(0.001)
+
+        gate.set()
+
+        for thread in threads:
+            thread.join()
+
+        stats = writer.stats()
+
+        self.assertEqual(results, [[True]] * 32)
+        self.assertDictContainsSubset({u'commits': 2, u'errors': 0, u'max_batch_rows': 31, u'pending_rows': 0,
+                                       u'requests': 32, u'rows': 32}, stats)
+        self.assertEqual(sum(stats[u'batch_rows_histogram'].values()), stats[u'commits'])
+        self.assertEqual(sqlite3.connect(self.dbfile.name).execute(u'SELECT COUNT(*) FROM sha_api').fetchone()[0], 32)
+
+    def test_plugin(self):
+        """
+        Tests that the plugin only wraps callbacks that accept the writer keyword.
+        """
+
+        writer = MagicMock()
+        plugin = GroupCommitPlugin(writer)
+
+        # Branch 1: Test that callbacks without a writer argument are returned unchanged
+
+        callback = MagicMock()
+        route = MagicMock()
+        route.get_callback_args.return_value = [u'db']
+
+        self.assertTrue(plugin.apply(callback, route) is callback)
+
+        # Branch 2: Test that callbacks with a writer argument receive the writer instance
+
+        route.get_callback_args.return_value = [u'db', u'writer']
+
+        plugin.apply(callback, route)()
+
+        callback.assert_called_once_with(writer=writer)
+
+    def test_submit(self):
+        """
+        Tests that submitted rows are committed and reported as stored or already stored.
+        """
+
+        writer = GroupCommitWriter(SqlitePool(self.dbfile.name))
+
+        # Branch 1: Test that new rows are stored and rows that are already stored are not
+
+        self.assertEqual(writer.submit([(u'A', u'aaaa'), (u'B', u'bbbb')]), [True, True])
+        self.assertEqual(writer.submit([(u'B', u'bbbb'), (u'C', u'cccc')]), [False, True])
+        self.assertEqual(
+            sqlite3.connect(self.dbfile.name).execute(u'SELECT message FROM sha_api WHERE digest = ?', (u'C',))
+            .fetchone()[0],
+            u'cccc'
+        )
+        self.assertDictContainsSubset({u'commits': 2, u'requests': 2, u'rows': 4, u'max_batch_rows': 2,
+                                       u'avg_batch_rows': 2.0}, writer.stats())
+
+        # Branch 2: Test that a failed group commit raises its error in every request and is rolled back
+
+        with self.assertRaises(sqlite3.Error):
+            writer.submit([(u'D', u'dddd'), (u'E', u'eeee', u'extra')])
+
+        self.assertIsNone(
+            sqlite3.connect(self.dbfile.name).execute(u'SELECT 1 FROM sha_api WHERE digest = ?', (u'D',)).fetchone()
+        )
+        self.assertEqual(writer.stats()[u'errors'], 1)
+
+        # Branch 3: Test that a writer thread that cannot open its connection fails the queued requests instead of
+        # leaving them waiting, and the next submit starts a new thread
+
+        pool = MagicMock(spec=SqlitePool)
+        pool.connection.side_effect = [sqlite3.OperationalError(u'unable to open database file'),
+                                       sqlite3.connect(self.dbfile.name, check_same_thread=False)]
+        writer = GroupCommitWriter(pool)
+
+        with self.assertRaises(sqlite3.OperationalError):
+            writer.submit([(u'F', u'ffff')])
+
+        self.assertEqual(writer.submit([(u'F', u'ffff')]), [True])
+        self.assertDictContainsSubset({u'commits': 1, u'errors': 1, u'pending_rows': 0}, writer.stats())
@@ -0,0 +1,152 @@
+"""
+The `test.unit.sha_api.mybottle.message_cache_test` module provides unit tests for the `MessageCache` and
+`MessageCachePlugin` classes in `sha_api.mybottle.message_cache`.
+
+Classes:
+    TestMessageCache: A unit test class for the `MessageCache` and `MessageCachePlugin` classes.
+"""
+
+import unittest
+
+from mock import MagicMock, patch
+from sha_api.mybottle.message_cache import MessageCache, MessageCachePlugin
+
+class TestMessageCache(unittest.TestCase):
+    """
+    A unit test class for the `MessageCache` and `MessageCachePlugin` classes.
+
+    Methods:
+        setUp: Unit test initialization.
+        test_lru_eviction: Tests that entries are evicted in LRU order when either limit is reached.
+        test_negative_cache: Tests that missed digests are remembered until they expire or are written.
+        test_plugin: Tests that the plugin only wraps callbacks that accept the cache keyword.
+    """
+
+    def setUp(self):
+        """
+        Initializes the unit test global configs
+        """
+
+        self.maxDiff = None # pylint: disable=invalid-name
+
+    def test_lru_eviction(self):
+        """
+        Tests that entries are evicted in LRU order when either limit is reached.
+        """
+
+        # Branch 1: Test that the entry count limit evicts the least recently used entry
+
+        cache = MessageCache(max_entries=2, max_bytes=100)
+
+        cache.put(u'A', u'aaaa')
+        cache.put(u'B', u'bbbb')
+
+        self.assertEqual(cache.get(u'A'), u'aaaa')
+
+        cache.put(u'C', u'cccc')
+
+        self.assertIsNone(cache.get(u'B'))
+        self.assertEqual(cache.get(u'C'), u'cccc')
+        self.assertDictContainsSubset({u'entries': 2, u'bytes': 8, u'evictions': 1, u'hits': 2, u'misses': 1},
+                                      cache.stats())
+
+        # Branch 2: Test that checking whether a digest is cached does not change the counters
+
+        self.assertTrue(cache.contains(u'A'))
+        self.assertFalse(cache.contains(u'B'))
+        self.assertDictContainsSubset({u'hits': 2, u'misses': 1}, cache.stats())
+
+        # Branch 3: Test that the byte limit evicts entries and oversized messages are never cached
+
+        cache = MessageCache(max_entries=10, max_bytes=10)
+
+        cache.put(u'A', u'aaaa')
+        cache.put(u'B', u'bbbb')
+        cache.put(u'C', u'cccc')
+        cache.put(u'D', u'd' * 11)
+
+        self.assertIsNone(cache.get(u'A'))
+        self.assertIsNone(cache.get(u'D'))
+        self.assertDictContainsSubset({u'entries': 2, u'bytes': 8, u'evictions': 1}, cache.stats())
+
+        # Branch 4: Test that re-adding an entry does not double count its size
+
+        cache.put(u'B', u'bbbb')
+
+        self.assertDictContainsSubset({u'entries': 2, u'bytes': 8}, cache.stats())
+
+        # Branch 5: Test that a cache with no entries allowed stores nothing
+
+        cache = MessageCache(max_entries=0)
+
+        cache.put(u'A', u'aaaa')
+        cache.put_missing(u'B')
+
+        self.assertIsNone(cache.get(u'A'))
+        self.assertFalse(cache.is_missing(u'B'))
+
+    @patch(u'sha_api.mybottle.message_cache.time.time')
+    def test_negative_cache(self, time_mock):
+        """
+        Tests that missed digests are remembered until they expire or are written.
+        """
+
+        time_mock.return_value = 1000.0
+
+        cache = MessageCache(max_entries=2, negative_ttl=5.0)
+
+        # Branch 1: Test that a missed digest is reported as missing until its TTL passes
+
+        cache.put_missing(u'A')
+
+        self.assertTrue(cache.is_missing(u'A'))
+
+        time_mock.return_value = 1006.0
+
+        self.assertFalse(cache.is_missing(u'A'))
+        self.assertEqual(cache.stats()[u'negative_hits'], 1)
+
+        # Branch 2: Test that writing a message clears its negative entry
+
+        cache.put_missing(u'B')
+        cache.put(u'B', u'bbbb')
+
+        self.assertFalse(cache.is_missing(u'B'))
+
+        cache.put_missing(u'C')
+        cache.forget_missing(u'C')
+
+        self.assertFalse(cache.is_missing(u'C'))
+
+        # Branch 3: Test that the negative cache is bounded by the entry limit
+
+        cache.put_missing(u'D')
+        cache.put_missing(u'E')
+        cache.put_missing(u'F')
+
+        self.assertFalse(cache.is_missing(u'D'))
+        self.assertTrue(cache.is_missing(u'F'))
+
+    def test_plugin(self):
+        """
+        Tests that the plugin only wraps callbacks that accept the cache keyword.
+        """
+
+        cache = MessageCache()
+        plugin = MessageCachePlugin(cache)
+
+        # Branch 1: Test that callbacks without a cache argument are returned unchanged
+
+        callback = MagicMock()
+        route = MagicMock()
+        route.get_callback_args.return_value = [u'db']
+
+        self.assertTrue(plugin.apply(callback, route) is callback)
+
+        # Branch 2: Test that callbacks with a cache argument receive the cache instance
+
+        route.get_callback_args.return_value = [u'db', u'cache']
+
+        plugin.apply(callback, route)(u'digest')
+
+        callback.assert_called_once_with(u'digest', cache=cache)
@@ -0,0 +1,174 @@
+"""
+The `test.unit.sha_api.mybottle.metrics_test` module provides unit tests for the metrics registry and plugin in
+`sha_api.mybottle.metrics`.
+
+Classes:
+    TestMetrics: A unit test class for the metrics registry and plugin.
+"""
+
+import json
+import unittest
+
+from io import BytesIO
+
+import bottle
+
+from sha_api.mybottle.metrics import MetricsPlugin, MetricsRegistry, record_error, record_phases, request_phases, \
+                                     stop_recording_phases, timed, timed_json_dumps
+
+class TestMetrics(unittest.TestCase):
+    """
+    A unit test class for the metrics registry and plugin.
+
+    Methods:
+        call: Calls a WSGI app and returns its status code.
+        test_metrics_plugin: Tests that the plugin records the counts, latencies, sizes, phases and errors of a route.
+        test_outside_request: Tests that timing phases and recording errors do nothing outside of a recorded request.
+        test_registry_render: Tests that counters and histograms are rendered in the Prometheus text format.
+    """
+
+    def call(self, app, method, path, body=b'', content_length=None):
+        """
+        Calls a WSGI app and returns its status code, sending the length of the body unless `content_length` is set.
+        """
+
+        status = []
+        environ = {
+            u'CONTENT_LENGTH': u'%d' % len(body) if content_length is None else content_length,
+            u'CONTENT_TYPE': u'application/json',
+            u'PATH_INFO': path,
+            u'REQUEST_METHOD': method,
+            u'wsgi.input': BytesIO(body)
+        }
+
+        b''.join(app(environ, lambda status_line, headers, exc_info=None: status.append(status_line)))
+
+        return int(status[0].split(u' ', 1)[0])
+
+    def test_metrics_plugin(self):
+        """
+        Tests that the plugin records the counts, latencies, sizes, phases and errors of a route.
+        """
+
+        registry = MetricsRegistry()
+        app = bottle.Bottle()
+
+        app.uninstall(bottle.JSONPlugin)
+        app.install(MetricsPlugin(registry))
+        app.install(bottle.JSONPlugin(json_dumps=timed_json_dumps))
+
+        @app.post(u'/items/<name>')
+        def add_item(name): # pylint: disable=unused-variable
+            """
+            Stores nothing, but spends time executing and fails for the name bad.
+            """
+
+            with timed(u'execute'):
+                if name == u'bad':
+                    record_error(ValueError(u'bad'))
+                    bottle.abort(500, u'Failed')
+
+            return {u'name': name}
+
+        @app.get(u'/items')
+        def get_items(): # pylint: disable=unused-variable
+            """
+            Returns no items without reading the request body.
+            """
+
+            return {u'items': []}
+
+        # Branch 1: Test that a successful request is counted with its latency, sizes and phases
+
+        self.assertEqual(self.call(app, u'POST', u'/items/good', b'{"a": 1}'), 200)
+
+        metrics = registry.render()
+
+        self.assertIn(u'sha_api_requests_total{route="/items/<name>",method="POST",status="200"} 1\n', metrics)
+        self.assertIn(u'sha_api_request_duration_seconds_count{route="/items/<name>",method="POST"} 1\n', metrics)
+        self.assertIn(u'sha_api_request_size_bytes_bucket{route="/items/<name>",le="64"} 1\n', metrics)
+        self.assertIn(u'sha_api_response_size_bytes_sum{route="/items/<name>"} %d.0\n' % len(
+            json.dumps({u'name': u'good'})
+        ), metrics)
+        for phase, count in ((u'execute', 1), (u'hash', 0), (u'serialize', 1)):
+            self.assertIn(u'sha_api_request_phase_duration_seconds_count{route="/items/<name>",phase="%s"} %d\n' % (
+                phase, count
+            ), metrics)
+
+        self.assertNotIn(u'sha_api_db_errors_total{', metrics)
+
+        # Branch 2: Test that an aborted request is counted by its status with the database error it recorded
+
+        self.assertEqual(self.call(app, u'POST', u'/items/bad'), 500)
+
+        metrics = registry.render()
+
+        self.assertIn(u'sha_api_requests_total{route="/items/<name>",method="POST",status="500"} 1\n', metrics)
+        self.assertIn(u'sha_api_request_duration_seconds_count{route="/items/<name>",method="POST"} 2\n', metrics)
+        self.assertIn(u'sha_api_request_size_bytes_count{route="/items/<name>"} 1\n', metrics)
+        self.assertIn(u'sha_api_db_errors_total{route="/items/<name>",error="ValueError"} 1\n', metrics)
+
+        # Branch 3: Test that a request with a malformed Content-Length is served and counted without a request size
+
+        self.assertEqual(self.call(app, u'GET', u'/items', content_length=u'abc'), 200)
+
+        metrics = registry.render()
+
+        self.assertIn(u'sha_api_requests_total{route="/items",method="GET",status="200"} 1\n', metrics)
+        self.assertIn(u'sha_api_request_size_bytes_count{route="/items"} 0\n', metrics)
+
+    def test_outside_request(self):
+        """
+        Tests that timing phases and recording errors do nothing outside of a recorded request.
+        """
+
+        with timed(u'execute'):
+            record_error(ValueError(u'bad'))
+
+        self.assertEqual(timed_json_dumps({u'a': 1}), u'{"a": 1}')
+        self.assertIsNone(request_phases())
+
+        # Phases can be recorded without the plugin until the recording is stopped
+
+        environ = {}
+        phases = record_phases(environ)
+
+        with timed(u'hash'):
+            pass
+
+        self.assertIs(request_phases(), phases)
+        self.assertListEqual(list(phases), [u'hash'])
+
+        stop_recording_phases(environ)
+
+        self.assertIsNone(request_phases())
+        self.assertDictEqual(environ, {})
+
+    def test_registry_render(self):
+        """
+        Tests that counters and histograms are rendered in the Prometheus text format.
+        """
+
+        registry = MetricsRegistry()
+        counter = registry.counter(u'test_total', u'A test counter.', (u'label',))
+        histogram = registry.histogram(u'test_seconds', u'A test histogram.', buckets=(0.1, 1.0))
+
+        counter.inc((u'a"b',))
+        counter.inc((u'a"b',), 2)
+        histogram.observe(0.05)
+        histogram.observe(0.5)
+        histogram.observe(5)
+
+        self.assertEqual(registry.render([u'extra 1']), u'\n'.join([
+            u'# HELP test_total A test counter.',
+            u'# TYPE test_total counter',
+            u'test_total{label="a\\"b"} 3',
+            u'# HELP test_seconds A test histogram.',
+            u'# TYPE test_seconds histogram',
+            u'test_seconds_bucket{le="0.1"} 1',
+            u'test_seconds_bucket{le="1.0"} 2',
+            u'test_seconds_bucket{le="+Inf"} 3',
+            u'test_seconds_sum 5.55',
+            u'test_seconds_count 3',
+            u'extra 1'
+        ]) + u'\n')
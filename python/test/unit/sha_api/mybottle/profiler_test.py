@@ -0,0 +1,176 @@
+"""
+The `test.unit.sha_api.mybottle.profiler_test` module provides unit tests for the request profiler and plugin in
+`sha_api.mybottle.profiler`.
+
+Classes:
+    TestProfiler: A unit test class for the request profiler and plugin.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from io import BytesIO
+
+import bottle
+
+from sha_api.mybottle.metrics import timed, timed_json_dumps
+from sha_api.mybottle.profiler import ProfilerPlugin, RequestProfiler
+
+class TestProfiler(unittest.TestCase):
+    """
+    A unit test class for the request profiler and plugin.
+
+    Methods:
+        setUp: Unit test initialization.
+        tearDown: Removes the profile output directory.
+        call: Calls a WSGI app and returns its status code and headers.
+        test_profiler_plugin: Tests that sampled requests are profiled and requested timings are returned.
+        test_request_profiler: Tests that profiled call stacks and phase timings are aggregated and written.
+    """
+
+    def setUp(self):
+        """
+        Creates the profile output directory.
+        """
+
+        self.output_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """
+        Removes the profile output directory.
+        """
+
+        shutil.rmtree(self.output_dir)
+
+    def call(self, app, path, headers=None):
+        """
+        Calls a WSGI app with a GET request and returns its status code and headers.
+        """
+
+        status = []
+        environ = {u'PATH_INFO': path, u'REQUEST_METHOD': u'GET', u'wsgi.errors': BytesIO(), u'wsgi.input': BytesIO()}
+        environ.update(headers or {})
+
+        b''.join(app(environ, lambda status_line, headers, exc_info=None: status.append((status_line, headers))))
+
+        return int(status[0][0].split(u' ', 1)[0]), dict(status[0][1])
+
+    def test_profiler_plugin(self):
+        """
+        Tests that sampled requests are profiled and requested timings are returned.
+        """
+
+        profiler = RequestProfiler(self.output_dir, sample_rate=1.0, dump_interval=3600)
+        app = bottle.Bottle()
+
+        app.uninstall(bottle.JSONPlugin)
+        app.install(ProfilerPlugin(profiler, server_timing=True))
+        app.install(bottle.JSONPlugin(json_dumps=timed_json_dumps))
+
+        @app.get(u'/items/<name>')
+        def get_item(name): # pylint: disable=unused-variable
+            """
+            Hashes the name and returns it, or a 404 for the name missing.
+            """
+
+            with timed(u'hash'):
+                digest = hashlib.sha256(name.encode(u'utf-8')).hexdigest()
+
+            if name == u'missing':
+                bottle.abort(404, u'Not found')
+
+            return {u'digest': digest}
+
+        # Branch 1: Test that nothing is recorded or added while profiling is off and no timings are requested
+
+        self.assertEqual(self.call(app, u'/items/a'), (200, {u'Content-Length': u'78',
+                                                               u'Content-Type': u'application/json'}))
+
+        profiler.dump()
+
+        self.assertEqual(os.path.getsize(profiler.paths()[0]), 0)
+
+        # Branch 2: Test that the requested timings are added to successful and error responses, error bodies are
+        # serialized by the error handler after the plugins
+
+        for path, status, expected in ((u'/items/a', 200, [u'hash', u'serialize', u'total']),
+                                       (u'/items/missing', 404, [u'hash', u'total'])):
+            response_status, headers = self.call(app, path, {u'HTTP_X_SERVER_TIMING': u'1'})
+            timings = [timing.split(u';')[0] for timing in headers[u'Server-Timing'].split(u', ')]
+
+            self.assertEqual(response_status, status)
+            self.assertListEqual(timings, expected)
+
+        # Branch 3: Test that sampled requests are profiled under their route
+
+        profiler.toggle()
+
+        self.assertEqual(self.call(app, u'/items/a')[0], 200)
+
+        profiler.toggle()
+
+        with open(profiler.paths()[0]) as fin:
+            folded = fin.read()
+
+        with open(profiler.paths()[1]) as fin:
+            phases = json.load(fin)
+
+        self.assertIn(u'GET /items/<name>;', folded)
+        self.assertRegexpMatches(folded, u':get_item;[^ ]*sha256 ')
+        self.assertEqual(phases[u'GET /items/<name>'][u'requests'], 1)
+        self.assertGreater(phases[u'GET /items/<name>'][u'mean_ms'][u'hash'], 0)
+
+    def test_request_profiler(self):
+        """
+        Tests that profiled call stacks and phase timings are aggregated and written.
+        """
+
+        profiler = RequestProfiler(os.path.join(self.output_dir, u'profiles'), sample_rate=0.0, enabled=True,
+                                   dump_interval=0)
+
+        def handler(value):
+            """
+            Sorts the value.
+            """
+
+            return sorted(value)
+
+        # Branch 1: Test that requests are only sampled while profiling is enabled
+
+        self.assertFalse(profiler.sample())
+
+        profiler.sample_rate = 1.0
+
+        self.assertTrue(profiler.sample())
+
+        profiler.enabled = False
+
+        self.assertFalse(profiler.sample())
+
+        # Branch 2: Test that the call stacks of a profiled callback are added under the route name
+
+        self.assertListEqual(profiler.profile(u'GET /', handler, ([2, 1],), {}), [1, 2])
+        self.assertListEqual(profiler.profile(u'GET /', handler, (), {u'value': [2, 1]}), [1, 2])
+
+        # Branch 3: Test that recording a request writes the aggregates once the dump interval has passed
+
+        profiler.record(u'GET /', 0.002, {u'execute': 0.001})
+        profiler.record(u'GET /', 0.004, {})
+
+        stacks_path, phases_path = profiler.paths()
+
+        with open(stacks_path) as fin:
+            stacks = dict(line.rsplit(u' ', 1) for line in fin.read().splitlines())
+
+        with open(phases_path) as fin:
+            phases = json.load(fin)
+
+        self.assertIn(u'GET /;%s:handler;%s:sorted' % (__name__, sorted.__module__), stacks)
+        self.assertEqual(phases[u'GET /'][u'requests'], 2)
+        self.assertAlmostEqual(phases[u'GET /'][u'mean_ms'][u'total'], 3.0)
+        self.assertAlmostEqual(phases[u'GET /'][u'mean_ms'][u'execute'], 0.5)
+        self.assertEqual(phases[u'GET /'][u'mean_ms'][u'hash'], 0.0)
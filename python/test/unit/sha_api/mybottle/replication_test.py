@@ -0,0 +1,322 @@
+"""
+The `test.unit.sha_api.mybottle.replication_test` module provides unit tests for the read replicas in
+`sha_api.mybottle.replication`, with a primary `ShaApiBottle` served on a localhost port.
+
+Classes:
+    TestReplication: A unit test class for the `Follower` and `ReplicaPlugin` classes.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from io import BytesIO
+
+import bottle
+
+from mock import patch
+from sha_api.benchmark.clients import LocalServer, WsgiClient
+from sha_api.mybottle.replication import Follower, ReplicaPlugin
+from sha_api.mybottle.sha_api_bottle import ShaApiBottle
+from sha_api.routes import ROUTES
+
+class TestReplication(unittest.TestCase):
+    """
+    A unit test class for the `Follower` and `ReplicaPlugin` classes.
+
+    Methods:
+        setUp: Serves a primary with a change log and configures a follower of it.
+        tearDown: Stops the primary and removes the files of both nodes.
+        call: Calls a WSGI app and returns its status code, headers and body.
+        make_app: Returns a `ShaApiBottle` with the routes of `sha_apid` and a configuration.
+        store: Stores messages with the storage engine of the primary and returns their digests.
+        test_follower: Tests that the follower stores the messages of the primary and reports its lag.
+        test_follower_thread: Tests that the follower tails the primary on a thread and counts its errors.
+        test_replica_plugin: Tests that writes are redirected or forwarded to the primary and reads are served locally.
+    """
+
+    def setUp(self):
+        """
+        Serves a primary with a change log and configures a follower of it.
+        """
+
+        self.maxDiff = None # pylint: disable=invalid-name
+        self.node_dir = tempfile.mkdtemp()
+        self.primary = self.make_app(u'[replication]\nchangelog = true\nchangelog_path = %s\n' %
+                                     os.path.join(self.node_dir, u'changes.db'), u'primary')
+        self.server = LocalServer(self.primary, threads=2)
+        self.primary_url = u'http://%s:%d' % (self.server.host, self.server.port)
+        self.state_path = os.path.join(self.node_dir, u'replica.json')
+        self.follower = self.make_app(u'[replication]\nprimary = %s\nstate_file = %s\nbatch_size = 2\n' %
+                                      (self.primary_url, self.state_path), u'follower')
+
+    def tearDown(self):
+        """
+        Stops the primary and removes the files of both nodes.
+        """
+
+        self.server.close()
+        self.primary.storage.close()
+        self.follower.storage.close()
+        shutil.rmtree(self.node_dir)
+
+    def call(self, app, method, path, body=b'', headers=None):
+        """
+        Calls a WSGI app and returns its status code, headers and body.
+        """
+
+        status = []
+        environ = {u'CONTENT_LENGTH': str(len(body)), u'CONTENT_TYPE': u'application/json', u'PATH_INFO': path,
+                   u'QUERY_STRING': u'', u'REQUEST_METHOD': method, u'wsgi.errors': BytesIO(),
+                   u'wsgi.input': BytesIO(body)}
+        environ.update(headers or {})
+
+        response_body = b''.join(app(environ, lambda status_line, headers, exc_info=None: status.append((status_line,
+                                                                                                          headers))))
+
+        return int(status[0][0].split(u' ', 1)[0]), dict(status[0][1]), response_body
+
+    def make_app(self, config, name):
+        """
+        Returns a `ShaApiBottle` with the routes of `sha_apid` and the configuration, in files named after the node.
+        """
+
+        config_path = os.path.join(self.node_dir, name + u'.conf')
+
+        with open(config_path, u'w') as fout:
+            fout.write(u'[sqlite]\ndbfile = %s\n%s' % (os.path.join(self.node_dir, name + u'.db'), config))
+
+        with patch.dict(u'sha_api.mybottle.sha_api_bottle.os.environ', values={u'SHA_API_CONFIG': config_path}):
+            return ShaApiBottle(ROUTES)
+
+    def store(self, *messages):
+        """
+        Stores the messages with the storage engine of the primary and returns their digests.
+        """
+
+        digests = [hashlib.sha256(message.encode(u'utf-8')).hexdigest().upper() for message in messages]
+
+        self.primary.storage.put_many(list(zip(digests, messages)))
+
+        return digests
+
+    def test_follower(self):
+        """
+        Tests that the follower stores the messages of the primary and reports its lag.
+        """
+
+        follower = self.follower.follower
+        client = WsgiClient(self.follower)
+        digests = self.store(u'foo', u'bar', u'f\xf6\xf6 \u2603')
+
+        # Branch 1: Test that nothing is replicated before the first batch is applied
+
+        self.assertDictContainsSubset({u'applied_seq': 0, u'lag_changes': 0, u'lag_seconds': None},
+                                      follower.stats())
+        self.assertEqual(client.request(u'GET', u'/messages/%s' % digests[0])[0], 404)
+
+        # Branch 2: Test that the changes are applied in batches until every change is applied
+
+        self.assertEqual(follower.apply(), 1)
+        self.assertDictContainsSubset({u'applied_seq': 2, u'lag_changes': 1, u'lag_seconds': None, u'stored': 2},
+                                      follower.stats())
+        self.assertEqual(follower.apply(), 0)
+
+        stats = follower.stats()
+
+        self.assertDictContainsSubset({u'applied_seq': 3, u'batches': 2, u'changes': 3, u'lag_changes': 0,
+                                       u'primary': self.primary_url, u'primary_seq': 3, u'stored': 3}, stats)
+        self.assertLess(stats[u'lag_seconds'], 5)
+
+        # The negative cache entry of the first lookup was cleared when its message was applied
+        status, body = client.request(u'GET', u'/messages/%s' % digests[2])
+
+        self.assertEqual((status, json.loads(body)[u'message']), (200, u'f\xf6\xf6 \u2603'))
+        self.assertEqual(client.request(u'GET', u'/messages/%s' % digests[0])[0], 200)
+
+        # Branch 3: Test that a caught up follower stays at the last change and picks up new ones
+
+        self.assertEqual(follower.apply(), 0)
+
+        self.store(u'baz')
+
+        self.assertEqual(follower.apply(), 0)
+        self.assertDictContainsSubset({u'applied_seq': 4, u'batches': 3, u'changes': 4}, follower.stats())
+
+        # Branch 4: Test that a message that does not match its digest stops the batch until a later poll has it
+
+        new_digests = [hashlib.sha256(message.encode(u'utf-8')).hexdigest().upper() for message in (u'qux', u'quux')]
+        log_id = follower.stats()[u'log_id']
+        requested = []
+
+        def fetch(after):
+            """
+            Returns the changes after the sequence number, with the first new message missing on the first poll.
+            """
+
+            requested.append(after)
+            changes = [{u'digest': digests[0], u'message': u'foo', u'seq': 5},
+                       {u'digest': new_digests[0], u'message': None if len(requested) == 1 else u'qux', u'seq': 6},
+                       {u'digest': new_digests[1], u'message': u'quux', u'seq': 7}]
+
+            return {u'changes': [change for change in changes if change[u'seq'] > after], u'last_seq': 7,
+                    u'log_id': log_id}
+
+        with patch.object(follower, u'_fetch', side_effect=fetch):
+            with self.assertRaises(ValueError):
+                follower.apply()
+
+            self.assertDictContainsSubset({u'applied_seq': 5, u'lag_changes': 2, u'rejected': 1}, follower.stats())
+            self.assertEqual(client.request(u'GET', u'/messages/%s' % new_digests[1])[0], 404)
+            self.assertEqual(follower.apply(), 0)
+
+        self.assertListEqual(requested, [4, 5])
+        self.assertDictContainsSubset({u'applied_seq': 7, u'rejected': 1, u'stored': 6}, follower.stats())
+        self.assertEqual(json.loads(client.request(u'GET', u'/messages/%s' % new_digests[0])[1])[u'message'], u'qux')
+        self.assertEqual(json.loads(client.request(u'GET', u'/messages/%s' % digests[0])[1])[u'message'], u'foo')
+
+        # Branch 5: Test that a change that stays bad is recorded and skipped after `max_attempts` polls
+
+        bad_digest, good_digest = [hashlib.sha256(message.encode(u'utf-8')).hexdigest().upper()
+                                   for message in (u'corge', u'grault')]
+        feed = {u'changes': [{u'digest': bad_digest, u'message': u'evil', u'seq': 8},
+                             {u'digest': good_digest, u'message': u'grault', u'seq': 9}],
+                u'last_seq': 9, u'log_id': log_id}
+        requested = []
+        follower.max_attempts = 3
+
+        with patch.object(follower, u'_fetch', side_effect=lambda after: requested.append(after) or feed):
+            for attempt in (1, 2):
+                with self.assertRaises(ValueError):
+                    follower.apply()
+
+                self.assertDictContainsSubset({u'applied_seq': 7, u'retry_attempts': attempt, u'retry_seq': 8,
+                                               u'skipped': 0}, follower.stats())
+
+            self.assertEqual(follower.apply(), 0)
+
+        self.assertListEqual(requested, [7, 7, 7])
+        self.assertDictContainsSubset({u'applied_seq': 9, u'rejected': 4, u'retry_attempts': 0, u'retry_seq': None,
+                                       u'skipped': 1, u'skipped_changes': [{u'digest': bad_digest, u'seq': 8}],
+                                       u'stored': 7}, follower.stats())
+        self.assertEqual(client.request(u'GET', u'/messages/%s' % bad_digest)[0], 404)
+        self.assertEqual(json.loads(client.request(u'GET', u'/messages/%s' % good_digest)[1])[u'message'], u'grault')
+
+        # Branch 6: Test that every change is applied again from the start of a new change log
+
+        requested = []
+        feed = {u'changes': [], u'last_seq': 0, u'log_id': u'new'}
+
+        with patch.object(follower, u'_fetch', side_effect=lambda after: requested.append(after) or feed):
+            self.assertEqual(follower.apply(), 0)
+
+        self.assertListEqual(requested, [9, 0])
+        self.assertDictContainsSubset({u'applied_seq': 0, u'log_id': u'new'}, follower.stats())
+
+    def test_follower_thread(self):
+        """
+        Tests that the follower tails the primary on a thread and counts its errors.
+        """
+
+        follower = self.follower.follower
+        follower.poll_interval = 0.01
+        digests = self.store(u'foo', u'bar', u'baz')
+
+        # Branch 1: Test that the follower catches up with the primary and keeps polling it
+
+        self.follower.start_replication()
+
+        try:
+            deadline = time.time() + 10
+
+            while follower.stats()[u'applied_seq'] < 4 and time.time() < deadline:
+                if follower.stats()[u'applied_seq'] == 3:
+                    self.store(u'qux')
+
+                time.sleep(0.01)
+        finally:
+            follower.stop()
+
+        self.assertDictContainsSubset({u'applied_seq': 4, u'lag_changes': 0, u'stored': 4}, follower.stats())
+        self.assertEqual(len(self.follower.storage.get_many(digests)), 3)
+
+        # Branch 2: Test that errors are counted and retried until the primary answers again
+
+        self.server.close()
+
+        follower.start()
+
+        try:
+            deadline = time.time() + 10
+
+            while not follower.stats()[u'errors'] and time.time() < deadline:
+                time.sleep(0.01)
+        finally:
+            follower.stop()
+
+        self.assertGreaterEqual(follower.stats()[u'errors'], 1)
+        self.assertIsNotNone(follower.stats()[u'last_error'])
+
+        # Branch 3: Test that an invalid primary URL is rejected
+
+        with self.assertRaises(ValueError):
+            Follower(u'ftp://10.0.0.1', self.follower.storage, self.state_path)
+
+    def test_replica_plugin(self):
+        """
+        Tests that writes are redirected or forwarded to the primary and reads are served locally.
+        """
+
+        body = json.dumps({u'message': u'foo'}).encode(u'utf-8')
+        digest = hashlib.sha256(b'foo').hexdigest().upper()
+
+        # Branch 1: Test that writes are redirected to the same path on the primary and never stored locally
+
+        status, headers, response_body = self.call(self.follower, u'POST', u'/messages', body)
+
+        self.assertEqual((status, headers[u'Location']), (307, self.primary_url + u'/messages'))
+        self.assertEqual(json.loads(response_body), {u'err_msg': u'Writes are served by the primary %s' %
+                                                                 self.primary_url})
+        self.assertEqual(self.call(self.follower, u'GET', u'/messages/%s' % digest)[0], 404)
+        self.assertEqual(self.call(self.follower, u'POST', u'/messages/lookup', b'[]')[0], 200)
+
+        # Branch 2: Test that forwarded writes are stored on the primary and answered with its response
+
+        app = bottle.Bottle()
+        plugin = ReplicaPlugin(self.primary_url, mode=u'forward', trusted_proxies=[u'127.0.0.1'])
+        app.install(plugin)
+        app.route(u'/messages', method=u'POST', callback=lambda: self.fail(u'The write was served locally'))
+
+        status, headers, response_body = self.call(app, u'POST', u'/messages', body, {u'REMOTE_ADDR': u'10.0.0.1'})
+
+        self.assertEqual((status, headers[u'Content-Type']), (200, u'application/json'))
+        self.assertEqual(json.loads(response_body), {u'digest': digest, u'stored': True})
+        self.assertEqual(self.primary.storage.get(digest), u'foo')
+
+        # The client is sent to the primary, taken from X-Real-IP only when the follower is behind a trusted proxy
+        connection = plugin._local.connection # pylint: disable=protected-access
+
+        with patch.object(connection, u'request', wraps=connection.request) as request_mock:
+            self.call(app, u'POST', u'/messages', body, {u'HTTP_X_REAL_IP': u'10.0.0.2', u'REMOTE_ADDR': u'10.0.0.1'})
+            self.call(app, u'POST', u'/messages', body, {u'HTTP_X_REAL_IP': u'10.0.0.2', u'REMOTE_ADDR': u'127.0.0.1'})
+
+        self.assertEqual([call_args[0][3][u'X-Real-IP'] for call_args in request_mock.call_args_list],
+                         [u'10.0.0.1', u'10.0.0.2'])
+
+        # Branch 3: Test that a write that cannot reach the primary gets a 502
+
+        self.server.close()
+
+        status, _, response_body = self.call(app, u'POST', u'/messages', body)
+
+        self.assertEqual((status, json.loads(response_body)),
+                         (502, {u'err_msg': u'Failed to forward the write to the primary'}))
+
+        # Branch 4: Test that unknown write modes are rejected
+
+        with self.assertRaises(ValueError):
+            ReplicaPlugin(self.primary_url, mode=u'drop')
@@ -0,0 +1,96 @@
+"""
+The `test.unit.sha_api.mybottle.serializers_test` module provides unit tests for the JSON serializers in
+`sha_api.mybottle.serializers`.
+
+Classes:
+    TestSerializers: A unit test class for the `Serializer` class and the `error_response` and `get_serializer` methods.
+"""
+
+import json
+import unittest
+
+from mock import MagicMock, patch
+from sha_api.mybottle.serializers import constant, error_response, get_serializer, Serializer
+
+class TestSerializers(unittest.TestCase):
+    """
+    A unit test class for the `Serializer` class and the `error_response` and `get_serializer` methods.
+
+    Methods:
+        setUp: Unit test initialization.
+        test_error_response: Tests that the same constant error response is returned for the same message.
+        test_get_serializer: Tests that serializers are returned by name and `auto` falls back to installed ones.
+        test_serializer: Tests that constant objects are only encoded once.
+    """
+
+    def setUp(self):
+        """
+        Initializes the unit test global configs
+        """
+
+        self.maxDiff = None # pylint: disable=invalid-name
+
+    def test_error_response(self):
+        """
+        Tests that the same constant error response is returned for the same message.
+        """
+
+        err_response = error_response(u'Test error')
+
+        self.assertDictEqual(err_response, {u'err_msg': u'Test error'})
+        self.assertIs(error_response(u'Test error'), err_response)
+        self.assertIsNot(error_response(u'Other test error'), err_response)
+
+    def test_get_serializer(self):
+        """
+        Tests that serializers are returned by name and `auto` falls back to installed ones.
+        """
+
+        # Branch 1: Test that the standard library serializer encodes and decodes JSON
+
+        serializer = get_serializer(u'json')
+
+        self.assertEqual(serializer.name, u'json')
+        self.assertEqual(serializer.dumps({u'a': u'b/c'}), json.dumps({u'a': u'b/c'}))
+        self.assertDictEqual(serializer.loads(b'{"a": [1, "b"]}'), {u'a': [1, u'b']})
+
+        # Branch 2: Test that auto returns the first installed serializer
+
+        missing_codec = MagicMock(side_effect=ImportError(u'No module named orjson'))
+        json_codec = MagicMock(return_value=(json.dumps, json.loads))
+
+        with patch.dict(u'sha_api.mybottle.serializers._CODECS', {u'orjson': missing_codec, u'ujson': json_codec}):
+            self.assertEqual(get_serializer().name, u'ujson')
+
+            # Branch 3: Test that a named serializer that is not installed raises its import error
+
+            with self.assertRaises(ImportError):
+                get_serializer(u'orjson')
+
+        # Branch 4: Test that an unknown serializer raises a value error
+
+        with self.assertRaises(ValueError) as err:
+            get_serializer(u'pickle')
+
+        self.assertEqual(str(err.exception), u'Unknown serializer pickle, expected auto or one of orjson, ujson, json')
+
+    def test_serializer(self):
+        """
+        Tests that constant objects are only encoded once.
+        """
+
+        dumps = MagicMock(side_effect=json.dumps)
+        serializer = Serializer(u'test', dumps, json.loads)
+        constant_response = constant({u'err_msg': u'Constant'})
+
+        # Branch 1: Test that other objects are encoded every time
+
+        self.assertEqual(serializer.dumps({u'a': 1}), u'{"a": 1}')
+        self.assertEqual(serializer.dumps({u'a': 1}), u'{"a": 1}')
+        self.assertEqual(dumps.call_count, 2)
+
+        # Branch 2: Test that the encoding of a constant object is reused
+
+        self.assertEqual(serializer.dumps(constant_response), u'{"err_msg": "Constant"}')
+        self.assertEqual(serializer.dumps(constant_response), u'{"err_msg": "Constant"}')
+        self.assertEqual(dumps.call_count, 3)
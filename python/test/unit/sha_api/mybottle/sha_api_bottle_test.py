@@ -7,13 +7,16 @@ Classes:
 """
 
 import json
+import os
+import shutil
+import signal
 import tempfile
 import unittest
 
 from bottle import ConfigDict # pylint: disable=no-name-in-module
 from mock import MagicMock, patch
-from sha_api.mybottle.sha_api_bottle import global_config, ShaApiBottle
-from sha_api.sha_apid import ROUTES
+from sha_api.mybottle.sha_api_bottle import global_config, global_config_bool, ShaApiBottle
+from sha_api.routes import ROUTES
 
 import sha_api
 
@@ -51,7 +54,10 @@ class TestShaApiBottle(unittest.TestCase):
         )
 
         with open(self.config_sample.name, 'w') as fout:
-            fout.write(u"[sha_api]\ntest_variable = test_value\n[sqlite]\ndbfile = %s" % self.dbfile.name)
+            fout.write(u"[sha_api]\nserializer = json\ntest_variable = test_value\n[sqlite]\ndbfile = %s\n"
+                       u"synchronous = OFF\ngroup_commit = true\ngroup_commit_max_batch = 128\n"
+                       u"[metrics]\nenabled = false\n[profiler]\nsample_rate = 0.5\nserver_timing = on\n"
+                       u"signal = SIGUSR2" % self.dbfile.name)
 
     def test_error_handler(self):
         """
@@ -59,13 +65,11 @@ class TestShaApiBottle(unittest.TestCase):
         """
 
         res = MagicMock()
-        res_json = json.dumps({u'err_msg': u'Response Body'})
-
         res.body = u'Response Body'
 
         api = ShaApiBottle(ROUTES)
 
-        self.assertEqual(api.default_error_handler(res), res_json)
+        self.assertDictEqual(json.loads(api.default_error_handler(res)), {u'err_msg': u'Response Body'})
 
     def test_global_config(self):
         """
@@ -74,6 +78,14 @@ class TestShaApiBottle(unittest.TestCase):
 
         self.assertEqual(global_config(self.configdict_ns, u'sqlite', u'dbfile', u'Not Found'), self.dbfile.name)
 
+        # Boolean settings are converted from their config file string values
+
+        self.assertTrue(global_config_bool(ConfigDict().load_dict({u'sqlite': {u'flag': u'Yes'}}), u'sqlite', u'flag',
+                                           False))
+        self.assertFalse(global_config_bool(ConfigDict().load_dict({u'sqlite': {u'flag': u'off'}}), u'sqlite', u'flag',
+                                            True))
+        self.assertTrue(global_config_bool(self.configdict_ns, u'sqlite', u'flag', True))
+
     def test_sha_api_constructor(self):
         """
         Tests that `ShaApiBottle` instance can be properly instantiated without throwing any exceptions.
@@ -81,10 +93,13 @@ class TestShaApiBottle(unittest.TestCase):
 
         # Branch 1: Nothing throws an error and all goes well
         try:
-            api = ShaApiBottle(ROUTES) # pylint: disable=unused-variable
+            api = ShaApiBottle(ROUTES)
         except Exception as err: # pylint: disable=broad-except
             self.fail(u'ShaApiBottle sha_api instance failed to initialize: %s' % str(err))
 
+        self.assertIn(u'metrics', [plugin.name for plugin in api.plugins])
+        self.assertNotIn(u'profiler', [plugin.name for plugin in api.plugins])
+
         # Branch 2: When routes object is not a list we get a proper assert error
 
         with self.assertRaises(AssertionError) as err:
@@ -108,9 +123,41 @@ class TestShaApiBottle(unittest.TestCase):
             api = ShaApiBottle(ROUTES)
 
             self.assertEqual(api.config.get(u'sha_api.test_variable'), u'test_value')
+            self.assertEqual(api.serializer.name, u'json')
             self.assertEqual(api.config.get(u'sqlite.dbfile'), self.dbfile.name)
+            self.assertEqual(api.sqlite_pool.dbfile, self.dbfile.name)
+            self.assertIn((u'synchronous', u'OFF'), api.sqlite_pool.pragmas)
+            self.assertEqual(api.group_commit_writer.max_batch_size, 128)
+            self.assertEqual(api.storage.name, u'sqlite')
+            self.assertIs(api.storage.writer, api.group_commit_writer)
+            self.assertIsNone(api.storage.compressor)
+            self.assertNotIn(u'metrics', [plugin.name for plugin in api.plugins])
+            self.assertIn(u'profiler', [plugin.name for plugin in api.plugins])
+            self.assertEqual(api.profiler.sample_rate, 0.5)
+            self.assertFalse(api.profiler.enabled)
+
+            # The configured signal toggles the profiler
+
+            previous_handler = signal.getsignal(signal.SIGUSR2)
+
+            try:
+                api.install_profiler_signal()
+                signal.getsignal(signal.SIGUSR2)(signal.SIGUSR2, None)
+            finally:
+                signal.signal(signal.SIGUSR2, previous_handler)
+
+            self.assertTrue(api.profiler.enabled)
+
+        # Branch 5: In async mode database routes run on the gevent executor
+
+        api = ShaApiBottle(ROUTES, async_mode=True)
 
-        # Branch 5: When any portion of the db initialization fails it should just bubble up the exception
+        self.assertEqual(api.db_executor.max_threads, 16)
+        self.assertIsNone(ShaApiBottle(ROUTES).db_executor)
+        self.assertIsNone(api.group_commit_writer)
+        self.assertIs(api.storage.executor, api.db_executor)
+
+        # Branch 6: When any portion of the db initialization fails it should just bubble up the exception
 
         with patch(u'sha_api.mybottle.sha_api_bottle.sqlite3.connect') as sqlite_connect:
             self.assertEqual(sqlite_connect, sha_api.mybottle.sha_api_bottle.sqlite3.connect)
@@ -121,3 +168,166 @@ class TestShaApiBottle(unittest.TestCase):
                 api = ShaApiBottle()
 
             self.assertEqual(str(err.exception), u'sqlite exception')
+
+        # Branch 7: When shards are configured the messages are stored in lazily opened shard files
+
+        shard_dir = tempfile.mkdtemp()
+
+        with open(self.config_sample.name, 'w') as fout:
+            fout.write(u"[sqlite]\nshards = 4\nshard_dir = %s\ngroup_commit = true\n" % shard_dir)
+
+        try:
+            with patch.dict(u'sha_api.mybottle.sha_api_bottle.os.environ', values=self.os_environ):
+                api = ShaApiBottle(ROUTES)
+
+            self.assertEqual(api.sqlite_pool.paths[3], os.path.join(shard_dir, u'sha_api-0003-of-0004.db'))
+            self.assertEqual(api.group_commit_writer.pool, api.sqlite_pool)
+            self.assertListEqual(os.listdir(shard_dir), [])
+        finally:
+            shutil.rmtree(shard_dir)
+
+        # Branch 8: When the lmdb engine is configured the messages are stored in its environment without group commit
+
+        storage_dir = tempfile.mkdtemp()
+
+        with open(self.config_sample.name, 'w') as fout:
+            fout.write(u"[sqlite]\ndbfile = %s\ngroup_commit = true\n[storage]\nengine = lmdb\npath = %s\n"
+                       u"map_size = 1048576\nsync = false\ncompression = zlib\ncompression_level = 1\n"
+                       u"compression_threshold = 64\n" % (self.dbfile.name, storage_dir))
+
+        try:
+            with patch.dict(u'sha_api.mybottle.sha_api_bottle.os.environ', values=self.os_environ):
+                api = ShaApiBottle(ROUTES)
+
+            self.assertEqual(api.storage.name, u'lmdb')
+            self.assertEqual(api.storage.path, storage_dir)
+            self.assertEqual(api.storage.map_size, 1048576)
+            self.assertFalse(api.storage.sync)
+            self.assertEqual(api.storage.compressor.name, u'zlib')
+            self.assertEqual(api.storage.compressor.threshold, 64)
+            self.assertIsNone(api.group_commit_writer)
+        finally:
+            shutil.rmtree(storage_dir)
+
+        # Branch 9: An unknown storage engine stops the initialization
+
+        with open(self.config_sample.name, 'w') as fout:
+            fout.write(u"[sqlite]\ndbfile = %s\n[storage]\nengine = rocksdb\n" % self.dbfile.name)
+
+        with patch.dict(u'sha_api.mybottle.sha_api_bottle.os.environ', values=self.os_environ):
+            with self.assertRaises(ValueError) as err:
+                ShaApiBottle(ROUTES)
+
+        self.assertEqual(str(err.exception), u'Unknown storage engine rocksdb, expected one of sqlite, lmdb')
+
+        # Branch 10: An unknown compression codec stops the initialization
+
+        with open(self.config_sample.name, 'w') as fout:
+            fout.write(u"[sqlite]\ndbfile = %s\n[storage]\ncompression = lz4\n" % self.dbfile.name)
+
+        with patch.dict(u'sha_api.mybottle.sha_api_bottle.os.environ', values=self.os_environ):
+            with self.assertRaises(ValueError) as err:
+                ShaApiBottle(ROUTES)
+
+        self.assertEqual(str(err.exception), u'Unknown compression lz4, expected auto, none or one of zstd, zlib')
+
+        # Branch 11: Response compression uses the configured content codings and its own cache
+
+        with open(self.config_sample.name, 'w') as fout:
+            fout.write(u"[sqlite]\ndbfile = %s\n[response_compression]\nencodings = deflate, gzip\nmin_size = 2048\n"
+                       u"cache_max_entries = 10\n" % self.dbfile.name)
+
+        with patch.dict(u'sha_api.mybottle.sha_api_bottle.os.environ', values=self.os_environ):
+            api = ShaApiBottle(ROUTES)
+
+        self.assertEqual(api.content_encoder.encodings, (u'gzip', u'deflate'))
+        self.assertEqual(api.content_encoder.min_size, 2048)
+        self.assertEqual(api.content_encoder.cache.max_entries, 10)
+        self.assertIsNot(api.content_encoder.cache, api.message_cache)
+        self.assertIn(u'content_encoder', [plugin.name for plugin in api.plugins])
+
+        with open(self.config_sample.name, 'w') as fout:
+            fout.write(u"[sqlite]\ndbfile = %s\n[response_compression]\nencodings = none\n" % self.dbfile.name)
+
+        with patch.dict(u'sha_api.mybottle.sha_api_bottle.os.environ', values=self.os_environ):
+            self.assertIsNone(ShaApiBottle(ROUTES).content_encoder)
+
+        # Branch 12: An unknown content coding stops the initialization
+
+        with open(self.config_sample.name, 'w') as fout:
+            fout.write(u"[sqlite]\ndbfile = %s\n[response_compression]\nencodings = lzma\n" % self.dbfile.name)
+
+        with patch.dict(u'sha_api.mybottle.sha_api_bottle.os.environ', values=self.os_environ):
+            with self.assertRaises(ValueError) as err:
+                ShaApiBottle(ROUTES)
+
+        self.assertEqual(str(err.exception),
+                         u'Unknown content encoding lzma, expected auto, none or one of zstd, br, gzip, deflate')
+
+        # Branch 13: Admission control is only installed when a limit is configured, with one limit per traffic class
+
+        self.assertIsNone(api.admission)
+        self.assertNotIn(u'admission', [plugin.name for plugin in api.plugins])
+
+        with open(self.config_sample.name, 'w') as fout:
+            fout.write(u"[sqlite]\ndbfile = %s\n[admission]\nmax_writes = 4\nmax_queue = 8\nmax_wait_ms = 250\n"
+                       u"retry_after = 2\nclient_rate = 50\nclient_burst = 100\n" % self.dbfile.name)
+
+        with patch.dict(u'sha_api.mybottle.sha_api_bottle.os.environ', values=self.os_environ):
+            api = ShaApiBottle(ROUTES)
+
+        self.assertEqual(list(api.admission.limits), [u'write'])
+        self.assertDictContainsSubset({u'max_in_flight': 4, u'max_queue': 8, u'max_wait': 0.25},
+                                      api.admission.limits[u'write'].stats())
+        self.assertDictEqual(api.admission.rate_limiter.stats(), {u'burst': 100.0, u'clients': 0, u'rate': 50.0})
+        self.assertEqual(api.admission.retry_after, 2)
+        self.assertIn(u'admission', [plugin.name for plugin in api.plugins])
+
+        # Branch 14: Chunking configures the chunker of the sqlite engine and is rejected for the other engines
+
+        self.assertIsNone(api.chunker)
+
+        with open(self.config_sample.name, 'w') as fout:
+            fout.write(u"[sqlite]\ndbfile = %s\n[storage]\nchunking = true\nchunk_size = 4096\n"
+                       u"chunk_threshold = 16384\n" % self.dbfile.name)
+
+        with patch.dict(u'sha_api.mybottle.sha_api_bottle.os.environ', values=self.os_environ):
+            api = ShaApiBottle(ROUTES)
+
+        self.assertIs(api.storage.chunker, api.chunker)
+        self.assertEqual((api.chunker.chunk_size, api.chunker.threshold), (4096, 16384))
+
+        with open(self.config_sample.name, 'w') as fout:
+            fout.write(u"[sqlite]\ndbfile = %s\n[storage]\nengine = lmdb\nchunking = true\n" % self.dbfile.name)
+
+        with patch.dict(u'sha_api.mybottle.sha_api_bottle.os.environ', values=self.os_environ):
+            with self.assertRaises(ValueError) as err:
+                ShaApiBottle(ROUTES)
+
+        self.assertEqual(str(err.exception), u'Chunking is only supported by the sqlite storage engine')
+
+        # Branch 15: A primary appends to a change log and a follower installs the replica plugin and its follower
+
+        self.assertIsNone(api.changelog)
+        self.assertIsNone(api.follower)
+
+        changelog_path = self.dbfile.name + u'.changes'
+        state_path = self.dbfile.name + u'.replica.json'
+
+        with open(self.config_sample.name, 'w') as fout:
+            fout.write(u"[sqlite]\ndbfile = %s\n[replication]\nchangelog = true\nchangelog_path = %s\n"
+                       u"primary = http://10.0.0.1:8080\nstate_file = %s\nbatch_size = 50\npoll_interval_ms = 500\n"
+                       u"write_mode = forward\n" % (self.dbfile.name, changelog_path, state_path))
+
+        with patch.dict(u'sha_api.mybottle.sha_api_bottle.os.environ', values=self.os_environ):
+            api = ShaApiBottle(ROUTES)
+
+        self.assertIs(api.storage.changelog, api.changelog)
+        self.assertEqual(api.changelog.path, changelog_path)
+        self.assertIs(api.follower.storage, api.storage)
+        self.assertEqual((api.follower.batch_size, api.follower.poll_interval, api.follower.state_path),
+                         (50, 0.5, state_path))
+        self.assertEqual([plugin for plugin in api.plugins if plugin.name == u'replica'][0].mode, u'forward')
+
+        api.changelog.close()
+        os.remove(changelog_path)
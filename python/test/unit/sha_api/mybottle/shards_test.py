@@ -0,0 +1,219 @@
+"""
+The `test.unit.sha_api.mybottle.shards_test` module provides unit tests for the sharded storage mode in
+`sha_api.mybottle.shards`.
+
+Classes:
+    TestShards: A unit test class for the `ShardedSqlitePool`, `ShardedConnection` and `ShardedGroupCommitWriter`
+                classes and the `reshard` and `shard_index` methods.
+"""
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from mock import MagicMock
+from sha_api.mybottle.shards import reshard, shard_index, ShardedGroupCommitWriter, ShardedSqlitePool
+from sha_api.schema import create_schema
+from sha_api.storage.chunking import Chunker
+from sha_api.storage.sqlite_engine import SqliteStorage
+from test.unit.sha_api.storage.conformance import digest
+
+class TestShards(unittest.TestCase):
+    """
+    A unit test class for the `ShardedSqlitePool`, `ShardedConnection` and `ShardedGroupCommitWriter` classes and the
+    `reshard` and `shard_index` methods.
+
+    Methods:
+        setUp: Unit test initialization.
+        tearDown: Removes the shard directory.
+        digests: Returns the sorted digests stored in a shard.
+        test_reshard: Tests that the rows of a database are copied into the shards that store them.
+        test_shard_index: Tests that keys are routed to equal ranges of their first four hex characters.
+        test_sharded_pool: Tests that shards are opened on first use and commit the changes of a request.
+        test_sharded_writer: Tests that submitted rows are group committed by the writers of their shards.
+    """
+
+    def setUp(self):
+        """
+        Initializes the unit test global configs
+        """
+
+        self.maxDiff = None # pylint: disable=invalid-name
+        self.shard_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """
+        Removes the shard directory.
+        """
+
+        shutil.rmtree(self.shard_dir)
+
+    def digests(self, pool, index):
+        """
+        Returns the sorted digests stored in the `sha_api` table of a shard.
+        """
+
+        return sorted(row[0] for row in pool.pool(index).connection().execute(u'SELECT digest FROM sha_api'))
+
+    def test_reshard(self):
+        """
+        Tests that the rows of a database are copied into the shards that store them.
+        """
+
+        dbfile = os.path.join(self.shard_dir, u'sha_api.db')
+        db_con = sqlite3.connect(dbfile)
+        create_schema(db_con)
+
+        with db_con:
+            db_con.executemany(u'INSERT INTO sha_api (digest, message) VALUES (?, ?)',
+                               [(u'00AA', u'a'), (u'7FFF', u'b'), (u'8000', u'c'), (u'FFFF', u'd')])
+            db_con.execute(u'INSERT INTO sha_api_blobs (digest, blob_id, size) VALUES (?, ?, ?)',
+                           (u'C000', u'0123abcd', 3))
+            db_con.execute(u'INSERT INTO sha_api_segments (blob_id, seq, data) VALUES (?, ?, ?)',
+                           (u'0123abcd', 0, sqlite3.Binary(b'raw')))
+
+        db_con.close()
+
+        # Branch 1: Test that the messages, blobs and segments of a single database are routed to their shards
+
+        logs = []
+
+        self.assertEqual(reshard([dbfile], self.shard_dir, 2, batch_size=2, log=logs.append), 5)
+        self.assertIn(u'Copied 4 sha_api rows from %s' % dbfile, logs)
+
+        pool = ShardedSqlitePool(self.shard_dir, 2)
+
+        self.assertListEqual(self.digests(pool, 0), [u'00AA', u'7FFF'])
+        self.assertListEqual(self.digests(pool, 1), [u'8000', u'FFFF'])
+        self.assertEqual(pool.pool(1).connection().execute(u'SELECT blob_id FROM sha_api_blobs').fetchone()[0],
+                         u'0123abcd')
+        self.assertEqual(bytes(pool.pool(0).connection().execute(u'SELECT data FROM sha_api_segments').fetchone()[0]),
+                         b'raw')
+
+        # Branch 2: Test that the shards of one shard count are resharded into another
+
+        self.assertEqual(reshard(pool.paths, self.shard_dir, 4), 5)
+
+        pool = ShardedSqlitePool(self.shard_dir, 4)
+
+        self.assertListEqual([self.digests(pool, index) for index in range(4)],
+                             [[u'00AA'], [u'7FFF'], [u'8000'], [u'FFFF']])
+
+        # Branch 3: Test that the shards being read can not be written
+
+        with self.assertRaises(AssertionError):
+            reshard(pool.paths, self.shard_dir, 4)
+
+        # Branch 4: Test that chunked messages are copied with the chunks they refer to in each of their shards
+
+        source = SqliteStorage(ShardedSqlitePool(os.path.join(self.shard_dir, u'chunked'), 1),
+                               chunker=Chunker(chunk_size=256, threshold=1024))
+        messages = dict((digest(message), message) for message in
+                        [u''.join(u'%d %s\n' % (line, version) for line in range(500)) for version in u'abcd'])
+
+        source.put_many(sorted(messages.items()))
+        source.close()
+
+        self.assertEqual(reshard(source.pool.paths, os.path.join(self.shard_dir, u'rechunked'), 4), 4)
+
+        target = SqliteStorage(ShardedSqlitePool(os.path.join(self.shard_dir, u'rechunked'), 4))
+
+        self.assertDictEqual(target.get_many(list(messages)), messages)
+        self.assertDictEqual(target.collect_garbage(), {u'chunk_bytes': 0, u'chunks': 0, u'refs': 0})
+
+        target.close()
+
+    def test_shard_index(self):
+        """
+        Tests that keys are routed to equal ranges of their first four hex characters.
+        """
+
+        self.assertListEqual([shard_index(key, 4) for key in (u'0000', u'3FFF', u'4000', u'BFFF', u'C000', u'ffff')],
+                             [0, 0, 1, 2, 3, 3])
+        self.assertEqual(shard_index(u'A' * 64, 1), 0)
+        self.assertEqual(shard_index(u'A' * 64, 65536), 0xAAAA)
+
+        # Prefixes are routed like the smallest digest that starts with them and other keys to the first shard
+
+        self.assertEqual(shard_index(u'C', 4), 3)
+        self.assertEqual(shard_index(u'not hex', 4), 0)
+        self.assertEqual(shard_index(u'', 4), 0)
+
+    def test_sharded_pool(self):
+        """
+        Tests that shards are opened on first use and commit the changes of a request.
+        """
+
+        pool = ShardedSqlitePool(os.path.join(self.shard_dir, u'shards'), 4)
+
+        # Branch 1: Test that no shard is opened until it is used
+
+        self.assertFalse(os.path.exists(pool.directory))
+
+        db = pool.connection() # pylint: disable=invalid-name
+        shard_db = db.shard(u'C0FFEE')
+
+        self.assertListEqual(os.listdir(pool.directory), [u'sha_api-0003-of-0004.db'])
+        self.assertIs(db.shard(u'FFFF'), shard_db)
+        self.assertIs(pool.shard_pool(u'C0FFEE'), pool.pool(3))
+
+        # Branch 2: Test that the changes of the request are committed or rolled back in every shard it used
+
+        db.shard(u'00').execute(u'INSERT INTO sha_api (digest, message) VALUES (?, ?)', (u'00', u'a'))
+        shard_db.execute(u'INSERT INTO sha_api (digest, message) VALUES (?, ?)', (u'FF', u'b'))
+        db.commit()
+
+        shard_db.execute(u'INSERT INTO sha_api (digest, message) VALUES (?, ?)', (u'FE', u'c'))
+        db.rollback()
+
+        self.assertListEqual(self.digests(pool, 0), [u'00'])
+        self.assertListEqual(self.digests(pool, 3), [u'FF'])
+
+        pool.close_all()
+
+    def test_sharded_writer(self):
+        """
+        Tests that submitted rows are group committed by the writers of their shards.
+        """
+
+        pool = ShardedSqlitePool(self.shard_dir, 2)
+        writer = ShardedGroupCommitWriter(pool, max_batch_size=16)
+
+        # Branch 1: Test that the results of the rows of each shard are returned in the submitted order
+
+        self.assertListEqual(writer.submit([(u'FF', u'a'), (u'00', u'b'), (u'FE', u'c')]), [True, True, True])
+        self.assertListEqual(writer.submit([(u'01', u'd'), (u'FF', u'a')]), [True, False])
+        self.assertListEqual(self.digests(pool, 0), [u'00', u'01'])
+        self.assertListEqual(self.digests(pool, 1), [u'FE', u'FF'])
+
+        # Branch 2: Test that the counters of the shard writers are summed
+
+        stats = writer.stats()
+
+        self.assertEqual(stats[u'requests'], 4)
+        self.assertEqual(stats[u'rows'], 5)
+        self.assertEqual(stats[u'commits'], 4)
+        self.assertEqual(stats[u'batch_rows_histogram'][u'2'], 1)
+        self.assertEqual(stats[u'avg_batch_rows'], 1.25)
+
+        # Branch 3: Test that the rows are queued on every shard before the request waits on any of them, and that the
+        # error of a shard is raised once every shard was waited on
+
+        calls = []
+        shard_writers = writer._writers = [MagicMock(), MagicMock()] # pylint: disable=protected-access
+
+        for index, shard_writer in enumerate(shard_writers):
+            shard_writer.queue.side_effect = lambda rows, index=index: calls.append((u'queue', index)) or index
+            shard_writer.wait.side_effect = lambda index: calls.append((u'wait', index)) or [True]
+
+        self.assertListEqual(writer.submit([(u'FF', u'a'), (u'00', u'b')]), [True, True])
+        self.assertListEqual(calls, [(u'queue', 1), (u'queue', 0), (u'wait', 1), (u'wait', 0)])
+
+        shard_writers[1].wait.side_effect = sqlite3.OperationalError(u'disk I/O error')
+
+        with self.assertRaises(sqlite3.OperationalError):
+            writer.submit([(u'FF', u'a'), (u'00', u'b')])
+
+        self.assertEqual(shard_writers[0].wait.call_count, 2)
@@ -0,0 +1,206 @@
+"""
+The `test.unit.sha_api.mybottle.sqlite_pool_test` module provides unit tests for the `SqlitePool` and
+`SqlitePoolPlugin` classes in `sha_api.mybottle.sqlite_pool`.
+
+Classes:
+    TestSqlitePool: A unit test class for the `SqlitePool` and `SqlitePoolPlugin` classes.
+"""
+
+import sqlite3
+import tempfile
+import threading
+import unittest
+
+import bottle
+
+from mock import MagicMock, patch
+from sha_api.mybottle.sqlite_pool import GeventDbExecutor, SqlitePool, SqlitePoolPlugin
+
+class ThreadExecutor(object): # pylint: disable=too-few-public-methods
+    """
+    A test executor that runs each function on a new thread and waits for it.
+    """
+
+    def __init__(self):
+        self.threads = []
+
+    def run(self, func):
+        """
+        Runs the function on a new thread and returns its result.
+        """
+
+        results = []
+        thread = threading.Thread(target=lambda: results.append(func()))
+        thread.start()
+        thread.join()
+        self.threads.append(thread)
+
+        return results[0]
+
+class TestSqlitePool(unittest.TestCase):
+    """
+    A unit test class for the `SqlitePool` and `SqlitePoolPlugin` classes.
+
+    Methods:
+        setUp: Unit test initialization.
+        test_connection: Tests that connections are reused per thread and opened with the configured PRAGMAs.
+        test_gevent_executor: Tests that the gevent executor runs functions on a thread pool.
+        test_executor_plugin: Tests that callbacks run on the executor with the request bound and the response copied
+                              back.
+        test_plugin: Tests that the plugin passes the pooled connection and commits or rolls back around the callback.
+    """
+
+    def setUp(self):
+        """
+        Initializes the unit test global configs
+        """
+
+        self.maxDiff = None # pylint: disable=invalid-name
+        self.dbfile = tempfile.NamedTemporaryFile(delete=False)
+
+    def test_connection(self):
+        """
+        Tests that connections are reused per thread and opened with the configured PRAGMAs.
+        """
+
+        pool = SqlitePool(self.dbfile.name, pragmas=((u'journal_mode', u'WAL'), (u'busy_timeout', 1234)))
+
+        # Branch 1: Test that the same thread always gets the same connection with the PRAGMAs applied
+
+        db_con = pool.connection()
+
+        self.assertTrue(pool.connection() is db_con)
+        self.assertEqual(db_con.execute(u'PRAGMA journal_mode').fetchone()[0], u'wal')
+        self.assertEqual(db_con.execute(u'PRAGMA busy_timeout').fetchone()[0], 1234)
+
+        # Branch 2: Test that another thread gets its own connection
+
+        thread_connections = []
+        thread = threading.Thread(target=lambda: thread_connections.append(pool.connection()))
+        thread.start()
+        thread.join()
+
+        self.assertFalse(thread_connections[0] is db_con)
+
+        # Branch 3: Test that closing the pool closes every connection and the next use opens a new one
+
+        pool.close_all()
+
+        with self.assertRaises(sqlite3.ProgrammingError):
+            db_con.execute(u'SELECT 1')
+
+        self.assertFalse(pool.connection() is db_con)
+
+        # Branch 4: Test that a forked process does not reuse the connections of its parent
+
+        db_con = pool.connection()
+
+        with patch(u'sha_api.mybottle.sqlite_pool.os.getpid') as getpid:
+            getpid.return_value = -1
+
+            self.assertFalse(pool.connection() is db_con)
+
+    def test_plugin(self):
+        """
+        Tests that the plugin passes the pooled connection and commits or rolls back around the callback.
+        """
+
+        db_con = MagicMock(spec=sqlite3.Connection)
+        pool = MagicMock()
+        pool.connection.return_value = db_con
+        plugin = SqlitePoolPlugin(pool)
+        route = MagicMock()
+
+        # Branch 1: Test that callbacks without a db argument are returned unchanged
+
+        callback = MagicMock()
+        route.get_callback_args.return_value = [u'digest']
+
+        self.assertTrue(plugin.apply(callback, route) is callback)
+
+        # Branch 2: Test that the connection is passed to the callback and committed afterwards
+
+        route.get_callback_args.return_value = [u'digest', u'db']
+        callback.return_value = {u'message': u'foobar'}
+
+        self.assertDictEqual(plugin.apply(callback, route)(u'digest'), {u'message': u'foobar'})
+        callback.assert_called_once_with(u'digest', db=db_con)
+        self.assertEqual(db_con.commit.call_count, 1)
+
+        # Branch 3: Test that HTTP responses raised by the callback are committed and re-raised
+
+        callback.side_effect = bottle.HTTPResponse(status=302)
+
+        with self.assertRaises(bottle.HTTPResponse):
+            plugin.apply(callback, route)(u'digest')
+
+        self.assertEqual(db_con.commit.call_count, 2)
+
+        # Branch 4: Test that any other exception rolls back the connection and is re-raised
+
+        callback.side_effect = Exception(u'callback went foobar')
+
+        with self.assertRaises(Exception) as err:
+            plugin.apply(callback, route)(u'digest')
+
+        self.assertEqual(str(err.exception), u'callback went foobar')
+        self.assertEqual(db_con.rollback.call_count, 1)
+
+    def test_gevent_executor(self):
+        """
+        Tests that the gevent executor runs functions on a thread pool.
+        """
+
+        try:
+            import gevent # pylint: disable=unused-variable
+        except ImportError: # pragma: no cover
+            self.skipTest(u'gevent is not installed')
+
+        executor = GeventDbExecutor(max_threads=2)
+
+        # Branch 1: Test that the result of the function is returned from another thread
+
+        self.assertNotEqual(executor.run(threading.current_thread).ident, threading.current_thread().ident)
+
+        # Branch 2: Test that exceptions raised by the function are re-raised
+
+        def fail():
+            """
+            Raises an exception.
+            """
+
+            raise ValueError(u'executor went foobar')
+
+        with self.assertRaises(ValueError):
+            executor.run(fail)
+
+    def test_executor_plugin(self):
+        """
+        Tests that callbacks run on the executor with the request bound and the response copied back.
+        """
+
+        pool = SqlitePool(self.dbfile.name)
+        executor = ThreadExecutor()
+        plugin = SqlitePoolPlugin(pool, executor=executor)
+        route = MagicMock()
+        route.get_callback_args.return_value = [u'digest', u'db']
+        callback_threads = []
+
+        def callback(digest, db): # pylint: disable=invalid-name
+            """
+            Records the thread it runs on and builds a 404 response from the bound request.
+            """
+
+            callback_threads.append(threading.current_thread())
+            bottle.response.status = 404
+            bottle.response.set_header(u'X-Digest', digest)
+
+            return {u'path': bottle.request.path, u'row': db.execute(u'SELECT 1').fetchone()[0]}
+
+        bottle.request.bind({u'PATH_INFO': u'/messages/foobar'})
+        bottle.response.bind()
+
+        self.assertDictEqual(plugin.apply(callback, route)(u'foobar'), {u'path': u'/messages/foobar', u'row': 1})
+        self.assertTrue(callback_threads[0] is executor.threads[0])
+        self.assertEqual(bottle.response.status_code, 404)
+        self.assertEqual(bottle.response.get_header(u'X-Digest'), u'foobar')
@@ -7,11 +7,27 @@ Classes:
 """
 
 import hashlib
+import json
+import shutil
 import sqlite3
+import tempfile
 import unittest
+import zlib
 
+from StringIO import StringIO
+
+from bottle import ConfigDict, HTTPError # pylint: disable=no-name-in-module
 from mock import MagicMock, patch
-from sha_api.route_handlers.messages import add_message, retrieve_message
+from sha_api.mybottle.content_encoding import get_content_encoder
+from sha_api.mybottle.counters import Counters
+from sha_api.mybottle.message_cache import MessageCache
+from sha_api.mybottle.serializers import get_serializer
+from sha_api.mybottle.shards import ShardedSqlitePool
+from sha_api.route_handlers.messages import add_message, add_messages, add_raw_message, retrieve_message, \
+                                           retrieve_messages, retrieve_raw_message
+from sha_api.schema import create_schema
+from sha_api.storage.engine import StorageEngine
+from sha_api.storage.sqlite_engine import SqliteStorage
 
 import sha_api
 
@@ -22,6 +38,15 @@ class TestMessagesEndpoints(unittest.TestCase):
     Methods:
         setUp: Unit test initialization.
         test_add_message: Tests that we can properly add a message or get the expected error response.
+        test_add_messages: Tests that we can properly add a batch of messages or get the expected error responses.
+        test_add_raw_message: Tests that we can properly stream a raw message into the db or get the expected error
+                              response.
+        test_retrieve_message: Tests that we can properly retrieve a message or get the expected error response.
+        test_retrieve_messages: Tests that we can properly retrieve a list of messages or get the expected error
+                                response.
+        test_retrieve_raw_message: Tests that we can properly stream a raw message from the db or get the expected
+                                   error response.
+        test_sharded_messages: Tests that messages are stored in and retrieved from the shards of their digests.
     """
 
     def setUp(self):
@@ -45,7 +70,7 @@ class TestMessagesEndpoints(unittest.TestCase):
 
         message_request.json = None
 
-        self.assertDictEqual(add_message(MagicMock(spec=sqlite3.Connection)),
+        self.assertDictEqual(add_message(MagicMock(spec=StorageEngine)),
                              {u'err_msg': u'Invalid content type, expected JSON'})
         self.assertEqual(message_response.status, 400)
 
@@ -56,7 +81,7 @@ class TestMessagesEndpoints(unittest.TestCase):
 
         message_request.json = {u'message': None}
 
-        self.assertDictEqual(add_message(MagicMock(spec=sqlite3.Connection)),
+        self.assertDictEqual(add_message(MagicMock(spec=StorageEngine)),
                              {u'err_msg': u'Invalid JSON request, no message key found'})
         self.assertEqual(message_response.status, 400)
 
@@ -66,10 +91,10 @@ class TestMessagesEndpoints(unittest.TestCase):
         # Branch 3: Test that we get a 500 response when we fail to insert record into db.
 
         message_request.json = {u'message': u'foobar'}
-        db_mock = MagicMock(spec=sqlite3.Connection)
-        db_mock.execute.side_effect = Exception(u'insert went foobar')
+        storage_mock = MagicMock(spec=StorageEngine)
+        storage_mock.put.side_effect = Exception(u'insert went foobar')
 
-        self.assertDictEqual(add_message(db_mock),
+        self.assertDictEqual(add_message(storage_mock),
                              {u'err_msg': u'Failed to add message and its SHA256 digest to database'})
         self.assertEqual(message_response.status, 500)
 
@@ -79,9 +104,345 @@ class TestMessagesEndpoints(unittest.TestCase):
         # Branch 4: Test that we get the expected response back when there is no error
 
         message_request.json = {u'message': u'foobar'}
+        message_request.app.write_counters = Counters(u'duplicates', u'duplicates_cached', u'stored')
+        storage_mock = MagicMock(spec=StorageEngine)
+        storage_mock.put.return_value = True
+
+        self.assertDictEqual(add_message(storage_mock),
+                             {u'digest': hashlib.sha256(u'foobar').hexdigest().upper(), u'stored': True})
+        storage_mock.put.assert_called_once_with(hashlib.sha256(u'foobar').hexdigest().upper(), u'foobar')
+
+        message_request.reset()
+        message_response.reset()
+
+        # Branch 5: Test that a message that is already stored is reported as not newly stored
+
+        storage_mock = MagicMock(spec=StorageEngine)
+        storage_mock.put.return_value = False
+
+        self.assertDictEqual(add_message(storage_mock),
+                             {u'digest': hashlib.sha256(u'foobar').hexdigest().upper(), u'stored': False})
+        self.assertDictEqual(message_request.app.write_counters.snapshot(),
+                             {u'duplicates': 1, u'duplicates_cached': 0, u'stored': 1})
+
+        message_request.reset()
+        message_response.reset()
+
+        # Branch 6: Test that the added message is put in the cache and a cached message skips the db entirely
+
+        message_request.json = {u'message': u'foobar'}
+        cache = MessageCache()
+
+        add_message(MagicMock(spec=StorageEngine), cache)
+
+        self.assertEqual(cache.get(hashlib.sha256(u'foobar').hexdigest().upper()), u'foobar')
+
+        storage_mock = MagicMock(spec=StorageEngine)
+
+        self.assertDictEqual(add_message(storage_mock, cache),
+                             {u'digest': hashlib.sha256(u'foobar').hexdigest().upper(), u'stored': False})
+        self.assertFalse(storage_mock.put.called)
+        self.assertEqual(message_request.app.write_counters.snapshot()[u'duplicates_cached'], 1)
+
+        message_request.reset()
+        message_response.reset()
 
-        self.assertDictEqual(add_message(MagicMock(spec=sqlite3.Connection)),
-                             {u'digest': hashlib.sha256(u'foobar').hexdigest().upper()})
+        # Branch 7: Test that the request is decoded by the serializer when one is set
+
+        message_request.app.write_counters = Counters(u'duplicates', u'duplicates_cached', u'stored')
+        message_request.content_type = u'application/json; charset=utf-8'
+        message_request.MEMFILE_MAX = 64
+        serializer = get_serializer(u'json')
+        storage_mock = MagicMock(spec=StorageEngine)
+        storage_mock.put.return_value = True
+
+        message_request.body = StringIO(json.dumps({u'message': u'foobar'}))
+
+        self.assertDictEqual(add_message(storage_mock, serializer=serializer),
+                             {u'digest': hashlib.sha256(u'foobar').hexdigest().upper(), u'stored': True})
+
+        for body, status in ((u'not json', 400), (json.dumps({u'message': u'x' * 64}), 413)):
+            message_request.body = StringIO(body)
+
+            with self.assertRaises(HTTPError) as err:
+                add_message(storage_mock, serializer=serializer)
+
+            self.assertEqual(err.exception.status_code, status)
+
+        message_request.content_type = u'text/plain'
+
+        self.assertDictEqual(add_message(storage_mock, serializer=serializer),
+                             {u'err_msg': u'Invalid content type, expected JSON'})
+        self.assertEqual(message_response.status, 400)
+
+        message_request.reset()
+        message_response.reset()
+
+    @patch(u'sha_api.route_handlers.messages.request')
+    @patch(u'sha_api.route_handlers.messages.response')
+    def test_add_messages(self, message_response, message_request):
+        """
+        Tests that we can properly add a batch of messages or get the expected error responses.
+        """
+
+        self.assertTrue(sha_api.route_handlers.messages.request is message_request)
+        self.assertTrue(sha_api.route_handlers.messages.response is message_response)
+
+        foo_digest = hashlib.sha256(u'foo').hexdigest().upper()
+        bar_digest = hashlib.sha256(u'bar').hexdigest().upper()
+
+        message_request.app.config = ConfigDict().load_dict({u'sha_api': {u'max_batch_size': u'3'}})
+
+        # Branch 1: Test that we get a 400 response with an invalid content type response
+
+        message_request.content_type = u'text/plain'
+
+        self.assertDictEqual(add_messages(MagicMock(spec=StorageEngine)),
+                             {u'err_msg': u'Invalid content type, expected JSON or NDJSON'})
+        self.assertEqual(message_response.status, 400)
+
+        message_request.reset()
+        message_response.reset()
+
+        # Branch 2: Test that we get a 400 response when the JSON body is not an array
+
+        message_request.content_type = u'application/json; charset=utf-8'
+        message_request.body = StringIO(json.dumps({u'message': u'foo'}))
+
+        self.assertDictEqual(add_messages(MagicMock(spec=StorageEngine)),
+                             {u'err_msg': u'Invalid JSON request, expected an array of messages'})
+        self.assertEqual(message_response.status, 400)
+
+        message_request.reset()
+        message_response.reset()
+
+        # Branch 3: Test that we get a 413 response when the batch is larger than the configured maximum
+
+        message_request.content_type = u'application/json'
+        message_request.body = StringIO(json.dumps([{u'message': u'foo'}] * 4))
+
+        self.assertDictEqual(add_messages(MagicMock(spec=StorageEngine)),
+                             {u'err_msg': u'Too many messages in batch, the maximum is 3'})
+        self.assertEqual(message_response.status, 413)
+
+        message_request.reset()
+        message_response.reset()
+
+        # Branch 4: Test that we get a 500 response when we fail to insert the records into db
+
+        message_request.content_type = u'application/json'
+        message_request.body = StringIO(json.dumps([{u'message': u'foo'}]))
+        storage_mock = MagicMock(spec=StorageEngine)
+        storage_mock.put_many.side_effect = Exception(u'insert went foobar')
+
+        self.assertDictEqual(add_messages(storage_mock),
+                             {u'err_msg': u'Failed to add messages and their SHA256 digests to database'})
+        self.assertEqual(message_response.status, 500)
+
+        message_request.reset()
+        message_response.reset()
+
+        # Branch 5: Test that valid items are stored with one put_many and invalid items are reported in order
+
+        message_request.content_type = u'application/json'
+        message_request.body = StringIO(json.dumps([{u'message': u'foo'}, {u'message': None}, {u'message': u'bar'}]))
+        message_request.app.write_counters = Counters(u'duplicates', u'duplicates_cached', u'stored')
+        storage_mock = MagicMock(spec=StorageEngine)
+        storage_mock.put_many.return_value = [True, True]
+
+        self.assertDictEqual(add_messages(storage_mock),
+                             {u'results': [{u'digest': foo_digest, u'stored': True},
+                                           {u'err_msg': u'Invalid JSON request, no message key found'},
+                                           {u'digest': bar_digest, u'stored': True}]})
+        storage_mock.put_many.assert_called_once_with([(foo_digest, u'foo'), (bar_digest, u'bar')])
+
+        message_request.reset()
+        message_response.reset()
+
+        # Branch 6: Test that the rows the storage engine did not newly store are reported as duplicates
+
+        message_request.content_type = u'application/json'
+        message_request.body = StringIO(json.dumps([{u'message': u'foo'}, {u'message': u'bar'}, {u'message': u'bar'}]))
+        message_request.app.write_counters = Counters(u'duplicates', u'duplicates_cached', u'stored')
+        storage_mock = MagicMock(spec=StorageEngine)
+        storage_mock.put_many.return_value = [False, True, False]
+
+        self.assertDictEqual(add_messages(storage_mock),
+                             {u'results': [{u'digest': foo_digest, u'stored': False},
+                                           {u'digest': bar_digest, u'stored': True},
+                                           {u'digest': bar_digest, u'stored': False}]})
+        storage_mock.put_many.assert_called_once_with([(foo_digest, u'foo'), (bar_digest, u'bar'),
+                                                       (bar_digest, u'bar')])
+        self.assertDictEqual(message_request.app.write_counters.snapshot(),
+                             {u'duplicates': 2, u'duplicates_cached': 0, u'stored': 1})
+
+        message_request.reset()
+        message_response.reset()
+
+        # Branch 7: Test that NDJSON bodies are accepted and unparseable lines are reported per item
+
+        message_request.content_type = u'application/x-ndjson'
+        message_request.body = StringIO(u'{"message": "foo"}\n\nnot json\n[1]\n')
+
+        storage_mock = MagicMock(spec=StorageEngine)
+        storage_mock.put_many.return_value = [True]
+
+        self.assertDictEqual(add_messages(storage_mock),
+                             {u'results': [{u'digest': foo_digest, u'stored': True},
+                                           {u'err_msg': u'Invalid JSON item, expected a message object'},
+                                           {u'err_msg': u'Invalid JSON item, expected a message object'}]})
+
+        message_request.reset()
+        message_response.reset()
+
+        # Branch 8: Test that a batch without any valid items does not touch the storage engine
+
+        message_request.content_type = u'application/json'
+        message_request.body = StringIO(json.dumps([{u'message': 1}]))
+        storage_mock = MagicMock(spec=StorageEngine)
+
+        self.assertDictEqual(add_messages(storage_mock),
+                             {u'results': [{u'err_msg': u'Invalid message, expected a UTF-8 string'}]})
+        self.assertFalse(storage_mock.put_many.called)
+
+        message_request.reset()
+        message_response.reset()
+
+        # Branch 9: Test that the negative cache entries of added messages are cleared without caching the batch
+
+        message_request.content_type = u'application/json'
+        message_request.body = StringIO(json.dumps([{u'message': u'foo'}]))
+        cache = MessageCache()
+        cache.put_missing(foo_digest)
+        storage_mock = MagicMock(spec=StorageEngine)
+        storage_mock.put_many.return_value = [True]
+
+        add_messages(storage_mock, cache)
+
+        self.assertFalse(cache.is_missing(foo_digest))
+        self.assertIsNone(cache.get(foo_digest))
+
+        message_request.reset()
+        message_response.reset()
+
+    @patch(u'sha_api.route_handlers.messages.request')
+    @patch(u'sha_api.route_handlers.messages.response')
+    def test_add_raw_message(self, message_response, message_request):
+        """
+        Tests that we can properly stream a raw message into the db or get the expected error response.
+        """
+
+        body = b'x' * 10
+        body_digest = hashlib.sha256(body).hexdigest().upper()
+        db_con = sqlite3.connect(u':memory:')
+        create_schema(db_con)
+        storage_mock = MagicMock(spec=StorageEngine)
+        storage_mock.exists.return_value = False
+
+        # Branch 1: Test that we get a 400 response with an invalid content type
+
+        message_request.content_type = u'application/json'
+
+        self.assertDictEqual(add_raw_message(db_con, storage_mock),
+                             {u'err_msg': u'Invalid content type, expected application/octet-stream'})
+        self.assertEqual(message_response.status, 400)
+
+        message_request.reset()
+        message_response.reset()
+
+        # Branch 2: Test that we get a 411 response when the length of the body cannot be determined
+
+        message_request.content_type = u'application/octet-stream'
+        message_request.content_length = -1
+        message_request.environ = {}
+
+        self.assertDictEqual(add_raw_message(db_con, storage_mock), {u'err_msg': u'Content-Length required'})
+        self.assertEqual(message_response.status, 411)
+
+        message_request.reset()
+        message_response.reset()
+
+        # Branch 3: Test that the body is hashed and stored as segments of the configured chunk size
+
+        message_request.app.config = ConfigDict().load_dict({u'sha_api': {u'stream_chunk_size': u'4'}})
+        message_request.app.write_counters = Counters(u'duplicates', u'duplicates_cached', u'stored')
+        message_request.content_type = u'application/octet-stream'
+        message_request.content_length = len(body)
+        message_request.environ = {u'wsgi.input': StringIO(body)}
+
+        self.assertDictEqual(add_raw_message(db_con, storage_mock),
+                             {u'digest': body_digest, u'size': 10, u'stored': True})
+        self.assertEqual(db_con.execute(u'SELECT COUNT(*) FROM sha_api_segments').fetchone()[0], 3)
+        self.assertEqual(db_con.execute(u'SELECT size FROM sha_api_blobs WHERE digest = ?', (body_digest,)).fetchone(),
+                         (10,))
+
+        # Branch 4: Test that a body that is already stored is reported as not stored and its segments are discarded
+
+        message_request.environ = {u'wsgi.input': StringIO(body)}
+
+        self.assertDictEqual(add_raw_message(db_con, storage_mock),
+                             {u'digest': body_digest, u'size': 10, u'stored': False})
+        self.assertEqual(db_con.execute(u'SELECT COUNT(*) FROM sha_api_segments').fetchone()[0], 3)
+        self.assertDictEqual(message_request.app.write_counters.snapshot(),
+                             {u'duplicates': 1, u'duplicates_cached': 0, u'stored': 1})
+
+        message_request.reset()
+        message_response.reset()
+
+        # Branch 5: Test that we get a 400 response and the segments are discarded when the body is truncated
+
+        message_request.content_type = u'application/octet-stream'
+        message_request.content_length = 20
+        message_request.environ = {u'wsgi.input': StringIO(b'y' * 10)}
+
+        self.assertDictEqual(add_raw_message(db_con, storage_mock),
+                             {u'err_msg': u'Request body ended before its Content-Length'})
+        self.assertEqual(message_response.status, 400)
+        self.assertEqual(db_con.execute(u'SELECT COUNT(*) FROM sha_api_segments').fetchone()[0], 3)
+
+        message_request.reset()
+        message_response.reset()
+
+        # Branch 6: Test that a server terminated input without a length is read to its end
+
+        message_request.content_type = u'application/octet-stream'
+        message_request.content_length = -1
+        message_request.environ = {u'wsgi.input': StringIO(b'z' * 5), u'wsgi.input_terminated': True}
+
+        self.assertDictEqual(add_raw_message(db_con, storage_mock),
+                             {u'digest': hashlib.sha256(b'z' * 5).hexdigest().upper(), u'size': 5, u'stored': True})
+
+        message_request.reset()
+        message_response.reset()
+
+        # Branch 7: Test that we get a 500 response when we fail to write the segments into db
+
+        message_request.content_type = u'application/octet-stream'
+        message_request.content_length = len(body)
+        message_request.environ = {u'wsgi.input': StringIO(body)}
+        db_mock = MagicMock(spec=sqlite3.Connection)
+        db_mock.execute.side_effect = Exception(u'insert went foobar')
+
+        self.assertDictEqual(add_raw_message(db_mock, storage_mock),
+                             {u'err_msg': u'Failed to add message and its SHA256 digest to database'})
+        self.assertEqual(message_response.status, 500)
+
+        message_request.reset()
+        message_response.reset()
+
+        # Branch 8: Test that a body already stored as a JSON message is not stored again
+
+        message_request.app.config = ConfigDict()
+        message_request.app.write_counters = Counters(u'duplicates', u'duplicates_cached', u'stored')
+        message_request.content_type = u'application/octet-stream'
+        message_request.content_length = 3
+        message_request.environ = {u'wsgi.input': StringIO(b'foo')}
+        storage_mock.exists.return_value = True
+
+        self.assertDictEqual(add_raw_message(db_con, storage_mock),
+                             {u'digest': hashlib.sha256(b'foo').hexdigest().upper(), u'size': 3, u'stored': False})
+        storage_mock.exists.assert_called_with(hashlib.sha256(b'foo').hexdigest().upper())
+        self.assertEqual(db_con.execute(u'SELECT COUNT(*) FROM sha_api_blobs').fetchone()[0], 2)
 
         message_request.reset()
         message_response.reset()
@@ -97,13 +458,15 @@ class TestMessagesEndpoints(unittest.TestCase):
         self.assertTrue(sha_api.route_handlers.messages.response is message_response)
 
         digest = hashlib.sha256(u'foobar').hexdigest().upper()
+        message_request.app.config = ConfigDict().load_dict({u'sha_api': {u'cache_max_age': u'60'}})
+        message_request.headers = {}
 
         # Branch 1: Test that we get a 500 response and an error response of failing to retrieve message from db
 
-        db_mock = MagicMock(spec=sqlite3.Connection)
-        db_mock.execute.side_effect = Exception(u'select went foobar')
+        storage_mock = MagicMock(spec=StorageEngine)
+        storage_mock.get.side_effect = Exception(u'select went foobar')
 
-        self.assertDictEqual(retrieve_message(digest, db_mock),
+        self.assertDictEqual(retrieve_message(digest, storage_mock),
                              {u'err_msg': u'Failed to retrieve message for the provided SHA256 digest from database'})
         self.assertEqual(message_response.status, 500)
 
@@ -112,27 +475,465 @@ class TestMessagesEndpoints(unittest.TestCase):
 
         # Branch 2: Test that we get back the expected message when successfully retrieved.
 
-        db_fetch = MagicMock()
-        db_fetch.fetchone.return_value = (u'foobar',)
-        db_mock = MagicMock(spec=sqlite3.Connection)
-        db_mock.execute.return_value = db_fetch
+        storage_mock = MagicMock(spec=StorageEngine)
+        storage_mock.get.return_value = u'foobar'
 
-        self.assertDictEqual(retrieve_message(digest, db_mock),
+        self.assertDictEqual(retrieve_message(digest, storage_mock),
                              {u'message': u'foobar'})
+        storage_mock.get.assert_called_once_with(digest)
+        message_response.set_header.assert_any_call(u'ETag', u'"%s"' % digest)
+        message_response.set_header.assert_any_call(u'Cache-Control', u'public, max-age=60, immutable')
 
         message_request.reset()
         message_response.reset()
 
         # Branch 3: Test that we get the a 404 response and a message not found error when message isnt found
 
-        db_fetch = MagicMock()
-        db_fetch.fetchone.return_value = None
-        db_mock = MagicMock(spec=sqlite3.Connection)
-        db_mock.execute.return_value = db_fetch
+        storage_mock = MagicMock(spec=StorageEngine)
+        storage_mock.get.return_value = None
 
-        self.assertDictEqual(retrieve_message(digest, db_mock),
+        self.assertDictEqual(retrieve_message(digest, storage_mock),
                              {u'err_msg': u'Message not found'})
         self.assertEqual(message_response.status, 404)
+        message_response.set_header.assert_called_with(u'Cache-Control', u'no-cache')
+
+        message_request.reset()
+        message_response.reset()
+
+        # Branch 4: Test that found messages are cached and served from the cache without touching the storage engine
+
+        storage_mock = MagicMock(spec=StorageEngine)
+        storage_mock.get.return_value = u'foobar'
+        cache = MessageCache()
+
+        self.assertDictEqual(retrieve_message(digest.lower(), storage_mock, cache), {u'message': u'foobar'})
+        self.assertDictEqual(retrieve_message(digest, storage_mock, cache), {u'message': u'foobar'})
+        self.assertEqual(storage_mock.get.call_count, 1)
+
+        message_request.reset()
+        message_response.reset()
+
+        # Branch 5: Test that missed digests are answered from the negative cache without touching the storage engine
+
+        storage_mock = MagicMock(spec=StorageEngine)
+        storage_mock.get.return_value = None
+        cache = MessageCache()
+
+        self.assertDictEqual(retrieve_message(digest, storage_mock, cache), {u'err_msg': u'Message not found'})
+        self.assertDictEqual(retrieve_message(digest, storage_mock, cache), {u'err_msg': u'Message not found'})
+        self.assertEqual(message_response.status, 404)
+        self.assertEqual(storage_mock.get.call_count, 1)
+
+        message_request.reset()
+        message_response.reset()
+
+        # Branch 6: Test that a request that has the ETag gets a 304 without touching the cache or the storage engine
+
+        for if_none_match in (u'"%s"' % digest, u'W/"%s"' % digest, u'"foo", "%s"' % digest):
+            storage_mock = MagicMock(spec=StorageEngine)
+            cache = MagicMock(spec=MessageCache)
+            message_request.headers = {u'If-None-Match': if_none_match}
+
+            self.assertEqual(retrieve_message(digest.lower(), storage_mock, cache), u'')
+            self.assertEqual(message_response.status, 304)
+            message_response.set_header.assert_any_call(u'ETag', u'"%s"' % digest)
+            self.assertFalse(storage_mock.get.called)
+            self.assertFalse(cache.get.called)
+
+            message_request.reset()
+            message_response.reset()
+
+        # Branch 7: Test that a request with another ETag gets the message
+
+        storage_mock = MagicMock(spec=StorageEngine)
+        storage_mock.get.return_value = u'foobar'
+        message_request.headers = {u'If-None-Match': u'"%s", *' % digest.lower()}
+
+        self.assertDictEqual(retrieve_message(digest, storage_mock), {u'message': u'foobar'})
+        storage_mock.get.assert_called_once_with(digest)
+
+        message_request.reset()
+        message_response.reset()
+
+        # Branch 8: Test that a large message is sent compressed with the accepted coding and its compressed ETag
+
+        message = u'{"level": "INFO", "msg": "foobar"} ' * 100
+        large_digest = hashlib.sha256(message).hexdigest().upper()
+        encoder = get_content_encoder(u'gzip, deflate', min_size=1024, cache=MessageCache())
+        storage_mock = MagicMock(spec=StorageEngine)
+        storage_mock.get.return_value = message
+        message_request.headers = {u'Accept-Encoding': u'gzip;q=0.5, deflate'}
+
+        body = retrieve_message(large_digest, storage_mock, encoder=encoder)
+
+        self.assertDictEqual(json.loads(zlib.decompress(body)), {u'message': message})
+        message_response.set_header.assert_any_call(u'Vary', u'Accept-Encoding')
+        message_response.set_header.assert_any_call(u'Content-Encoding', u'deflate')
+        message_response.set_header.assert_any_call(u'ETag', u'"%s-deflate"' % large_digest)
+        self.assertEqual(message_response.content_type, u'application/json')
+
+        message_request.reset()
+        message_response.reset()
+
+        # Branch 9: Test that the compressed body is cached and a request with the compressed ETag gets a 304
+
+        self.assertEqual(retrieve_message(large_digest, storage_mock, encoder=encoder), body)
+        self.assertEqual(encoder.stats()[u'deflate_cached'], 1)
+
+        message_request.headers = {u'Accept-Encoding': u'deflate', u'If-None-Match': u'"%s-deflate"' % large_digest}
+
+        self.assertEqual(retrieve_message(large_digest, storage_mock, encoder=encoder), u'')
+        self.assertEqual(message_response.status, 304)
+        message_response.set_header.assert_any_call(u'ETag', u'"%s-deflate"' % large_digest)
+        self.assertEqual(storage_mock.get.call_count, 2)
+
+        message_request.reset()
+        message_response.reset()
+
+        # Branch 10: Test that small messages and requests without an accepted coding are not compressed
+
+        storage_mock = MagicMock(spec=StorageEngine)
+        storage_mock.get.return_value = u'foobar'
+        message_request.headers = {u'Accept-Encoding': u'gzip'}
+
+        self.assertDictEqual(retrieve_message(digest, storage_mock, encoder=encoder), {u'message': u'foobar'})
+
+        storage_mock.get.return_value = message
+        message_request.headers = {u'Accept-Encoding': u'br, identity'}
+
+        self.assertDictEqual(retrieve_message(large_digest, storage_mock, encoder=encoder), {u'message': message})
+        message_response.set_header.assert_called_with(u'Cache-Control', u'public, max-age=60, immutable')
+        message_response.set_header.assert_any_call(u'ETag', u'"%s"' % large_digest)
+
+        message_request.reset()
+        message_response.reset()
+
+        # Branch 11: Test that a prefix of a single digest returns its message with a revalidated Cache-Control
+
+        storage_mock = MagicMock(spec=StorageEngine)
+        storage_mock.find_digests.return_value = [digest]
+        storage_mock.get.return_value = u'foobar'
+        message_request.headers = {}
+
+        self.assertDictEqual(retrieve_message(digest[:8].lower(), storage_mock), {u'message': u'foobar'})
+        storage_mock.find_digests.assert_called_once_with(digest[:8], 10)
+        storage_mock.get.assert_called_once_with(digest)
+        message_response.set_header.assert_any_call(u'Content-Location', u'/messages/%s' % digest)
+        message_response.set_header.assert_called_with(u'Cache-Control', u'no-cache')
+
+        message_request.headers = {u'If-None-Match': u'"%s"' % digest}
+
+        self.assertEqual(retrieve_message(digest[:8], storage_mock), u'')
+        self.assertEqual(message_response.status, 304)
+
+        message_request.reset()
+        message_response.reset()
+
+        # Branch 12: Test that an ambiguous prefix gets a 409 with the candidates and an unknown one a 404
+
+        storage_mock = MagicMock(spec=StorageEngine)
+        storage_mock.find_digests.return_value = [digest, large_digest]
+        message_request.headers = {}
+
+        self.assertDictEqual(retrieve_message(digest[:8], storage_mock),
+                             {u'digests': [digest, large_digest], u'err_msg': u'Ambiguous digest prefix'})
+        self.assertEqual(message_response.status, 409)
+
+        storage_mock.find_digests.return_value = []
+
+        self.assertDictEqual(retrieve_message(digest[:8], storage_mock), {u'err_msg': u'Message not found'})
+        self.assertEqual(message_response.status, 404)
+        self.assertFalse(storage_mock.get.called)
+
+        message_request.reset()
+        message_response.reset()
+
+        # Branch 13: Test that prefixes shorter than the minimum or that are not hex are rejected without a lookup
+
+        message_request.app.config = ConfigDict().load_dict({u'sha_api': {u'min_prefix_length': u'6'}})
+        storage_mock = MagicMock(spec=StorageEngine)
+
+        for prefix in (digest[:5], u'%s-' % digest[:8]):
+            self.assertDictEqual(retrieve_message(prefix, storage_mock),
+                                 {u'err_msg': u'Invalid digest prefix, expected at least 6 hex characters'})
+            self.assertEqual(message_response.status, 400)
+
+        self.assertFalse(storage_mock.find_digests.called)
+
+        message_request.reset()
+        message_response.reset()
+
+        # Branch 14: Test that we get a 500 response when the prefix lookup fails
+
+        storage_mock.find_digests.side_effect = Exception(u'select went foobar')
+
+        self.assertDictEqual(retrieve_message(digest[:8], storage_mock),
+                             {u'err_msg': u'Failed to retrieve message for the provided SHA256 digest from database'})
+        self.assertEqual(message_response.status, 500)
+
+        message_request.reset()
+        message_response.reset()
+
+    @patch(u'sha_api.route_handlers.messages.request')
+    @patch(u'sha_api.route_handlers.messages.response')
+    def test_retrieve_messages(self, message_response, message_request):
+        """
+        Tests that we can properly retrieve a list of messages or get the expected error response.
+        """
+
+        self.assertTrue(sha_api.route_handlers.messages.request is message_request)
+        self.assertTrue(sha_api.route_handlers.messages.response is message_response)
+
+        foo_digest = hashlib.sha256(u'foo').hexdigest().upper()
+        bar_digest = hashlib.sha256(u'bar').hexdigest().upper()
+
+        message_request.app.config = ConfigDict().load_dict({u'sha_api': {u'max_lookup_size': u'3'}})
+
+        # Branch 1: Test that we get a 400 response when the POST body is not a JSON array
+
+        message_request.method = u'POST'
+        message_request.body = StringIO(u'not json')
+
+        self.assertDictEqual(retrieve_messages(MagicMock(spec=StorageEngine)),
+                             {u'err_msg': u'Invalid JSON request, expected an array of digests'})
+        self.assertEqual(message_response.status, 400)
+
+        message_request.reset()
+        message_response.reset()
+
+        # Branch 2: Test that we get a 413 response when more digests than the configured maximum are requested
+
+        message_request.method = u'POST'
+        message_request.body = StringIO(json.dumps([foo_digest] * 4))
+
+        self.assertDictEqual(retrieve_messages(MagicMock(spec=StorageEngine)),
+                             {u'err_msg': u'Too many digests in lookup, the maximum is 3'})
+        self.assertEqual(message_response.status, 413)
+
+        message_request.reset()
+        message_response.reset()
+
+        # Branch 3: Test that we get a 400 response when a digest is not a string
+
+        message_request.method = u'POST'
+        message_request.body = StringIO(json.dumps([1]))
+
+        self.assertDictEqual(retrieve_messages(MagicMock(spec=StorageEngine)),
+                             {u'err_msg': u'Invalid digest, expected a hex string'})
+        self.assertEqual(message_response.status, 400)
+
+        message_request.reset()
+        message_response.reset()
+
+        # Branch 4: Test that we get a 500 response when the select fails
+
+        message_request.method = u'POST'
+        message_request.body = StringIO(json.dumps([foo_digest]))
+        storage_mock = MagicMock(spec=StorageEngine)
+        storage_mock.get_many.side_effect = Exception(u'select went foobar')
+
+        self.assertDictEqual(retrieve_messages(storage_mock),
+                             {u'err_msg': u'Failed to retrieve messages for the provided SHA256 digests from database'})
+        self.assertEqual(message_response.status, 500)
+
+        message_request.reset()
+        message_response.reset()
+
+        # Branch 5: Test that GET query digests are normalized, deduplicated and split into found and missing
+
+        message_request.method = u'GET'
+        message_request.query.getall.return_value = [foo_digest.lower(), foo_digest, bar_digest]
+        storage_mock = MagicMock(spec=StorageEngine)
+        storage_mock.get_many.return_value = {foo_digest: u'foo'}
+
+        self.assertDictEqual(retrieve_messages(storage_mock),
+                             {u'messages': {foo_digest: u'foo'}, u'missing': [bar_digest]})
+        storage_mock.get_many.assert_called_once_with([foo_digest, bar_digest])
+
+        message_request.reset()
+        message_response.reset()
+
+    @patch(u'sha_api.route_handlers.messages.request')
+    @patch(u'sha_api.route_handlers.messages.response')
+    def test_retrieve_raw_message(self, message_response, message_request):
+        """
+        Tests that we can properly stream a raw message from the db or get the expected error response.
+        """
+
+        db_con = sqlite3.connect(u':memory:')
+        create_schema(db_con)
+        db_con.execute(u'INSERT INTO sha_api_blobs (digest, blob_id, size) VALUES (?, ?, ?)', (u'AB', u'blob', 6))
+        db_con.executemany(u'INSERT INTO sha_api_segments (blob_id, seq, data) VALUES (?, ?, ?)',
+                           [(u'blob', 0, sqlite3.Binary(b'foo')), (u'blob', 1, sqlite3.Binary(b'bar'))])
+        storage_mock = MagicMock(spec=StorageEngine)
+        storage_mock.get_stream.return_value = None
+
+        # Branch 1: Test that we get a 500 response when the lookup fails
+
+        db_mock = MagicMock(spec=sqlite3.Connection)
+        db_mock.execute.side_effect = Exception(u'select went foobar')
+
+        self.assertDictEqual(retrieve_raw_message(u'ab', db_mock, storage_mock),
+                             {u'err_msg': u'Failed to retrieve message for the provided SHA256 digest from database'})
+        self.assertEqual(message_response.status, 500)
+
+        message_request.reset()
+        message_response.reset()
+
+        # Branch 2: Test that we get a 404 response when the message isnt found
+
+        self.assertDictEqual(retrieve_raw_message(u'ef', db_con, storage_mock), {u'err_msg': u'Message not found'})
+        self.assertEqual(message_response.status, 404)
+
+        message_request.reset()
+        message_response.reset()
+
+        # Branch 3: Test that a streamed message is returned one segment at a time from the pool of the iterating thread
+
+        message_request.app.sqlite_pool.connection.return_value = db_con
+        message_request.app.db_executor = None
+
+        self.assertEqual(list(retrieve_raw_message(u'ab', db_con, storage_mock)), [b'foo', b'bar'])
+        self.assertEqual(message_response.content_type, u'application/octet-stream')
+        self.assertEqual(message_response.content_length, 6)
+
+        # Branch 4: Test that the segments are read on the executor when one is set
+
+        message_request.app.db_executor = MagicMock()
+        message_request.app.db_executor.run.side_effect = lambda func: func()
+
+        self.assertEqual(b''.join(retrieve_raw_message(u'ab', db_con, storage_mock)), b'foobar')
+        self.assertEqual(message_request.app.db_executor.run.call_count, 3)
+
+        message_request.reset()
+        message_response.reset()
+
+        # Branch 5: Test that a message added as JSON is streamed from the storage engine as its UTF-8 encoding
+
+        storage_mock.get_stream.return_value = (5, iter([b'f\xc3', b'\xb6\xc3\xb6']))
+
+        self.assertEqual(b''.join(retrieve_raw_message(u'cd', db_con, storage_mock)), u'f\xf6\xf6'.encode(u'utf-8'))
+        self.assertEqual(message_response.content_length, 5)
+        storage_mock.get_stream.assert_called_with(u'CD')
+
+        message_request.reset()
+        message_response.reset()
+
+        # Branch 6: Test that a message stored compressed with zlib is sent as stored when deflate is accepted
+
+        message = u'{"level": "INFO", "msg": "foobar"} ' * 100
+        data = zlib.compress(message.encode(u'utf-8'))
+        encoder = get_content_encoder(u'gzip', min_size=1024, cache=MessageCache())
+        storage_mock.get_compressed.return_value = (u'zlib', data)
+        message_request.headers = {u'Accept-Encoding': u'gzip, deflate'}
+
+        self.assertEqual(retrieve_raw_message(u'cd', db_con, storage_mock, encoder), data)
+        storage_mock.get_compressed.assert_called_with(u'CD')
+        message_response.set_header.assert_any_call(u'Vary', u'Accept-Encoding')
+        message_response.set_header.assert_called_with(u'Content-Encoding', u'deflate')
+        self.assertEqual(encoder.stats()[u'gzip_responses'], 0)
+
+        message_request.reset()
+        message_response.reset()
+
+        # Branch 7: Test that it is decompressed and compressed with an encoding of the encoder otherwise
+
+        message_request.headers = {u'Accept-Encoding': u'gzip'}
+
+        body = retrieve_raw_message(u'cd', db_con, storage_mock, encoder)
+
+        self.assertEqual(zlib.decompress(body, 31), message.encode(u'utf-8'))
+        message_response.set_header.assert_called_with(u'Content-Encoding', u'gzip')
+        self.assertEqual(retrieve_raw_message(u'cd', db_con, storage_mock, encoder), body)
+        self.assertEqual(encoder.stats()[u'gzip_cached'], 1)
+
+        message_request.reset()
+        message_response.reset()
+
+        # Branch 8: Test that it is streamed without an Accept-Encoding header and sent uncompressed when small
+
+        message_request.headers = {}
+        storage_mock.get_stream.return_value = (len(message), iter([message.encode(u'utf-8')]))
+
+        self.assertEqual(list(retrieve_raw_message(u'cd', db_con, storage_mock, encoder)), [message.encode(u'utf-8')])
+        message_response.set_header.assert_called_with(u'Vary', u'Accept-Encoding')
+
+        message_request.headers = {u'Accept-Encoding': u'gzip'}
+        storage_mock.get_compressed.return_value = (None, b'foobar')
+
+        self.assertEqual(retrieve_raw_message(u'cd', db_con, storage_mock, encoder), b'foobar')
+        self.assertEqual(encoder.stats()[u'gzip_responses'], 1)
+
+        message_request.reset()
+        message_response.reset()
+
+    @patch(u'sha_api.route_handlers.messages.request')
+    @patch(u'sha_api.route_handlers.messages.response')
+    def test_sharded_messages(self, message_response, message_request):
+        """
+        Tests that messages are stored in and retrieved from the shards of their digests.
+        """
+
+        self.assertTrue(sha_api.route_handlers.messages.request is message_request)
+        self.assertTrue(sha_api.route_handlers.messages.response is message_response)
+
+        shard_dir = tempfile.mkdtemp()
+        pool = ShardedSqlitePool(shard_dir, 4)
+        storage = SqliteStorage(pool)
+        digests = dict((message, hashlib.sha256(message).hexdigest().upper()) for message in (u'foo', u'bar', u'baz'))
+
+        message_request.app.config = ConfigDict()
+        message_request.app.db_executor = None
+        message_request.app.sqlite_pool = pool
+        message_request.app.write_counters = Counters(u'duplicates', u'duplicates_cached', u'stored')
+
+        try:
+            # Branch 1: Test that a message is stored in the shard of its digest and retrieved from it
+
+            message_request.json = {u'message': u'foo'}
+
+            self.assertDictEqual(add_message(storage), {u'digest': digests[u'foo'], u'stored': True})
+            self.assertEqual(pool.shard_pool(digests[u'foo']).connection().execute(
+                u'SELECT message FROM sha_api WHERE digest = ?', (digests[u'foo'],)
+            ).fetchone()[0], u'foo')
+            self.assertDictEqual(retrieve_message(digests[u'foo'], storage), {u'message': u'foo'})
+
+            # Branch 2: Test that a batch is split over the shards and looked up from all of them
+
+            message_request.content_type = u'application/json'
+            message_request.body = StringIO(json.dumps([{u'message': u'foo'}, {u'message': u'bar'},
+                                                        {u'message': u'baz'}]))
+
+            self.assertDictEqual(add_messages(storage), {u'results': [
+                {u'digest': digests[u'foo'], u'stored': False},
+                {u'digest': digests[u'bar'], u'stored': True},
+                {u'digest': digests[u'baz'], u'stored': True}
+            ]})
+            self.assertNotEqual(pool.shard_index(digests[u'foo']), pool.shard_index(digests[u'bar']))
+
+            message_request.method = u'POST'
+            message_request.body = StringIO(json.dumps(sorted(digests.values()) + [u'00' * 32]))
+
+            self.assertDictEqual(retrieve_messages(storage), {
+                u'messages': dict((digest, message) for message, digest in digests.items()),
+                u'missing': [u'00' * 32]
+            })
+
+            # Branch 3: Test that a raw message is indexed in the shard of its digest and streamed from the shard of
+            # its segments
+
+            body = b'raw message'
+            message_request.content_type = u'application/octet-stream'
+            message_request.content_length = len(body)
+            message_request.environ = {u'wsgi.input': StringIO(body)}
+
+            raw_digest = add_raw_message(pool.connection(), storage)[u'digest']
+
+            self.assertEqual(b''.join(retrieve_raw_message(raw_digest, pool.connection(), storage)), body)
+            self.assertEqual(message_response.content_length, len(body))
+        finally:
+            pool.close_all()
+            shutil.rmtree(shard_dir)
 
         message_request.reset()
         message_response.reset()
@@ -0,0 +1,132 @@
+"""
+The `test.unit.sha_api.route_handlers.replication_test` module provides unit tests for the replication endpoint handler
+methods in `sha_api.route_handlers.replication`.
+
+Classes:
+    TestReplicationEndpoints: A unit test class for the replication endpoint handler methods.
+"""
+
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+
+from bottle import ConfigDict # pylint: disable=no-name-in-module
+from mock import MagicMock, patch
+from sha_api.route_handlers.replication import retrieve_changes
+from sha_api.storage.changelog import ChangeLog
+from sha_api.storage.engine import StorageEngine
+
+import sha_api
+
+class TestReplicationEndpoints(unittest.TestCase):
+    """
+    A unit test class for the replication endpoint handler methods.
+
+    Methods:
+        setUp: Unit test initialization.
+        tearDown: Closes the change log and removes its file.
+        test_retrieve_changes: Tests that we can properly retrieve the changes of the change log or get the expected
+                               error response.
+    """
+
+    def setUp(self):
+        """
+        Initializes the unit test global configs
+        """
+
+        self.maxDiff = None # pylint: disable=invalid-name
+        self.changelog_dir = tempfile.mkdtemp()
+        self.changelog = ChangeLog(os.path.join(self.changelog_dir, u'changes.db'))
+
+    def tearDown(self):
+        """
+        Closes the change log and removes its file.
+        """
+
+        self.changelog.close()
+        shutil.rmtree(self.changelog_dir)
+
+    @patch(u'sha_api.route_handlers.replication.request')
+    @patch(u'sha_api.route_handlers.replication.response')
+    def test_retrieve_changes(self, replication_response, replication_request):
+        """
+        Tests that we can properly retrieve the changes of the change log or get the expected error response.
+        """
+
+        self.assertTrue(sha_api.route_handlers.replication.request is replication_request)
+        self.assertTrue(sha_api.route_handlers.replication.response is replication_response)
+
+        messages = dict((hashlib.sha256(message).hexdigest().upper(), message) for message in (u'foo', u'bar', u'bazz'))
+        digests = [hashlib.sha256(message).hexdigest().upper() for message in (u'foo', u'bar', u'bazz')]
+        storage = MagicMock(spec=StorageEngine)
+        storage.get_many.side_effect = lambda requested: dict((digest, messages[digest]) for digest in requested
+                                                              if digest in messages)
+
+        self.changelog.append(digests + [u'F' * 64])
+
+        replication_request.app.changelog = None
+        replication_request.app.config = ConfigDict().load_dict({u'replication': {u'max_batch_bytes': u'6'}})
+        replication_request.app.db_executor = None
+        replication_request.query = {}
+
+        # Branch 1: Test that we get a 404 response when the change log is disabled
+
+        self.assertDictEqual(retrieve_changes(storage), {u'err_msg': u'The change log is disabled'})
+        self.assertEqual(replication_response.status, 404)
+
+        replication_response.reset()
+        replication_request.app.changelog = self.changelog
+
+        # Branch 2: Test that we get a 400 response when after or limit are invalid
+
+        for query in ({u'after': u'x'}, {u'after': u'-1'}, {u'limit': u'0'}, {u'limit': u'10001'}):
+            replication_request.query = query
+
+            self.assertEqual(retrieve_changes(storage)[u'err_msg'][:24], u'Invalid after or limit, ')
+            self.assertEqual(replication_response.status, 400)
+
+            replication_response.reset()
+
+        # Branch 3: Test that the changes stop once their messages add up to max_batch_bytes
+
+        replication_request.query = {}
+
+        self.assertDictEqual(retrieve_changes(storage), {
+            u'changes': [{u'digest': digests[0], u'message': u'foo', u'seq': 1},
+                         {u'digest': digests[1], u'message': u'bar', u'seq': 2}],
+            u'last_seq': 4,
+            u'log_id': self.changelog.log_id
+        })
+
+        # Branch 4: Test that a message that cannot be read is returned as null, and at least one change is returned
+
+        replication_request.query = {u'after': u'2', u'limit': u'5'}
+
+        self.assertListEqual(retrieve_changes(storage)[u'changes'], [
+            {u'digest': digests[2], u'message': u'bazz', u'seq': 3},
+            {u'digest': u'F' * 64, u'message': None, u'seq': 4}
+        ])
+
+        replication_request.app.config = ConfigDict().load_dict({u'replication': {u'max_batch_bytes': u'1'}})
+        replication_request.query = {}
+
+        self.assertEqual(len(retrieve_changes(storage)[u'changes']), 1)
+
+        # Branch 5: Test that the change log is read on the executor in async mode
+
+        replication_request.app.db_executor = MagicMock()
+        replication_request.app.db_executor.run.side_effect = lambda func: func()
+        replication_request.query = {u'after': u'4'}
+
+        self.assertListEqual(retrieve_changes(storage)[u'changes'], [])
+        self.assertEqual(replication_request.app.db_executor.run.call_count, 1)
+
+        # Branch 6: Test that we get a 500 response when the storage engine fails
+
+        replication_request.query = {}
+        storage.get_many.side_effect = IOError(u'disk went foobar')
+
+        self.assertDictEqual(retrieve_changes(storage), {u'err_msg': u'Failed to read the change log'})
+        self.assertEqual(replication_response.status, 500)
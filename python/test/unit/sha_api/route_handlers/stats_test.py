@@ -0,0 +1,225 @@
+"""
+The `test.unit.sha_api.route_handlers.stats_test` module provides unit tests for the stats endpoint handler methods in
+`sha_api.route_handlers.stats`.
+
+Classes:
+    TestStatsEndpoints: A unit test class for the stats endpoint handler methods.
+"""
+
+import unittest
+
+from mock import MagicMock, patch
+from sha_api.mybottle.admission import AdmissionController, ConcurrencyLimit
+from sha_api.mybottle.content_encoding import get_content_encoder
+from sha_api.mybottle.counters import Counters
+from sha_api.mybottle.message_cache import MessageCache
+from sha_api.mybottle.metrics import MetricsRegistry
+from sha_api.route_handlers.stats import admission_stats, cache_stats, encoding_stats, prometheus_metrics, \
+                                        PROMETHEUS_CONTENT_TYPE, replication_stats, write_stats, writer_stats
+
+class TestStatsEndpoints(unittest.TestCase):
+    """
+    A unit test class for the stats endpoint handler methods.
+
+    Methods:
+        test_admission_stats: Tests that the admission control counters are returned when it is enabled.
+        test_cache_stats: Tests that the cache counters are returned.
+        test_encoding_stats: Tests that the response compression counters are returned when it is enabled.
+        test_prometheus_metrics: Tests that the request metrics and stats counters are returned in the Prometheus text
+                                 format.
+        test_replication_stats: Tests that the change log and follower stats are returned when replication is
+                                enabled.
+        test_write_stats: Tests that the write counters and the deduplication hit rate are returned.
+        test_writer_stats: Tests that the group commit writer counters are returned when it is enabled.
+    """
+
+    @patch(u'sha_api.route_handlers.stats.request')
+    def test_admission_stats(self, stats_request):
+        """
+        Tests that the admission control counters are returned when it is enabled.
+        """
+
+        # Branch 1: Test that only the disabled flag is returned without admission control
+
+        stats_request.app.admission = None
+
+        self.assertDictEqual(admission_stats(), {u'enabled': False})
+
+        # Branch 2: Test that the counters and the limits of each traffic class are returned with the enabled flag
+
+        stats_request.app.admission = AdmissionController({u'write': ConcurrencyLimit(1)})
+        stats_request.app.admission.admit(u'write')
+        stats_request.app.admission.admit(u'write')
+
+        stats = admission_stats()
+
+        self.assertDictContainsSubset({u'enabled': True, u'read_admitted': 0, u'write_admitted': 1,
+                                       u'write_shed_queue_full': 1}, stats)
+        self.assertDictContainsSubset({u'in_flight': 1, u'max_in_flight': 1}, stats[u'write'])
+        self.assertNotIn(u'read', stats)
+
+    def test_cache_stats(self):
+        """
+        Tests that the cache counters are returned.
+        """
+
+        cache = MessageCache()
+
+        cache.put(u'A', u'aaaa')
+        cache.get(u'A')
+        cache.get(u'B')
+
+        self.assertDictContainsSubset({u'entries': 1, u'hits': 1, u'misses': 1}, cache_stats(cache))
+
+    def test_encoding_stats(self):
+        """
+        Tests that the response compression counters are returned when it is enabled.
+        """
+
+        # Branch 1: Test that only the disabled flag is returned without an encoder
+
+        self.assertDictEqual(encoding_stats(None), {u'enabled': False})
+
+        # Branch 2: Test that the counters of each content coding and of the cache are returned with the enabled flag
+
+        encoder = get_content_encoder(u'gzip', min_size=1024, cache=MessageCache(negative_ttl=0))
+
+        encoder.encode(u'A', b'a' * 2048, u'gzip')
+        encoder.encode(u'A', b'a' * 2048, u'gzip')
+
+        stats = encoding_stats(encoder)
+
+        self.assertDictContainsSubset({u'enabled': True, u'encodings': [u'gzip'], u'gzip_bytes_in': 2048,
+                                       u'gzip_cached': 1, u'gzip_responses': 1, u'min_size': 1024}, stats)
+        self.assertEqual(stats[u'cache'][u'entries'], 1)
+
+    @patch(u'sha_api.route_handlers.stats.response')
+    @patch(u'sha_api.route_handlers.stats.request')
+    def test_prometheus_metrics(self, stats_request, stats_response):
+        """
+        Tests that the request metrics and stats counters are returned in the Prometheus text format.
+        """
+
+        cache = MessageCache()
+        registry = MetricsRegistry()
+
+        cache.get(u'A')
+        registry.counter(u'sha_api_requests_total', u'Requests.').inc()
+
+        stats_request.app.admission = None
+        stats_request.app.changelog = None
+        stats_request.app.follower = None
+        stats_request.app.metrics_registry = registry
+        stats_request.app.write_counters = Counters(u'stored')
+        stats_request.app.write_counters.increment(u'stored', 2)
+
+        # Branch 1: Test that the registry, cache and write counters are rendered without a writer
+
+        metrics = prometheus_metrics(cache, None)
+
+        self.assertEqual(stats_response.content_type, PROMETHEUS_CONTENT_TYPE)
+        self.assertTrue(metrics.startswith(u'# HELP sha_api_requests_total Requests.\n'))
+        self.assertIn(u'\nsha_api_cache_misses_total 1\n', metrics)
+        self.assertIn(u'\n# TYPE sha_api_cache_entries gauge\nsha_api_cache_entries 0\n', metrics)
+        self.assertIn(u'\nsha_api_messages_stored_total 2\n', metrics)
+        self.assertNotIn(u'sha_api_group_commit', metrics)
+        self.assertNotIn(u'sha_api_admission', metrics)
+
+        # Branch 2: Test that the group commit writer counters are rendered when it is enabled
+
+        writer = MagicMock()
+        writer.stats.return_value = {u'commits': 2, u'errors': 0, u'requests': 3, u'rows': 4}
+
+        self.assertIn(u'\nsha_api_group_commit_rows_total 4\n', prometheus_metrics(cache, writer))
+
+        # Branch 3: Test that the admission counters and the gauges of the limited traffic classes are rendered
+
+        stats_request.app.admission = AdmissionController({u'read': ConcurrencyLimit(1)})
+        stats_request.app.admission.admit(u'read')
+        stats_request.app.admission.admit(u'read')
+
+        metrics = prometheus_metrics(cache, None)
+
+        self.assertIn(u'\nsha_api_admission_read_admitted_total 1\n', metrics)
+        self.assertIn(u'\nsha_api_admission_read_shed_queue_full_total 1\n', metrics)
+        self.assertIn(u'\nsha_api_admission_write_admitted_total 0\n', metrics)
+        self.assertIn(u'\n# TYPE sha_api_admission_read_in_flight gauge\nsha_api_admission_read_in_flight 1\n', metrics)
+        self.assertNotIn(u'sha_api_admission_write_in_flight', metrics)
+        self.assertNotIn(u'sha_api_replication', metrics)
+
+        # Branch 4: Test that the change log head and the follower counters and lag gauges are rendered
+
+        stats_request.app.changelog = MagicMock()
+        stats_request.app.changelog.head.return_value = 12
+        stats_request.app.follower = MagicMock()
+        stats_request.app.follower.stats.return_value = {u'applied_seq': 10, u'batches': 2, u'changes': 10,
+                                                         u'errors': 1, u'lag_changes': 2, u'lag_seconds': None,
+                                                         u'primary_seq': 12, u'rejected': 0, u'skipped': 0,
+                                                         u'stored': 9}
+
+        metrics = prometheus_metrics(cache, None)
+
+        self.assertIn(u'\n# TYPE sha_api_replication_log_seq gauge\nsha_api_replication_log_seq 12\n', metrics)
+        self.assertIn(u'\n# TYPE sha_api_replication_stored_total counter\nsha_api_replication_stored_total 9\n',
+                      metrics)
+        self.assertIn(u'\nsha_api_replication_lag_changes 2\n', metrics)
+        self.assertNotIn(u'sha_api_replication_lag_seconds', metrics)
+
+    @patch(u'sha_api.route_handlers.stats.request')
+    def test_replication_stats(self, stats_request):
+        """
+        Tests that the change log and follower stats are returned when replication is enabled.
+        """
+
+        # Branch 1: Test that only the disabled flag is returned without a change log or a follower
+
+        stats_request.app.changelog = None
+        stats_request.app.follower = None
+
+        self.assertDictEqual(replication_stats(), {u'enabled': False})
+
+        # Branch 2: Test that the change log head and the follower state are returned, for a follower of a follower
+
+        stats_request.app.changelog = MagicMock(log_id=u'abc')
+        stats_request.app.changelog.head.return_value = 3
+        stats_request.app.follower = MagicMock()
+        stats_request.app.follower.stats.return_value = {u'lag_changes': 1}
+
+        self.assertDictEqual(replication_stats(), {u'changelog': {u'last_seq': 3, u'log_id': u'abc'}, u'enabled': True,
+                                                   u'follower': {u'lag_changes': 1}})
+
+    @patch(u'sha_api.route_handlers.stats.request')
+    def test_write_stats(self, stats_request):
+        """
+        Tests that the write counters and the deduplication hit rate are returned.
+        """
+
+        # Branch 1: Test that the hit rate is zero before any writes
+
+        stats_request.app.write_counters = Counters(u'duplicates', u'duplicates_cached', u'stored')
+
+        self.assertDictEqual(write_stats(),
+                             {u'dedup_hit_rate': 0.0, u'duplicates': 0, u'duplicates_cached': 0, u'stored': 0})
+
+        # Branch 2: Test that the hit rate is the share of writes that were duplicates
+
+        stats_request.app.write_counters.increment(u'stored', 3)
+        stats_request.app.write_counters.increment(u'duplicates')
+
+        self.assertEqual(write_stats()[u'dedup_hit_rate'], 0.25)
+
+    def test_writer_stats(self):
+        """
+        Tests that the group commit writer counters are returned when it is enabled.
+        """
+
+        # Branch 1: Test that only the disabled flag is returned without a writer
+
+        self.assertDictEqual(writer_stats(None), {u'enabled': False})
+
+        # Branch 2: Test that the writer counters are returned with the enabled flag
+
+        writer = MagicMock()
+        writer.stats.return_value = {u'commits': 2}
+
+        self.assertDictEqual(writer_stats(writer), {u'commits': 2, u'enabled': True})
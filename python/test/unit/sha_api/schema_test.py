@@ -0,0 +1,127 @@
+"""
+The `test.unit.sha_api.schema_test` module provides unit tests for the schema creation and migration methods in
+`sha_api.schema`.
+
+Classes:
+    TestSchema: A unit test class for the schema creation and migration methods.
+"""
+
+import sqlite3
+import tempfile
+import unittest
+
+from sha_api.schema import create_schema, migrate, schema_version, SCHEMA_VERSION
+
+class TestSchema(unittest.TestCase):
+    """
+    A unit test class for the schema creation and migration methods.
+
+    Methods:
+        setUp: Unit test initialization.
+        test_create_schema: Tests that new databases get the current schema and old ones are left untouched.
+        test_migrate: Tests that an old database is upgraded in place with all of its rows.
+    """
+
+    def setUp(self):
+        """
+        Initializes the unit test global configs
+        """
+
+        self.maxDiff = None # pylint: disable=invalid-name
+        self.dbfile = tempfile.NamedTemporaryFile(delete=False)
+
+    def _create_v0(self, rows):
+        """
+        Creates the original composite primary key table with the provided rows.
+        """
+
+        db_con = sqlite3.connect(self.dbfile.name)
+        db_con.execute(u'CREATE TABLE sha_api (digest TEXT, message TEXT, PRIMARY KEY (digest, message))')
+        db_con.executemany(u'INSERT INTO sha_api (digest, message) VALUES (?, ?)', rows)
+        db_con.commit()
+
+        return db_con
+
+    def test_create_schema(self):
+        """
+        Tests that new databases get the current schema and old ones are left untouched.
+        """
+
+        # Branch 1: Test that an empty database gets the current schema version
+
+        db_con = sqlite3.connect(self.dbfile.name)
+
+        self.assertIsNone(schema_version(db_con))
+
+        create_schema(db_con)
+
+        self.assertEqual(schema_version(db_con), SCHEMA_VERSION)
+        self.assertIn(u'WITHOUT ROWID',
+                      db_con.execute(u"SELECT sql FROM sqlite_master WHERE name = 'sha_api'").fetchone()[0])
+
+        db_con.close()
+
+        # Branch 2: Test that the rowid layout can be requested for databases of large messages
+
+        self.dbfile = tempfile.NamedTemporaryFile(delete=False)
+        db_con = sqlite3.connect(self.dbfile.name)
+
+        create_schema(db_con, without_rowid=False)
+
+        self.assertEqual(schema_version(db_con), SCHEMA_VERSION)
+        self.assertNotIn(u'WITHOUT ROWID',
+                         db_con.execute(u"SELECT sql FROM sqlite_master WHERE name = 'sha_api'").fetchone()[0])
+
+        db_con.close()
+
+        # Branch 3: Test that an existing old table is not modified but still gets the raw stream tables
+
+        self.dbfile = tempfile.NamedTemporaryFile(delete=False)
+        db_con = self._create_v0([])
+
+        create_schema(db_con)
+
+        self.assertEqual(schema_version(db_con), 0)
+        self.assertEqual(
+            db_con.execute(
+                u"SELECT COUNT(*) FROM sqlite_master WHERE name IN ('sha_api_blobs', 'sha_api_segments')"
+            ).fetchone()[0],
+            2
+        )
+
+        db_con.close()
+
+    def test_migrate(self):
+        """
+        Tests that an old database is upgraded in place with all of its rows.
+        """
+
+        rows = [(u'%064X' % index, u'message %d' % index) for index in range(25)]
+        db_con = self._create_v0(rows)
+        messages = []
+
+        # Branch 1: Test that all rows are copied across several batches and the schema version is updated
+
+        self.assertEqual(migrate(self.dbfile.name, batch_size=10, vacuum=True, log=messages.append), 25)
+        self.assertEqual(schema_version(db_con), SCHEMA_VERSION)
+        self.assertEqual(sorted(db_con.execute(u'SELECT digest, message FROM sha_api').fetchall()), rows)
+        self.assertIsNone(db_con.execute(u"SELECT 1 FROM sqlite_master WHERE name = 'sha_api_migrate'").fetchone())
+        self.assertIn(u'Upgraded sha_api table from schema version 0 to %d' % SCHEMA_VERSION, messages)
+
+        # Branch 2: Test that migrating a current database is a no-op
+
+        self.assertEqual(migrate(self.dbfile.name), 25)
+
+        db_con.close()
+
+        # Branch 3: Test that migrating an empty database creates the current schema
+
+        self.dbfile = tempfile.NamedTemporaryFile(delete=False)
+
+        self.assertEqual(migrate(self.dbfile.name), 0)
+
+        db_con = sqlite3.connect(self.dbfile.name)
+
+        self.assertEqual(schema_version(db_con), SCHEMA_VERSION)
+
+        db_con.close()
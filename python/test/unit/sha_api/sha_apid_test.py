@@ -0,0 +1,116 @@
+"""
+The `test.unit.sha_api.sha_apid_test` module provides unit tests for the `sha_api.sha_apid` daemon helper methods.
+
+Classes:
+    TestShaApid: A unit test class for the `sha_api.sha_apid` helper methods.
+"""
+
+import hashlib
+import json
+import shutil
+import tempfile
+import threading
+import unittest
+
+from bottle import ConfigDict # pylint: disable=no-name-in-module
+from sha_api.benchmark.replication import Node
+from sha_api.sha_apid import server_options
+
+class TestShaApid(unittest.TestCase):
+    """
+    A unit test class for the `sha_api.sha_apid` helper methods.
+
+    Methods:
+        test_async_concurrent_requests: Tests that concurrent requests to `sha_apid --async` each get their own
+                                        response.
+        test_server_options: Tests that the worker pool options are only returned for the gunicorn server.
+    """
+
+    def test_async_concurrent_requests(self):
+        """
+        Tests that concurrent requests to `sha_apid --async` each get their own response.
+        """
+
+        try:
+            import gevent # pylint: disable=unused-variable
+        except ImportError: # pragma: no cover
+            self.skipTest(u'gevent is not installed')
+
+        node_dir = tempfile.mkdtemp()
+        node = Node(u'async', node_dir, args=[u'--async'])
+        messages = [u'foo%d' % index * (index + 1) for index in range(20)]
+        failures = []
+
+        def send_requests(offset):
+            """
+            Reads stored and missing messages on a connection of its own and records every unexpected response.
+            """
+
+            client = node.client()
+
+            for index in range(40):
+                message = messages[(offset + index) % len(messages)]
+                digest = hashlib.sha256((message if index % 2 else message + u'bar').encode(u'utf-8')).hexdigest()
+
+                try:
+                    status, body = client.request(u'GET', u'/messages/%s' % digest.upper())
+
+                    if (status, json.loads(body).get(u'message')) != ((200, message) if index % 2 else (404, None)):
+                        failures.append((status, body[:80]))
+                except Exception as err: # pylint: disable=broad-except
+                    failures.append(repr(err))
+
+        try:
+            for message in messages:
+                self.assertEqual(node.client().request(u'POST', u'/messages', json.dumps({u'message': message}))[0],
+                                 200)
+
+            threads = [threading.Thread(target=send_requests, args=(offset,)) for offset in range(32)]
+
+            for thread in threads:
+                thread.start()
+
+            for thread in threads:
+                thread.join()
+        finally:
+            node.stop()
+            shutil.rmtree(node_dir)
+
+        self.assertListEqual(failures, [])
+
+    def test_server_options(self):
+        """
+        Tests that the worker pool options are only returned for the gunicorn server.
+        """
+
+        # Branch 1: Test that other servers get no extra options
+
+        self.assertDictEqual(server_options(ConfigDict().load_dict({u'sha_api': {u'server': u'wsgiref'}})), {})
+
+        # Branch 2: Test that threaded gunicorn workers use the gthread worker class with the configured settings
+
+        config = ConfigDict().load_dict(
+            {u'sha_api': {u'server': u'gunicorn', u'workers': u'4', u'threads': u'8', u'keepalive': u'10'}}
+        )
+
+        self.assertDictEqual(server_options(config), {
+            u'graceful_timeout': 30,
+            u'keepalive': 10,
+            u'threads': 8,
+            u'timeout': 30,
+            u'worker_class': u'gthread',
+            u'workers': 4
+        })
+
+        # Branch 3: Test that single threaded gunicorn workers use the sync worker class
+
+        config = ConfigDict().load_dict({u'sha_api': {u'server': u'gunicorn', u'workers': u'2'}})
+
+        self.assertEqual(server_options(config)[u'worker_class'], u'sync')
+
+        # Branch 4: Test that async mode always uses the gevent worker class with the configured connection limit
+
+        config = ConfigDict().load_dict({u'sha_api': {u'server': u'wsgiref', u'worker_connections': u'5000'}})
+
+        self.assertDictContainsSubset({u'worker_class': u'gevent', u'worker_connections': 5000},
+                                      server_options(config, async_mode=True))
@@ -0,0 +1,3 @@
+"""
+The `test.unit.sha_api.storage` module provides nose unit tests for `sha_api.storage`.
+"""
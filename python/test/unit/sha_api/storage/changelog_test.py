@@ -0,0 +1,107 @@
+"""
+The `test.unit.sha_api.storage.changelog_test` module provides unit tests for the change log in
+`sha_api.storage.changelog`.
+
+Classes:
+    TestChangeLogStorage: A unit test class for the `ChangeLog` and `ChangeLogStorage` classes, in addition to the
+                          storage engine conformance tests of a `ChangeLogStorage` over a `SqliteStorage`.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from sha_api.mybottle.sqlite_pool import SqlitePool
+from sha_api.schema import create_schema
+from sha_api.storage.changelog import ChangeLog, ChangeLogStorage
+from sha_api.storage.sqlite_engine import SqliteStorage
+from test.unit.sha_api.storage.conformance import digest, StorageConformance
+
+class TestChangeLogStorage(StorageConformance, unittest.TestCase):
+    """
+    A unit test class for the `ChangeLog` and `ChangeLogStorage` classes, in addition to the storage engine conformance
+    tests of a `ChangeLogStorage` over a `SqliteStorage`.
+
+    Methods:
+        setUp: Unit test initialization.
+        tearDown: Closes the engine and removes its files.
+        make_storage: Returns a `ChangeLogStorage` over a `SqliteStorage` and a change log in new database files.
+        test_changelog: Tests that changes are numbered in order and read back after a sequence number.
+        test_changelog_storage: Tests that only newly stored messages are appended to the change log.
+    """
+
+    def setUp(self):
+        """
+        Initializes the unit test global configs
+        """
+
+        self.maxDiff = None # pylint: disable=invalid-name
+        self.storage_dir = tempfile.mkdtemp()
+        self.storage = self.make_storage()
+
+    def tearDown(self):
+        """
+        Closes the engine and removes its files.
+        """
+
+        self.storage.close()
+        shutil.rmtree(self.storage_dir)
+
+    def make_storage(self):
+        """
+        Returns a `ChangeLogStorage` over a `SqliteStorage` and a change log in new database files.
+        """
+
+        pool = SqlitePool(os.path.join(self.storage_dir, u'sha_api.db'))
+        create_schema(pool.connection())
+
+        return ChangeLogStorage(SqliteStorage(pool), ChangeLog(os.path.join(self.storage_dir, u'changes.db')))
+
+    def test_changelog(self):
+        """
+        Tests that changes are numbered in order and read back after a sequence number.
+        """
+
+        changelog = self.storage.changelog
+
+        # Branch 1: Test that an empty log has no changes
+
+        self.assertEqual(changelog.head(), 0)
+        self.assertListEqual(changelog.read(0, 10), [])
+
+        # Branch 2: Test that the changes are numbered from 1 in the order they were appended
+
+        changelog.append([u'A', u'B'])
+        changelog.append([])
+        changelog.append([u'C'])
+
+        self.assertEqual(changelog.head(), 3)
+        self.assertListEqual(changelog.read(0, 10), [(1, u'A'), (2, u'B'), (3, u'C')])
+        self.assertListEqual(changelog.read(1, 1), [(2, u'B')])
+        self.assertListEqual(changelog.read(3, 10), [])
+
+        # Branch 3: Test that the log keeps its id when it is opened again, and a new log gets another one
+
+        self.assertEqual(ChangeLog(changelog.path).log_id, changelog.log_id)
+        self.assertNotEqual(ChangeLog(os.path.join(self.storage_dir, u'other.db')).log_id, changelog.log_id)
+
+    def test_changelog_storage(self):
+        """
+        Tests that only newly stored messages are appended to the change log.
+        """
+
+        # Branch 1: Test that the newly stored messages are appended in the order of the rows
+
+        self.assertListEqual(self.storage.put_many([(digest(u'foo'), u'foo'), (digest(u'bar'), u'bar'),
+                                                    (digest(u'foo'), u'foo')]), [True, True, False])
+        self.assertTrue(self.storage.put(digest(u'baz'), u'baz'))
+
+        self.assertListEqual(self.storage.changelog.read(0, 10),
+                             [(1, digest(u'foo')), (2, digest(u'bar')), (3, digest(u'baz'))])
+
+        # Branch 2: Test that messages that are already stored are not appended again
+
+        self.assertListEqual(self.storage.put_many([(digest(u'bar'), u'bar'), (digest(u'baz'), u'baz')]),
+                             [False, False])
+        self.assertEqual(self.storage.changelog.head(), 3)
@@ -0,0 +1,79 @@
+"""
+The `test.unit.sha_api.storage.chunking_test` module provides unit tests for the content defined chunking in
+`sha_api.storage.chunking`.
+
+Classes:
+    TestChunking: A unit test class for the `Chunker` class and the `is_manifest`, `manifest` and `manifest_size`
+                  methods.
+"""
+
+import random
+import unittest
+
+from sha_api.storage.chunking import Chunker, is_manifest, manifest, manifest_size
+
+class TestChunking(unittest.TestCase):
+    """
+    A unit test class for the `Chunker` class and the `is_manifest`, `manifest` and `manifest_size` methods.
+
+    Methods:
+        setUp: Unit test initialization.
+        test_chunker: Tests that the chunks are within their size bounds and survive edits of the data.
+        test_manifest: Tests that manifests are recognized and keep the size of their message.
+    """
+
+    def setUp(self):
+        """
+        Initializes the unit test global configs
+        """
+
+        self.maxDiff = None # pylint: disable=invalid-name
+
+    def test_chunker(self):
+        """
+        Tests that the chunks are within their size bounds and survive edits of the data.
+        """
+
+        chunker = Chunker(chunk_size=1024)
+        rand = random.Random(0)
+        data = bytes(bytearray(rand.randrange(256) for _ in range(200000)))
+
+        # Branch 1: Test that the chunks add up to the data, with only the last one under the minimum size
+
+        chunks = chunker.split(data)
+
+        self.assertEqual(b''.join(chunks), data)
+        self.assertTrue(all(chunker.min_size <= len(chunk) <= chunker.max_size for chunk in chunks[:-1]))
+        self.assertTrue(512 <= len(data) // len(chunks) <= 2048)
+        self.assertListEqual(chunker.split(b''), [])
+        self.assertListEqual(chunker.split(b'foo'), [b'foo'])
+
+        # Branch 2: Test that an insert and an overwrite only change the chunks around them
+
+        edited = data[:50000] + b'an inserted edit' + data[50000:150000] + b'X' * 10 + data[150010:]
+        edited_chunks = chunker.split(edited)
+
+        self.assertEqual(b''.join(edited_chunks), edited)
+        self.assertLessEqual(len(set(edited_chunks) - set(chunks)), 4)
+
+        # Branch 3: Test that data without any boundary is cut at the maximum size
+
+        self.assertListEqual([len(chunk) for chunk in chunker.split(b'\x00' * 20000)], [8192, 8192, 3616])
+
+        # Branch 4: Test that chunk sizes too small for the boundary window are rejected
+
+        with self.assertRaises(ValueError):
+            Chunker(chunk_size=100)
+
+    def test_manifest(self):
+        """
+        Tests that manifests are recognized and keep the size of their message.
+        """
+
+        value = manifest(123456789)
+
+        self.assertTrue(is_manifest(value))
+        self.assertTrue(is_manifest(bytearray(value)))
+        self.assertEqual(manifest_size(value), 123456789)
+        self.assertFalse(is_manifest(b'\xf8foo'))
+        self.assertFalse(is_manifest(b''))
@@ -0,0 +1,146 @@
+"""
+The `test.unit.sha_api.storage.compression_test` module provides unit tests for the message compression in
+`sha_api.storage.compression`.
+
+Classes:
+    TestCompression: A unit test class for the `Compressor` class and the `decompress`, `get_compressor` and `unpack`
+                     methods.
+"""
+
+import unittest
+import zlib
+
+from mock import patch
+from sha_api.storage.compression import Compressor, decompress, decompress_data, get_compressor, unpack
+
+class TestCompression(unittest.TestCase):
+    """
+    A unit test class for the `Compressor` class and the `decompress`, `get_compressor` and `unpack` methods.
+
+    Methods:
+        setUp: Unit test initialization.
+        test_compress: Tests that only messages above the threshold that get smaller are compressed.
+        test_decompress: Tests that values of every codec and plain UTF-8 values are read back.
+        test_get_compressor: Tests that the configured codec is returned and unknown codecs are rejected.
+        test_unpack: Tests that stored values are split into their codec and data without decompressing them.
+    """
+
+    def setUp(self):
+        """
+        Initializes the unit test global configs
+        """
+
+        self.maxDiff = None # pylint: disable=invalid-name
+
+    def test_compress(self):
+        """
+        Tests that only messages above the threshold that get smaller are compressed.
+        """
+
+        compressor = get_compressor(u'zlib', threshold=16)
+        message = u'{"level": "INFO", "msg": "f\xf6\xf6 \u2603"} ' * 20
+
+        # Branch 1: Test that a compressible message is marked and compressed
+
+        value = compressor.compress(message)
+
+        self.assertEqual(value[:1], b'\xf8')
+        self.assertEqual(zlib.decompress(value[1:]).decode(u'utf-8'), message)
+        self.assertLess(len(value), len(message))
+
+        # Branch 2: Test that messages below the threshold or that do not get smaller are not compressed
+
+        self.assertIsNone(compressor.compress(u'a' * 15))
+        self.assertIsNone(compressor.compress(u'0123456789abcdef'))
+
+        # Branch 3: Test that bytes are compressed the same way, with the threshold in bytes
+
+        data = message.encode(u'utf-8')
+
+        self.assertEqual(compressor.compress_data(data), value)
+        self.assertIsNone(compressor.compress_data(b'a' * 15))
+        self.assertIsNone(compressor.compress_data(b'0123456789abcdef'))
+
+    def test_decompress(self):
+        """
+        Tests that values of every codec and plain UTF-8 values are read back.
+        """
+
+        message = u'f\xf6\xf6 \u2603 ' * 100
+
+        # Branch 1: Test that plain UTF-8 values, including empty ones, are decoded
+
+        self.assertEqual(decompress(message.encode(u'utf-8')), message)
+        self.assertEqual(decompress(b''), u'')
+        self.assertEqual(decompress(bytearray(message.encode(u'utf-8'))), message)
+
+        # Branch 2: Test that the values of each installed codec are decompressed
+
+        names = [u'zlib']
+
+        try:
+            import zstandard # pylint: disable=unused-variable
+
+            names.append(u'zstd')
+        except ImportError: # pragma: no cover
+            pass
+
+        for name in names:
+            self.assertEqual(decompress(get_compressor(name, threshold=0).compress(message)), message)
+
+        # Branch 3: Test that a zstd value can not be read without zstandard
+
+        with patch.dict(u'sys.modules', {u'zstandard': None}):
+            with patch(u'sha_api.storage.compression._LOCAL') as local:
+                local.zstd_decompressor = None
+
+                with self.assertRaises(ImportError):
+                    decompress(b'\xf9' + b'\x00' * 8)
+
+    def test_get_compressor(self):
+        """
+        Tests that the configured codec is returned and unknown codecs are rejected.
+        """
+
+        # Branch 1: Test that none disables compression and the named codecs are returned with their settings
+
+        self.assertIsNone(get_compressor(u'none'))
+
+        compressor = get_compressor(u'zlib', level=1, threshold=10)
+
+        self.assertTrue(isinstance(compressor, Compressor))
+        self.assertEqual(compressor.name, u'zlib')
+        self.assertEqual(compressor.threshold, 10)
+
+        # Branch 2: Test that auto falls back to zlib when zstandard is not installed
+
+        with patch.dict(u'sys.modules', {u'zstandard': None}):
+            self.assertEqual(get_compressor(u'auto').name, u'zlib')
+
+            with self.assertRaises(ImportError):
+                get_compressor(u'zstd')
+
+        # Branch 3: Test that an unknown codec is rejected
+
+        with self.assertRaises(ValueError) as err:
+            get_compressor(u'lz4')
+
+        self.assertEqual(str(err.exception), u'Unknown compression lz4, expected auto, none or one of zstd, zlib')
+
+    def test_unpack(self):
+        """
+        Tests that stored values are split into their codec and data without decompressing them.
+        """
+
+        message = u'f\xf6\xf6 \u2603 ' * 100
+        value = get_compressor(u'zlib', threshold=0).compress(message)
+
+        # Branch 1: Test that a compressed value is returned as its codec and its compressed data
+
+        self.assertEqual(unpack(bytearray(value)), (u'zlib', value[1:]))
+        self.assertEqual(decompress_data(*unpack(value)), message.encode(u'utf-8'))
+
+        # Branch 2: Test that a plain UTF-8 value has no codec and is returned as it is
+
+        self.assertEqual(unpack(message.encode(u'utf-8')), (None, message.encode(u'utf-8')))
+        self.assertEqual(decompress_data(None, b'foo'), b'foo')
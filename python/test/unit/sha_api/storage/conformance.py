@@ -0,0 +1,204 @@
+"""
+The `test.unit.sha_api.storage.conformance` module provides the conformance tests shared by the unit tests of every
+storage engine in `sha_api.storage`.
+
+Classes:
+    StorageConformance: A mixin of the unit tests every `StorageEngine` has to pass.
+
+Methods:
+    digest: Returns the upper cased hex SHA256 digest of a message.
+"""
+
+import hashlib
+import os
+
+from sha_api.storage.compression import decompress_data
+from sha_api.storage.engine import ITER_PAGE_SIZE
+
+def digest(message):
+    """
+    Returns the upper cased hex SHA256 digest of the message, like the route handlers compute it.
+    """
+
+    return hashlib.sha256(message.encode(u'utf-8')).hexdigest().upper()
+
+class StorageConformance(object):
+    """
+    A mixin of the unit tests every `StorageEngine` has to pass, for `unittest.TestCase` classes that implement
+    `make_storage` to return an engine over new empty files and set it to `self.storage`.
+
+    Methods:
+        test_collect_garbage: Tests that collecting garbage keeps every stored message.
+        test_disk_usage: Tests that the files of the engine are reported with the space they use.
+        test_exists: Tests that stored digests exist and other digests do not.
+        test_find_digests: Tests that the stored digests that start with a prefix are found in digest order.
+        test_get: Tests that stored messages are returned unchanged and missing ones as `None`.
+        test_get_compressed: Tests that stored messages are returned as their UTF-8 bytes, compressed or not, and
+                             missing ones as `None`.
+        test_get_many: Tests that the stored messages of a list of digests are returned by digest.
+        test_get_stream: Tests that stored messages are streamed as their UTF-8 bytes with their size, and missing ones
+                         as `None`.
+        test_iter: Tests that messages are iterated in digest order from a digest prefix across pages.
+        test_put: Tests that a message is only reported as stored the first time.
+        test_put_many: Tests that repeated and already stored rows of a batch are reported as not stored.
+    """
+
+    def test_collect_garbage(self):
+        """
+        Tests that collecting garbage keeps every stored message.
+        """
+
+        messages = dict((digest(message), message) for message in (u'foo', u'f\xf6\xf6 \u2603' * 1000, u'bar ' * 5000))
+
+        self.storage.put_many(sorted(messages.items()))
+
+        self.assertListEqual(sorted(self.storage.collect_garbage()), [u'chunk_bytes', u'chunks', u'refs'])
+        self.assertDictEqual(self.storage.collect_garbage(), {u'chunk_bytes': 0, u'chunks': 0, u'refs': 0})
+        self.assertDictEqual(self.storage.get_many(list(messages)), messages)
+
+    def test_disk_usage(self):
+        """
+        Tests that the files of the engine are reported with the space they use.
+        """
+
+        self.storage.put_many([(digest(u'%d' % index), u'x' * 100) for index in range(100)])
+
+        self.assertTrue(any(os.path.exists(path) for path in self.storage.paths()))
+        self.assertGreater(self.storage.disk_usage(), 100 * 100)
+
+    def test_exists(self):
+        """
+        Tests that stored digests exist and other digests do not.
+        """
+
+        self.storage.put(digest(u'foo'), u'foo')
+
+        self.assertTrue(self.storage.exists(digest(u'foo')))
+        self.assertFalse(self.storage.exists(digest(u'bar')))
+
+    def test_find_digests(self):
+        """
+        Tests that the stored digests that start with a prefix are found in digest order.
+        """
+
+        digests = sorted(digest(u'%d' % index) for index in range(2000))
+
+        self.storage.put_many([(digest(u'%d' % index), u'%d' % index) for index in range(2000)])
+
+        # Branch 1: Test that a prefix of a single digest, or the digest itself, finds only that digest
+
+        self.assertListEqual(self.storage.find_digests(digests[500][:12], 10), [digests[500]])
+        self.assertListEqual(self.storage.find_digests(digests[500], 10), [digests[500]])
+
+        # Branch 2: Test that short prefixes of odd and even length find the first digests that start with them
+
+        for prefix in (u'', u'0', u'AB', u'F', u'C7'):
+            self.assertListEqual(self.storage.find_digests(prefix, 5),
+                                 [candidate for candidate in digests if candidate.startswith(prefix)][:5])
+
+        self.assertListEqual(self.storage.find_digests(u'', 5000), digests)
+
+        # Branch 3: Test that a prefix of no stored digest finds nothing
+
+        self.assertNotIn(u'FFFFFFFF', [candidate[:8] for candidate in digests])
+        self.assertListEqual(self.storage.find_digests(u'FFFFFFFF', 10), [])
+
+    def test_get(self):
+        """
+        Tests that stored messages are returned unchanged and missing ones as `None`.
+        """
+
+        for message in (u'foo', u'', u'f\xf6\xf6 \u2603', u'x' * 100000):
+            self.storage.put(digest(message), message)
+
+            self.assertEqual(self.storage.get(digest(message)), message)
+
+        self.assertIsNone(self.storage.get(digest(u'bar')))
+
+    def test_get_compressed(self):
+        """
+        Tests that stored messages are returned as their UTF-8 bytes, compressed or not, and missing ones as `None`.
+        """
+
+        for message in (u'foo', u'', u'f\xf6\xf6 \u2603' * 1000):
+            self.storage.put(digest(message), message)
+
+            self.assertEqual(decompress_data(*self.storage.get_compressed(digest(message))), message.encode(u'utf-8'))
+
+        self.assertIsNone(self.storage.get_compressed(digest(u'bar')))
+
+    def test_get_many(self):
+        """
+        Tests that the stored messages of a list of digests are returned by digest.
+        """
+
+        messages = dict((digest(u'%d' % index), u'%d' % index) for index in range(1200))
+
+        self.storage.put_many(sorted(messages.items()))
+
+        self.assertDictEqual(self.storage.get_many(list(messages) + [digest(u'bar')]), messages)
+        self.assertDictEqual(self.storage.get_many([digest(u'bar')]), {})
+        self.assertDictEqual(self.storage.get_many([]), {})
+
+    def test_get_stream(self):
+        """
+        Tests that stored messages are streamed as their UTF-8 bytes with their size, and missing ones as `None`.
+        """
+
+        for message in (u'foo', u'', u'f\xf6\xf6 \u2603' * 10000):
+            self.storage.put(digest(message), message)
+
+            size, pieces = self.storage.get_stream(digest(message))
+            data = b''.join(pieces)
+
+            self.assertEqual(data, message.encode(u'utf-8'))
+            self.assertEqual(size, len(data))
+
+        self.assertIsNone(self.storage.get_stream(digest(u'bar')))
+
+    def test_iter(self):
+        """
+        Tests that messages are iterated in digest order from a digest prefix across pages.
+        """
+
+        # Branch 1: Test that an empty engine yields nothing
+
+        self.assertListEqual(list(self.storage.iter()), [])
+
+        # Branch 2: Test that every message is yielded once in digest order, across more than one page
+
+        rows = sorted((digest(u'%d' % index), u'%d' % index) for index in range(ITER_PAGE_SIZE + 5))
+
+        self.storage.put_many(rows)
+
+        self.assertListEqual(list(self.storage.iter()), rows)
+
+        # Branch 3: Test that the iteration starts at the first digest that is not less than a digest or prefix
+
+        self.assertListEqual(list(self.storage.iter(rows[10][0])), rows[10:])
+        self.assertListEqual(list(self.storage.iter(u'8')), [row for row in rows if row[0] >= u'8'])
+        self.assertListEqual(list(self.storage.iter(u'8a')), [row for row in rows if row[0] >= u'8A'])
+        self.assertListEqual(list(self.storage.iter(u'F' * 64)), [])
+
+    def test_put(self):
+        """
+        Tests that a message is only reported as stored the first time.
+        """
+
+        self.assertTrue(self.storage.put(digest(u'foo'), u'foo'))
+        self.assertFalse(self.storage.put(digest(u'foo'), u'foo'))
+        self.assertEqual(self.storage.get(digest(u'foo')), u'foo')
+
+    def test_put_many(self):
+        """
+        Tests that repeated and already stored rows of a batch are reported as not stored.
+        """
+
+        self.storage.put(digest(u'foo'), u'foo')
+
+        rows = [(digest(message), message) for message in (u'foo', u'bar', u'baz', u'bar')]
+
+        self.assertListEqual(self.storage.put_many(rows), [False, True, True, False])
+        self.assertListEqual(self.storage.put_many(rows), [False, False, False, False])
+        self.assertListEqual(self.storage.put_many([]), [])
+        self.assertDictEqual(self.storage.get_many([row[0] for row in rows]), dict(rows))
@@ -0,0 +1,148 @@
+"""
+The `test.unit.sha_api.storage.engine_test` module provides unit tests for the storage engine interface, executor
+wrapper and plugin in `sha_api.storage.engine`.
+
+Classes:
+    TestStorageEngine: A unit test class for the `ExecutorStorage`, `StorageEngine` and `StoragePlugin` classes.
+"""
+
+import unittest
+
+from mock import MagicMock
+from sha_api.storage.engine import ExecutorStorage, ITER_PAGE_SIZE, StorageEngine, StoragePlugin
+
+class TestStorageEngine(unittest.TestCase):
+    """
+    A unit test class for the `ExecutorStorage`, `StorageEngine` and `StoragePlugin` classes.
+
+    Methods:
+        setUp: Unit test initialization.
+        test_executor_storage: Tests that every operation of the engine runs on the executor.
+        test_plugin: Tests that the plugin only wraps callbacks that accept the storage keyword.
+        test_storage_engine: Tests that the default operations use `get`, `iter` and `put_many` of the engine.
+    """
+
+    def setUp(self):
+        """
+        Initializes the unit test global configs
+        """
+
+        self.maxDiff = None # pylint: disable=invalid-name
+
+    def test_executor_storage(self):
+        """
+        Tests that every operation of the engine runs on the executor.
+        """
+
+        engine = MagicMock(spec=StorageEngine)
+        engine.name = u'test'
+        executor = MagicMock()
+        executor.run.side_effect = lambda func: func()
+        storage = ExecutorStorage(engine, executor)
+
+        # Branch 1: Test that the reads and writes return the results of the engine
+
+        engine.collect_garbage.return_value = {u'chunk_bytes': 10, u'chunks': 1, u'refs': 2}
+        engine.exists.return_value = True
+        engine.find_digests.return_value = [u'AB']
+        engine.get.return_value = u'foo'
+        engine.get_compressed.return_value = (None, b'foo')
+        engine.get_many.return_value = {u'A': u'foo'}
+        engine.put.return_value = True
+        engine.put_many.return_value = [True, False]
+
+        self.assertEqual(storage.name, u'test')
+        self.assertTrue(storage.exists(u'A'))
+        self.assertEqual(storage.get(u'A'), u'foo')
+        self.assertEqual(storage.get_compressed(u'A'), (None, b'foo'))
+        self.assertListEqual(storage.find_digests(u'A', 10), [u'AB'])
+        self.assertDictEqual(storage.get_many([u'A', u'B']), {u'A': u'foo'})
+        self.assertTrue(storage.put(u'A', u'foo'))
+        self.assertListEqual(storage.put_many([(u'A', u'foo'), (u'A', u'foo')]), [True, False])
+        self.assertDictEqual(storage.collect_garbage(), {u'chunk_bytes': 10, u'chunks': 1, u'refs': 2})
+        self.assertEqual(executor.run.call_count, 8)
+        engine.get_many.assert_called_once_with([u'A', u'B'])
+        engine.put.assert_called_once_with(u'A', u'foo')
+        engine.find_digests.assert_called_once_with(u'A', 10)
+
+        # Branch 2: Test that the iteration reads one page at a time on the executor
+
+        rows = [(u'%064X' % index, u'%d' % index) for index in range(ITER_PAGE_SIZE + 1)]
+        engine.iter.return_value = iter(rows)
+        executor.run.reset_mock()
+
+        self.assertListEqual(list(storage.iter(u'0')), rows)
+        engine.iter.assert_called_once_with(u'0')
+        self.assertEqual(executor.run.call_count, 3)
+
+        # Branch 3: Test that a stream is opened and each of its pieces read on the executor
+
+        engine.get_stream.side_effect = [(6, iter([b'foo', b'bar'])), None]
+        executor.run.reset_mock()
+
+        size, pieces = storage.get_stream(u'A')
+
+        self.assertEqual((size, list(pieces)), (6, [b'foo', b'bar']))
+        self.assertEqual(executor.run.call_count, 4)
+        self.assertIsNone(storage.get_stream(u'B'))
+
+    def test_plugin(self):
+        """
+        Tests that the plugin only wraps callbacks that accept the storage keyword.
+        """
+
+        storage = MagicMock(spec=StorageEngine)
+        plugin = StoragePlugin(storage)
+
+        # Branch 1: Test that callbacks without a storage argument are returned unchanged
+
+        callback = MagicMock()
+        route = MagicMock()
+        route.get_callback_args.return_value = [u'db']
+
+        self.assertTrue(plugin.apply(callback, route) is callback)
+
+        # Branch 2: Test that callbacks with a storage argument receive the storage engine
+
+        route.get_callback_args.return_value = [u'digest', u'storage']
+
+        plugin.apply(callback, route)(u'digest')
+
+        callback.assert_called_once_with(u'digest', storage=storage)
+
+    def test_storage_engine(self):
+        """
+        Tests that the default operations use `get`, `iter` and `put_many` of the engine.
+        """
+
+        # Branch 1: Test that the operations an engine has to implement raise until it does
+
+        engine = StorageEngine()
+
+        for operation, args in ((engine.get, (u'A',)), (engine.get_many, ([u'A'],)), (engine.iter, ()),
+                                (engine.paths, ()), (engine.put_many, ([(u'A', u'foo')],))):
+            with self.assertRaises(NotImplementedError):
+                operation(*args)
+
+        # Branch 2: Test that the default operations use the implemented ones
+
+        engine.get = MagicMock(side_effect=[u'foo', None, u'f\xf6\xf6', None, u'foo', None])
+        engine.iter = MagicMock(side_effect=lambda start: iter([(u'AB1', u'foo'), (u'AB2', u'bar'), (u'AC', u'baz')]))
+        engine.put_many = MagicMock(return_value=[True])
+        engine.paths = MagicMock(return_value=[u'/nonexistent/sha_api.db'])
+
+        self.assertTrue(engine.exists(u'A'))
+        self.assertFalse(engine.exists(u'B'))
+        self.assertEqual(engine.get_compressed(u'A'), (None, u'f\xf6\xf6'.encode(u'utf-8')))
+        self.assertIsNone(engine.get_compressed(u'B'))
+        size, pieces = engine.get_stream(u'A')
+
+        self.assertEqual((size, list(pieces)), (3, [b'foo']))
+        self.assertIsNone(engine.get_stream(u'B'))
+        self.assertListEqual(engine.find_digests(u'AB', 10), [u'AB1', u'AB2'])
+        self.assertListEqual(engine.find_digests(u'AB', 1), [u'AB1'])
+        engine.iter.assert_called_with(u'AB')
+        self.assertTrue(engine.put(u'A', u'foo'))
+        engine.put_many.assert_called_once_with([(u'A', u'foo')])
+        self.assertEqual(engine.disk_usage(), 0)
+        self.assertDictEqual(engine.collect_garbage(), {u'chunk_bytes': 0, u'chunks': 0, u'refs': 0})
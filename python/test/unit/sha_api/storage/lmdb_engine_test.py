@@ -0,0 +1,129 @@
+"""
+The `test.unit.sha_api.storage.lmdb_engine_test` module provides unit tests for the LMDB storage engine in
+`sha_api.storage.lmdb_engine`.
+
+Classes:
+    TestLmdbStorage: A unit test class for the `LmdbStorage` class.
+"""
+
+import binascii
+import os
+import shutil
+import tempfile
+import unittest
+
+from mock import patch
+from sha_api.storage.compression import get_compressor
+from test.unit.sha_api.storage.conformance import digest, StorageConformance
+
+class TestLmdbStorage(StorageConformance, unittest.TestCase):
+    """
+    A unit test class for the `LmdbStorage` class, in addition to the storage engine conformance tests.
+
+    Methods:
+        setUp: Unit test initialization.
+        tearDown: Closes the engine and removes its files.
+        make_storage: Returns a `LmdbStorage` over a new environment directory.
+        test_compression: Tests that compressed and uncompressed values are both read whatever the compression setting.
+        test_invalid_digests: Tests that keys that are not SHA256 digests are never found and can not be stored.
+        test_reopen: Tests that the environment is opened again after it is closed or the process forks.
+    """
+
+    def setUp(self):
+        """
+        Initializes the unit test global configs
+        """
+
+        try:
+            import lmdb # pylint: disable=unused-variable
+        except ImportError: # pragma: no cover
+            self.skipTest(u'lmdb is not installed')
+
+        self.maxDiff = None # pylint: disable=invalid-name
+        self.storage_dir = tempfile.mkdtemp()
+        self.storage = self.make_storage()
+
+    def tearDown(self):
+        """
+        Closes the engine and removes its files.
+        """
+
+        self.storage.close()
+        shutil.rmtree(self.storage_dir)
+
+    def make_storage(self):
+        """
+        Returns a `LmdbStorage` over a new environment directory.
+        """
+
+        from sha_api.storage.lmdb_engine import LmdbStorage
+
+        return LmdbStorage(os.path.join(self.storage_dir, u'sha_api.lmdb'), map_size=64 * 1024 * 1024, sync=False)
+
+    def test_compression(self):
+        """
+        Tests that compressed and uncompressed values are both read whatever the compression setting.
+        """
+
+        from sha_api.storage.lmdb_engine import LmdbStorage
+
+        compressed_storage = LmdbStorage(self.storage.path, compressor=get_compressor(u'zlib', threshold=64))
+        # Both engines must share the environment of the process, a second one of the same files is not allowed
+        compressed_storage._environment = self.storage._environment # pylint: disable=protected-access
+
+        small = u'small'
+        large = u'f\xf6\xf6 bar ' * 100
+        old = u'old ' * 100
+
+        self.assertListEqual(compressed_storage.put_many([(digest(small), small), (digest(large), large)]),
+                             [True, True])
+        self.storage.put(digest(old), old)
+
+        for storage in (self.storage, compressed_storage):
+            self.assertDictEqual(storage.get_many([digest(small), digest(large), digest(old)]),
+                                 {digest(small): small, digest(large): large, digest(old): old})
+            self.assertEqual(storage.get(digest(large)), large)
+            self.assertEqual(dict(storage.iter())[digest(old)], old)
+
+        with self.storage._environment().begin() as txn: # pylint: disable=protected-access
+            self.assertEqual(txn.get(binascii.unhexlify(digest(large)))[:1], b'\xf8')
+            self.assertEqual(txn.get(binascii.unhexlify(digest(old))), old.encode(u'utf-8'))
+
+    def test_invalid_digests(self):
+        """
+        Tests that keys that are not SHA256 digests are never found and can not be stored.
+        """
+
+        for key in (u'not hex', u'ABC', u'AB' * 16, u'\xe9' * 64):
+            self.assertFalse(self.storage.exists(key))
+            self.assertIsNone(self.storage.get(key))
+            self.assertDictEqual(self.storage.get_many([key]), {})
+
+            with self.assertRaises(ValueError):
+                self.storage.put(key, u'foo')
+
+    def test_reopen(self):
+        """
+        Tests that the environment is opened again after it is closed or the process forks.
+        """
+
+        self.storage.put(digest(u'foo'), u'foo')
+
+        # Branch 1: Test that a closed environment is opened again on next use
+
+        self.storage.close()
+
+        self.assertEqual(self.storage.get(digest(u'foo')), u'foo')
+
+        # Branch 2: Test that a forked process opens an environment of its own
+
+        parent_env = self.storage._environment() # pylint: disable=protected-access
+
+        with patch(u'sha_api.storage.lmdb_engine.os.getpid', return_value=os.getpid() + 1):
+            child_env = self.storage._environment() # pylint: disable=protected-access
+
+            self.assertIsNot(child_env, parent_env)
+            self.assertEqual(self.storage.get(digest(u'foo')), u'foo')
+            self.storage.close()
+
+        parent_env.close()
@@ -0,0 +1,384 @@
+"""
+The `test.unit.sha_api.storage.sqlite_engine_test` module provides unit tests for the sqlite storage engine in
+`sha_api.storage.sqlite_engine`.
+
+Classes:
+    TestChunkedSqliteStorage: The storage engine conformance tests for a `SqliteStorage` that stores most messages as
+                              chunks.
+    TestCompressedSqliteStorage: The storage engine conformance tests for a `SqliteStorage` that compresses every
+                                 message.
+    TestShardedSqliteStorage: The storage engine conformance tests for a `SqliteStorage` over a `ShardedSqlitePool`.
+    TestSqliteStorage: A unit test class for the `SqliteStorage` class.
+"""
+
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from mock import MagicMock
+from sha_api.mybottle.group_commit import GroupCommitWriter
+from sha_api.mybottle.shards import ShardedSqlitePool
+from sha_api.mybottle.sqlite_pool import SqlitePool
+from sha_api.schema import create_schema
+from sha_api.storage.chunking import Chunker, is_manifest, manifest
+from sha_api.storage.compression import get_compressor
+from sha_api.storage.sqlite_engine import CHUNK_PAGE_SIZE, SqliteStorage
+from test.unit.sha_api.storage.conformance import digest, StorageConformance
+
+class TestSqliteStorage(StorageConformance, unittest.TestCase):
+    """
+    A unit test class for the `SqliteStorage` class, in addition to the storage engine conformance tests.
+
+    Methods:
+        setUp: Unit test initialization.
+        tearDown: Closes the engine and removes its files.
+        make_storage: Returns a `SqliteStorage` over a new database file.
+        test_chunking: Tests that large messages are stored as chunks that similar messages share and that
+                       unreferenced chunks are collected.
+        test_compression: Tests that compressed and uncompressed rows are both read whatever the compression setting.
+        test_concurrent_put_many: Tests that a digest stored concurrently by another connection is not reported as
+                                  newly stored.
+        test_lookup_chunks: Tests that lookups of many digests are split into chunked queries.
+        test_put_chunked_lookups: Tests that the stored chunks of a message are looked up once per transaction.
+        test_writer: Tests that writes are handed to the group commit writer when one is set.
+    """
+
+    def setUp(self):
+        """
+        Initializes the unit test global configs
+        """
+
+        self.maxDiff = None # pylint: disable=invalid-name
+        self.storage_dir = tempfile.mkdtemp()
+        self.storage = self.make_storage()
+
+    def tearDown(self):
+        """
+        Closes the engine and removes its files.
+        """
+
+        self.storage.close()
+        shutil.rmtree(self.storage_dir)
+
+    def make_storage(self):
+        """
+        Returns a `SqliteStorage` over a new database file.
+        """
+
+        pool = SqlitePool(os.path.join(self.storage_dir, u'sha_api.db'))
+        create_schema(pool.connection())
+
+        return SqliteStorage(pool)
+
+    def test_chunking(self):
+        """
+        Tests that large messages are stored as chunks that similar messages share and that unreferenced chunks are
+        collected.
+        """
+
+        storage = SqliteStorage(self.storage.pool, compressor=get_compressor(u'zlib'),
+                                chunker=Chunker(chunk_size=256, threshold=1024))
+        db_con = self.storage.pool.connection()
+        rand = random.Random(0)
+        base = u''.join(rand.choice(u'abcdefghijklmnopqrstuvwxyz0123456789 \u2603\n') for _ in range(20000))
+        edited = base[:10000] + u'an edit' + base[10000:]
+
+        # Branch 1: Test that only the messages over the threshold are stored as a manifest and its chunks
+
+        self.assertListEqual(storage.put_many([(digest(u'small'), u'small'), (digest(base), base)]), [True, True])
+        self.assertFalse(storage.put(digest(base), base))
+
+        rows = db_con.execute(u'SELECT digest, message FROM sha_api').fetchall()
+
+        self.assertDictEqual(dict((row[0], bytes(row[1]) if is_manifest(row[1]) else row[1]) for row in rows),
+                             {digest(u'small'): u'small', digest(base): manifest(len(base.encode(u'utf-8')))})
+
+        chunks = db_con.execute(u'SELECT COUNT(*) FROM sha_api_chunks').fetchone()[0]
+
+        self.assertGreater(chunks, 10)
+
+        # Branch 2: Test that an edited copy only adds the chunks around the edit and both are read back
+
+        self.assertTrue(storage.put(digest(edited), edited))
+        self.assertLessEqual(db_con.execute(u'SELECT COUNT(*) FROM sha_api_chunks').fetchone()[0], chunks + 3)
+
+        for reader in (storage, self.storage):
+            self.assertDictEqual(reader.get_many([digest(base), digest(edited)]),
+                                 {digest(base): base, digest(edited): edited})
+            self.assertEqual(reader.get(digest(edited)), edited)
+            self.assertEqual(dict(reader.iter())[digest(base)], base)
+
+        # Branch 3: Test that a chunked message is streamed chunk by chunk across pages of chunks
+
+        data = edited.encode(u'utf-8')
+        size, pieces = storage.get_stream(digest(edited))
+
+        self.assertEqual(size, len(data))
+        self.assertListEqual(list(pieces), storage.chunker.split(data))
+        self.assertGreater(len(storage.chunker.split(data)), CHUNK_PAGE_SIZE)
+
+        # Branch 4: Test that only the chunks that no other message refers to are collected
+
+        with db_con:
+            db_con.execute(u'DELETE FROM sha_api WHERE digest = ?', (digest(edited),))
+
+        collected = storage.collect_garbage()
+
+        self.assertGreater(collected[u'refs'], 10)
+        self.assertTrue(1 <= collected[u'chunks'] <= 3)
+        self.assertGreater(collected[u'chunk_bytes'], 0)
+        self.assertEqual(storage.get(digest(base)), base)
+
+        # Branch 5: Test that a message stored again after it was deleted and before garbage collection is complete
+
+        with db_con:
+            db_con.execute(u'DELETE FROM sha_api WHERE digest = ?', (digest(base),))
+
+        self.assertTrue(storage.put(digest(base), base))
+        self.assertEqual(storage.get(digest(base)), base)
+        self.assertDictEqual(storage.collect_garbage(), {u'chunk_bytes': 0, u'chunks': 0, u'refs': 0})
+
+    def test_compression(self):
+        """
+        Tests that compressed and uncompressed rows are both read whatever the compression setting.
+        """
+
+        small = u'small'
+        large = u'f\xf6\xf6 bar ' * 100
+        db_con = self.storage.pool.connection()
+        compressed_storage = SqliteStorage(self.storage.pool, compressor=get_compressor(u'zlib', threshold=64))
+
+        # Branch 1: Test that only the messages above the threshold are stored as compressed BLOB values
+
+        self.assertListEqual(compressed_storage.put_many([(digest(small), small), (digest(large), large)]),
+                             [True, True])
+        rows = db_con.execute(u'SELECT typeof(message) FROM sha_api WHERE digest IN (?, ?) ORDER BY length(message)',
+                              (digest(small), digest(large))).fetchall()
+
+        self.assertListEqual([row[0] for row in rows], [u'text', u'blob'])
+
+        # Branch 2: Test that an engine without compression reads the compressed rows, and the reverse
+
+        old = u'old ' * 100
+
+        self.storage.put(digest(old), old)
+
+        for storage in (self.storage, compressed_storage):
+            self.assertDictEqual(storage.get_many([digest(small), digest(large), digest(old)]),
+                                 {digest(small): small, digest(large): large, digest(old): old})
+            self.assertEqual(storage.get(digest(large)), large)
+            self.assertEqual(dict(storage.iter())[digest(old)], old)
+
+    def test_concurrent_put_many(self):
+        """
+        Tests that a digest stored concurrently by another connection is not reported as newly stored.
+        """
+
+        foo_digest = digest(u'foo')
+        db_con = self.storage.pool.connection()
+        other = SqliteStorage(SqlitePool(self.storage.pool.dbfile))
+        pool = MagicMock(spec=SqlitePool)
+        pool.connection.return_value = MagicMock(wraps=db_con)
+        pool.connection.return_value.__enter__ = lambda _: db_con.__enter__()
+        pool.connection.return_value.__exit__ = lambda _, *exc_info: db_con.__exit__(*exc_info)
+
+        def execute(sql, params=()):
+            """
+            Stores the message with the other connection, like another worker process, right before the first write.
+            """
+
+            if sql.startswith(u'INSERT') and not other.exists(foo_digest):
+                other.put(foo_digest, u'foo')
+
+            return db_con.execute(sql, params)
+
+        pool.connection.return_value.execute.side_effect = execute
+        pool.connection.return_value.executemany.side_effect = lambda sql, rows: [execute(sql, row) for row in rows]
+
+        self.assertListEqual(SqliteStorage(pool).put_many([(foo_digest, u'foo'), (digest(u'bar'), u'bar')]),
+                             [False, True])
+        self.assertDictEqual(self.storage.get_many([foo_digest, digest(u'bar')]),
+                             {foo_digest: u'foo', digest(u'bar'): u'bar'})
+
+        other.close()
+
+    def test_lookup_chunks(self):
+        """
+        Tests that lookups of many digests are split into chunked queries.
+        """
+
+        db_con = MagicMock()
+        db_con.execute.return_value.fetchall.return_value = []
+        pool = MagicMock(spec=SqlitePool)
+        pool.connection.return_value = db_con
+
+        self.assertDictEqual(SqliteStorage(pool).get_many([u'%064X' % index for index in range(1200)]), {})
+        self.assertEqual(db_con.execute.call_count, 3)
+
+    def test_put_chunked_lookups(self):
+        """
+        Tests that the stored chunks of a message are looked up once per transaction.
+        """
+
+        db_con = self.storage.pool.connection()
+        pool = MagicMock(spec=SqlitePool)
+        pool.connection.return_value = MagicMock(wraps=db_con)
+        pool.connection.return_value.__enter__ = lambda _: db_con.__enter__()
+        pool.connection.return_value.__exit__ = lambda _, *exc_info: db_con.__exit__(*exc_info)
+        storage = SqliteStorage(pool, chunker=Chunker(chunk_size=256, threshold=1024))
+        rand = random.Random(0)
+        message = u''.join(rand.choice(u'abcdefghijklmnopqrstuvwxyz0123456789 \n') for _ in range(20000))
+
+        self.assertTrue(storage.put(digest(message), message))
+        self.assertGreater(len(storage.chunker.split(message.encode(u'utf-8'))), 20)
+        self.assertEqual(len([call_args for call_args in pool.connection.return_value.execute.call_args_list
+                              if call_args[0][0].startswith(u'SELECT chunk FROM sha_api_chunks')]), 2)
+        self.assertEqual(self.storage.get(digest(message)), message)
+
+    def test_writer(self):
+        """
+        Tests that writes are handed to the group commit writer when one is set.
+        """
+
+        foo_digest = digest(u'foo')
+        bar_digest = digest(u'bar')
+
+        # Branch 1: Test that only the unique rows are submitted and the results of the writer are reported
+
+        writer = MagicMock()
+        writer.submit.return_value = [False, True]
+        storage = SqliteStorage(self.storage.pool, writer=writer)
+
+        self.assertListEqual(storage.put_many([(foo_digest, u'foo'), (bar_digest, u'bar'), (bar_digest, u'bar')]),
+                             [False, True, False])
+        writer.submit.assert_called_once_with([(foo_digest, u'foo'), (bar_digest, u'bar')])
+
+        writer.submit.return_value = [True]
+
+        self.assertTrue(storage.put(foo_digest, u'foo'))
+        writer.submit.assert_called_with([(foo_digest, u'foo')])
+        self.assertIsNone(storage.get(foo_digest))
+
+        # A batch of only chunked messages is not submitted
+        writer.reset_mock()
+        storage = SqliteStorage(self.storage.pool, writer=writer, chunker=Chunker(threshold=2))
+
+        self.assertListEqual(storage.put_many([(digest(u'baz'), u'baz')]), [True])
+        self.assertFalse(writer.submit.called)
+
+        # Branch 2: Test that the rows committed by a group commit writer are stored
+
+        storage = SqliteStorage(self.storage.pool, writer=GroupCommitWriter(self.storage.pool))
+
+        self.assertTrue(storage.put(foo_digest, u'foo'))
+        self.assertListEqual(storage.put_many([(foo_digest, u'foo'), (bar_digest, u'bar')]), [False, True])
+        self.assertDictEqual(self.storage.get_many([foo_digest, bar_digest]), {foo_digest: u'foo', bar_digest: u'bar'})
+
+class TestShardedSqliteStorage(StorageConformance, unittest.TestCase):
+    """
+    The storage engine conformance tests for a `SqliteStorage` over a `ShardedSqlitePool`.
+
+    Methods:
+        setUp: Unit test initialization.
+        tearDown: Closes the engine and removes its files.
+        make_storage: Returns a `SqliteStorage` over four new shard files.
+    """
+
+    def setUp(self):
+        """
+        Initializes the unit test global configs
+        """
+
+        self.maxDiff = None # pylint: disable=invalid-name
+        self.storage_dir = tempfile.mkdtemp()
+        self.storage = self.make_storage()
+
+    def tearDown(self):
+        """
+        Closes the engine and removes its files.
+        """
+
+        self.storage.close()
+        shutil.rmtree(self.storage_dir)
+
+    def make_storage(self):
+        """
+        Returns a `SqliteStorage` over four new shard files.
+        """
+
+        return SqliteStorage(ShardedSqlitePool(self.storage_dir, 4))
+
+class TestCompressedSqliteStorage(StorageConformance, unittest.TestCase):
+    """
+    The storage engine conformance tests for a `SqliteStorage` that compresses every message.
+
+    Methods:
+        setUp: Unit test initialization.
+        tearDown: Closes the engine and removes its files.
+        make_storage: Returns a `SqliteStorage` over a new database file that compresses every message with zlib.
+    """
+
+    def setUp(self):
+        """
+        Initializes the unit test global configs
+        """
+
+        self.maxDiff = None # pylint: disable=invalid-name
+        self.storage_dir = tempfile.mkdtemp()
+        self.storage = self.make_storage()
+
+    def tearDown(self):
+        """
+        Closes the engine and removes its files.
+        """
+
+        self.storage.close()
+        shutil.rmtree(self.storage_dir)
+
+    def make_storage(self):
+        """
+        Returns a `SqliteStorage` over a new database file that compresses every message with zlib.
+        """
+
+        pool = SqlitePool(os.path.join(self.storage_dir, u'sha_api.db'))
+        create_schema(pool.connection())
+
+        return SqliteStorage(pool, compressor=get_compressor(u'zlib', threshold=0))
+
+class TestChunkedSqliteStorage(StorageConformance, unittest.TestCase):
+    """
+    The storage engine conformance tests for a `SqliteStorage` that stores most messages as chunks.
+
+    Methods:
+        setUp: Unit test initialization.
+        tearDown: Closes the engine and removes its files.
+        make_storage: Returns a `SqliteStorage` over two new shard files that chunks the messages of at least 1024
+                      characters.
+    """
+
+    def setUp(self):
+        """
+        Initializes the unit test global configs
+        """
+
+        self.maxDiff = None # pylint: disable=invalid-name
+        self.storage_dir = tempfile.mkdtemp()
+        self.storage = self.make_storage()
+
+    def tearDown(self):
+        """
+        Closes the engine and removes its files.
+        """
+
+        self.storage.close()
+        shutil.rmtree(self.storage_dir)
+
+    def make_storage(self):
+        """
+        Returns a `SqliteStorage` over two new shard files that chunks the messages of at least 1024 characters.
+        """
+
+        return SqliteStorage(ShardedSqlitePool(self.storage_dir, 2), compressor=get_compressor(u'zlib'),
+                             chunker=Chunker(chunk_size=256, threshold=1024))
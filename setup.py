@@ -45,6 +45,16 @@ if parse_version(PYTHON_VERSION) < parse_version('2.6'):
 
 PYTHON_3_EXTRAS = {}
 
+INSTALL_REQUIRES = [
+    'bottle>=0.12.10',
+    'gunicorn<20',
+    'setuptools'
+]
+
+# The gunicorn threaded worker needs the concurrent.futures backport on Python 2
+if parse_version(PYTHON_VERSION) < parse_version('3'):
+    INSTALL_REQUIRES.append('futures')
+
 if parse_version(PYTHON_VERSION) >= parse_version('3'):
     setuptools.use_2to3_on_doctests = True
 
@@ -77,15 +87,34 @@ setup( # pylint: disable=star-args
     download_url='https://github.com/ju2wheels/sha_api',
     entry_points={
         'console_scripts': [
+            'sha_api-admin = sha_api.admin:main',
+            'sha_api-benchmark = sha_api.benchmark.runner:main',
+            'sha_api-benchmark-replication = sha_api.benchmark.replication:main',
+            'sha_api-benchmark-storage = sha_api.benchmark.storage:main',
+            'sha_api-migrate = sha_api.schema:main',
+            'sha_api-reshard = sha_api.mybottle.shards:main',
             'sha_apid = sha_api.sha_apid:main'
         ]
     },
+    extras_require={
+        'async': [
+            'gevent'
+        ],
+        'brotli': [
+            'brotli'
+        ],
+        'json': [
+            'ujson'
+        ],
+        'lmdb': [
+            'lmdb'
+        ],
+        'zstd': [
+            'zstandard'
+        ]
+    },
     include_package_data=True,
-    install_requires=[
-        'bottle>=0.12.10',
-        'bottle-sqlite',
-        'setuptools'
-    ],
+    install_requires=INSTALL_REQUIRES,
     license='Proprietary',
     long_description=read_file('README.md'),
     keywords='rest api json sha sha256 shasum bottle sqlite',
@@ -102,7 +131,6 @@ setup( # pylint: disable=star-args
     test_loader='setuptools.command.test:ScanningLoader',
     tests_require=[
         'bottle>=0.12.10',
-        'bottle-sqlite',
         'coverage',
         'mock',
         'nose',